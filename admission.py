@@ -0,0 +1,238 @@
+# admission.py
+# Защита мастера от перегрузки: объединение одинаковых GET (single flight),
+# ограничение одновременных запросов к каждой ноде с ограниченной очередью
+# и ограничение частоты запросов клиента (token bucket).
+import asyncio
+import collections
+import math
+import threading
+import time
+
+# Запросов, ждущих слота ноды, когда число запросов к ней ограничено
+DEFAULT_NODE_QUEUE = 1024
+# Сколько запрос ждёт слота, прежде чем получить 503, с
+DEFAULT_QUEUE_TIMEOUT = 2.0
+# Адресов клиентов, для которых хранится состояние ограничения частоты
+MAX_CLIENTS = 65536
+
+def retry_after(seconds):
+    """Значение Retry-After: целое число секунд, не меньше 1."""
+    return str(max(1, math.ceil(seconds)))
+
+class Overloaded(Exception):
+    """Запрос отклонён без обращения к ноде; retry_after — через сколько секунд повторить."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# --- Single flight ---
+
+class Flight:
+    """Запрос к нодам, ответа которого ждут одинаковые GET.
+
+    result — ответ ведущего запроса или None, если его нельзя разделить
+    (тело идёт потоком): тогда ждущие обращаются к нодам сами.
+    """
+
+    __slots__ = ("done", "result")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+    def wait(self):
+        self.done.wait()
+        return self.result
+
+class Flights:
+    """Идущие запросы по ключам: первый GET ключа ведёт, остальные ждут его ответа."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key):
+        """Возвращает (Flight, ведущий ли). Ведущий обязан вызвать finish."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def finish(self, key, flight, result):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.done.set()
+
+    def forget(self, key):
+        """Ключ записан: новые GET не присоединяются к запросу, начатому до записи."""
+        with self._lock:
+            self._flights.pop(key, None)
+
+class AsyncFlights:
+    """Flights для asyncio-режима: ответ ведущего ждут через asyncio.Future."""
+
+    def __init__(self):
+        self._flights = {}
+
+    def join(self, key):
+        future = self._flights.get(key)
+        if future is not None:
+            return future, False
+        future = self._flights[key] = asyncio.get_running_loop().create_future()
+        return future, True
+
+    def finish(self, key, future, result):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.done():
+            future.set_result(result)
+
+    def forget(self, key):
+        self._flights.pop(key, None)
+
+# --- Ограничение запросов к ноде ---
+
+class NodeLimiter:
+    """Не больше limit одновременных запросов к ноде.
+
+    Сверх limit запрос ждёт в очереди до queue_timeout секунд; если в
+    очереди уже queue_size запросов или время вышло — Overloaded. Быстрый
+    отказ дешевле, чем копить запросы, которые всё равно не успеют.
+    """
+
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiting = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return
+            if self.waiting >= self.queue_size:
+                raise Overloaded("node queue is full", self.queue_timeout)
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.queue_timeout
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise Overloaded("node queue timeout", self.queue_timeout)
+                    self._cond.wait(remaining)
+                self.active += 1
+            finally:
+                self.waiting -= 1
+                # Уведомление могло достаться запросу, который ушёл по таймауту
+                if self.waiting and self.active < self.limit:
+                    self._cond.notify()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+class AsyncNodeLimiter:
+    """NodeLimiter для asyncio-режима: освободившийся слот передаётся первому в очереди."""
+
+    def __init__(self, limit, queue_size, queue_timeout):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters = collections.deque()
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Overloaded("node queue is full", self.queue_timeout)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            async with asyncio.timeout(self.queue_timeout):
+                await waiter
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Слот передан, но задачу уже прервали
+                if isinstance(e, TimeoutError):
+                    return
+                self.release()
+                raise
+            try:
+                self._waiters.remove(waiter)
+            except ValueError:
+                pass
+            if isinstance(e, TimeoutError):
+                raise Overloaded("node queue timeout", self.queue_timeout) from None
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+# --- Ограничение частоты запросов клиента ---
+
+class TokenBucket:
+    """rate токенов в секунду, не больше burst в запасе; запрос забирает один токен."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now):
+        """Забирает токен. Возвращает 0 или сколько секунд ждать следующего."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class ClientLimiter:
+    """Token bucket на каждый адрес клиента.
+
+    Хранится max_clients последних адресов: давно не приходивший клиент
+    вытесняется и при следующем запросе получает полный запас.
+    """
+
+    def __init__(self, rate, burst, max_clients=MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._lock = threading.Lock()
+        self._buckets = collections.OrderedDict()
+
+    def take(self, client):
+        """0 — запрос разрешён, иначе сколько секунд клиенту ждать."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            return bucket.take(now)
@@ -0,0 +1,126 @@
+# batch.py
+# Формат пакетных запросов POST /storage/_batch, общий для мастера и нод.
+#
+# Запрос:  {"op": "get" | "delete", "keys": [...]}
+#          {"op": "put", "items": [{"key": ..., "value": ...}, ...]}
+#          "encoding": "utf-8" (по умолчанию) или "base64" — как закодированы значения.
+#          Мастер с репликацией добавляет "versions": [...] — версии записей.
+#          {"op": "drop", "keys": [...], "versions": [...]} — только от мастера
+#          к ноде: перебалансировка забирает перенесённые ключи.
+#          "max_value": N в get — значения длиннее N не возвращаются (статус 413).
+# Ответ:   {"results": [{"key": ..., "status": 200, "value": ...}, ...]}
+#          в порядке запроса. Значение, не являющееся UTF-8, в режиме utf-8
+#          приходит в поле "value_base64". Нода добавляет "version" ключа.
+import base64
+import json
+
+OPS = ("get", "put", "delete", "drop")
+# Операции, доступные клиентам мастера
+CLIENT_OPS = ("get", "put", "delete")
+ENCODINGS = ("utf-8", "base64")
+MAX_KEYS = 10000
+PATH = "/storage/_batch"
+
+def _decode_value(text, encoding):
+    if not isinstance(text, str):
+        raise ValueError("value must be a string")
+    if encoding == "base64":
+        return base64.b64decode(text, validate=True)
+    return text.encode('utf-8')
+
+def _encode_value(item, value, encoding):
+    if encoding == "utf-8":
+        try:
+            item["value"] = value.decode('utf-8')
+            return
+        except UnicodeDecodeError:
+            item["value_base64"] = base64.b64encode(value).decode('ascii')
+            return
+    item["value"] = base64.b64encode(value).decode('ascii')
+
+def parse_request(body):
+    """Возвращает (op, [(ключ, значение или None)], encoding, версии, max_value).
+
+    Версии — список по позициям (None, если не заданы); max_value — None,
+    если не задан. Ошибка формата — ValueError.
+    """
+    try:
+        payload = json.loads(body.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid JSON")
+    if not isinstance(payload, dict):
+        raise ValueError("Invalid JSON")
+    op = payload.get("op")
+    encoding = payload.get("encoding", "utf-8")
+    if op not in OPS:
+        raise ValueError("Unknown op")
+    if encoding not in ENCODINGS:
+        raise ValueError("Unknown encoding")
+    if op == "put":
+        raw = payload.get("items")
+        if not isinstance(raw, list) or not all(isinstance(i, dict) for i in raw):
+            raise ValueError("'items' must be a list of objects")
+        try:
+            items = [(i.get("key"), _decode_value(i.get("value"), encoding)) for i in raw]
+        except (ValueError, TypeError):
+            raise ValueError("Invalid value")
+    else:
+        keys = payload.get("keys")
+        if not isinstance(keys, list):
+            raise ValueError("'keys' must be a list")
+        items = [(k, None) for k in keys]
+    if len(items) > MAX_KEYS:
+        raise ValueError(f"At most {MAX_KEYS} keys per batch")
+    if not all(isinstance(k, str) and k for k, _ in items):
+        raise ValueError("Keys must be non-empty strings")
+    versions = payload.get("versions")
+    if versions is None:
+        versions = [None] * len(items)
+    elif (not isinstance(versions, list) or len(versions) != len(items)
+          or not all(isinstance(v, int) and v >= 0 for v in versions)):
+        raise ValueError("'versions' must be a list of integers, one per key")
+    max_value = payload.get("max_value")
+    if max_value is not None and (not isinstance(max_value, int) or max_value < 0):
+        raise ValueError("'max_value' must be a non-negative integer")
+    return op, items, encoding, versions, max_value
+
+def build_request(op, items, encoding="base64", versions=None, max_value=None):
+    payload = {"op": op, "encoding": encoding}
+    if versions is not None:
+        payload["versions"] = versions
+    if max_value is not None:
+        payload["max_value"] = max_value
+    if op == "put":
+        payload["items"] = []
+        for key, value in items:
+            item = {"key": key}
+            _encode_value(item, value, encoding)
+            payload["items"].append(item)
+    else:
+        payload["keys"] = [key for key, _ in items]
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+def build_response(items, results, encoding):
+    """results — [(статус, значение или None, версия или None)] в порядке items."""
+    out = []
+    for (key, _), (status, value, version) in zip(items, results):
+        item = {"key": key, "status": status}
+        if value is not None:
+            _encode_value(item, value, encoding)
+        if version is not None:
+            item["version"] = version
+        out.append(item)
+    return json.dumps({"results": out}, ensure_ascii=False).encode('utf-8')
+
+def parse_response(body, encoding="base64"):
+    """Возвращает [(статус, значение в байтах или None, версия или None)]."""
+    results = []
+    for item in json.loads(body.decode('utf-8'))["results"]:
+        if "value_base64" in item:
+            value = base64.b64decode(item["value_base64"])
+        elif "value" in item:
+            value = _decode_value(item["value"], encoding)
+        else:
+            value = None
+        results.append((item["status"], value, item.get("version")))
+    return results
@@ -0,0 +1,197 @@
+# bench/bench_admission.py
+# Защита мастера от перегрузки (admission.py) в двух сценариях.
+# herd — «набег»: все клиенты одновременно читают один горячий ключ;
+# мастер с объединением GET и без него. Кроме пропускной способности
+# считается, сколько запросов к нодам приходится на один GET клиента.
+# overload — клиентов намного больше, чем успевает обслужить нода
+# (заглушка slow_worker.py: --node-delay-ms на запрос, не больше
+# --node-concurrency сразу); мастер без ограничений и с ограничениями
+# (--limits). Отклонённый запрос (503/429) клиент повторяет через --backoff-ms.
+import argparse
+import asyncio
+import time
+
+from cluster import (BASE_WORKER_PORT, MASTER_PORT, Cluster, Connection, percentile, proc_cpu,
+                     proc_status, request)
+
+import bench_load
+import httputil
+import results
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.shed = 0
+        self.errors = 0
+
+async def client(paths, deadline, stats, backoff):
+    """Клиент на keep-alive соединении; после Connection: close подключается заново."""
+    reader = writer = None
+    i = 0
+    while time.perf_counter() < deadline:
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", MASTER_PORT)
+            path = paths[i % len(paths)]
+            i += 1
+            start = time.perf_counter()
+            writer.write(httputil.build_request("GET", path, "127.0.0.1"))
+            async with asyncio.timeout(max(deadline - start, 0) + 10):
+                await writer.drain()
+                code, headers, _ = await httputil.read_response_async(reader)
+            if code == 200:
+                stats.latencies.append(time.perf_counter() - start)
+            elif code in (429, 503):
+                stats.shed += 1
+            else:
+                stats.errors += 1
+            if headers.get("connection", "").lower() == "close":
+                writer.close()
+                writer = None
+            if code in (429, 503):
+                await asyncio.sleep(backoff)
+        except (OSError, asyncio.IncompleteReadError, TimeoutError, httputil.BadRequest):
+            stats.errors += 1
+            if writer is not None:
+                writer.close()
+                writer = None
+            await asyncio.sleep(backoff)
+    if writer is not None:
+        writer.close()
+
+async def run_load(clients, paths, duration, backoff, master_pid):
+    stats = Stats()
+    peak_threads = 0
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, proc_status(master_pid)[0])
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_threads())
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(paths[i % len(paths):] + paths[:i % len(paths)], deadline,
+                                  stats, backoff)
+                           for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    return stats, elapsed, peak_threads
+
+def upstream_gets(workers):
+    """Сколько GET ключей обработали ноды (по их /metrics); у заглушки нод нет метрик."""
+    total = 0
+    for node_id in range(1, workers + 1):
+        code, body = request("GET", "/metrics", port=BASE_WORKER_PORT + node_id)
+        for line in body.decode('utf-8').splitlines():
+            if line.startswith("dstorage_requests_total") and 'method="GET"' in line \
+                    and 'route="/storage/{key}"' in line:
+                total += float(line.rsplit(" ", 1)[1])
+    return total
+
+def measure(args, cluster, clients, paths, workers):
+    master_pid = cluster.procs["master"].pid
+    before, cpu = upstream_gets(workers), proc_cpu(master_pid)
+    stats, elapsed, threads = asyncio.run(run_load(clients, paths, args.duration,
+                                                   args.backoff_ms / 1000, master_pid))
+    master_cpu = proc_cpu(master_pid) - cpu
+    upstream = upstream_gets(workers) - before
+    lat = sorted(stats.latencies)
+    ok = len(lat)
+    total = ok + stats.shed + stats.errors
+    return {"ops_s": round(ok / elapsed, 1),
+            "shed_pct": round(stats.shed / total * 100, 1) if total else 0,
+            "errors": stats.errors,
+            "latency_ms": {name: round(percentile(lat, p) * 1000, 2)
+                           for name, p in (("p50", 50), ("p99", 99), ("max", 100))},
+            "upstream_per_get": round(upstream / ok, 3) if ok and workers else None,
+            "master_cpu_us_per_op": round(master_cpu / ok * 1e6, 1) if ok else 0,
+            "master_threads": threads,
+            "master_rss_mb": round(proc_status(master_pid)[1], 1)}
+
+def print_row(scenario, config, part):
+    lat = part["latency_ms"]
+    upstream = part["upstream_per_get"]
+    print(f"{scenario:<10}{config:<10}{part['ops_s']:>9.0f}{lat['p50']:>9.2f}{lat['p99']:>9.2f}"
+          f"{lat['max']:>9.1f}{part['shed_pct']:>10.1f}{part['errors']:>8}"
+          f"{'-' if upstream is None else f'{upstream:.3f}':>10}{part['master_cpu_us_per_op']:>11.1f}"
+          f"{part['master_threads']:>9}{part['master_rss_mb']:>9.1f}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=("herd", "overload"),
+                        default=["herd", "overload"])
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                        help="режим мастера и нод")
+    parser.add_argument("--engine", default="log")
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд на замер")
+    parser.add_argument("--backoff-ms", type=float, default=50,
+                        help="пауза клиента после отказа (503/429) или ошибки")
+    parser.add_argument("--herd-clients", type=int, default=200)
+    parser.add_argument("--herd-workers", type=int, default=3)
+    parser.add_argument("--herd-size", type=bench_load.parse_size, default=64 * 1024,
+                        help="размер горячего значения")
+    parser.add_argument("--coalesce-kb", type=float, default=1024,
+                        help="--coalesce-kb мастера для замера с объединением GET")
+    parser.add_argument("--overload-clients", type=int, default=1500)
+    parser.add_argument("--overload-keys", type=int, default=200)
+    parser.add_argument("--overload-size", type=bench_load.parse_size, default=1024)
+    parser.add_argument("--node-delay-ms", type=float, default=5.0,
+                        help="время обработки запроса заглушкой ноды")
+    parser.add_argument("--node-concurrency", type=int, default=4,
+                        help="запросов, которые заглушка обрабатывает одновременно")
+    parser.add_argument("--limits", default="--node-limit 16 --node-queue 64 --queue-ms 200 "
+                                            "--max-connections 1000",
+                        help="аргументы мастера для замера с ограничениями")
+    parser.add_argument("--name", default="admission", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    summary = {}
+    print(f"{'сценарий':<10}{'мастер':<10}{'ops/s':>9}{'p50, мс':>9}{'p99, мс':>9}{'макс.':>9}"
+          f"{'отказ, %':>10}{'ошибок':>8}{'к нодам':>10}{'CPU, мкс':>11}{'потоков':>9}"
+          f"{'RSS, МиБ':>9}")
+    mode_args = ["--mode", args.mode]
+    worker_args = mode_args + ["--engine", args.engine]
+    if "herd" in args.scenarios:
+        configs = (("без", []), ("single", ["--coalesce-kb", str(args.coalesce_kb)]))
+        for config, master_args in configs:
+            with Cluster(args.herd_workers, master_args=mode_args + master_args,
+                         worker_args=worker_args) as cluster:
+                code, _ = request("PUT", "/storage/hot", b"h" * args.herd_size)
+                if code != 201:
+                    raise RuntimeError(f"PUT вернул {code}")
+                part = measure(args, cluster, args.herd_clients, ["/storage/hot"],
+                               args.herd_workers)
+            summary.setdefault("herd", {})[config] = part
+            print_row("herd", config, part)
+    if "overload" in args.scenarios:
+        paths = [f"/storage/{bench_load.key_name(i)}" for i in range(args.overload_keys)]
+        configs = (("без", []), ("лимиты", args.limits.split()))
+        for config, master_args in configs:
+            with Cluster(0, master_args=mode_args + master_args) as cluster:
+                cluster.start_stub(1, "slow_worker.py",
+                                   ["--delay-ms", str(args.node_delay_ms),
+                                    "--concurrency", str(args.node_concurrency)])
+                # Нода регистрируется на мастере после старта
+                time.sleep(0.5)
+                conn = Connection()
+                for path in paths:
+                    code, _ = conn.request("PUT", path, b"o" * args.overload_size)
+                    if code != 201:
+                        raise RuntimeError(f"PUT вернул {code}")
+                conn.close()
+                part = measure(args, cluster, args.overload_clients, paths, 0)
+            summary.setdefault("overload", {})[config] = part
+            print_row("overload", config, part)
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
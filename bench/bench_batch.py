@@ -0,0 +1,61 @@
+# bench/bench_batch.py
+# Запись и чтение набора ключей по одному и пакетами POST /storage/_batch.
+import argparse
+import time
+
+from cluster import Cluster, Connection
+
+import batch
+
+def one_by_one(conn, keys, value):
+    start = time.perf_counter()
+    for key in keys:
+        code, _ = conn.request("PUT", f"/storage/{key}", value)
+        if code != 201:
+            raise RuntimeError(f"PUT вернул {code}")
+    put_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for key in keys:
+        code, _ = conn.request("GET", f"/storage/{key}")
+        if code != 200:
+            raise RuntimeError(f"GET вернул {code}")
+    return put_s, time.perf_counter() - start
+
+def batched(conn, keys, value, size):
+    def run(op, items, expected):
+        start = time.perf_counter()
+        for i in range(0, len(items), size):
+            code, body = conn.request("POST", batch.PATH, batch.build_request(op, items[i:i + size]))
+            statuses = {s for s, _, _ in batch.parse_response(body)} if code == 200 else {code}
+            if statuses != {expected}:
+                raise RuntimeError(f"{op} вернул {statuses}")
+        return time.perf_counter() - start
+
+    put_s = run("put", [(k, value) for k in keys], 201)
+    return put_s, run("get", [(k, None) for k in keys], 200)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=5000)
+    parser.add_argument("--batch", type=int, default=500, help="ключей в пакете")
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    value = b"b" * args.value_size
+    print(f"ключей: {args.keys}, пакет: {args.batch}, значение: {args.value_size} Б, "
+          f"режим: {args.mode}")
+    print(f"{'способ':<10}{'PUT ops/s':>11}{'GET ops/s':>11}")
+    for name, prefix in (("по одному", "one"), ("пакетами", "batch")):
+        with Cluster(3, master_args=["--mode", args.mode]):
+            conn = Connection()
+            keys = [f"{prefix}-{i}" for i in range(args.keys)]
+            if name == "по одному":
+                put_s, get_s = one_by_one(conn, keys, value)
+            else:
+                put_s, get_s = batched(conn, keys, value, args.batch)
+            conn.close()
+        print(f"{name:<10}{args.keys / put_s:>11.0f}{args.keys / get_s:>11.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# bench/bench_cache.py
+# GET по Zipf-распределению ключей через мастер с кэшем значений и без.
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+
+from cluster import Cluster, Connection, percentile, request
+
+def zipf_weights(n, s):
+    return list(itertools.accumulate(1.0 / (i ** s) for i in range(1, n + 1)))
+
+def run(master_args, args):
+    value = b"z" * args.value_size
+    with Cluster(3, master_args=master_args):
+        conn = Connection()
+        for i in range(args.keys):
+            conn.request("PUT", f"/storage/key-{i}", value)
+        conn.close()
+
+        cum = zipf_weights(args.keys, args.zipf)
+        latencies = []
+        lock = threading.Lock()
+
+        def client(seed):
+            rnd = random.Random(seed)
+            picks = rnd.choices(range(args.keys), cum_weights=cum, k=args.ops)
+            c = Connection()
+            local = []
+            for i in picks:
+                start = time.perf_counter()
+                code, _ = c.request("GET", f"/storage/key-{i}")
+                local.append(time.perf_counter() - start)
+                if code != 200:
+                    raise RuntimeError(f"GET вернул {code}")
+            c.close()
+            with lock:
+                latencies.extend(local)
+
+        threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        elapsed = time.perf_counter() - start
+        _, body = request("GET", "/stats")
+        stats = json.loads(body)["cache"]
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, stats
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--zipf", type=float, default=1.1, help="показатель распределения")
+    parser.add_argument("--ops", type=int, default=2000, help="GET на клиента")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--value-size", type=int, default=1024)
+    parser.add_argument("--cache-mb", type=float, default=4)
+    args = parser.parse_args()
+
+    print(f"ключей: {args.keys}, zipf s={args.zipf}, значение: {args.value_size} Б, "
+          f"кэш: {args.cache_mb} МиБ")
+    print(f"{'режим':<8}{'ops/s':>9}{'p50, мс':>10}{'p99, мс':>10}{'hit ratio':>11}{'вытеснений':>12}")
+    for name, master_args in [("без кэша", []), ("кэш", ["--cache-mb", str(args.cache_mb)])]:
+        ops_s, lat, stats = run(master_args, args)
+        hit = f"{stats['hit_ratio']:.1%}" if stats else "-"
+        evictions = stats["evictions"] if stats else "-"
+        print(f"{name:<8}{ops_s:>9.0f}{percentile(lat, 50) * 1000:>10.2f}"
+              f"{percentile(lat, 99) * 1000:>10.2f}{hit:>11}{evictions:>12}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# bench/bench_client.py
+# Суммарная пропускная способность клиентов через мастер и напрямую к нодам
+# (client.SmartClient) на одном и том же кластере. Нагрузку дают
+# --procs процессов по --threads потоков; время CPU мастера показывает,
+# сколько работы с него снимает прямой доступ.
+import argparse
+import multiprocessing
+import random
+import threading
+import time
+
+from cluster import Cluster, percentile, proc_cpu
+
+import bench_load
+import client
+import results
+
+def client_process(mode, threads, keys, read_ratio, value, deadline, seed):
+    """Нагрузка из одного процесса. Возвращает (операций, ошибок, задержки в мс)."""
+    smart = client.SmartClient(direct=mode == "direct", pool_size=threads)
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def run(i):
+        rnd = random.Random(seed * 1000 + i)
+        local, failed = [], 0
+        while time.time() < deadline:
+            key = bench_load.key_name(rnd.randrange(keys))
+            start = time.perf_counter()
+            if rnd.random() < read_ratio:
+                code, _ = smart.get(key)
+                ok = code == 200
+            else:
+                code, _ = smart.put(key, value)
+                ok = code == 201
+            local.append((time.perf_counter() - start) * 1000)
+            failed += not ok
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    smart.close()
+    return len(latencies), errors[0], latencies
+
+def run_mode(mode, args, master_pid):
+    ctx = multiprocessing.get_context("fork")
+    value = b"x" * args.value_size
+    # Прогрев: соединения и карта кластера
+    client_process(mode, 1, args.keys, args.read_ratio, value, time.time() + args.warmup, 0)
+    cpu = proc_cpu(master_pid)
+    deadline = time.time() + args.duration
+    with ctx.Pool(args.procs) as p:
+        parts = p.starmap(client_process,
+                          [(mode, args.threads, args.keys, args.read_ratio, value, deadline, i)
+                           for i in range(args.procs)])
+    master_cpu = proc_cpu(master_pid) - cpu
+    ops = sum(n for n, _, _ in parts)
+    latencies = sorted(x for _, _, lat in parts for x in lat)
+    return {"ops_s": round(ops / args.duration, 1), "errors": sum(e for _, e, _ in parts),
+            "latency_ms": {name: round(percentile(latencies, p), 3)
+                           for name, p in (("p50", 50), ("p99", 99))},
+            "master_cpu_us_per_op": round(master_cpu / ops * 1e6, 1) if ops else 0}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=("master", "direct"),
+                        default=["master", "direct"])
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                        help="режим мастера и нод")
+    parser.add_argument("--procs", type=int, default=4, help="процессов нагрузки")
+    parser.add_argument("--threads", type=int, default=8, help="потоков в процессе")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--value-size", type=bench_load.parse_size, default=4096)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--name", default="client", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    summary = {}
+    print(f"{'путь':<8}{'ops/s':>9}{'p50, мс':>10}{'p99, мс':>10}{'CPU мастера, мкс/оп':>21}"
+          f"{'ошибок':>8}")
+    with Cluster(args.workers, master_args=["--mode", args.mode],
+                 worker_args=["--mode", args.mode]) as cluster:
+        bench_load.preload(bench_load.Workload(args.keys, "uniform", 0, 0.0, [args.value_size]))
+        for mode in args.modes:
+            part = run_mode(mode, args, cluster.procs["master"].pid)
+            summary[mode] = part
+            lat = part["latency_ms"]
+            print(f"{mode:<8}{part['ops_s']:>9.0f}{lat['p50']:>10.2f}{lat['p99']:>10.2f}"
+                  f"{part['master_cpu_us_per_op']:>21.1f}{part['errors']:>8}")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# bench/bench_compress.py
+# Сжатие значений (worker.py --compress) на выборке типичных данных: JSON,
+# журналы, текст, случайные и уже сжатые байты. Для каждого кодека —
+# сколько байт ложится на диск, скорость сжатия и распаковки в процессе
+# (время CPU), а на живом кластере — байты ответа на GET с Accept-Encoding
+# и без него, время CPU ноды и место на диске.
+import argparse
+import json
+import os
+import random
+import socket
+import tempfile
+import time
+import zlib
+
+from cluster import BASE_WORKER_PORT, MASTER_PORT, Cluster, Connection, proc_cpu
+
+import compress
+import httputil
+import results
+
+WORDS = ("storage node master replica key value version ring hash write read "
+         "quorum cluster request response latency disk commit segment").split()
+
+def corpus(size, seed):
+    """{имя: значение} около size байт каждое."""
+    rnd = random.Random(seed)
+    records, total = [], 0
+    while total < size:
+        record = {"id": len(records), "user": f"user{rnd.randrange(10000)}",
+                  "score": round(rnd.random() * 100, 3),
+                  "tags": rnd.sample(WORDS, 3), "active": rnd.random() < 0.5}
+        records.append(record)
+        total += 90
+    lines = []
+    start = 1_700_000_000
+    while sum(map(len, lines)) < size:
+        lines.append(f"{start + len(lines) // 7} INFO worker{rnd.randrange(8)} "
+                     f"{rnd.choice(('GET', 'PUT', 'DELETE'))} /storage/key{rnd.randrange(100000)} "
+                     f"{rnd.choice((200, 201, 404))} {rnd.random() * 5:.3f}ms\n")
+    log = "".join(lines).encode()[:size]
+    text = " ".join(rnd.choice(WORDS) for _ in range(size // 6)).encode()[:size]
+    return {
+        "json": json.dumps(records).encode()[:size],
+        "log": log,
+        "text": text,
+        "random": rnd.randbytes(size),
+        "compressed": zlib.compress(log + text, 9),
+        "small": json.dumps(records[:5]).encode()[:512],
+    }
+
+def cpu_time(fn, repeat):
+    """Лучшее из repeat время CPU процесса на один вызов fn, с."""
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def split(value, size=64 * 1024):
+    return [value[i:i + size] for i in range(0, len(value), size)]
+
+def codec_case(codec, value, repeat, tmp):
+    """Размер на диске и скорости сжатия и распаковки, МиБ/с."""
+    stored = b"".join(compress.encode(split(value), len(value), codec)[0])
+    seconds = cpu_time(lambda: b"".join(compress.encode(split(value), len(value), codec)[0]),
+                       repeat)
+    tmp.seek(0)
+    tmp.truncate()
+    tmp.write(stored)
+    tmp.flush()
+    framed, value_codec, _ = compress.read_header(tmp.fileno(), 0, len(stored))
+    offset = compress.HEADER.size if framed else 0
+    decode_seconds = 0.0
+    if value_codec is not None:
+        decode_seconds = cpu_time(lambda: b"".join(compress.decode(
+            tmp.fileno(), offset, len(stored) - offset, value_codec)), repeat)
+    mib = len(value) / 1024 / 1024
+    return {"stored": len(stored), "ratio": round(len(stored) / len(value), 4),
+            "compress_mb_s": round(mib / seconds, 1) if seconds else None,
+            "decompress_mb_s": round(mib / decode_seconds, 1) if decode_seconds else None}
+
+def get(path, accept_encoding):
+    """GET на новом соединении. Возвращает байты тела."""
+    headers = f"Accept-Encoding: {accept_encoding}\r\n" if accept_encoding else ""
+    with socket.create_connection(("127.0.0.1", MASTER_PORT), timeout=30) as s:
+        s.sendall(f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n{headers}"
+                  f"Connection: close\r\n\r\n".encode())
+        code, _, body = httputil.read_response(s)
+    if code != 200:
+        raise RuntimeError(f"GET {path} вернул {code}")
+    return body
+
+def disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+def cluster_case(name, values, reads, engine):
+    """PUT выборки и reads чтений каждого значения с Accept-Encoding и без."""
+    part = {}
+    worker_args = ["--engine", engine, "--durability", "none", "--compress", name]
+    with Cluster(1, worker_args=worker_args) as cluster:
+        pid = cluster.procs[1].pid
+        conn = Connection()
+        cpu = proc_cpu(pid)
+        for key, value in values.items():
+            code, _ = conn.request("PUT", f"/storage/{key}", value)
+            if code != 201:
+                raise RuntimeError(f"PUT {key} вернул {code}")
+        conn.close()
+        part["put_cpu_ms"] = round((proc_cpu(pid) - cpu) * 1000, 1)
+        # Каталог значений ноды, без журнала предзаписи и таблицы версий
+        port = BASE_WORKER_PORT + 1
+        data_dir = (f"worker_data_{port}" if engine == "files" else f"worker_{engine}_{port}")
+        part["disk_bytes"] = disk_usage(os.path.join(cluster.workdir, "basic_node", data_dir))
+        for label, accept in (("identity", None), ("negotiated", "deflate, xz")):
+            cpu, wire = proc_cpu(pid), 0
+            start = time.perf_counter()
+            for _ in range(reads):
+                for key in values:
+                    wire += len(get(f"/storage/{key}", accept))
+            part[label] = {"wire_bytes": wire // reads,
+                           "seconds": round(time.perf_counter() - start, 3),
+                           "worker_cpu_ms": round((proc_cpu(pid) - cpu) * 1000 / reads, 1)}
+    return part
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=1024 * 1024, help="байт в значении выборки")
+    parser.add_argument("--codecs", nargs="+", default=["none"] + sorted(compress.CODECS))
+    parser.add_argument("--repeat", type=int, default=3, help="замеров CPU, берётся лучший")
+    parser.add_argument("--reads", type=int, default=5, help="чтений каждого значения")
+    parser.add_argument("--engine", default="files")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--name", default="compress", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    values = corpus(args.size, args.seed)
+    summary = {"values": {}, "cluster": {}}
+    print(f"{'кодек':<7}{'значение':<12}{'байт':>10}{'на диске':>10}{'доля':>8}"
+          f"{'сжатие, МиБ/с':>15}{'распаковка, МиБ/с':>19}")
+    with tempfile.TemporaryFile() as tmp:
+        for name in args.codecs:
+            codec = compress.CODECS.get(name)
+            for key, value in values.items():
+                part = codec_case(codec, value, args.repeat, tmp)
+                summary["values"][f"{name}.{key}"] = part
+                print(f"{name:<7}{key:<12}{len(value):>10}{part['stored']:>10}{part['ratio']:>8.3f}"
+                      f"{part['compress_mb_s'] or 0:>15.1f}{part['decompress_mb_s'] or 0:>19.1f}")
+
+    print(f"\n{'кодек':<7}{'на диске':>11}{'CPU PUT, мс':>13}{'GET байт':>11}{'CPU, мс':>9}"
+          f"{'GET+AE байт':>13}{'CPU, мс':>9}")
+    for name in args.codecs:
+        part = cluster_case(name, values, args.reads, args.engine)
+        summary["cluster"][name] = part
+        plain, negotiated = part["identity"], part["negotiated"]
+        print(f"{name:<7}{part['disk_bytes']:>11}{part['put_cpu_ms']:>13.1f}"
+              f"{plain['wire_bytes']:>11}{plain['worker_cpu_ms']:>9.1f}"
+              f"{negotiated['wire_bytes']:>13}{negotiated['worker_cpu_ms']:>9.1f}")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
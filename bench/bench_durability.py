@@ -0,0 +1,78 @@
+# bench/bench_durability.py
+# Пропускная способность и задержки PUT в режимах --durability нод
+# (none, batch, always) для обоих движков при разном числе клиентов.
+# Средний размер группы fsync берётся из /metrics ноды.
+import argparse
+
+from cluster import BASE_WORKER_PORT, Cluster, request
+
+import bench_load
+import results
+
+def metric(text, name):
+    for line in text.splitlines():
+        if line.startswith(name + " "):
+            return float(line.split()[1])
+    return 0.0
+
+def fsync_counters(workers):
+    """(записей, дождавшихся fsync; fsync) по всем нодам."""
+    writes = commits = 0.0
+    for node_id in range(1, workers + 1):
+        _, body = request("GET", "/metrics", port=BASE_WORKER_PORT + node_id)
+        text = body.decode('utf-8')
+        writes += metric(text, "dstorage_durable_writes_total")
+        commits += metric(text, "dstorage_group_commits_total")
+    return writes, commits
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--engines", nargs="+", default=["files", "log"])
+    parser.add_argument("--modes", nargs="+", default=["none", "batch", "always"])
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--value-size", type=bench_load.parse_size, default=4096)
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=5.0, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--commit-window", type=float, help="окно группы, мс (batch)")
+    parser.add_argument("--name", default="durability", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    workload = bench_load.Workload(args.keys, "uniform", 0, 0.0, [args.value_size])
+    summary = {}
+    print(f"{'движок':<7}{'режим':<8}{'клиентов':>9}{'ops/s':>9}{'p50, мс':>10}{'p99, мс':>10}"
+          f"{'p99.9, мс':>11}{'записей/fsync':>15}")
+    for engine in args.engines:
+        for mode in args.modes:
+            worker_args = ["--engine", engine, "--durability", mode]
+            if args.commit_window is not None:
+                worker_args += ["--commit-window", str(args.commit_window)]
+            with Cluster(args.workers, worker_args=worker_args):
+                for clients in args.clients:
+                    run = argparse.Namespace(warmup=args.warmup, duration=args.duration,
+                                             arrival="closed", clients=clients,
+                                             seed=clients)
+                    writes, commits = fsync_counters(args.workers)
+                    part = bench_load.run_workload(run, workload)
+                    writes_after, commits_after = fsync_counters(args.workers)
+                    commits = commits_after - commits
+                    lat = part["latency_ms"]
+                    part = {"ops_s": part["ops_s"], "errors": part["errors"], "latency_ms": lat,
+                            "writes_per_fsync": round((writes_after - writes) / commits, 2)
+                                                if commits else 0}
+                    summary[f"{engine}.{mode}.c{clients}"] = part
+                    print(f"{engine:<7}{mode:<8}{clients:>9}{part['ops_s']:>9.0f}"
+                          f"{lat['p50']:>10.2f}{lat['p99']:>10.2f}{lat['p99.9']:>11.2f}"
+                          f"{part['writes_per_fsync']:>15.2f}")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+# bench/bench_engines.py
+# Пропускная способность PUT/GET маленьких значений, GET отсутствующих
+# ключей и метаданных ключа (stat: ETag и HEAD) и время старта для
+# движков хранения рабочей ноды (без сети, прямо через storage.py).
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import storage
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+def list_all(engine, page=10000):
+    keys, after = [], None
+    while True:
+        part = engine.list_keys(after=after, count=page)
+        keys.extend(part)
+        if len(part) < page:
+            return keys
+        after = part[-1]
+
+def bench_engine(name, data_dir, keys, value):
+    engine = storage.open_engine(name, data_dir)
+    missing = [f"missing-{key}" for key in keys]
+
+    def put_all():
+        for key in keys:
+            engine.put(key, [value], len(value))
+
+    def get_all():
+        for key in keys:
+            f, offset, length = engine.get(key)
+            with f:
+                os.pread(f.fileno(), length, offset)
+
+    def miss_all():
+        for key in missing:
+            assert engine.get(key) is None
+
+    def stat_all():
+        for key in keys:
+            engine.stat(key)
+
+    put_s, _ = timed(put_all)
+    get_s, _ = timed(get_all)
+    miss_s, _ = timed(miss_all)
+    stat_s, _ = timed(stat_all)
+    engine.close()
+
+    rows = [("PUT", f"{len(keys) / put_s:,.0f} ops/s"), ("GET", f"{len(keys) / get_s:,.0f} ops/s"),
+            ("GET промах", f"{len(keys) / miss_s:,.0f} ops/s"),
+            ("stat", f"{len(keys) / stat_s:,.0f} ops/s")]
+    open_s, engine = timed(lambda: storage.open_engine(name, data_dir))
+    list_s, listed = timed(lambda: list_all(engine))
+    engine.close()
+    assert len(listed) == len(keys)
+    rows.append(("старт", f"{open_s:.2f} с"))
+    rows.append(("список ключей", f"{list_s:.2f} с"))
+    if name == "files":
+        # Манифест пишет close(); без него индекс строится по заголовкам файлов
+        os.remove(data_dir + ".manifest")
+        scan_s, engine = timed(lambda: storage.open_engine(name, data_dir))
+        engine.close()
+        rows.append(("старт без манифеста", f"{scan_s:.2f} с"))
+    if name == "log":
+        for path in glob.glob(os.path.join(data_dir, "*.hint")):
+            os.remove(path)
+        scan_s, engine = timed(lambda: storage.open_engine(name, data_dir))
+        engine.close()
+        rows.append(("старт без hint", f"{scan_s:.2f} с"))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=1000000)
+    parser.add_argument("--value-size", type=int, default=100)
+    parser.add_argument("--engines", nargs="+", default=sorted(storage.ENGINES))
+    parser.add_argument("--dir", default=None, help="каталог для данных (по умолчанию временный)")
+    args = parser.parse_args()
+
+    keys = [f"key-{i:08d}" for i in range(args.keys)]
+    value = b"v" * args.value_size
+    print(f"ключей: {args.keys}, значение: {args.value_size} Б")
+    for name in args.engines:
+        data_dir = tempfile.mkdtemp(prefix=f"engine-{name}-", dir=args.dir)
+        try:
+            for metric, result in bench_engine(name, data_dir, keys, value):
+                print(f"{name:<6}{metric:<20}{result:>16}")
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+            for path in glob.glob(data_dir + ".*"):
+                os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# bench/bench_failover.py
+# Отказ рабочей ноды под нагрузкой: нода завершается (SIGKILL) или
+# замирает (SIGSTOP), потом возвращается. Печатает, когда мастер признал
+# её недоступной и снова доступной, и задержки/ошибки чтений по фазам.
+import argparse
+import json
+import os
+import random
+import signal
+import threading
+import time
+
+from cluster import Cluster, Connection, percentile, request
+
+import batch
+
+NODE = 2
+
+def load(keys, value):
+    conn = Connection()
+    for i in range(0, keys, 500):
+        items = [(f"key-{n}", value) for n in range(i, min(i + 500, keys))]
+        code, _ = conn.request("POST", batch.PATH, batch.build_request("put", items))
+        if code != 200:
+            raise RuntimeError(f"пакетная запись вернула {code}")
+    conn.close()
+
+def node_state():
+    code, body = request("GET", "/health")
+    state = json.loads(body).get(str(NODE), {}) if code == 200 else {}
+    return state.get("state"), state.get("breaker")
+
+class Readers:
+    """Клиенты, читающие случайные ключи; каждый запрос пишется с отметкой времени."""
+
+    def __init__(self, clients, keys):
+        self.keys = keys
+        self.samples = []
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.threads = [threading.Thread(target=self.run, args=(i,)) for i in range(clients)]
+
+    def run(self, seed):
+        rnd = random.Random(seed)
+        conn = Connection()
+        local = []
+        while not self.stop.is_set():
+            start = time.monotonic()
+            try:
+                code, _ = conn.request("GET", f"/storage/key-{rnd.randrange(self.keys)}")
+            except OSError:
+                conn.close()
+                code = 0
+            local.append((start, time.monotonic() - start, code))
+        conn.close()
+        with self.lock:
+            self.samples.extend(local)
+
+    def __enter__(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+
+def wait_state(states, timeout=30):
+    """Ждёт состояния ноды из states. Возвращает момент, когда оно наступило."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if node_state() in states:
+            return time.monotonic()
+        time.sleep(0.02)
+    raise RuntimeError(f"нода не перешла в {states} за {timeout} с")
+
+def run(args, fault):
+    master_args = ["--mode", args.mode, "--replicas", str(args.replicas),
+                   "--probe-ms", str(args.probe_ms)]
+    with Cluster(3, master_args=master_args, worker_args=["--engine", "log"]) as cluster:
+        load(args.keys, b"f" * args.value_size)
+        # Детектору нужна история интервалов
+        time.sleep(2)
+        with Readers(args.clients, args.keys) as readers:
+            time.sleep(args.warmup)
+            t_fault = time.monotonic()
+            if fault == "kill":
+                cluster.kill(NODE)
+            else:
+                os.kill(cluster.procs[NODE].pid, signal.SIGSTOP)
+            t_down = wait_state({("down", "open"), ("down", "closed"), ("down", "half-open")})
+            time.sleep(max(0.0, t_fault + args.outage - time.monotonic()))
+            t_back = time.monotonic()
+            if fault == "kill":
+                cluster.start_worker(NODE, register=False)
+            else:
+                os.kill(cluster.procs[NODE].pid, signal.SIGCONT)
+            t_alive = wait_state({("alive", "closed")})
+            time.sleep(args.warmup)
+        phases = [("до отказа", 0, t_fault), ("отказ -> обнаружен", t_fault, t_down),
+                  ("обнаружен -> возврат", t_down, t_back), ("возврат -> доступна", t_back, t_alive),
+                  ("после", t_alive, float("inf"))]
+        return t_down - t_fault, t_alive - t_back, phases, readers.samples
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=3000)
+    parser.add_argument("--value-size", type=int, default=1024)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--faults", default="kill,stop", help="kill (SIGKILL) и/или stop (SIGSTOP)")
+    parser.add_argument("--outage", type=float, default=5, help="секунд до возврата ноды")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--probe-ms", type=float, default=500)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    print(f"3 ноды, N={args.replicas}, нода {NODE} отказывает на {args.outage} с, "
+          f"проба раз в {args.probe_ms} мс, режим: {args.mode}, читателей: {args.clients}")
+    for fault in args.faults.split(","):
+        detect, recover, phases, samples = run(args, fault)
+        print(f"\n{fault}: обнаружение {detect:.2f} с, возврат в маршрутизацию {recover:.2f} с")
+        print(f"{'фаза':<24}{'запросов':>9}{'ошибок':>8}{'p50, мс':>9}{'p99, мс':>9}{'max, мс':>9}")
+        for name, start, end in phases:
+            chunk = [s for s in samples if start <= s[0] < end]
+            lat = sorted(s[1] for s in chunk)
+            errors = sum(1 for s in chunk if s[2] != 200)
+            print(f"{name:<24}{len(chunk):>9}{errors:>8}{percentile(lat, 50) * 1000:>9.2f}"
+                  f"{percentile(lat, 99) * 1000:>9.2f}{(lat[-1] if lat else 0) * 1000:>9.1f}")
+
+if __name__ == "__main__":
+    main()
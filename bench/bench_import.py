@@ -0,0 +1,135 @@
+# bench/bench_import.py
+# Массовый импорт и экспорт (bulk.py): --small небольших ключей из NDJSON
+# и --large крупных файлов из каталога, при разном числе соединений и
+# глубине конвейера (--configs 1x1,8x4 — соединений x запросов в полёте).
+# Для сравнения --single ключей записываются по одному PUT на одном
+# keep-alive соединении, как без инструмента.
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from cluster import MASTER_PORT, Cluster, Connection
+
+import bench_load
+import bulk
+import results
+
+def make_sources(workdir, small, small_size, large, large_size):
+    """NDJSON с небольшими значениями и каталог крупных файлов."""
+    ndjson = os.path.join(workdir, "small.ndjson")
+    value = "s" * small_size
+    with open(ndjson, "w") as f:
+        for i in range(small):
+            f.write(json.dumps({"key": f"small/{i:08d}", "value": value}) + "\n")
+    files = os.path.join(workdir, "large")
+    chunk = os.urandom(large_size)
+    for i in range(large):
+        directory = os.path.join(files, f"{i // 100:03d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{i:05d}.bin"), "wb") as f:
+            f.write(chunk)
+    return ndjson, files
+
+def bulk_args(path, prefix, connections, depth, dest=False):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("dest" if dest else "source")
+    bulk.add_arguments(parser)
+    return parser.parse_args([path, "--prefix", prefix, "--connections", str(connections),
+                              "--depth", str(depth), "--quiet"])
+
+def timed(run, args):
+    start = time.perf_counter()
+    # Итоговую строку переноса заменяет строка таблицы
+    with contextlib.redirect_stdout(io.StringIO()):
+        code = run("127.0.0.1", MASTER_PORT, args)
+    elapsed = time.perf_counter() - start
+    if code != 0:
+        raise RuntimeError("перенос завершился с ошибками")
+    return elapsed
+
+def single_puts(count, size):
+    """Ключи по одному PUT на одном соединении. Возвращает секунды."""
+    conn = Connection()
+    value = b"s" * size
+    start = time.perf_counter()
+    for i in range(count):
+        code, _ = conn.request("PUT", f"/storage/single-{i}", value)
+        if code != 201:
+            raise RuntimeError(f"PUT вернул {code}")
+    elapsed = time.perf_counter() - start
+    conn.close()
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--engine", default="log")
+    parser.add_argument("--small", type=int, default=1000000, help="небольших ключей")
+    parser.add_argument("--small-size", type=int, default=100)
+    parser.add_argument("--large", type=int, default=1000, help="крупных файлов")
+    parser.add_argument("--large-size", type=bench_load.parse_size, default=1024 * 1024)
+    parser.add_argument("--configs", default="1x1,8x1,8x4",
+                        help="соединений x запросов в полёте, через запятую")
+    parser.add_argument("--single", type=int, default=20000,
+                        help="ключей для замера записи по одному (0 — без него)")
+    parser.add_argument("--name", default="import", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+    configs = [tuple(int(n) for n in part.split("x")) for part in args.configs.split(",")]
+
+    workdir = tempfile.mkdtemp(prefix="dstorage-import-")
+    summary = {}
+    try:
+        start = time.perf_counter()
+        ndjson, files = make_sources(workdir, args.small, args.small_size, args.large,
+                                     args.large_size)
+        print(f"источники: {args.small} ключей по {args.small_size} Б, {args.large} файлов "
+              f"по {bulk.format_size(args.large_size)} за {time.perf_counter() - start:.1f} с")
+        phases = [("import_small", bulk.run_import, ndjson, "small/", args.small, args.small_size),
+                  ("import_large", bulk.run_import, files, "large/", args.large, args.large_size),
+                  ("export_small", bulk.run_export, os.path.join(workdir, "out.ndjson"),
+                   "small/", args.small, args.small_size),
+                  ("export_large", bulk.run_export, os.path.join(workdir, "out"),
+                   "large/", args.large, args.large_size)]
+        print(f"{'этап':<14}{'конфигурация':>14}{'с':>8}{'ключей/с':>11}{'МиБ/с':>9}")
+        with Cluster(args.workers, worker_args=["--engine", args.engine]):
+            if args.single:
+                elapsed = single_puts(args.single, args.small_size)
+                summary["single_put"] = {"seconds": round(elapsed, 2),
+                                         "keys_s": round(args.single / elapsed, 1)}
+                print(f"{'single_put':<14}{'1x1':>14}{elapsed:>8.1f}"
+                      f"{args.single / elapsed:>11.0f}"
+                      f"{args.single * args.small_size / elapsed / 2 ** 20:>9.1f}")
+            for connections, depth in configs:
+                config = f"{connections}x{depth}"
+                for phase, run, path, prefix, count, size in phases:
+                    exporting = run is bulk.run_export
+                    elapsed = timed(run, bulk_args(path, prefix, connections, depth, exporting))
+                    if exporting:
+                        # Следующая конфигурация выгружает заново
+                        if os.path.isdir(path):
+                            shutil.rmtree(path)
+                        else:
+                            os.remove(path)
+                    part = {"seconds": round(elapsed, 2), "keys_s": round(count / elapsed, 1),
+                            "mb_s": round(count * size / elapsed / 2 ** 20, 1)}
+                    summary.setdefault(phase, {})[config] = part
+                    print(f"{phase:<14}{config:>14}{elapsed:>8.1f}{part['keys_s']:>11.0f}"
+                          f"{part['mb_s']:>9.1f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
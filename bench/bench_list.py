@@ -0,0 +1,85 @@
+# bench/bench_list.py
+# Полный список ключей и постраничный обход через мастер: скорость и
+# пиковая память мастера и нод.
+import argparse
+import json
+import socket
+import time
+import urllib.parse
+
+from cluster import MASTER_PORT, Cluster, Connection, proc_status
+
+import batch
+import httputil
+
+def load(keys, batch_size):
+    conn = Connection()
+    for i in range(0, keys, batch_size):
+        items = [(f"key:{n:09d}", b"v") for n in range(i, min(i + batch_size, keys))]
+        code, _ = conn.request("POST", batch.PATH, batch.build_request("put", items))
+        if code != 200:
+            raise RuntimeError(f"пакетная запись вернула {code}")
+    conn.close()
+
+def full_listing():
+    """Читает поток NDJSON по кускам, не собирая его в памяти. Возвращает число ключей."""
+    with socket.create_connection(("127.0.0.1", MASTER_PORT), timeout=600) as s:
+        s.sendall(httputil.build_request("GET", "/storage", "127.0.0.1", keep_alive=False))
+        code, _, stream = httputil.read_response_head(s, bytearray())
+        if code != 200:
+            raise RuntimeError(f"GET /storage вернул {code}")
+        count = 0
+        for chunk in stream.chunks():
+            count += chunk.count(b"\n")
+    return count
+
+def paged_listing(limit):
+    conn = Connection()
+    cursor, count, pages = None, 0, 0
+    while True:
+        query = {"limit": limit}
+        if cursor is not None:
+            query["cursor"] = cursor
+        code, body = conn.request("GET", "/storage?" + urllib.parse.urlencode(query))
+        if code != 200:
+            raise RuntimeError(f"GET /storage вернул {code}")
+        pages += 1
+        records = [json.loads(line) for line in body.splitlines()]
+        count += sum(1 for r in records if "key" in r)
+        if not records or "next_cursor" not in records[-1]:
+            break
+        cursor = records[-1]["next_cursor"]
+    conn.close()
+    return count, pages
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=300000)
+    parser.add_argument("--page", type=int, default=10000, help="limit= при постраничном обходе")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    with Cluster(3, master_args=["--mode", args.mode], worker_args=["--engine", "log"]) as cluster:
+        start = time.perf_counter()
+        load(args.keys, 5000)
+        print(f"загрузка {args.keys} ключей: {time.perf_counter() - start:.1f} с")
+        _, master_before = proc_status(cluster.procs["master"].pid)
+
+        start = time.perf_counter()
+        count = full_listing()
+        elapsed = time.perf_counter() - start
+        print(f"полный список: {count} ключей за {elapsed:.2f} с ({count / elapsed:.0f} ключей/с)")
+
+        start = time.perf_counter()
+        count, pages = paged_listing(args.page)
+        elapsed = time.perf_counter() - start
+        print(f"по страницам limit={args.page}: {count} ключей, {pages} страниц за {elapsed:.2f} с "
+              f"({count / elapsed:.0f} ключей/с)")
+
+        _, master_peak = proc_status(cluster.procs["master"].pid)
+        worker_peak = max(proc_status(cluster.procs[i].pid)[1] for i in (1, 2, 3))
+        print(f"пиковый RSS мастера: {master_before:.0f} МиБ после загрузки, "
+              f"{master_peak:.0f} МиБ после списков; ноды: до {worker_peak:.0f} МиБ")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# bench/bench_load.py
+# Генератор нагрузки на локальный кластер: мастер и N нод в подпроцессах,
+# равномерное или Zipf-распределение ключей, доля чтений, размеры значений
+# от 16 Б до 64 МиБ, закрытый или открытый цикл подачи запросов.
+# Результат — ops/s и перцентили задержек в JSON (bench/results/).
+import argparse
+import asyncio
+import bisect
+import itertools
+import random
+import time
+
+from cluster import MASTER_PORT, Cluster, Connection, percentile
+
+import batch
+import httputil
+import results
+
+SIZE_UNITS = {"": 1, "B": 1, "K": 1024, "M": 1024 * 1024}
+MIN_SIZE, MAX_SIZE = 16, 64 * 1024 * 1024
+# Значения не длиннее этого загружаются пакетами
+BATCH_LOAD_VALUE = 64 * 1024
+PERCENTILES = (50, 95, 99, 99.9)
+
+def parse_size(text):
+    """'16', '4K', '64M' -> байты."""
+    text = text.strip().upper().removesuffix("IB").removesuffix("B")
+    number, unit = (text[:-1], text[-1]) if text and text[-1] in SIZE_UNITS else (text, "")
+    size = int(float(number) * SIZE_UNITS[unit])
+    if not MIN_SIZE <= size <= MAX_SIZE:
+        raise argparse.ArgumentTypeError(f"размер {text} вне диапазона 16B..64M")
+    return size
+
+def parse_sizes(text):
+    return [parse_size(part) for part in text.split(",")]
+
+class Workload:
+    """Выбор операции, ключа и размера значения.
+
+    Размер значения определяется номером ключа, поэтому GET знает, сколько
+    байт должно вернуться. При Zipf ключ с номером 0 самый популярный.
+    """
+
+    def __init__(self, keys, dist, zipf_s, read_ratio, sizes):
+        self.keys = keys
+        self.read_ratio = read_ratio
+        self.sizes = sizes
+        self.values = {size: b"v" * size for size in set(sizes)}
+        self.cum = None
+        if dist == "zipf":
+            self.cum = list(itertools.accumulate(1.0 / (i ** zipf_s) for i in range(1, keys + 1)))
+
+    def key_index(self, rnd):
+        if self.cum is None:
+            return rnd.randrange(self.keys)
+        return min(bisect.bisect_left(self.cum, rnd.random() * self.cum[-1]), self.keys - 1)
+
+    def size(self, index):
+        return self.sizes[index % len(self.sizes)]
+
+    def next_op(self, rnd):
+        index = self.key_index(rnd)
+        return ("GET" if rnd.random() < self.read_ratio else "PUT"), index
+
+def key_name(index):
+    return f"load-{index}"
+
+def preload(workload):
+    """Записывает все ключи: небольшие значения пакетами, крупные по одному."""
+    conn = Connection()
+    small = [i for i in range(workload.keys) if workload.size(i) <= BATCH_LOAD_VALUE]
+    for start in range(0, len(small), 500):
+        items = [(key_name(i), workload.values[workload.size(i)]) for i in small[start:start + 500]]
+        code, _ = conn.request("POST", batch.PATH, batch.build_request("put", items))
+        if code != 200:
+            raise RuntimeError(f"пакетная запись вернула {code}")
+    for i in range(workload.keys):
+        if workload.size(i) > BATCH_LOAD_VALUE:
+            code, _ = conn.request("PUT", f"/storage/{key_name(i)}", workload.values[workload.size(i)])
+            if code != 201:
+                raise RuntimeError(f"PUT вернул {code}")
+    conn.close()
+
+class Recorder:
+    """Задержки и коды ответов операций, начатых после прогрева."""
+
+    def __init__(self, measure_from):
+        self.measure_from = measure_from
+        self.latencies = {"GET": [], "PUT": []}
+        self.status = {}
+        self.errors = 0
+        self.misses = 0
+        self.bytes = 0
+
+    def add(self, method, start, end, code, size, expected):
+        if start < self.measure_from:
+            return
+        self.latencies[method].append(end - start)
+        self.status[code] = self.status.get(code, 0) + 1
+        self.bytes += size
+        if code is None or code >= 500:
+            self.errors += 1
+        elif method == "GET" and (code != 200 or size != expected):
+            self.misses += 1
+
+async def do_request(conn, workload, method, index):
+    """Один запрос на соединении conn = [reader, writer]. Возвращает (код, байт тела)."""
+    reader, writer = conn
+    size = workload.size(index)
+    path = f"/storage/{key_name(index)}"
+    if method == "PUT":
+        value = workload.values[size]
+        writer.write(httputil.request_head("PUT", path, "127.0.0.1", len(value)))
+        writer.write(value)
+    else:
+        writer.write(httputil.request_head("GET", path, "127.0.0.1", 0))
+    await writer.drain()
+    code, headers, stream = await httputil.read_response_head_async(reader)
+    received = 0
+    # Тело не собирается в памяти: значения бывают по 64 МиБ
+    async for chunk in stream.chunks():
+        received += len(chunk)
+    if headers.get("connection", "").lower() == "close":
+        raise ConnectionError("мастер закрыл соединение")
+    return code, (received if method == "GET" else size)
+
+async def open_conn():
+    reader, writer = await asyncio.open_connection("127.0.0.1", MASTER_PORT,
+                                                   limit=httputil.MAX_HEADER_SIZE)
+    return [reader, writer]
+
+async def run_op(conn, workload, method, index, start, recorder):
+    """Выполняет операцию; start — время, от которого считается задержка."""
+    try:
+        code, size = await do_request(conn, workload, method, index)
+    except (OSError, ConnectionError, asyncio.IncompleteReadError, httputil.BadRequest):
+        recorder.add(method, start, time.perf_counter(), None, 0, 0)
+        conn[1].close()
+        # Следующая операция пойдёт на новом соединении
+        conn[:] = await open_conn()
+        return
+    recorder.add(method, start, time.perf_counter(), code, size, workload.size(index))
+
+async def closed_loop(workload, clients, deadline, recorder, seed):
+    """clients соединений, каждое шлёт следующий запрос сразу после ответа."""
+    async def client(i):
+        rnd = random.Random(seed + i)
+        conn = await open_conn()
+        while time.perf_counter() < deadline:
+            method, index = workload.next_op(rnd)
+            await run_op(conn, workload, method, index, time.perf_counter(), recorder)
+        conn[1].close()
+    await asyncio.gather(*(client(i) for i in range(clients)))
+
+async def open_loop(workload, clients, rate, deadline, recorder, seed):
+    """Запросы приходят пуассоновским потоком с частотой rate, независимо от ответов.
+
+    Задержка считается от запланированного момента прихода: если все
+    clients соединений заняты, ожидание свободного входит в задержку
+    (без coordinated omission).
+    """
+    rnd = random.Random(seed)
+    idle = asyncio.Queue()
+    for _ in range(clients):
+        idle.put_nowait(await open_conn())
+    tasks = set()
+
+    async def op(method, index, start):
+        conn = await idle.get()
+        try:
+            await run_op(conn, workload, method, index, start, recorder)
+        finally:
+            idle.put_nowait(conn)
+
+    planned = time.perf_counter()
+    while True:
+        planned += rnd.expovariate(rate)
+        if planned >= deadline:
+            break
+        delay = planned - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        method, index = workload.next_op(rnd)
+        task = asyncio.create_task(op(method, index, planned))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    while not idle.empty():
+        idle.get_nowait()[1].close()
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    summary = {"ops": len(latencies), "ops_s": round(len(latencies) / elapsed, 1)}
+    if latencies:
+        ms = {f"p{p:g}": round(percentile(latencies, p) * 1000, 3) for p in PERCENTILES}
+        ms["mean"] = round(sum(latencies) / len(latencies) * 1000, 3)
+        ms["max"] = round(latencies[-1] * 1000, 3)
+        summary["latency_ms"] = ms
+    return summary
+
+def run_workload(args, workload):
+    start = time.perf_counter()
+    recorder = Recorder(start + args.warmup)
+    deadline = start + args.warmup + args.duration
+    if args.arrival == "closed":
+        coro = closed_loop(workload, args.clients, deadline, recorder, args.seed)
+    else:
+        coro = open_loop(workload, args.clients, args.rate, deadline, recorder, args.seed)
+    asyncio.run(coro)
+    # Открытый цикл дожидается запросов, пришедших до конца замера
+    elapsed = max(time.perf_counter(), deadline) - recorder.measure_from
+    everything = recorder.latencies["GET"] + recorder.latencies["PUT"]
+    summary = summarize(everything, elapsed)
+    summary.update(
+        mb_s=round(recorder.bytes / elapsed / 1024 / 1024, 3),
+        errors=recorder.errors,
+        misses=recorder.misses,
+        status={str(code): n for code, n in sorted(recorder.status.items(), key=str)},
+        by_op={method: summarize(lat, elapsed) for method, lat in recorder.latencies.items() if lat},
+    )
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест локального кластера")
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                        help="режим мастера и нод")
+    parser.add_argument("--engine", default="log", help="движок хранения нод")
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--master-arg", action="append", default=[],
+                        help="дополнительный аргумент мастера (можно повторять)")
+    parser.add_argument("--worker-arg", action="append", default=[],
+                        help="дополнительный аргумент нод (можно повторять)")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--dist", choices=("uniform", "zipf"), default="uniform")
+    parser.add_argument("--zipf", type=float, default=0.99, help="показатель Zipf-распределения")
+    parser.add_argument("--read-ratio", type=float, default=0.9, help="доля GET среди операций")
+    parser.add_argument("--value-size", type=parse_sizes, default=[parse_size("128")],
+                        help="размеры значений через запятую, например 16,4K,1M,64M")
+    parser.add_argument("--arrival", choices=("closed", "open"), default="closed",
+                        help="closed — ответ, затем следующий запрос; open — поток с частотой --rate")
+    parser.add_argument("--clients", type=int, default=16, help="соединений с мастером")
+    parser.add_argument("--rate", type=float, default=1000, help="запросов в секунду (open)")
+    parser.add_argument("--duration", type=float, default=10, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=2, help="секунд прогрева без учёта")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-preload", action="store_true", help="не записывать ключи заранее")
+    parser.add_argument("--name", default="load", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR, help="каталог результатов")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+    if not 0 <= args.read_ratio <= 1:
+        parser.error("--read-ratio должно быть от 0 до 1")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    workload = Workload(args.keys, args.dist, args.zipf, args.read_ratio, args.value_size)
+    master_args = ["--mode", args.mode, "--replicas", str(args.replicas)] + args.master_arg
+    worker_args = ["--mode", args.mode, "--engine", args.engine] + args.worker_arg
+    with Cluster(args.workers, master_args=master_args, worker_args=worker_args):
+        if not args.no_preload:
+            start = time.perf_counter()
+            preload(workload)
+            print(f"загрузка {args.keys} ключей: {time.perf_counter() - start:.1f} с")
+        summary = run_workload(args, workload)
+
+    lat = summary.get("latency_ms", {})
+    print(f"{summary['ops_s']:.0f} ops/s, {summary['mb_s']:.1f} МиБ/с, "
+          + ", ".join(f"{name} {lat[name]:.2f} мс" for name in ("p50", "p95", "p99", "p99.9")
+                      if name in lat)
+          + f", ошибок: {summary['errors']}, промахов: {summary['misses']}")
+    for method, part in summary["by_op"].items():
+        ms = part["latency_ms"]
+        print(f"  {method}: {part['ops_s']:.0f} ops/s, p50 {ms['p50']:.2f} мс, "
+              f"p99 {ms['p99']:.2f} мс, p99.9 {ms['p99.9']:.2f} мс")
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# bench/bench_micro.py
+# Отдельные части пути запроса без сети и подпроцессов: выбор ноды
+# (master.get_target_node), путь файла ключа (storage.value_path),
+# разбор заголовков запроса и ответа (httputil.read_request, в том числе
+# конвейером, и read_response_head), сборка и отправка ответа
+# (httputil.response_head, send_response). Результат — нс на вызов в JSON
+# (bench/results/).
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hashring
+import httputil
+import master
+import results
+import storage
+
+def measure(fn, number, repeat):
+    """Лучшее из repeat время одного вызова fn, нс (как timeit)."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        per_call = (time.perf_counter() - start) / number * 1e9
+        best = per_call if best is None else min(best, per_call)
+    return best
+
+def target_node_case(nodes):
+    with master.workers_lock:
+        master.workers.clear()
+        # С пустого кольца: перебалансировка для замера не нужна
+        master.ring = hashring.HashRing()
+        for i in range(1, nodes + 1):
+            master.workers[i] = {"id": i, "name": f"w{i}", "host": "127.0.0.1",
+                                 "port": 8000 + i, "weight": 1.0}
+        master.rebuild_ring()
+    keys = [f"user:{i}" for i in range(1000)]
+    it = iter(range(1 << 62))
+    return lambda: master.get_target_node(keys[next(it) % 1000])
+
+def parse_case(raw, count=1):
+    """Разбор count запросов подряд из одного буфера (pipelining)."""
+    def parse():
+        buf = bytearray(raw * count)
+        for _ in range(count):
+            req = httputil.read_request(None, buf)
+            if req is None:
+                raise RuntimeError("запрос не разобран")
+            req.stream.read_all()
+    return parse
+
+def response_parse_case(raw):
+    def parse():
+        httputil.read_response_head(None, bytearray(raw))
+    return parse
+
+class Sink:
+    """Пара сокетов: в один пишет send_response, второй вычитывает поток."""
+
+    def __init__(self):
+        self.conn, self.peer = socket.socketpair()
+        self.thread = threading.Thread(target=self.drain, daemon=True)
+        self.thread.start()
+
+    def drain(self):
+        while self.peer.recv(1 << 20):
+            pass
+
+    def close(self):
+        self.conn.close()
+        self.thread.join()
+        self.peer.close()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--number", type=int, default=20000, help="вызовов в одном замере")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров, берётся лучший")
+    parser.add_argument("--name", default="micro", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    get_request = (b"GET /storage/user%3A42 HTTP/1.1\r\nHost: 127.0.0.1:8080\r\n"
+                   b"User-Agent: bench\r\nAccept: */*\r\nConnection: keep-alive\r\n\r\n")
+    put_request = (b"PUT /storage/user%3A42 HTTP/1.1\r\nHost: 127.0.0.1:8080\r\n"
+                   b"Content-Type: application/octet-stream\r\nContent-Length: 128\r\n"
+                   b"X-Version: 1700000000000000000\r\n\r\n") + b"v" * 128
+    worker_response = (b"HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\n"
+                       b"Content-Length: 128\r\nConnection: keep-alive\r\n"
+                       b"Date: Thu, 01 Jan 2026 00:00:00 GMT\r\nX-Version: 1\r\n\r\n")
+    sink = Sink()
+    small, large = b"v" * 128, b"v" * 65536
+
+    def cases():
+        # Генератор: кольцо для get_target_node собирается прямо перед своим замером
+        yield "get_target_node.3_nodes", target_node_case(3)
+        yield "get_target_node.10_nodes", target_node_case(10)
+        yield "value_path.short", lambda: storage.value_path("user:42/profile")
+        yield "value_path.250_chars", lambda: storage.value_path("k/" * 125)
+        yield "read_request.get", parse_case(get_request)
+        yield "read_request.put", parse_case(put_request)
+        yield "read_request.pipelined_x10", parse_case(get_request, 10)
+        yield "read_response_head", response_parse_case(worker_response)
+        yield "response_head", lambda: httputil.response_head(200, 128, "application/octet-stream",
+                                                              True, {"X-Version": 1})
+        yield "send_response.128b", lambda: httputil.send_response(
+            sink.conn, 200, small, "application/octet-stream", True)
+        yield "send_response.64kib", lambda: httputil.send_response(
+            sink.conn, 200, large, "application/octet-stream", True)
+
+    summary = {}
+    print(f"{'операция':<28}{'нс/вызов':>12}{'вызовов/с':>14}")
+    for name, fn in cases():
+        ns = measure(fn, args.number, args.repeat)
+        summary[name] = {"ns_per_call": round(ns, 1), "calls_s": round(1e9 / ns)}
+        print(f"{name:<28}{ns:>12.0f}{1e9 / ns:>14,.0f}")
+    sink.close()
+
+    config = {"number": args.number, "repeat": args.repeat}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# bench/bench_modes.py
+# Генератор нагрузки: поток на соединение против asyncio-режима мастера и
+# нод при 10, 100 и 1000 одновременных keep-alive соединениях.
+import argparse
+import asyncio
+import time
+
+from cluster import MASTER_PORT, Cluster, percentile, proc_status
+
+import httputil
+
+async def client(idx, deadline, value, latencies, errors):
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", MASTER_PORT)
+    except OSError:
+        errors.append("connect")
+        return
+    i = 0
+    try:
+        while time.perf_counter() < deadline:
+            path = f"/storage/c{idx}-k{i % 50}"
+            method, body = ("PUT", value) if i % 2 == 0 else ("GET", b"")
+            start = time.perf_counter()
+            writer.write(httputil.build_request(method, path, "127.0.0.1", body))
+            await writer.drain()
+            code, _, _ = await httputil.read_response_async(reader)
+            latencies.append(time.perf_counter() - start)
+            if code >= 500:
+                errors.append(code)
+            i += 1
+    except (ConnectionError, asyncio.IncompleteReadError) as e:
+        errors.append(type(e).__name__)
+    finally:
+        writer.close()
+
+async def run_load(concurrency, duration, value, master_pid):
+    latencies, errors = [], []
+    peak_threads = 0
+
+    async def sample_threads():
+        nonlocal peak_threads
+        while True:
+            peak_threads = max(peak_threads, proc_status(master_pid)[0])
+            await asyncio.sleep(0.2)
+
+    sampler = asyncio.create_task(sample_threads())
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i, deadline, value, latencies, errors)
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+    latencies.sort()
+    return len(latencies) / elapsed, latencies, errors, peak_threads
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--duration", type=float, default=5.0, help="секунд на замер")
+    parser.add_argument("--value-size", type=int, default=128)
+    args = parser.parse_args()
+    value = b"x" * args.value_size
+
+    print(f"{'режим':<9}{'conns':>7}{'ops/s':>9}{'p50, мс':>10}{'p99, мс':>10}{'ошибки':>8}"
+          f"{'потоков':>9}{'RSS, МиБ':>10}")
+    for mode in ("threads", "asyncio"):
+        with Cluster(3, master_args=["--mode", mode], worker_args=["--mode", mode]) as cluster:
+            master_pid = cluster.procs["master"].pid
+            for concurrency in args.concurrency:
+                ops_s, lat, errors, threads = asyncio.run(
+                    run_load(concurrency, args.duration, value, master_pid))
+                rss = proc_status(master_pid)[1]
+                print(f"{mode:<9}{concurrency:>7}{ops_s:>9.0f}{percentile(lat, 50) * 1000:>10.2f}"
+                      f"{percentile(lat, 99) * 1000:>10.2f}{len(errors):>8}{threads:>9}{rss:>10.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# bench/bench_pool.py
+# Латентность и пропускная способность мастера с пулом соединений к нодам
+# и без него (--pool-size 0) на локальном кластере из трёх нод.
+import argparse
+import threading
+import time
+
+from cluster import Cluster, Connection, percentile
+
+def run_load(clients, ops, value):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(idx):
+        conn = Connection()
+        local = []
+        for i in range(ops):
+            path = f"/storage/c{idx}-k{i % 100}"
+            start = time.perf_counter()
+            if i % 2 == 0:
+                code, _ = conn.request("PUT", path, value)
+            else:
+                code, _ = conn.request("GET", path)
+            local.append(time.perf_counter() - start)
+            if code >= 500:
+                raise RuntimeError(f"ошибка {code}")
+        conn.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, percentile(latencies, 50), percentile(latencies, 99)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=500, help="операций на клиента")
+    parser.add_argument("--value-size", type=int, default=128)
+    args = parser.parse_args()
+    value = b"x" * args.value_size
+
+    print(f"{'режим':<10}{'ops/s':>10}{'p50, мс':>10}{'p99, мс':>10}")
+    for name, master_args in [("без пула", ["--pool-size", "0"]), ("пул", [])]:
+        with Cluster(3, master_args=master_args):
+            ops_s, p50, p99 = run_load(args.clients, args.ops, value)
+        print(f"{name:<10}{ops_s:>10.0f}{p50 * 1000:>10.2f}{p99 * 1000:>10.2f}")
+
+if __name__ == "__main__":
+    main()
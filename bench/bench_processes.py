@@ -0,0 +1,63 @@
+# bench/bench_processes.py
+# Масштабирование пропускной способности по числу процессов (--processes)
+# у мастера и нод: одна и та же нагрузка bench_load для каждого числа
+# процессов. Рост ожидается примерно до числа ядер машины.
+import argparse
+import os
+
+from cluster import Cluster
+
+import bench_load
+import results
+
+def main():
+    cores = os.cpu_count() or 1
+    default = sorted({1, 2, max(cores // 2, 1), cores})
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--processes", type=int, nargs="+", default=default,
+                        help="числа процессов мастера и нод")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    parser.add_argument("--engine", default="log")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--value-size", type=bench_load.parse_size, default=128)
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--duration", type=float, default=10.0, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--name", default="processes", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    workload = bench_load.Workload(args.keys, "uniform", 0, args.read_ratio, [args.value_size])
+    summary = {}
+    base = None
+    print(f"ядер: {cores}")
+    print(f"{'процессов':>10}{'ops/s':>9}{'рост':>7}{'p50, мс':>10}{'p99, мс':>10}{'ошибок':>8}")
+    for processes in args.processes:
+        master_args = ["--mode", args.mode, "--processes", str(processes)]
+        worker_args = ["--mode", args.mode, "--engine", args.engine,
+                       "--processes", str(processes)]
+        with Cluster(args.workers, master_args=master_args, worker_args=worker_args):
+            bench_load.preload(workload)
+            run = argparse.Namespace(warmup=args.warmup, duration=args.duration,
+                                     arrival="closed", clients=args.clients, seed=processes)
+            part = bench_load.run_workload(run, workload)
+        lat = part["latency_ms"]
+        base = base or part["ops_s"]
+        part = {"ops_s": part["ops_s"], "errors": part["errors"], "misses": part["misses"],
+                "latency_ms": lat, "speedup": round(part["ops_s"] / base, 2) if base else 0}
+        summary[f"p{processes}"] = part
+        print(f"{processes:>10}{part['ops_s']:>9.0f}{part['speedup']:>7.2f}"
+              f"{lat['p50']:>10.2f}{lat['p99']:>10.2f}{part['errors']:>8}")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    config["cores"] = cores
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# bench/bench_rebalance.py
+# Перенос ключей при добавлении ноды: скорость переноса и задержки
+# чтений, идущих в это время через мастер. Сравнивается с фоном без
+# переноса при разных ограничениях скорости (--rebalance-mb).
+import argparse
+import json
+import random
+import threading
+import time
+
+from cluster import Cluster, Connection, percentile, request
+
+import batch
+
+def load(keys, value):
+    conn = Connection()
+    for i in range(0, keys, 500):
+        items = [(f"key-{n}", value) for n in range(i, min(i + 500, keys))]
+        code, _ = conn.request("POST", batch.PATH, batch.build_request("put", items))
+        if code != 200:
+            raise RuntimeError(f"пакетная запись вернула {code}")
+    conn.close()
+
+class Readers:
+    """Клиенты, непрерывно читающие случайные ключи; задержки пишутся в текущую фазу."""
+
+    def __init__(self, clients, keys, value_size):
+        self.keys = keys
+        self.value_size = value_size
+        self.phase = "baseline"
+        self.latencies = {}
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.threads = [threading.Thread(target=self.run, args=(i,)) for i in range(clients)]
+
+    def run(self, seed):
+        rnd = random.Random(seed)
+        conn = Connection()
+        while not self.stop.is_set():
+            key = f"key-{rnd.randrange(self.keys)}"
+            start = time.perf_counter()
+            code, body = conn.request("GET", f"/storage/{key}")
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.latencies.setdefault(self.phase, []).append(elapsed)
+                if code != 200 or len(body) != self.value_size:
+                    self.misses += 1
+        conn.close()
+
+    def __enter__(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for t in self.threads:
+            t.join()
+
+def run(args, rate):
+    value = b"m" * args.value_size
+    master_args = ["--mode", args.mode, "--rebalance-mb", str(rate),
+                   "--rebalance-threads", str(args.threads), "--replicas", str(args.replicas)]
+    with Cluster(2, master_args=master_args, worker_args=["--engine", "log"]) as cluster:
+        load(args.keys, value)
+        with Readers(args.clients, args.keys, args.value_size) as readers:
+            time.sleep(args.baseline)
+            with readers.lock:
+                readers.phase = "migration"
+            start = time.perf_counter()
+            cluster.start_worker(3)
+            while True:
+                time.sleep(0.2)
+                status = json.loads(request("GET", "/rebalance")[1])
+                last = status["last"]
+                if not status["active"] and last is not None and 3 in last["new_nodes"]:
+                    break
+            with readers.lock:
+                readers.phase = "after"
+            duration = time.perf_counter() - start
+        return last, readers.latencies, readers.misses, duration
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=20000)
+    parser.add_argument("--value-size", type=int, default=4096)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--threads", type=int, default=8, help="--rebalance-threads мастера")
+    parser.add_argument("--rates", default="0,10", help="ограничения скорости переноса, МиБ/с")
+    parser.add_argument("--replicas", type=int, default=1)
+    parser.add_argument("--baseline", type=float, default=3, help="секунд чтения до добавления ноды")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    print(f"{args.keys} ключей по {args.value_size} байт, 2 ноды + 1, N={args.replicas}, "
+          f"режим: {args.mode}, читателей: {args.clients}")
+    print(f"{'МиБ/с':>6}{'ключей':>8}{'время, с':>10}{'ключей/с':>10}{'МиБ/с':>8}"
+          f"{'фаза':>11}{'GET/s':>8}{'p50, мс':>9}{'p99, мс':>9}{'промахи':>9}")
+    for rate in (float(r) for r in args.rates.split(",")):
+        last, latencies, misses, migration_time = run(args, rate)
+        for phase in ("baseline", "migration"):
+            lat = sorted(latencies.get(phase, []))
+            duration = args.baseline if phase == "baseline" else migration_time
+            head = (f"{rate or 'нет':>6}{last['keys_copied']:>8}{last['elapsed_s']:>10.2f}"
+                    f"{last['keys_per_s']:>10.0f}{last['mb_per_s']:>8.1f}" if phase == "baseline"
+                    else " " * 42)
+            print(f"{head}{phase:>11}{len(lat) / duration:>8.0f}{percentile(lat, 50) * 1000:>9.2f}"
+                  f"{percentile(lat, 99) * 1000:>9.2f}{misses if phase == 'migration' else '':>9}")
+
+if __name__ == "__main__":
+    main()
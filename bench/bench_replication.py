@@ -0,0 +1,83 @@
+# bench/bench_replication.py
+# Хвосты задержек PUT/GET, когда одна из трёх нод медленная (заглушка
+# slow_worker.py), без репликации и с репликацией N=3 при разных кворумах
+# и дублировании чтений.
+import argparse
+import random
+import threading
+import time
+
+from cluster import Cluster, Connection, percentile
+
+def run_phase(args, method, value):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(seed):
+        rnd = random.Random(seed)
+        c = Connection()
+        local = []
+        for _ in range(args.ops):
+            key = f"key-{rnd.randrange(args.keys)}"
+            start = time.perf_counter()
+            code, _ = c.request(method, f"/storage/{key}", value if method == "PUT" else b"")
+            local.append(time.perf_counter() - start)
+            if code not in (200, 201):
+                raise RuntimeError(f"{method} вернул {code}")
+        c.close()
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return len(latencies) / elapsed, latencies
+
+def run(master_args, args):
+    value = b"r" * args.value_size
+    with Cluster(2, master_args=master_args) as cluster:
+        cluster.start_stub(3, "slow_worker.py", ["--delay-ms", str(args.delay_ms)])
+        time.sleep(0.3)
+        conn = Connection()
+        for i in range(args.keys):
+            conn.request("PUT", f"/storage/key-{i}", value)
+        conn.close()
+        return run_phase(args, "PUT", value), run_phase(args, "GET", value)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=1000)
+    parser.add_argument("--ops", type=int, default=500, help="запросов на клиента в каждой фазе")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--value-size", type=int, default=1024)
+    parser.add_argument("--delay-ms", type=float, default=50, help="задержка медленной ноды")
+    parser.add_argument("--hedge-ms", type=float, default=5)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    no_hedge = ["--hedge-ms", "100000"]
+    hedge = ["--hedge-ms", str(args.hedge_ms)]
+    configs = [
+        ("N=1", []),
+        ("N=3 W=2 R=1", ["--replicas", "3", "--write-quorum", "2", "--read-quorum", "1"] + no_hedge),
+        ("N=3 W=2 R=1 hedge", ["--replicas", "3", "--write-quorum", "2", "--read-quorum", "1"]
+         + hedge),
+        ("N=3 W=2 R=2 hedge", ["--replicas", "3", "--write-quorum", "2", "--read-quorum", "2"]
+         + hedge),
+    ]
+    print(f"медленная нода: +{args.delay_ms} мс, дублирование чтения через {args.hedge_ms} мс, "
+          f"режим: {args.mode}, клиентов: {args.clients}")
+    print(f"{'конфигурация':<20}{'':<5}{'ops/s':>8}{'p50, мс':>10}{'p99, мс':>10}{'p99.9, мс':>11}")
+    for name, master_args in configs:
+        phases = run(["--mode", args.mode] + master_args, args)
+        for method, (ops_s, lat) in zip(("PUT", "GET"), phases):
+            print(f"{name:<20}{method:<5}{ops_s:>8.0f}{percentile(lat, 50) * 1000:>10.2f}"
+                  f"{percentile(lat, 99) * 1000:>10.2f}{percentile(lat, 99.9) * 1000:>11.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# bench/bench_restart.py
+# Время от перезапуска мастера до первого успешного GET. persisted —
+# мастер восстанавливает состав нод из --meta-dir; fresh — метаданные не
+# сохраняются, и после запуска ноды создаются заново (PUT /node), как это
+# делал бы оператор, а ноды регистрируются повторно сами. Кроме первого
+# GET замеряется время, когда все ключи (на всех нодах) снова читаются.
+import argparse
+import json
+import socket
+import time
+
+from cluster import MASTER_PORT, Cluster, request
+
+import httputil
+import results
+
+def try_get(path):
+    """Код ответа GET на новом соединении или None, если порт ещё закрыт."""
+    try:
+        with socket.create_connection(("127.0.0.1", MASTER_PORT), timeout=5) as s:
+            s.sendall(httputil.build_request("GET", path, "127.0.0.1", keep_alive=False))
+            code, _, _ = httputil.read_response(s)
+            return code
+    except OSError:
+        return None
+
+def restart(cluster, workers, keys, mode, kill, timeout):
+    """Перезапускает мастер.
+
+    Возвращает мс до открытия порта, до первого GET 200 и до того, как
+    каждый ключ хотя бы раз прочитан.
+    """
+    if kill:
+        cluster.kill("master")
+    else:
+        cluster.stop("master")
+    start = time.perf_counter()
+    cluster.start_master(wait=False)
+    port_open = first_get = None
+    unread = set(range(keys))
+    attempt = 0
+    while time.perf_counter() - start < timeout:
+        index = attempt % keys if first_get is None else min(unread)
+        code = try_get(f"/storage/restart-{index}")
+        attempt += 1
+        if code is None:
+            time.sleep(0.002)
+            continue
+        if port_open is None:
+            port_open = (time.perf_counter() - start) * 1000
+            if mode == "fresh":
+                for node_id in range(1, workers + 1):
+                    body = json.dumps({"name": f"w{node_id}"}).encode('utf-8')
+                    request("PUT", f"/node/{node_id}", body, content_type="application/json")
+        if code != 200:
+            time.sleep(0.002)
+            continue
+        first_get = first_get or (time.perf_counter() - start) * 1000
+        unread.discard(index)
+        if not unread:
+            return port_open, first_get, (time.perf_counter() - start) * 1000
+    raise RuntimeError(f"не все ключи прочитаны за {timeout} с")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", choices=("persisted", "fresh"),
+                        default=["persisted", "fresh"])
+    parser.add_argument("--rounds", type=int, default=5, help="перезапусков в каждом режиме")
+    parser.add_argument("--keys", type=int, default=100)
+    parser.add_argument("--kill", action="store_true", help="SIGKILL вместо SIGTERM")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--pause", type=float, default=6.0,
+                        help="секунд между перезапусками: ноды успевают заметить мастер")
+    parser.add_argument("--name", default="restart", help="префикс файла результата")
+    parser.add_argument("--out", default=results.RESULTS_DIR)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--compare", help="файл прошлого результата для сравнения")
+    args = parser.parse_args()
+
+    summary = {}
+    print(f"{'режим':<11}{'порт, мс':>10}{'первый GET, мс':>16}{'все ключи, мс':>15}"
+          f"{'макс., мс':>11}")
+    for mode in args.modes:
+        master_args = ["--meta-dir", ""] if mode == "fresh" else []
+        with Cluster(args.workers, master_args=master_args) as cluster:
+            for i in range(args.keys):
+                code, _ = request("PUT", f"/storage/restart-{i}", b"x" * 100)
+                if code != 201:
+                    raise RuntimeError(f"PUT вернул {code}")
+            times = []
+            for _ in range(args.rounds):
+                time.sleep(args.pause)
+                times.append(restart(cluster, args.workers, args.keys, mode, args.kill,
+                                     args.timeout))
+        part = {}
+        for name, values in zip(("port_open_ms", "first_get_ms", "all_keys_ms"), zip(*times)):
+            values = sorted(values)
+            part[name] = {"p50": round(values[len(values) // 2], 1), "max": round(values[-1], 1)}
+        summary[mode] = part
+        print(f"{mode:<11}{part['port_open_ms']['p50']:>10.1f}{part['first_get_ms']['p50']:>16.1f}"
+              f"{part['all_keys_ms']['p50']:>15.1f}{part['all_keys_ms']['max']:>11.1f}")
+
+    config = {name: value for name, value in vars(args).items()
+              if name not in ("name", "out", "no_save", "compare")}
+    results.report(results.record(args.name, config, summary), args.out, args.no_save,
+                   args.compare)
+
+if __name__ == "__main__":
+    main()
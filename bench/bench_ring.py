@@ -0,0 +1,67 @@
+# bench/bench_ring.py
+# Стоимость поиска ноды и доля перемещённых ключей при смене состава:
+# старое шардирование по модулю против консистентного кольца.
+import argparse
+import hashlib
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import hashring
+
+def modulo_lookup(nodes):
+    """Старый алгоритм master.get_target_node: список активных нод
+    под блокировкой на каждый поиск, затем sha256 % число нод."""
+    workers = {n: {"id": n, "port": 8000 + n} for n in nodes}
+    lock = threading.Lock()
+    def lookup(key):
+        with lock:
+            active = [w for w in workers.values() if w["port"] != 0]
+        key_hash = int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16)
+        return active[key_hash % len(active)]["id"]
+    return lookup
+
+def ring_lookup(nodes, vnodes):
+    return hashring.HashRing({n: 1.0 for n in nodes}, vnodes).get_node
+
+def moved_fraction(keys, before, after):
+    moved = sum(1 for k in keys if before(k) != after(k))
+    return moved / len(keys)
+
+def time_lookups(keys, lookup):
+    start = time.perf_counter()
+    for k in keys:
+        lookup(k)
+    return (time.perf_counter() - start) / len(keys) * 1e9
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--vnodes", type=int, default=hashring.DEFAULT_VNODES)
+    args = parser.parse_args()
+
+    keys = [f"key-{i}" for i in range(args.keys)]
+    base = list(range(1, args.nodes + 1))
+    grown = base + [args.nodes + 1]
+    shrunk = base[:-1]
+
+    print(f"ключей: {args.keys}, нод: {args.nodes}, vnodes: {args.vnodes}")
+    print(f"{'схема':<10}{'ns/поиск':>12}{'+1 нода':>12}{'-1 нода':>12}")
+    schemes = [
+        ("modulo", modulo_lookup),
+        ("ring", lambda nodes: ring_lookup(nodes, args.vnodes)),
+    ]
+    for name, make in schemes:
+        lookup = make(base)
+        ns = time_lookups(keys, lookup)
+        added = moved_fraction(keys, lookup, make(grown))
+        removed = moved_fraction(keys, lookup, make(shrunk))
+        print(f"{name:<10}{ns:>12.0f}{added:>11.1%}{removed:>12.1%}")
+    print(f"идеал: +1 нода {1 / (args.nodes + 1):.1%}, -1 нода {1 / args.nodes:.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# bench/bench_stream.py
+# PUT и GET большого значения через мастер: скорость и пиковая память
+# процессов. При потоковой передаче RSS не должен расти с размером значения.
+import argparse
+import socket
+import time
+
+from cluster import MASTER_PORT, Cluster, proc_status
+
+import httputil
+
+CHUNK = b"\xab" * (1024 * 1024)
+
+def put(path, size_mb):
+    with socket.create_connection(("127.0.0.1", MASTER_PORT)) as s:
+        s.sendall(httputil.request_head("PUT", path, "127.0.0.1", size_mb * len(CHUNK),
+                                        keep_alive=False))
+        for _ in range(size_mb):
+            s.sendall(CHUNK)
+        code, _, _ = httputil.read_response(s)
+    return code
+
+def get(path):
+    with socket.create_connection(("127.0.0.1", MASTER_PORT)) as s:
+        s.sendall(httputil.build_request("GET", path, "127.0.0.1", keep_alive=False))
+        code, _, stream = httputil.read_response_head(s, bytearray())
+        received = sum(len(chunk) for chunk in stream.chunks())
+    return code, received
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=int, default=1024)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads")
+    args = parser.parse_args()
+
+    with Cluster(1, master_args=["--mode", args.mode],
+                 worker_args=["--mode", args.mode]) as cluster:
+        start = time.perf_counter()
+        code = put("/storage/big", args.size_mb)
+        put_s = time.perf_counter() - start
+        if code != 201:
+            raise RuntimeError(f"PUT вернул {code}")
+
+        start = time.perf_counter()
+        code, received = get("/storage/big")
+        get_s = time.perf_counter() - start
+        if code != 200 or received != args.size_mb * len(CHUNK):
+            raise RuntimeError(f"GET вернул {code}, {received} байт")
+
+        print(f"значение: {args.size_mb} МиБ, режим: {args.mode}")
+        print(f"PUT: {args.size_mb / put_s:.0f} МиБ/с, GET: {args.size_mb / get_s:.0f} МиБ/с")
+        for name in ("master", 1):
+            print(f"пиковый RSS {'мастера' if name == 'master' else 'ноды'}: "
+                  f"{proc_status(cluster.procs[name].pid)[1]:.1f} МиБ")
+
+if __name__ == "__main__":
+    main()
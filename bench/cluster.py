@@ -0,0 +1,158 @@
+# bench/cluster.py
+# Локальный кластер для бенчмарков: мастер и N рабочих нод в подпроцессах,
+# данные во временном каталоге.
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import httputil
+
+MASTER_PORT = 8080
+BASE_WORKER_PORT = 8000
+
+def wait_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"порт {port} не открылся за {timeout} с")
+
+def request(method, path, body=b"", port=MASTER_PORT, content_type="application/octet-stream"):
+    """Одиночный запрос на новом соединении. Возвращает (код, тело)."""
+    with socket.create_connection(("127.0.0.1", port), timeout=30) as s:
+        s.sendall(httputil.build_request(method, path, "127.0.0.1", body, content_type,
+                                         keep_alive=False))
+        code, _, body = httputil.read_response(s)
+    return code, body
+
+class Cluster:
+    """Контекстный менеджер: поднимает кластер и гасит его на выходе."""
+
+    def __init__(self, workers=3, master_args=(), worker_args=(), quiet=True):
+        self.n_workers = workers
+        self.master_args = list(master_args)
+        self.worker_args = list(worker_args)
+        self.quiet = quiet
+        self.procs = {}
+        self.workdir = None
+
+    def _spawn(self, script, args):
+        out = subprocess.DEVNULL if self.quiet else None
+        return subprocess.Popen([sys.executable, os.path.join(ROOT, script)] + args,
+                                cwd=self.workdir, stdout=out, stderr=out)
+
+    def start_master(self, wait=True):
+        self.procs["master"] = self._spawn("master.py", self.master_args)
+        if wait:
+            wait_port(MASTER_PORT)
+
+    def start_worker(self, node_id, register=True):
+        if register:
+            body = json.dumps({"name": f"w{node_id}"}).encode('utf-8')
+            code, _ = request("PUT", f"/node/{node_id}", body, content_type="application/json")
+            if code != 201:
+                raise RuntimeError(f"не удалось создать ноду {node_id}: {code}")
+        port = BASE_WORKER_PORT + node_id
+        self.procs[node_id] = self._spawn(
+            "worker.py", [str(port), f"w{node_id}", str(node_id)] + self.worker_args)
+        wait_port(port)
+
+    def start_stub(self, node_id, script, args=()):
+        """Регистрирует ноду и запускает вместо worker.py заглушку script <порт> <id> [args]."""
+        body = json.dumps({"name": f"stub{node_id}"}).encode('utf-8')
+        code, _ = request("PUT", f"/node/{node_id}", body, content_type="application/json")
+        if code != 201:
+            raise RuntimeError(f"не удалось создать ноду {node_id}: {code}")
+        port = BASE_WORKER_PORT + node_id
+        self.procs[node_id] = self._spawn(os.path.join("bench", script),
+                                          [str(port), str(node_id)] + list(args))
+        wait_port(port)
+
+    def stop(self, name):
+        proc = self.procs.pop(name, None)
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+
+    def kill(self, name):
+        """Аварийное завершение процесса (SIGKILL) без корректной остановки."""
+        proc = self.procs.pop(name, None)
+        if proc is not None:
+            proc.kill()
+            proc.wait()
+
+    def __enter__(self):
+        self.workdir = tempfile.mkdtemp(prefix="dstorage-bench-")
+        try:
+            self.start_master()
+            for node_id in range(1, self.n_workers + 1):
+                self.start_worker(node_id)
+            # Нода регистрируется на мастере через ~0.2 с после старта
+            time.sleep(0.5)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        for name in list(self.procs):
+            self.stop(name)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+class Connection:
+    """Keep-alive соединение клиента с мастером."""
+
+    def __init__(self, port=MASTER_PORT):
+        self.port = port
+        self.sock = None
+        self.buf = bytearray()
+
+    def request(self, method, path, body=b""):
+        if self.sock is None:
+            self.sock = socket.create_connection(("127.0.0.1", self.port), timeout=30)
+            self.buf = bytearray()
+        self.sock.sendall(httputil.build_request(method, path, "127.0.0.1", body))
+        code, headers, body = httputil.read_response(self.sock, self.buf)
+        if headers.get("connection", "").lower() == "close":
+            self.close()
+        return code, body
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+def proc_status(pid):
+    """Число потоков и пиковый RSS (МиБ) процесса из /proc (только Linux)."""
+    fields = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                fields[name] = value.strip().split(" ")[0]
+    except OSError:
+        return 0, 0.0
+    return int(fields.get("Threads", 0)), int(fields.get("VmHWM", 0)) / 1024
+
+def proc_cpu(pid):
+    """Время CPU процесса (user + system), с."""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
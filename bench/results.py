@@ -0,0 +1,95 @@
+# bench/results.py
+# Сохранение результатов бенчмарков в JSON с привязкой к коммиту и
+# сравнение двух запусков: python bench/results.py старый.json новый.json
+import datetime
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def git_commit():
+    """(коммит, есть ли незакоммиченные изменения); (None, False) вне git."""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                cwd=ROOT, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return commit, bool(status.strip())
+
+def record(name, config, results):
+    """Результат запуска вместе с коммитом и окружением."""
+    commit, dirty = git_commit()
+    return {
+        "name": name,
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "cpus": os.cpu_count(),
+        "config": config,
+        "results": results,
+    }
+
+def save(rec, out_dir=RESULTS_DIR):
+    """Пишет record() в out_dir/<имя>-<коммит>-<время>.json. Возвращает путь."""
+    os.makedirs(out_dir, exist_ok=True)
+    tag = (rec["commit"] or "nogit")[:8] + ("-dirty" if rec["dirty"] else "")
+    stamp = datetime.datetime.fromisoformat(rec["timestamp"]).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(out_dir, f"{rec['name']}-{tag}-{stamp}.json")
+    with open(path, "w") as f:
+        json.dump(rec, f, indent=2, ensure_ascii=False)
+    return path
+
+def report(rec, out_dir, no_save, compare_with):
+    """Общий конец бенчмарков: сохранение и сравнение с прошлым результатом."""
+    if not no_save:
+        print(f"результат: {save(rec, out_dir)}")
+    if compare_with:
+        for line in compare(load(compare_with), rec):
+            print(line)
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+def flatten(value, prefix=""):
+    """{"a": {"b": 1}} -> {"a.b": 1}; остаются только числа."""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(flatten(item, f"{prefix}{key}."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix[:-1]] = value
+    return flat
+
+def compare(old, new):
+    """Строки сравнения числовых результатов двух запусков."""
+    before, after = flatten(old["results"]), flatten(new["results"])
+    lines = [f"{old.get('commit') or '?':.8} ({old['timestamp']}) -> "
+             f"{new.get('commit') or '?':.8} ({new['timestamp']})"]
+    if old.get("config") != new.get("config"):
+        lines.append("внимание: параметры запусков различаются")
+    width = max((len(k) for k in after), default=10)
+    lines.append(f"{'метрика':<{width}}{'было':>14}{'стало':>14}{'изм.':>9}")
+    for key, value in after.items():
+        prev = before.get(key)
+        if prev is None:
+            lines.append(f"{key:<{width}}{'—':>14}{value:>14.6g}")
+            continue
+        change = f"{(value - prev) / prev * 100:+.1f}%" if prev else ""
+        lines.append(f"{key:<{width}}{prev:>14.6g}{value:>14.6g}{change:>9}")
+    return lines
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit("использование: python bench/results.py старый.json новый.json")
+    for line in compare(load(sys.argv[1]), load(sys.argv[2])):
+        print(line)
+
+if __name__ == "__main__":
+    main()
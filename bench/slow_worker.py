@@ -0,0 +1,102 @@
+# bench/slow_worker.py
+# Заглушка рабочей ноды для бенчмарков: значения в памяти и искусственная
+# задержка перед каждым ответом. Понимает X-Version так же, как worker.py.
+# --concurrency ограничивает, сколько запросов «обрабатывается» сразу:
+# нода успевает не больше concurrency / delay запросов в секунду.
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import httputil
+
+MASTER_PORT = 8080
+delay = 0.0
+# threading.Semaphore при --concurrency; None — без ограничения
+slots = None
+# ключ -> (версия, значение или None для удалённого)
+data = {}
+lock = threading.Lock()
+
+def handle_request(req):
+    if req.path == "/health":
+        # Медленная нода всё же жива: проба отвечает без задержки
+        return 200, b"OK", None
+    if slots is not None:
+        with slots:
+            time.sleep(delay)
+    else:
+        time.sleep(delay)
+    key = req.path[len("/storage/"):]
+    body = req.body
+    with lock:
+        current = data.get(key)
+        if req.method == "GET":
+            if current is None or current[1] is None:
+                headers = {"X-Version": current[0]} if current else None
+                return 404, b"Key not found", headers
+            return 200, current[1], {"X-Version": current[0]}
+        if "x-version" in req.headers:
+            version = int(req.headers["x-version"])
+            if current is not None and current[0] >= version:
+                return 409, b"Newer version exists", {"X-Version": current[0]}
+        else:
+            # Запрос без репликации: версия просто растёт
+            version = current[0] + 1 if current else 0
+        if req.method == "PUT":
+            data[key] = (version, body)
+            return 201, b"OK", {"X-Version": version}
+        data[key] = (version, None)
+        return (200 if current and current[1] is not None else 404), b"", {"X-Version": version}
+
+def handle_client(conn):
+    buf = bytearray()
+    try:
+        while True:
+            req = httputil.read_request(conn, buf)
+            if req is None:
+                return
+            code, body, headers = handle_request(req)
+            httputil.send_response(conn, code, body, "application/octet-stream", req.keep_alive,
+                                   headers)
+            if not req.keep_alive:
+                return
+    except (OSError, httputil.BadRequest):
+        pass
+    finally:
+        conn.close()
+
+def main():
+    global delay, slots
+    parser = argparse.ArgumentParser()
+    parser.add_argument("port", type=int)
+    parser.add_argument("id", type=int)
+    parser.add_argument("--delay-ms", type=float, default=50)
+    parser.add_argument("--concurrency", type=int, default=0,
+                        help="запросов, обрабатываемых одновременно (0 — без ограничения)")
+    args = parser.parse_args()
+    delay = args.delay_ms / 1000
+    if args.concurrency:
+        slots = threading.Semaphore(args.concurrency)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", args.port))
+    sock.listen(socket.SOMAXCONN)
+    with socket.create_connection(("127.0.0.1", MASTER_PORT)) as s:
+        body = json.dumps({"id": args.id, "port": args.port}).encode('utf-8')
+        s.sendall(httputil.build_request("POST", "/register", "127.0.0.1", body,
+                                         "application/json", keep_alive=False))
+        httputil.read_response(s)
+    while True:
+        conn, _ = sock.accept()
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        threading.Thread(target=handle_client, args=(conn,), daemon=True).start()
+
+if __name__ == "__main__":
+    main()
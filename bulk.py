@@ -0,0 +1,902 @@
+# bulk.py
+# Массовый перенос ключей: python client.py import / export.
+#
+# Источник импорта и приёмник экспорта — каталог (ключ — путь файла
+# относительно каталога, через «/»), tar-архив или NDJSON, по строке
+# {"key": ..., "value": ...} на ключ ("value_base64" — для двоичных
+# значений). Значения до BATCH_VALUE идут пакетами POST /storage/_batch,
+# крупные — по одному. Запросы конвейеризуются: на каждом из нескольких
+# keep-alive соединений с мастером отправляется до depth запросов, не
+# дожидаясь ответов. Прогресс сохраняется в файл контрольной точки, и
+# прерванный перенос продолжается с места остановки.
+import base64
+import collections
+import gzip
+import heapq
+import io
+import itertools
+import json
+import os
+import random
+import socket
+import stat
+import sys
+import tarfile
+import threading
+import time
+import urllib.parse
+
+import batch
+import httputil
+import listing
+
+# Значения не длиннее идут в пакетах
+BATCH_VALUE = 64 * 1024
+# Ключей и байт значений в пакете импорта
+BATCH_KEYS = 1000
+BATCH_BYTES = 1024 * 1024
+# Ключей в пакете экспорта: ответ не больше EXPORT_BATCH * BATCH_VALUE
+EXPORT_BATCH = 100
+# Ключей в странице списка при экспорте
+LIST_PAGE = 10000
+DEFAULT_CONNECTIONS = 8
+# Запросов в полёте на одном соединении
+DEFAULT_DEPTH = 4
+# Байт тел запросов в полёте на соединении: крупное значение уходит,
+# только когда очередь соединения пуста
+WINDOW_BYTES = 4 * 1024 * 1024
+# Значений, ждущих записи по порядку в tar или NDJSON
+REORDER_BYTES = 64 * 1024 * 1024
+TIMEOUT = 60
+DEFAULT_RETRIES = 5
+RETRY_BASE = 0.1
+RETRY_MAX = 5.0
+# Ответы, после которых запрос повторяется
+RETRY_CODES = (429, 500, 502, 503, 504)
+CHECKPOINT_INTERVAL = 2.0
+PROGRESS_INTERVAL = 1.0
+FORMATS = ("dir", "tar", "ndjson")
+
+def backoff(attempt):
+    """Задержка перед попыткой номер attempt (с 1): экспонента со случайным разбросом."""
+    delay = min(RETRY_MAX, RETRY_BASE * 2 ** (attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+def storage_path(key):
+    return f"/storage/{urllib.parse.quote(key, safe='')}"
+
+def detect_format(path, importing):
+    """Формат по пути: каталог, *.ndjson / *.jsonl (и .gz при импорте) или tar."""
+    name = path.lower()
+    if name.endswith(".gz") and importing:
+        name = name[:-3]
+    if name.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    if importing:
+        return "dir" if os.path.isdir(path) else "tar"
+    return "tar" if name.endswith(".tar") else "dir"
+
+def encode_item(key, value):
+    """Строка NDJSON для ключа; значение не в UTF-8 — в value_base64."""
+    item = {"key": key}
+    try:
+        item["value"] = value.decode('utf-8')
+    except UnicodeDecodeError:
+        item["value_base64"] = base64.b64encode(value).decode('ascii')
+    return json.dumps(item, ensure_ascii=False).encode('utf-8') + b"\n"
+
+def key_path(root, key):
+    """Путь файла для ключа при экспорте в каталог. Ключ, который не
+    ложится в дерево каталогов («a//b», «../x», «a/»), — ValueError."""
+    parts = key.split("/")
+    if any(part in ("", ".", "..") for part in parts):
+        raise ValueError("ключ нельзя сохранить файлом")
+    return os.path.join(root, *parts)
+
+class FileValue:
+    """Значение из файла: читается, когда понадобится, а не при обходе.
+    Крупные значения уходят потоком, не собираясь в памяти."""
+
+    def __init__(self, path, length):
+        self.path = path
+        self.length = length
+
+    def chunks(self):
+        left = self.length
+        with open(self.path, 'rb') as f:
+            while left:
+                chunk = f.read(min(left, httputil.RECV_SIZE))
+                if not chunk:
+                    raise OSError(f"{self.path}: файл изменился во время отправки")
+                left -= len(chunk)
+                yield chunk
+
+    def read_all(self):
+        return b"".join(self.chunks())
+
+# --- Источники импорта: (ключ, bytes или FileValue) в постоянном порядке ---
+
+def read_dir(root):
+    for top, dirs, files in os.walk(root):
+        dirs.sort()
+        rel = os.path.relpath(top, root)
+        for name in sorted(files):
+            path = os.path.join(top, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            key = name if rel == "." else f"{rel.replace(os.sep, '/')}/{name}"
+            # Содержимое читается, только если файл не пропущен по контрольной точке
+            yield key, FileValue(path, st.st_size)
+
+def read_tar(path):
+    # Потоковый режим: архив читается один раз по порядку, в том числе
+    # сжатый (gz, bz2, xz)
+    with tarfile.open(path, "r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            name = member.name[2:] if member.name.startswith("./") else member.name
+            yield name, tar.extractfile(member).read()
+
+def read_ndjson(path):
+    opener = gzip.open if path.lower().endswith(".gz") else open
+    with opener(path, 'rb') as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                if "value_base64" in item:
+                    value = base64.b64decode(item["value_base64"], validate=True)
+                else:
+                    value = item["value"].encode('utf-8')
+                key = item["key"]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                raise ValueError(f"{path}:{lineno}: ожидается {{\"key\": ..., \"value\": ...}}")
+            if not isinstance(key, str) or not key:
+                raise ValueError(f"{path}:{lineno}: ключ должен быть непустой строкой")
+            yield key, value
+
+SOURCES = {"dir": read_dir, "tar": read_tar, "ndjson": read_ndjson}
+
+class Task:
+    """Один HTTP-запрос переноса.
+
+    items — [(номер, ключ, значение)] ключей, которые он покрывает;
+    body — bytes или потоковое тело (length, chunks()).
+    """
+
+    def __init__(self, method, path, body, items):
+        self.method = method
+        self.path = path
+        self.body = body
+        self.items = items
+        self.size = len(body) if isinstance(body, bytes) else body.length
+        self.attempts = 0
+
+class Stats:
+    """Счётчики переноса для строки прогресса и итога."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"keys": 0, "bytes": 0, "failed": 0, "missing": 0, "requests": 0,
+                       "retries": 0}
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+class Watermark:
+    """Завершённые ключи по номерам в порядке источника.
+
+    Все номера меньше next завершены — записаны или в failed ({номер:
+    ключ}); last_key — ключ номера next - 1. Контрольная точка хранит
+    только эту границу: завершённые после неё при продолжении
+    переносятся ещё раз, записи идемпотентны.
+    """
+
+    def __init__(self, start=0, failed=None, last_key=None):
+        self.next = start
+        self.failed = dict(failed or {})
+        self.last_key = last_key
+        self._ahead = {}
+        self.lock = threading.Lock()
+
+    def done(self, seq, key, failed=False):
+        with self.lock:
+            if failed:
+                self.failed[seq] = key
+            else:
+                self.failed.pop(seq, None)
+            if seq < self.next:
+                return
+            self._ahead[seq] = key
+            while self.next in self._ahead:
+                self.last_key = self._ahead.pop(self.next)
+                self.next += 1
+
+    def state(self):
+        with self.lock:
+            failed = {seq: key for seq, key in self.failed.items() if seq < self.next}
+            return self.next, failed, self.last_key
+
+class Pipeline:
+    """Выполняет задачи на connections соединениях с мастером, до depth
+    запросов в полёте на каждом.
+
+    source — итератор задач, его по очереди читают потоки соединений.
+    Итератор может вернуть None: задач пока нет, но будут. handle(task,
+    код, заголовки, тело) разбирает ответ. Соединение, которое оборвалось,
+    и ответы RETRY_CODES повторяются с экспоненциальной задержкой (или по
+    Retry-After); после retries неудачных попыток перенос прерывается.
+    """
+
+    def __init__(self, host, port, source, handle, stats, connections=DEFAULT_CONNECTIONS,
+                 depth=DEFAULT_DEPTH, retries=DEFAULT_RETRIES):
+        self.host = host
+        self.port = port
+        self.handle = handle
+        self.stats = stats
+        self.connections = connections
+        self.depth = depth
+        self.retries = retries
+        self.error = None
+        self._source = source
+        self._source_lock = threading.Lock()
+        self._cond = threading.Condition()
+        # Задачи, ждущие повтора: [(когда, порядковый номер, задача)]
+        self._delayed = []
+        self._order = itertools.count()
+        # Задачи, взятые из источника или добавленные и ещё не завершённые
+        self._pending = 0
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        for i in range(self.connections):
+            t = threading.Thread(target=self._connection, name=f"bulk-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def wait(self, timeout):
+        """Ждёт завершения до timeout секунд. True — все потоки закончили."""
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0, deadline - time.monotonic()))
+        return not any(t.is_alive() for t in self._threads)
+
+    def abort(self, reason):
+        with self._cond:
+            if self.error is None:
+                self.error = reason
+            self._stopped = True
+            self._cond.notify_all()
+
+    def submit(self, task, reason=None, retry_after=None):
+        """Добавляет задачу из обработчика ответа; с reason — как повтор."""
+        with self._cond:
+            self._pending += 1
+        if reason is None:
+            self._push(task, 0)
+        else:
+            self.retry(task, reason, retry_after)
+
+    def retry(self, task, reason, retry_after=None):
+        task.attempts += 1
+        if task.attempts > self.retries:
+            self.abort(f"{reason} (попыток: {task.attempts})")
+            return
+        delay = backoff(task.attempts)
+        try:
+            delay = max(delay, min(float(retry_after), RETRY_MAX * 6))
+        except (TypeError, ValueError):
+            pass
+        self.stats.add(retries=1)
+        self._push(task, delay)
+
+    def _push(self, task, delay):
+        with self._cond:
+            heapq.heappush(self._delayed, (time.monotonic() + delay, next(self._order), task))
+            self._cond.notify()
+
+    def _finish(self):
+        with self._cond:
+            self._pending -= 1
+            if self._pending == 0:
+                self._cond.notify_all()
+
+    def _next(self, wait):
+        """Следующая задача: сначала повторы, чей срок пришёл, затем источник.
+
+        wait=False — не ждать, если задач сейчас нет. None — задач нет
+        (с wait=True — больше не будет или перенос прерван).
+        """
+        while True:
+            with self._cond:
+                if self._stopped:
+                    return None
+                now = time.monotonic()
+                if self._delayed and self._delayed[0][0] <= now:
+                    return heapq.heappop(self._delayed)[2]
+                if self._source is None:
+                    if not wait or self._pending == 0:
+                        return None
+                    self._cond.wait(self._delayed[0][0] - now if self._delayed else None)
+                    continue
+            with self._source_lock:
+                try:
+                    task = next(self._source) if self._source is not None else None
+                except StopIteration:
+                    with self._cond:
+                        self._source = None
+                        self._cond.notify_all()
+                    continue
+                except Exception as e:
+                    self.abort(f"ошибка источника: {e}")
+                    return None
+            if task is not None:
+                with self._cond:
+                    self._pending += 1
+                return task
+            if not wait:
+                return None
+            # Источник ждёт, пока освободится место (экспорт по порядку)
+            with self._cond:
+                self._cond.wait(0.01)
+
+    def _connection(self):
+        sock, buf = None, bytearray()
+        inflight = collections.deque()
+        window = 0
+        held = None
+        # Обрывов подряд: соединение тоже ждёт, а не разбирает источник,
+        # пока мастер недоступен
+        failures = 0
+        try:
+            while True:
+                # Заполняем окно соединения
+                while len(inflight) < self.depth:
+                    task = held or self._next(wait=not inflight)
+                    held = None
+                    if task is None:
+                        break
+                    if inflight and window + task.size > WINDOW_BYTES:
+                        held = task
+                        break
+                    try:
+                        if sock is None:
+                            sock = socket.create_connection((self.host, self.port), TIMEOUT)
+                            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                            buf = bytearray()
+                        httputil.send_request(sock, task.method, task.path, self.host,
+                                              task.body, True)
+                    except OSError as e:
+                        sock = self._broken(sock, [*inflight, task], e)
+                        inflight.clear()
+                        window = 0
+                        failures += 1
+                        self._pause(backoff(failures))
+                        continue
+                    inflight.append(task)
+                    window += task.size
+                    self.stats.add(requests=1)
+                if not inflight:
+                    if held is None:
+                        return
+                    continue
+                task = inflight.popleft()
+                window -= task.size
+                try:
+                    code, headers, stream = httputil.read_response_head(sock, buf)
+                    data = stream.read_all()
+                except (OSError, ValueError, httputil.BadRequest) as e:
+                    sock = self._broken(sock, [task, *inflight], e)
+                    inflight.clear()
+                    window = 0
+                    failures += 1
+                    self._pause(backoff(failures))
+                    continue
+                failures = 0
+                if headers.get("connection", "").lower() == "close":
+                    # Остальные запросы этого соединения сервер не читал
+                    sock.close()
+                    sock = None
+                    for t in inflight:
+                        self._push(t, 0)
+                    inflight.clear()
+                    window = 0
+                if code in RETRY_CODES:
+                    self.retry(task, f"{task.method} {task.path}: код {code}",
+                               headers.get("retry-after"))
+                    continue
+                try:
+                    self.handle(task, code, headers, data)
+                except Exception as e:
+                    self.abort(f"{task.method} {task.path}: {e}")
+                self._finish()
+        finally:
+            if sock is not None:
+                sock.close()
+            for t in ([held] if held else []) + list(inflight):
+                self._push(t, 0)
+
+    def _pause(self, delay):
+        with self._cond:
+            self._cond.wait_for(lambda: self._stopped, delay)
+
+    def _broken(self, sock, tasks, error):
+        if sock is not None:
+            sock.close()
+        for t in tasks:
+            self.retry(t, f"{t.method} {t.path}: {error}")
+        return None
+
+# --- Контрольная точка ---
+
+def load_checkpoint(path, identity):
+    """Состояние прерванного переноса или None, если его ещё не было.
+
+    identity — что переносится; точка от другого переноса — ValueError.
+    """
+    if not path:
+        return None
+    try:
+        with open(path, 'rb') as f:
+            state = json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    if state.get("identity") != identity:
+        raise ValueError(f"{path}: контрольная точка другого переноса")
+    return state
+
+def save_checkpoint(path, identity, state):
+    state = dict(state, identity=identity)
+    tmp = path + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(json.dumps(state, ensure_ascii=False).encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+# --- Импорт ---
+
+class Import:
+    def __init__(self, source, fmt, prefix, watermark, stats):
+        self.source = source
+        self.fmt = fmt
+        self.prefix = prefix
+        self.watermark = watermark
+        self.stats = stats
+        self.pipeline = None
+
+    def batch_task(self, items):
+        values = [value for _, _, value in items]
+        try:
+            for value in values:
+                value.decode('utf-8')
+            encoding = "utf-8"
+        except UnicodeDecodeError:
+            encoding = "base64"
+        body = batch.build_request("put", [(key, value) for _, key, value in items], encoding)
+        return Task("POST", batch.PATH, body, items)
+
+    def tasks(self):
+        """Задачи по порядку источника; завершённое до контрольной точки пропускается."""
+        start, failed, _ = self.watermark.state()
+        group, size = [], 0
+        for seq, (key, value) in enumerate(SOURCES[self.fmt](self.source)):
+            if seq < start and seq not in failed:
+                continue
+            key = self.prefix + key
+            if not (value.length if isinstance(value, FileValue) else value):
+                # Ноды требуют тело у PUT
+                self.fail(seq, key, "пустое значение не хранится")
+                continue
+            if isinstance(value, FileValue) and value.length <= BATCH_VALUE:
+                try:
+                    value = value.read_all()
+                except OSError as e:
+                    self.fail(seq, key, e)
+                    continue
+            if isinstance(value, bytes) and len(value) <= BATCH_VALUE:
+                group.append((seq, key, value))
+                size += len(value)
+                if len(group) >= BATCH_KEYS or size >= BATCH_BYTES:
+                    yield self.batch_task(group)
+                    group, size = [], 0
+                continue
+            yield Task("PUT", storage_path(key), value, [(seq, key, None)])
+        if group:
+            yield self.batch_task(group)
+
+    def done(self, seq, key, size):
+        self.stats.add(keys=1, bytes=size)
+        self.watermark.done(seq, key)
+
+    def fail(self, seq, key, reason):
+        self.stats.add(failed=1)
+        self.watermark.done(seq, key, failed=True)
+        print(f"\n{key}: {reason}", file=sys.stderr)
+
+    def handle(self, task, code, headers, data):
+        if task.method == "PUT":
+            seq, key, _ = task.items[0]
+            if code == 201:
+                self.done(seq, key, task.size)
+            else:
+                self.fail(seq, key, f"код {code}")
+            return
+        if code != 200:
+            for seq, key, _ in task.items:
+                self.fail(seq, key, f"код {code}")
+            return
+        results = batch.parse_response(data)
+        if len(results) != len(task.items):
+            raise ValueError("ответ не совпадает с запросом")
+        again = []
+        for item, (status, _, _) in zip(task.items, results):
+            seq, key, value = item
+            if status == 201:
+                self.done(seq, key, len(value))
+            elif status in RETRY_CODES:
+                again.append(item)
+            else:
+                self.fail(seq, key, f"код {status}")
+        if again:
+            # Ключи нод, которые не ответили, повторяются отдельным пакетом
+            retry = self.batch_task(again)
+            retry.attempts = task.attempts
+            self.pipeline.submit(retry, f"пакет: не записано ключей: {len(again)}")
+
+    def checkpoint(self):
+        start, failed, _ = self.watermark.state()
+        return {"done": start, "failed": sorted(failed)}
+
+# --- Экспорт ---
+
+class DirSink:
+    """Значения в файлы каталога; порядок записи не важен."""
+
+    ordered = False
+
+    def __init__(self, root, watermark, resume):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.watermark = watermark
+        self.lock = threading.Lock()
+
+    def buffered(self):
+        return 0
+
+    def put(self, seq, key, value):
+        path = key_path(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(value)
+        self.watermark.done(seq, key)
+
+    def skip(self, seq, key, failed):
+        self.watermark.done(seq, key, failed)
+
+    def state(self):
+        return {}
+
+    def close(self):
+        pass
+
+class StreamSink:
+    """Значения одним файлом в порядке списка ключей. Ответы приходят не по
+    порядку и ждут в буфере; контрольная точка хранит длину записанного, и
+    при продолжении файл обрезается до неё."""
+
+    ordered = True
+
+    def __init__(self, path, watermark, resume):
+        self.path = path
+        self.watermark = watermark
+        if resume:
+            self.file = open(path, 'r+b')
+            self.file.truncate(resume["offset"])
+            self.file.seek(resume["offset"])
+        else:
+            self.file = open(path, 'wb')
+        self.lock = threading.Lock()
+        # {номер: (ключ, значение или None, ошибка)}
+        self._waiting = {}
+        self._size = 0
+
+    def buffered(self):
+        return self._size
+
+    def write(self, key, value):
+        raise NotImplementedError
+
+    def _add(self, seq, key, value, failed):
+        with self.lock:
+            if seq < 0:
+                # Ключ, не записанный до контрольной точки: порядок уже не важен
+                if value is not None:
+                    self.write(key, value)
+                self.watermark.done(seq, key, failed)
+                return
+            self._waiting[seq] = (key, value, failed)
+            self._size += len(value or b"")
+            seq = self.watermark.next
+            while seq in self._waiting:
+                key, value, failed = self._waiting.pop(seq)
+                if value is not None:
+                    self.write(key, value)
+                    self._size -= len(value)
+                self.watermark.done(seq, key, failed)
+                seq += 1
+
+    def put(self, seq, key, value):
+        self._add(seq, key, value, False)
+
+    def skip(self, seq, key, failed):
+        self._add(seq, key, None, failed)
+
+    def state(self):
+        """Длина записанного; вызывается под lock вместе с watermark.state()."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+class NdjsonSink(StreamSink):
+    def write(self, key, value):
+        self.file.write(encode_item(key, value))
+
+class TarSink(StreamSink):
+    def __init__(self, path, watermark, resume):
+        super().__init__(path, watermark, resume)
+        # Режим "w" пишет каждый элемент сразу в файл с текущей позиции
+        self.tar = tarfile.open(fileobj=self.file, mode="w", format=tarfile.PAX_FORMAT)
+
+    def write(self, key, value):
+        info = tarfile.TarInfo(key)
+        info.size = len(value)
+        info.mtime = int(time.time())
+        self.tar.addfile(info, io.BytesIO(value))
+
+    def close(self):
+        self.tar.close()
+        self.file.close()
+
+SINKS = {"dir": DirSink, "tar": TarSink, "ndjson": NdjsonSink}
+
+class Export:
+    def __init__(self, host, port, prefix, sink, resume, stats):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        self.sink = sink
+        self.watermark = sink.watermark
+        self.stats = stats
+        self.pipeline = None
+        self.cursor = resume.get("cursor") if resume else None
+        # Ключи, не записанные в прошлый раз, переносятся первыми
+        self.retry_keys = resume.get("failed", []) if resume else []
+
+    def keys(self):
+        """Ключи с prefix после cursor, страницами списка GET /storage."""
+        cursor = self.cursor
+        with socket.create_connection((self.host, self.port), TIMEOUT) as sock:
+            buf = bytearray()
+            while True:
+                path = "/storage" + listing.query_string(self.prefix, cursor, LIST_PAGE)
+                httputil.send_request(sock, "GET", path, self.host, b"", True)
+                code, _, stream = httputil.read_response_head(sock, buf)
+                body = stream.read_all()
+                if code != 200:
+                    raise ConnectionError(f"список ключей: код {code}")
+                cursor = None
+                for line in body.splitlines():
+                    record = json.loads(line)
+                    if "key" in record:
+                        yield record["key"]
+                    elif "next_cursor" in record:
+                        cursor = record["next_cursor"]
+                if cursor is None:
+                    return
+
+    def batch_task(self, items):
+        body = batch.build_request("get", [(key, None) for _, key, _ in items],
+                                   max_value=BATCH_VALUE)
+        return Task("POST", batch.PATH, body, items)
+
+    def tasks(self):
+        numbered = itertools.chain(
+            ((-1 - i, key) for i, key in enumerate(self.retry_keys)),
+            enumerate(self.keys()))
+        group = []
+        for seq, key in numbered:
+            group.append((seq, key, None))
+            if len(group) >= EXPORT_BATCH:
+                yield self.batch_task(group)
+                group = []
+                # Буфер записи по порядку полон: ждём, пока голова догонит
+                while self.sink.buffered() > REORDER_BYTES:
+                    yield None
+        if group:
+            yield self.batch_task(group)
+
+    def done(self, seq, key, value):
+        try:
+            self.sink.put(seq, key, value)
+        except (OSError, ValueError) as e:
+            self.fail(seq, key, e)
+            return
+        self.stats.add(keys=1, bytes=len(value))
+
+    def fail(self, seq, key, reason):
+        self.stats.add(failed=1)
+        self.sink.skip(seq, key, True)
+        print(f"\n{key}: {reason}", file=sys.stderr)
+
+    def missing(self, seq, key):
+        # Ключ удалили после того, как он попал в список
+        self.stats.add(missing=1)
+        self.sink.skip(seq, key, False)
+
+    def handle(self, task, code, headers, data):
+        if task.method == "GET":
+            seq, key, _ = task.items[0]
+            if code == 200:
+                self.done(seq, key, data)
+            elif code == 404:
+                self.missing(seq, key)
+            else:
+                self.fail(seq, key, f"код {code}")
+            return
+        if code != 200:
+            for seq, key, _ in task.items:
+                self.fail(seq, key, f"код {code}")
+            return
+        results = batch.parse_response(data)
+        if len(results) != len(task.items):
+            raise ValueError("ответ не совпадает с запросом")
+        again = []
+        for item, (status, value, _) in zip(task.items, results):
+            seq, key, _ = item
+            if status == 200:
+                self.done(seq, key, value)
+            elif status == 404:
+                self.missing(seq, key)
+            elif status == 413:
+                # Крупное значение — отдельным GET
+                self.pipeline.submit(Task("GET", storage_path(key), b"", [item]))
+            elif status in RETRY_CODES:
+                again.append(item)
+            else:
+                self.fail(seq, key, f"код {status}")
+        if again:
+            retry = self.batch_task(again)
+            retry.attempts = task.attempts
+            self.pipeline.submit(retry, f"пакет: не прочитано ключей: {len(again)}")
+
+    def checkpoint(self):
+        with self.sink.lock:
+            _, failed, last_key = self.watermark.state()
+            state = self.sink.state()
+        state.update(cursor=last_key, failed=list(failed.values()))
+        return state
+
+# --- Запуск ---
+
+def format_size(n):
+    for unit in ("Б", "КиБ", "МиБ", "ГиБ"):
+        if n < 1024 or unit == "ГиБ":
+            return f"{n:.0f} {unit}" if unit == "Б" else f"{n:.1f} {unit}"
+        n /= 1024
+
+def progress_line(title, counts, elapsed, keys_rate, bytes_rate):
+    line = (f"{title}: {counts['keys']} ключей, {format_size(counts['bytes'])} за {elapsed:.0f} с"
+            f" | {keys_rate:.0f} ключей/с, {format_size(bytes_rate)}/с"
+            f" | запросов {counts['requests']}, повторов {counts['retries']},"
+            f" ошибок {counts['failed']}")
+    if counts["missing"]:
+        line += f", удалено во время экспорта {counts['missing']}"
+    return line
+
+def run(title, job, pipeline, checkpoint, identity, quiet):
+    """Выполняет перенос, печатая прогресс и сохраняя контрольную точку.
+
+    Возвращает код завершения: 0 — всё перенесено, 1 — есть ошибки или
+    перенос прерван (его можно продолжить с той же контрольной точкой).
+    """
+    stats = pipeline.stats
+    start = last = last_saved = time.monotonic()
+    previous = stats.snapshot()
+    tty = sys.stderr.isatty()
+    pipeline.start()
+    try:
+        while not pipeline.wait(PROGRESS_INTERVAL):
+            now = time.monotonic()
+            if checkpoint and now - last_saved >= CHECKPOINT_INTERVAL:
+                save_checkpoint(checkpoint, identity, job.checkpoint())
+                last_saved = now
+            if quiet:
+                continue
+            counts = stats.snapshot()
+            line = progress_line(title, counts, now - start,
+                                 (counts["keys"] - previous["keys"]) / (now - last),
+                                 (counts["bytes"] - previous["bytes"]) / (now - last))
+            print("\r" + line + "\033[K" if tty else line, end="" if tty else "\n",
+                  file=sys.stderr, flush=True)
+            previous, last = counts, now
+    except KeyboardInterrupt:
+        pipeline.abort("прервано")
+        pipeline.wait(TIMEOUT)
+    elapsed = time.monotonic() - start
+    if tty and not quiet:
+        print(file=sys.stderr)
+    counts = stats.snapshot()
+    print(progress_line(title, counts, elapsed, counts["keys"] / elapsed,
+                        counts["bytes"] / elapsed))
+    if pipeline.error is None and not counts["failed"]:
+        if checkpoint and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        return 0
+    if checkpoint:
+        save_checkpoint(checkpoint, identity, job.checkpoint())
+    if pipeline.error is not None:
+        print(f"Перенос прерван: {pipeline.error}", file=sys.stderr)
+    if checkpoint:
+        print(f"Продолжить: та же команда с --checkpoint {checkpoint}", file=sys.stderr)
+    return 1
+
+def run_import(host, port, args):
+    fmt = args.format or detect_format(args.source, True)
+    identity = {"op": "import", "source": os.path.abspath(args.source), "format": fmt,
+                "prefix": args.prefix}
+    resume = load_checkpoint(args.checkpoint, identity)
+    watermark = Watermark(resume["done"], {seq: None for seq in resume["failed"]}) \
+        if resume else Watermark()
+    stats = Stats()
+    job = Import(args.source, fmt, args.prefix, watermark, stats)
+    job.pipeline = Pipeline(host, port, job.tasks(), job.handle, stats, args.connections,
+                            args.depth, args.retries)
+    return run("импорт", job, job.pipeline, args.checkpoint, identity, args.quiet)
+
+def run_export(host, port, args):
+    fmt = args.format or detect_format(args.dest, False)
+    identity = {"op": "export", "dest": os.path.abspath(args.dest), "format": fmt,
+                "prefix": args.prefix}
+    resume = load_checkpoint(args.checkpoint, identity)
+    watermark = Watermark(last_key=resume["cursor"] if resume else None)
+    stats = Stats()
+    sink = SINKS[fmt](args.dest, watermark, resume)
+    job = Export(host, port, args.prefix, sink, resume, stats)
+    job.pipeline = Pipeline(host, port, job.tasks(), job.handle, stats, args.connections,
+                            args.depth, args.retries)
+    try:
+        return run("экспорт", job, job.pipeline, args.checkpoint, identity, args.quiet)
+    finally:
+        sink.close()
+
+def add_arguments(parser):
+    """Общие параметры import и export."""
+    parser.add_argument("--format", choices=FORMATS,
+                        help="по умолчанию — по пути: каталог, *.tar, *.ndjson / *.jsonl")
+    parser.add_argument("--prefix", default="",
+                        help="импорт: добавить к ключам; экспорт: только ключи с префиксом")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS,
+                        help="соединений с мастером")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH,
+                        help="запросов в полёте на соединении")
+    parser.add_argument("--retries", type=int, default=DEFAULT_RETRIES,
+                        help="повторов запроса, после которых перенос прерывается")
+    parser.add_argument("--checkpoint", help="файл контрольной точки для продолжения")
+    parser.add_argument("--quiet", action="store_true", help="без строки прогресса")
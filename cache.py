@@ -0,0 +1,119 @@
+# cache.py
+# LRU-кэш значений в мастере, ограниченный по байтам.
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRY = 64 * 1024
+# Примерная стоимость записи сверх ключа и значения
+ENTRY_OVERHEAD = 100
+STRIPES = 4096
+
+class ValueCache:
+    """Кэш горячих значений со сквозной записью.
+
+    Заполнение после обращения к ноде может опоздать: пока шёл запрос,
+    ключ успели перезаписать. Поэтому каждая операция берёт токен —
+    счётчик полосы ключа и эпоху состава кластера, — и значение кладётся
+    в кэш, только если с тех пор ни то, ни другое не менялось.
+    """
+
+    def __init__(self, max_bytes, max_entry=DEFAULT_MAX_ENTRY):
+        self.max_bytes = max_bytes
+        self.max_entry = max_entry
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._stripes = [0] * STRIPES
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _size(key, value):
+        return len(key) + len(value) + ENTRY_OVERHEAD
+
+    def _stripe(self, key):
+        return hash(key) & (STRIPES - 1)
+
+    def _drop(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._bytes -= self._size(key, value)
+
+    def _insert(self, key, value):
+        self._drop(key)
+        size = self._size(key, value)
+        if len(value) > self.max_entry or size > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            old_key, old_value = self._entries.popitem(last=False)
+            self._bytes -= self._size(old_key, old_value)
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def begin_read(self, key):
+        """Токен для заполнения кэша по результату GET."""
+        with self._lock:
+            return self._epoch, self._stripes[self._stripe(key)]
+
+    def finish_read(self, key, value, token):
+        with self._lock:
+            if token == (self._epoch, self._stripes[self._stripe(key)]):
+                self._insert(key, value)
+
+    def begin_write(self, key):
+        """Убирает ключ перед PUT/DELETE и возвращает токен операции."""
+        with self._lock:
+            self._drop(key)
+            stripe = self._stripe(key)
+            self._stripes[stripe] += 1
+            return self._epoch, self._stripes[stripe]
+
+    def finish_write(self, key, value, token):
+        """value=None — запись не удалась или это DELETE.
+
+        Если параллельно шла другая запись того же ключа, порядок их
+        применения на ноде неизвестен, и ключ просто вычищается.
+        """
+        with self._lock:
+            stripe = self._stripe(key)
+            if value is not None and token == (self._epoch, self._stripes[stripe]):
+                self._insert(key, value)
+            else:
+                self._drop(key)
+                self._stripes[stripe] += 1
+
+    def invalidate_moved(self, owner_before, owner_after):
+        """Вычищает ключи, сменившие владельца после изменения состава нод."""
+        with self._lock:
+            self._epoch += 1
+            moved = [k for k in self._entries if owner_before(k) != owner_after(k)]
+            for key in moved:
+                self._drop(key)
+        return len(moved)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entry": self.max_entry,
+            }
@@ -1,48 +1,247 @@
 # client.py
+import argparse
 import socket
 import json
+import sys
+import threading
+import time
 import urllib.parse
 
+import batch
+import bulk
+import hashring
+import httputil
+import pool
+
 MASTER_HOST = "127.0.0.1"
 MASTER_PORT = 8080
+# Ключей в одном пакетном запросе
+BATCH_SIZE = 1000
+MAP_VERSION_HEADER = "X-Map-Version"
+# Карта, по которой напрямую нельзя, перепроверяется не чаще раза в
+# столько секунд: о конце переноса ноды клиенту не сообщают
+MAP_RECHECK = 1.0
 
 def send_http_request(method, path, body=None, content_type="application/octet-stream"):
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((MASTER_HOST, MASTER_PORT))
-            headers = [
-                f"{method} {path} HTTP/1.1",
-                f"Host: {MASTER_HOST}",
-                "Connection: close"
-            ]
-            if body is not None:
-                headers.append(f"Content-Length: {len(body)}")
-                headers.append(f"Content-Type: {content_type}")
-            request = "\r\n".join(headers) + "\r\n\r\n"
-            s.sendall(request.encode('latin1') + (body or b""))
-
-            response = b""
-            while True:
-                chunk = s.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-
-        header_end = response.find(b"\r\n\r\n")
-        if header_end == -1:
-            return 500, b"Invalid response"
-        status_line = response[:header_end].split(b'\r\n')[0]
-        status_code = int(status_line.split(b' ')[1])
-        body = response[header_end + 4:]
+        with socket.create_connection((MASTER_HOST, MASTER_PORT)) as s:
+            s.sendall(httputil.build_request(method, path, MASTER_HOST, body or b"",
+                                             content_type, keep_alive=False))
+            # Ответ может прийти с Transfer-Encoding: chunked (список ключей)
+            status_code, _, body = httputil.read_response(s)
         return status_code, body
     except Exception as e:
         print(f"Ошибка: {e}")
         return 500, b""
 
+class SmartClient:
+    """Клиент, который ходит к нодам напрямую, минуя мастер.
+
+    Карта кластера (GET /cluster мастера: адреса нод и параметры кольца)
+    хранится вместе с её версией; по ней клиент сам находит ноду-владельца
+    ключа. Нода, которой ключ не принадлежит по её карте, отвечает 421, и
+    клиент обновляет карту. Если напрямую нельзя (репликация, кэш или
+    перенос на мастере), нода недоступна или карта так и не сошлась,
+    запрос идёт через мастер. direct=False — всегда через мастер.
+    Потокобезопасен: соединения берутся из пулов keep-alive, по одному на
+    ноду и на мастер.
+    """
+
+    def __init__(self, host=MASTER_HOST, port=MASTER_PORT, timeout=10, pool_size=64,
+                 direct=True):
+        self.direct = direct
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._master = pool.ConnectionPool(host, port, pool_size)
+        self._pools = {}
+        self._lock = threading.Lock()
+        # {"version", "direct", "fetched", "ring", "nodes": {id: (host, port)}}
+        self.map = None
+        self.stats = {"direct": 0, "proxied": 0, "misdirected": 0, "map_refreshes": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _pool(self, addr):
+        with self._lock:
+            p = self._pools.get(addr)
+            if p is None:
+                p = self._pools[addr] = pool.ConnectionPool(*addr, self.pool_size)
+            return p
+
+    def _exchange(self, p, method, path, body=b"", headers=None):
+        """Запрос через пул p. Возвращает (код, заголовки, тело)."""
+        fresh = False
+        while True:
+            sock, reused = p.acquire(self.timeout, fresh)
+            try:
+                httputil.send_request(sock, method, path, p.host, body, True, headers)
+                code, reply, stream = httputil.read_response_head(sock, bytearray())
+                data = stream.read_all()
+            except OSError:
+                p.release(sock, False)
+                # Соединение из пула могли закрыть, пока оно простаивало
+                if reused:
+                    fresh = True
+                    continue
+                raise
+            p.release(sock, reply.get("connection", "").lower() != "close")
+            return code, reply, data
+
+    def refresh_map(self, stale=None):
+        """Загружает карту с мастера. stale — версия, признанная устаревшей:
+        если другой поток уже заменил её, карта повторно не загружается."""
+        with self._lock:
+            current = self.map
+        if stale is not None and current is not None and current["version"] != stale:
+            return current
+        code, _, body = self._exchange(self._master, "GET", "/cluster")
+        if code != 200:
+            raise ConnectionError(f"карта кластера недоступна: {code}")
+        data = json.loads(body.decode('utf-8'))
+        new = {"version": data["version"], "direct": data["direct"],
+               "fetched": time.monotonic(),
+               "ring": hashring.HashRing({w["id"]: w["weight"] for w in data["workers"]},
+                                         data["vnodes"]),
+               "nodes": {w["id"]: (w["host"], w["port"]) for w in data["workers"]}}
+        with self._lock:
+            if self.map is None or new["version"] >= self.map["version"]:
+                self.map = new
+            self.stats["map_refreshes"] += 1
+            return self.map
+
+    def request(self, method, key, body=b""):
+        """Запрос к ключу: (код, тело)."""
+        path = f"/storage/{urllib.parse.quote(key, safe='')}"
+        if not self.direct:
+            self._count("proxied")
+            code, _, data = self._exchange(self._master, method, path, body)
+            return code, data
+        cluster = self.map
+        if cluster is None:
+            cluster = self.refresh_map()
+        elif not cluster["direct"] and time.monotonic() - cluster["fetched"] >= MAP_RECHECK:
+            cluster = self.refresh_map(cluster["version"])
+        # Вторая попытка — с обновлённой картой после 421
+        for _ in range(2):
+            addr = cluster["nodes"].get(cluster["ring"].get_node(key)) if cluster["direct"] else None
+            if addr is None:
+                break
+            try:
+                code, _, data = self._exchange(self._pool(addr), method, path, body,
+                                               {MAP_VERSION_HEADER: cluster["version"]})
+            except OSError:
+                # Нода недоступна: мастер знает, кто её заменяет
+                break
+            if code != 421:
+                self._count("direct")
+                return code, data
+            self._count("misdirected")
+            cluster = self.refresh_map(cluster["version"])
+        self._count("proxied")
+        code, _, data = self._exchange(self._master, method, path, body)
+        return code, data
+
+    def get(self, key):
+        return self.request("GET", key)
+
+    def put(self, key, value):
+        return self.request("PUT", key, value)
+
+    def delete(self, key):
+        return self.request("DELETE", key)
+
+    def close(self):
+        self._master.close()
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for p in pools:
+            p.close()
+
+def read_batch_file(filename, with_values):
+    """Ключи по одному на строку; для mput — «ключ значение»."""
+    items = []
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            if with_values:
+                parts = line.rstrip('\r\n').split(None, 1)
+                value = parts[1] if len(parts) > 1 else ""
+                items.append((parts[0], value.encode('utf-8')))
+            else:
+                items.append((line.strip(), None))
+    return items
+
+def run_batch(op, items):
+    """Выполняет операцию пачками по BATCH_SIZE; возвращает [(статус, значение, версия)]."""
+    results = []
+    for start in range(0, len(items), BATCH_SIZE):
+        part = items[start:start + BATCH_SIZE]
+        code, body = send_http_request("POST", batch.PATH, batch.build_request(op, part, "utf-8"),
+                                       "application/json")
+        if code != 200:
+            print(f"Ошибка: {code} {body.decode('utf-8', errors='replace')}")
+            results.extend([(code, None, None)] * len(part))
+            continue
+        results.extend(batch.parse_response(body, "utf-8"))
+    return results
+
+def batch_command(cmd, filename):
+    op = cmd[1:]
+    try:
+        items = read_batch_file(filename, op == "put")
+    except OSError as e:
+        print(f"Не удалось прочитать файл: {e}")
+        return
+    results = run_batch(op, items)
+    if op == "get":
+        for (key, _), (status, value, _) in zip(items, results):
+            if status == 200:
+                print(f"{key}: {value.decode('utf-8', errors='replace')}")
+            else:
+                print(f"{key}: {status}")
+        return
+    ok_status = 201 if op == "put" else 200
+    failed = [(key, status) for (key, _), (status, _, _) in zip(items, results)
+              if status != ok_status]
+    done = "Записано" if op == "put" else "Удалено"
+    print(f"{done}: {len(items) - len(failed)} из {len(items)}")
+    for key, status in failed:
+        print(f"  {key}: {status}")
+
+def storage_request(smart, method, key, body=b""):
+    """Запрос к ключу через мастер или, с --direct, напрямую к ноде."""
+    if smart is None:
+        return send_http_request(method, f"/storage/{urllib.parse.quote(key, safe='')}", body)
+    try:
+        return smart.request(method, key, body)
+    except Exception as e:
+        print(f"Ошибка: {e}")
+        return 500, b""
+
 def main():
-    print("Клиент")
+    parser = argparse.ArgumentParser(description="Клиент")
+    parser.add_argument("--direct", action="store_true",
+                        help="запросы к ключам напрямую к нодам по карте кластера")
+    commands = parser.add_subparsers(dest="command")
+    importer = commands.add_parser("import", help="загрузить ключи из каталога, tar или NDJSON")
+    importer.add_argument("source", help="каталог, tar-архив или файл NDJSON")
+    bulk.add_arguments(importer)
+    exporter = commands.add_parser("export", help="выгрузить ключи в каталог, tar или NDJSON")
+    exporter.add_argument("dest", help="каталог, *.tar или *.ndjson")
+    bulk.add_arguments(exporter)
+    args = parser.parse_args()
+    if args.command == "import":
+        sys.exit(bulk.run_import(MASTER_HOST, MASTER_PORT, args))
+    if args.command == "export":
+        sys.exit(bulk.run_export(MASTER_HOST, MASTER_PORT, args))
+    smart = SmartClient() if args.direct else None
+    print("Клиент" + (" (напрямую к нодам)" if smart else ""))
     print("Команды: node create <id> <имя>, node list, node delete <id>")
-    print("         put <ключ> <значение>, get <ключ>, get all, delete <ключ>, quit\n")
+    print("         put <ключ> <значение>, get <ключ>, get all [префикс], delete <ключ>")
+    print("         mput <файл>, mget <файл>, mdelete <файл>, quit\n")
 
     while True:
         try:
@@ -111,28 +310,29 @@ def main():
                     print("put <ключ> <значение>")
                     continue
                 key, value = parts[1], parts[2]
-                path = f"/storage/{urllib.parse.quote(key, safe='')}"
-                code, _ = send_http_request("PUT", path, value.encode('utf-8'))
+                code, _ = storage_request(smart, "PUT", key, value.encode('utf-8'))
                 print("Удачно" if code == 201 else f"ERROR {code}")
 
             elif cmd == "get":
                 if len(parts) < 2:
-                    print("get <ключ> или get all")
+                    print("get <ключ> или get all [префикс]")
                     continue
                 if parts[1] == "all":
-                    code, body = send_http_request("GET", "/storage")
+                    # get all [префикс]
+                    path = "/storage"
+                    if len(parts) > 2:
+                        path += "?" + urllib.parse.urlencode({"prefix": parts[2]})
+                    code, body = send_http_request("GET", path)
                     if code == 200:
                         try:
-                            keys = json.loads(body.decode('utf-8'))
-                            print("Ключи:", keys)
+                            records = [json.loads(line) for line in body.splitlines() if line]
+                            print("Ключи:", [r["key"] for r in records if "key" in r])
                         except:
                             print("Ошибка разбора")
                     else:
                         print(f"{code}")
                 else:
-                    key = parts[1]
-                    path = f"/storage/{urllib.parse.quote(key, safe='')}"
-                    code, body = send_http_request("GET", path)
+                    code, body = storage_request(smart, "GET", parts[1])
                     if code == 200:
                         print("Значение:", body.decode('utf-8', errors='replace'))
                     else:
@@ -142,11 +342,15 @@ def main():
                 if len(parts) < 2:
                     print("delete <ключ>")
                     continue
-                key = parts[1]
-                path = f"/storage/{urllib.parse.quote(key, safe='')}"
-                code, _ = send_http_request("DELETE", path)
+                code, _ = storage_request(smart, "DELETE", parts[1])
                 print("Удалено" if code == 200 else f"{code}")
 
+            elif cmd in ("mput", "mget", "mdelete"):
+                if len(parts) < 2:
+                    print(f"{cmd} <файл>")
+                    continue
+                batch_command(cmd, parts[1])
+
             else:
                 print("Неизвестная команда")
 
@@ -0,0 +1,203 @@
+# compress.py
+# Сжатие значений на рабочей ноде. Кодек выбирается для каждого значения
+# и записывается в заголовок перед ним; клиент, который принимает этот
+# кодек (Accept-Encoding), получает сжатые байты как есть.
+import itertools
+import lzma
+import os
+import struct
+import zlib
+
+# Заголовок сохранённого значения: метка | id кодека | исходная длина
+MAGIC = b"\x89DSZ"
+HEADER = struct.Struct(">4sBQ")
+# Исходная длина неизвестна (значение пришло уже сжатым или chunked)
+UNKNOWN_LENGTH = (1 << 64) - 1
+# id кодека для значения без сжатия, которое само начинается с MAGIC
+IDENTITY = 0
+# Сводка заголовка (frame_of): id кодека + 1 выше FRAME_SHIFT, исходная длина
+FRAME_SHIFT = 56
+FRAME_LENGTH = (1 << FRAME_SHIFT) - 1
+
+# Значения короче не сжимаются
+MIN_SIZE = 1024
+# По этому началу значения решается, сжимать ли его
+SAMPLE_SIZE = 64 * 1024
+# Сжимается, если проба ужимается хотя бы до этой доли
+MAX_RATIO = 0.9
+CHUNK_SIZE = 64 * 1024
+
+class Codec:
+    """Кодек: имя для --compress, id в заголовке значения, токен HTTP
+    (Content-Encoding) и фабрики потоковых объектов сжатия и распаковки.
+
+    compressor() возвращает объект с compress(data) и flush(),
+    decompressor() — объект с decompress(data).
+    """
+
+    def __init__(self, name, codec_id, token, compressor, decompressor):
+        self.name = name
+        self.id = codec_id
+        self.token = token
+        self.compressor = compressor
+        self.decompressor = decompressor
+
+CODECS = {}
+_by_id = {}
+_by_token = {}
+
+def register(codec):
+    """Добавляет кодек; id в заголовках уже сохранённых значений менять нельзя."""
+    if codec.id == IDENTITY or codec.id in _by_id and _by_id[codec.id] is not codec:
+        raise ValueError(f"codec id {codec.id} is taken")
+    CODECS[codec.name] = codec
+    _by_id[codec.id] = codec
+    _by_token[codec.token] = codec
+
+# deflate в HTTP — это поток zlib (RFC 9110)
+register(Codec("zlib", 1, "deflate", lambda: zlib.compressobj(6), zlib.decompressobj))
+register(Codec("lzma", 2, "xz", lambda: lzma.LZMACompressor(lzma.FORMAT_XZ),
+               lzma.LZMADecompressor))
+
+def by_token(token):
+    """Кодек по значению Content-Encoding или None."""
+    return _by_token.get(token.strip().lower())
+
+def accepts(accept_encoding, codec):
+    """Принимает ли клиент ответ в кодировке codec по заголовку Accept-Encoding."""
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(','):
+        token, _, params = item.partition(';')
+        token = token.strip().lower()
+        if token != codec.token and token != "*":
+            continue
+        q = params.strip().replace(" ", "")
+        if q.startswith("q="):
+            try:
+                return float(q[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+def compressible(sample):
+    """Быстрая проба: zlib с уровнем 1 на начале значения."""
+    return len(zlib.compress(sample, 1)) <= len(sample) * MAX_RATIO
+
+def _peek(chunks, size):
+    """(начало не короче size байт или всё значение, поток всех кусков)."""
+    chunks = iter(chunks)
+    head = bytearray()
+    while len(head) < size:
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        head += chunk
+    head = bytes(head)
+    return head, itertools.chain([head] if head else [], chunks)
+
+def _compressed(codec, chunks, length):
+    c = codec.compressor()
+    yield HEADER.pack(MAGIC, codec.id, UNKNOWN_LENGTH if length is None else length)
+    for chunk in chunks:
+        data = c.compress(chunk)
+        if data:
+            yield data
+    yield c.flush()
+
+def encode(chunks, length, codec=None, min_size=MIN_SIZE):
+    """Значение для записи в движок: (куски, длина или None).
+
+    codec — кодек ноды (--compress) или None. Значение сжимается, если оно
+    не короче min_size и его начало сжимается (compressible). Несжатое
+    значение, которое начинается с MAGIC, получает заголовок IDENTITY,
+    чтобы при чтении его не приняли за сжатое.
+    """
+    probe = codec is not None and (length is None or length >= min_size)
+    head, chunks = _peek(chunks, SAMPLE_SIZE if probe else len(MAGIC))
+    if probe and (len(head) < SAMPLE_SIZE or length == len(head)):
+        # Значение целиком в head: сжимается сразу, длина результата известна
+        if len(head) >= min_size:
+            c = codec.compressor()
+            data = c.compress(head) + c.flush()
+            if HEADER.size + len(data) <= len(head) * MAX_RATIO:
+                blob = HEADER.pack(MAGIC, codec.id, len(head)) + data
+                return [blob], len(blob)
+        length = len(head)
+    elif probe and compressible(head[:SAMPLE_SIZE]):
+        return _compressed(codec, chunks, length), None
+    if head.startswith(MAGIC):
+        framed = itertools.chain([HEADER.pack(MAGIC, IDENTITY, length if length is not None
+                                              else UNKNOWN_LENGTH)], chunks)
+        return framed, None if length is None else length + HEADER.size
+    return chunks, length
+
+def encoded(chunks, codec):
+    """Тело PUT, пришедшее уже сжатым (Content-Encoding): сохраняется как есть."""
+    return itertools.chain([HEADER.pack(MAGIC, codec.id, UNKNOWN_LENGTH)], chunks)
+
+def frame_of(head):
+    """Сводка заголовка значения по его первым байтам head — для индекса движка.
+
+    Число: id кодека + 1 в старшем байте, исходная длина в остальных
+    (все единицы — неизвестна); 0 — заголовка нет.
+    """
+    if len(head) < HEADER.size:
+        return 0
+    magic, codec_id, original = HEADER.unpack_from(head)
+    if magic != MAGIC:
+        return 0
+    return (codec_id + 1) << FRAME_SHIFT | (original & FRAME_LENGTH)
+
+def read_frame(frame, size):
+    """(есть ли заголовок, кодек, исходная длина) по сводке frame_of значения size байт."""
+    if not frame:
+        return False, None, size
+    codec_id, original = (frame >> FRAME_SHIFT) - 1, frame & FRAME_LENGTH
+    if codec_id == IDENTITY:
+        return True, None, size - HEADER.size
+    codec = _by_id.get(codec_id)
+    if codec is None:
+        raise ValueError(f"unknown codec id {codec_id}")
+    return True, codec, None if original == FRAME_LENGTH else original
+
+def read_header(fd, offset, size):
+    """(есть ли заголовок, кодек, исходная длина) значения size байт с offset.
+
+    Кодек None — значение не сжато; исходная длина None — неизвестна.
+    Если заголовок есть, данные начинаются на HEADER.size байт дальше.
+    """
+    if size < HEADER.size:
+        return False, None, size
+    return read_frame(frame_of(os.pread(fd, HEADER.size, offset)), size)
+
+def decode(fd, offset, size, codec, start=0, length=None):
+    """Куски распакованного значения (size сжатых байт с offset).
+
+    start и length выбирают диапазон распакованных байт; чтение
+    прекращается, как только диапазон отдан.
+    """
+    d = codec.decompressor()
+    end = None if length is None else start + length
+    pos = 0
+    stop = offset + size
+    while offset < stop:
+        data = os.pread(fd, min(CHUNK_SIZE, stop - offset), offset)
+        if not data:
+            raise OSError("compressed value is truncated")
+        offset += len(data)
+        out = d.decompress(data)
+        if not out:
+            continue
+        lo, hi = max(start - pos, 0), len(out) if end is None else min(end - pos, len(out))
+        if lo < hi:
+            yield out[lo:hi]
+        pos += len(out)
+        if end is not None and pos >= end:
+            return
+
+def decode_all(data, codec):
+    """Распаковывает значение целиком (для пакетного GET)."""
+    d = codec.decompressor()
+    return d.decompress(data)
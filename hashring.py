@@ -0,0 +1,59 @@
+# hashring.py
+import bisect
+import hashlib
+
+# Число виртуальных точек на ноду с весом 1.0
+DEFAULT_VNODES = 160
+
+def hash_key(key):
+    """64-битная позиция ключа на кольце."""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Консистентное хеш-кольцо с виртуальными нодами.
+
+    Кольцо неизменяемое: при смене состава нод строится новое, поэтому
+    поиск не требует блокировок.
+    """
+
+    def __init__(self, nodes=None, vnodes=DEFAULT_VNODES):
+        # nodes: {node_id: вес}
+        self.vnodes = vnodes
+        self.nodes = dict(nodes or {})
+        points = []
+        for node_id, weight in self.nodes.items():
+            count = max(1, int(round(vnodes * weight)))
+            for i in range(count):
+                points.append((hash_key(f"{node_id}#{i}"), node_id))
+        points.sort()
+        self._hashes = [p[0] for p in points]
+        self._owners = [p[1] for p in points]
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get_node(self, key):
+        """Возвращает id ноды, владеющей ключом, или None для пустого кольца."""
+        if not self._hashes:
+            return None
+        idx = bisect.bisect(self._hashes, hash_key(key))
+        if idx == len(self._hashes):
+            idx = 0
+        return self._owners[idx]
+
+    def get_nodes(self, key, n):
+        """Первые n разных нод по часовой стрелке от ключа: владелец и реплики."""
+        if not self._hashes:
+            return []
+        n = min(n, len(self.nodes))
+        idx = bisect.bisect(self._hashes, hash_key(key))
+        result = []
+        for i in range(len(self._owners)):
+            node_id = self._owners[(idx + i) % len(self._owners)]
+            if node_id not in result:
+                result.append(node_id)
+                if len(result) == n:
+                    break
+        return result
@@ -0,0 +1,193 @@
+# health.py
+# Состояние рабочих нод на мастере: детектор отказов phi accrual по
+# ответам на пробы, автомат размыкания цепи и адаптивный таймаут запросов.
+import collections
+import math
+import threading
+import time
+
+# Как часто мастер опрашивает каждую ноду, с
+PROBE_INTERVAL = 0.5
+# Нода считается недоступной при phi >= PHI_THRESHOLD, подозрительной — с половины порога
+PHI_THRESHOLD = 8.0
+# Интервалов между ответами в истории детектора
+PHI_WINDOW = 100
+# Нижняя граница разброса интервалов: на локальной сети он почти нулевой,
+# и без неё одна задержанная проба сразу давала бы огромный phi
+MIN_STD = 0.1
+# Допустимая пауза сверх обычного интервала (сборка мусора, нагрузка)
+ACCEPTABLE_PAUSE = 0.5
+# Ошибок подряд, после которых цепь размыкается, и время до пробного запроса
+BREAKER_FAILURES = 5
+BREAKER_COOLDOWN = 2.0
+# Пределы адаптивного таймаута, с
+TIMEOUT_MIN = 0.5
+TIMEOUT_MAX = 10.0
+
+ALIVE, SUSPECT, DOWN = "alive", "suspect", "down"
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half-open"
+
+class NodeUnavailable(ConnectionError):
+    """Запрос к ноде не отправлялся: цепь разомкнута."""
+
+class PhiDetector:
+    """Детектор отказов phi accrual (Hayashibara и др.).
+
+    Вместо «жива/мертва» даёт уровень подозрения phi = -log10 вероятности
+    того, что очередной ответ ещё придёт, по нормальному распределению
+    прошлых интервалов между ответами. phi растёт непрерывно, пока ответов нет.
+    """
+
+    def __init__(self, interval=PROBE_INTERVAL, window=PHI_WINDOW):
+        self.interval = interval
+        self.intervals = collections.deque(maxlen=window)
+        self.last = None
+
+    def heartbeat(self, now):
+        if self.last is not None:
+            self.intervals.append(now - self.last)
+        self.last = now
+
+    def phi(self, now):
+        if self.last is None:
+            return 0.0
+        if self.intervals:
+            mean = sum(self.intervals) / len(self.intervals)
+            var = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+        else:
+            mean, var = self.interval, (self.interval / 4) ** 2
+        std = max(math.sqrt(var), MIN_STD)
+        # Снизу y ограничен, чтобы exp не переполнялся при долгих интервалах
+        y = max((now - self.last - mean - ACCEPTABLE_PAUSE) / std, -20.0)
+        # Логистическое приближение функции распределения нормального закона
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if y > 0:
+            p = e / (1.0 + e)
+        else:
+            p = 1.0 - 1.0 / (1.0 + e)
+        return -math.log10(max(p, 1e-300))
+
+class CircuitBreaker:
+    """Автомат размыкания цепи к одной ноде.
+
+    Замкнут — запросы идут. После BREAKER_FAILURES ошибок подряд
+    размыкается: запросы сразу завершаются ошибкой, не дожидаясь таймаута.
+    Через BREAKER_COOLDOWN пропускает один пробный запрос (полуоткрыт): его
+    успех замыкает цепь, ошибка снова размыкает.
+    """
+
+    def __init__(self, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.failures = 0
+        self.changed = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            # Пробный запрос, не сообщивший результат, не держит цепь вечно
+            if now - self.changed >= self.cooldown:
+                self.state = HALF_OPEN
+                self.changed = now
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.max_failures:
+                self.state = OPEN
+                self.changed = time.monotonic()
+
+class LatencyTracker:
+    """Адаптивный таймаут как RTO в TCP (RFC 6298): srtt + 4 * rttvar.
+
+    Таймаут удваивает следующий (до TIMEOUT_MAX), успешный ответ
+    сбрасывает удвоение. Параллельные запросы, истёкшие с одним и тем же
+    таймаутом, удваивают его один раз.
+    """
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = 0.0
+        self.backoff = 1
+        self._lock = threading.Lock()
+
+    def observe(self, sample):
+        with self._lock:
+            if self.srtt is None:
+                self.srtt, self.rttvar = sample, sample / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - sample)
+                self.srtt = 0.875 * self.srtt + 0.125 * sample
+            self.backoff = 1
+
+    def timed_out(self, used):
+        with self._lock:
+            if used >= self.timeout():
+                self.backoff = min(self.backoff * 2, 64)
+
+    def timeout(self):
+        if self.srtt is None:
+            return TIMEOUT_MAX
+        base = max(self.srtt + 4 * self.rttvar, TIMEOUT_MIN)
+        return min(base * self.backoff, TIMEOUT_MAX)
+
+class NodeHealth:
+    """Всё, что мастер знает о доступности одной ноды (по адресу)."""
+
+    def __init__(self, interval=PROBE_INTERVAL, threshold=PHI_THRESHOLD):
+        self.detector = PhiDetector(interval)
+        self.breaker = CircuitBreaker()
+        self.latency = LatencyTracker()
+        self.threshold = threshold
+        self.state = ALIVE
+        self.phi = 0.0
+        self.probing = False
+        self.probe_sock = None
+        self.probe_buf = bytearray()
+        self.last_probe = 0.0
+
+    def update(self, now):
+        """Пересчитывает состояние по phi. Возвращает новое состояние."""
+        self.phi = self.detector.phi(now)
+        if self.phi >= self.threshold:
+            self.state = DOWN
+        elif self.phi >= self.threshold / 2:
+            self.state = SUSPECT
+        else:
+            self.state = ALIVE
+        return self.state
+
+    def success(self, latency=None):
+        self.breaker.success()
+        if latency is not None:
+            self.latency.observe(latency)
+
+    def failure(self, timeout=None):
+        """timeout — таймаут запроса, если он истёк."""
+        self.breaker.failure()
+        if timeout is not None:
+            self.latency.timed_out(timeout)
+
+    def heartbeat(self, now):
+        # Интервал, перекрывающий простой ноды, не попадает в историю:
+        # иначе после возврата детектор долго не заметил бы следующий отказ
+        if self.state == DOWN:
+            self.detector.last = now
+        else:
+            self.detector.heartbeat(now)
+
+    def snapshot(self):
+        return {"state": self.state, "phi": round(min(self.phi, 1000.0), 2),
+                "breaker": self.breaker.state,
+                "timeout_ms": round(self.latency.timeout() * 1000, 1)}
@@ -0,0 +1,761 @@
+# httputil.py
+# Общий разбор HTTP/1.1 для мастера и рабочих нод: keep-alive,
+# разграничение сообщений по Content-Length или chunked, потоковые тела.
+import asyncio
+import email.utils
+import os
+import re
+import tempfile
+import time
+import urllib.parse
+
+import metrics
+
+MAX_HEADER_SIZE = 64 * 1024
+RECV_SIZE = 64 * 1024
+# Сколько держать простаивающее входящее соединение
+KEEPALIVE_TIMEOUT = 60
+
+# Строка запроса с нестандартными пробелами; обычная разбирается split
+REQUEST_LINE = re.compile(r'([A-Z]+)\s+(\S+)\s+HTTP/1\.([01])$')
+VERSIONS = {"HTTP/1.1": "1", "HTTP/1.0": "0"}
+CONTINUE = b"HTTP/1.1 100 Continue\r\n\r\n"
+
+REASONS = {
+    200: "OK", 201: "Created", 206: "Partial Content", 304: "Not Modified", 400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed", 409: "Conflict", 410: "Gone", 415: "Unsupported Media Type",
+    416: "Range Not Satisfiable", 421: "Misdirected Request", 429: "Too Many Requests",
+    500: "Internal Error", 503: "Service Unavailable",
+}
+
+class BadRequest(Exception):
+    pass
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+class Request:
+    __slots__ = ("method", "path", "headers", "keep_alive", "query", "stream", "_body",
+                 "head_size")
+
+    def __init__(self, method, path, headers, keep_alive, query=None):
+        self.method = method
+        self.path = path
+        self.headers = headers
+        self.keep_alive = keep_alive
+        # Параметры строки запроса {имя: значение}
+        self.query = query or {}
+        # BodyReader / AsyncBodyReader; выставляет read_request*
+        self.stream = None
+        # Длина заголовков с завершающей пустой строкой — для счётчика принятых байт
+        self.head_size = 0
+        self._body = None
+
+    @property
+    def body(self):
+        """Тело целиком — для небольших JSON-запросов служебных маршрутов."""
+        if self._body is None:
+            self._body = self.stream.read_all() if self.stream is not None else b""
+        return self._body
+
+    async def load_body(self):
+        """Дочитывает тело в asyncio-режиме, чтобы синхронный код мог взять req.body."""
+        if self._body is None:
+            self._body = await self.stream.read_all()
+
+class BodyReader:
+    """Тело сообщения, читаемое из сокета по частям.
+
+    length — длина по Content-Length; None — chunked или (для ответа без
+    Content-Length) до закрытия соединения. Первые байты могут уже лежать
+    в buf соединения.
+    """
+
+    def __init__(self, sock, buf, length, chunked=False, expect_continue=False):
+        self.sock = sock
+        self.buf = buf
+        self.length = None if chunked else length
+        self.chunked = chunked
+        self.expect_continue = expect_continue
+        self.done = length == 0 and not chunked
+        # Принято байт тела (без разметки chunked)
+        self.received = 0
+
+    def _recv(self, size):
+        chunk = self.sock.recv(size)
+        if not chunk:
+            raise BadRequest("Unexpected end of body")
+        return chunk
+
+    def _take(self, size):
+        """Не более size байт: сначала из буфера соединения, потом из сокета.
+
+        Из буфера байты копируются один раз. Отдать их представлением
+        (memoryview) без копии нельзя: bytearray с живыми представлениями
+        не сдвигается, а буфер соединения продолжает принимать данные.
+        """
+        buf = self.buf
+        if buf:
+            if size >= len(buf):
+                chunk = bytes(buf)
+                buf.clear()
+                return chunk
+            with memoryview(buf) as view:
+                chunk = bytes(view[:size])
+            del buf[:size]
+            return chunk
+        return self._recv(min(size, RECV_SIZE))
+
+    def _readline(self):
+        while True:
+            end = self.buf.find(b"\r\n")
+            if end != -1:
+                line = bytes(self.buf[:end])
+                del self.buf[:end + 2]
+                return line
+            if len(self.buf) > MAX_HEADER_SIZE:
+                raise BadRequest("Chunk header too large")
+            self.buf += self._recv(RECV_SIZE)
+
+    def chunks(self):
+        """Генератор кусков тела; память ограничена RECV_SIZE."""
+        if self.done:
+            return
+        if self.expect_continue:
+            self.expect_continue = False
+            self.sock.sendall(CONTINUE)
+        if self.chunked:
+            while True:
+                try:
+                    size = int(self._readline().split(b";")[0], 16)
+                except ValueError:
+                    raise BadRequest("Invalid chunk size")
+                if size == 0:
+                    # Трейлеры до пустой строки
+                    while self._readline():
+                        pass
+                    break
+                while size:
+                    chunk = self._take(size)
+                    size -= len(chunk)
+                    self.received += len(chunk)
+                    yield chunk
+                if self._readline():
+                    raise BadRequest("Invalid chunk terminator")
+        elif self.length is None:
+            if self.buf:
+                chunk = self._take(len(self.buf))
+                self.received += len(chunk)
+                yield chunk
+            while True:
+                chunk = self.sock.recv(RECV_SIZE)
+                if not chunk:
+                    break
+                self.received += len(chunk)
+                yield chunk
+        else:
+            remaining = self.length
+            while remaining:
+                chunk = self._take(remaining)
+                remaining -= len(chunk)
+                self.received += len(chunk)
+                yield chunk
+        self.done = True
+
+    def read_all(self):
+        return b"".join(self.chunks())
+
+class AsyncBodyReader:
+    """BodyReader для asyncio.StreamReader."""
+
+    def __init__(self, reader, length, chunked=False, writer=None):
+        self.reader = reader
+        self.length = None if chunked else length
+        self.chunked = chunked
+        # writer задан, если клиент ждёт 100 Continue
+        self.writer = writer
+        self.done = length == 0 and not chunked
+        self.received = 0
+
+    async def _read(self, size):
+        chunk = await self.reader.read(min(size, RECV_SIZE))
+        if not chunk:
+            raise BadRequest("Unexpected end of body")
+        return chunk
+
+    async def _readline(self):
+        try:
+            return (await self.reader.readuntil(b"\r\n"))[:-2]
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            raise BadRequest("Invalid chunked body")
+
+    async def chunks(self):
+        if self.done:
+            return
+        if self.writer is not None:
+            self.writer.write(CONTINUE)
+            self.writer = None
+        if self.chunked:
+            while True:
+                try:
+                    size = int((await self._readline()).split(b";")[0], 16)
+                except ValueError:
+                    raise BadRequest("Invalid chunk size")
+                if size == 0:
+                    while await self._readline():
+                        pass
+                    break
+                while size:
+                    chunk = await self._read(size)
+                    size -= len(chunk)
+                    self.received += len(chunk)
+                    yield chunk
+                if await self._readline():
+                    raise BadRequest("Invalid chunk terminator")
+        elif self.length is None:
+            while True:
+                chunk = await self.reader.read(RECV_SIZE)
+                if not chunk:
+                    break
+                self.received += len(chunk)
+                yield chunk
+        else:
+            remaining = self.length
+            while remaining:
+                chunk = await self._read(remaining)
+                remaining -= len(chunk)
+                self.received += len(chunk)
+                yield chunk
+        self.done = True
+
+    async def read_all(self):
+        return b"".join([chunk async for chunk in self.chunks()])
+
+class BufferedBody:
+    """Тело запроса, уже принятое в память; интерфейс BodyReader."""
+
+    def __init__(self, data):
+        self.data = data
+        self.length = len(data)
+        self.done = True
+
+    def chunks(self):
+        if self.data:
+            yield self.data
+
+    def read_all(self):
+        return self.data
+
+    def close(self):
+        pass
+
+def parse_range(value, size):
+    """Диапазон из заголовка Range для тела длиной size: (начало, длина).
+
+    None — заголовок не разобран или диапазонов несколько: тогда отдаётся
+    всё тело, как разрешает RFC 9110. Диапазон, который начинается за
+    концом тела, — RangeNotSatisfiable (ответ 416).
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != "bytes" or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash or not (first or last) or not (first + last).isdigit():
+        return None
+    if not first:
+        # bytes=-N: последние N байт
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiable()
+        return max(size - suffix, 0), min(suffix, size)
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable()
+    end = min(end, size - 1)
+    return start, end - start + 1
+
+def content_range(start, length, size):
+    """Значение Content-Range; start=None — для ответа 416."""
+    if start is None:
+        return f"bytes */{size}"
+    return f"bytes {start}-{start + length - 1}/{size}"
+
+def etag_matches(if_none_match, etag):
+    """Совпадает ли ETag с заголовком If-None-Match (слабое сравнение, RFC 9110)."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for item in if_none_match.split(','):
+        item = item.strip()
+        if item.startswith("W/"):
+            item = item[2:]
+        if item == opaque:
+            return True
+    return False
+
+class FileBody:
+    """Тело ответа из открытого файла; отправляется через sendfile."""
+
+    def __init__(self, file, offset, length):
+        self.file = file
+        self.offset = offset
+        self.length = length
+
+    def close(self, completed=True):
+        self.file.close()
+
+class HeadBody:
+    """Тело, которое не отправляется: ответ на HEAD или 304.
+
+    length — длина тела такого же GET для Content-Length; None — без
+    Content-Length.
+    """
+
+    def __init__(self, length=None):
+        self.length = length
+
+    def close(self, completed=True):
+        pass
+
+def without_body(code, body, content_type, headers=None):
+    """Ответ на HEAD: Content-Length того же GET, тело не отправляется."""
+    if isinstance(body, (bytes, bytearray)):
+        length = len(body)
+    else:
+        length = body.length
+        body.close()
+    return code, HeadBody(length), content_type, headers
+
+class SpooledBody:
+    """Тело запроса во временном файле, которое можно отправить несколько раз.
+
+    Повторяет интерфейс BodyReader (length, chunks(), read_all()); каждый
+    вызов chunks() читает файл с начала через pread.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.length = length
+        self.done = True
+
+    @classmethod
+    def from_stream(cls, stream):
+        f = tempfile.TemporaryFile()
+        try:
+            for chunk in stream.chunks():
+                f.write(chunk)
+            f.flush()
+        except BaseException:
+            f.close()
+            raise
+        return cls(f, f.tell())
+
+    def chunks(self):
+        pos = 0
+        while pos < self.length:
+            chunk = os.pread(self.file.fileno(), min(self.length - pos, RECV_SIZE), pos)
+            if not chunk:
+                raise OSError("Spooled body truncated")
+            pos += len(chunk)
+            yield chunk
+
+    def read_all(self):
+        return b"".join(self.chunks())
+
+    def close(self):
+        self.file.close()
+
+async def receive_body_async(stream, memory_limit=RECV_SIZE):
+    """Дочитывает тело AsyncBodyReader на event loop.
+
+    Синхронный обработчик в пуле потоков получает его целиком и не ждёт
+    медленного клиента. Тело до memory_limit байт остаётся в памяти
+    (BufferedBody), длиннее — во временном файле (SpooledBody); вызывающий
+    закрывает результат.
+    """
+    if stream.length is not None and stream.length <= memory_limit:
+        return BufferedBody(await stream.read_all())
+    parts, size, f = [], 0, None
+    try:
+        async for chunk in stream.chunks():
+            size += len(chunk)
+            if f is None and size <= memory_limit:
+                parts.append(chunk)
+                continue
+            if f is None:
+                f = tempfile.TemporaryFile()
+                f.writelines(parts)
+                parts = None
+            f.write(chunk)
+        if f is None:
+            return BufferedBody(b"".join(parts))
+        f.flush()
+    except BaseException:
+        if f is not None:
+            f.close()
+        raise
+    return SpooledBody(f, size)
+
+class StreamBody:
+    """Тело ответа из итератора кусков (обычного или асинхронного).
+
+    length=None — отправить с Transfer-Encoding: chunked. on_close(completed)
+    вызывается после отправки, например чтобы вернуть соединение в пул.
+    """
+
+    def __init__(self, chunks, length, on_close=None):
+        self.chunks = chunks
+        self.length = length
+        self.on_close = on_close
+
+    def close(self, completed=True):
+        if self.on_close is not None:
+            self.on_close(completed)
+
+def _read_head(sock, buf):
+    """Дочитывает в buf заголовки целиком. Возвращает их длину или -1 при EOF."""
+    scanned = 0
+    while True:
+        head_end = buf.find(b"\r\n\r\n", max(0, scanned - 3))
+        if head_end != -1:
+            return head_end
+        if len(buf) > MAX_HEADER_SIZE:
+            raise BadRequest("Headers too large")
+        scanned = len(buf)
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            if buf:
+                raise BadRequest("Unexpected end of headers")
+            return -1
+        buf += chunk
+
+def _parse_headers(lines):
+    headers = {}
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if not sep:
+            raise BadRequest("Malformed header")
+        headers[name.strip().lower()] = value.strip()
+    return headers
+
+def _content_length(headers):
+    value = headers.get("content-length")
+    if value is None:
+        return None
+    if not value.isdigit():
+        raise BadRequest("Invalid Content-Length")
+    return int(value)
+
+def _is_chunked(headers):
+    return "chunked" in headers.get("transfer-encoding", "").lower()
+
+def _response_framing(status_code, headers, head):
+    """(длина, chunked) тела ответа; у ответа на HEAD, 204 и 304 тела нет."""
+    if head or status_code in (204, 304):
+        return 0, False
+    length = _content_length(headers)
+    chunked = _is_chunked(headers)
+    if length is None and not chunked:
+        # Без Content-Length тело ограничено закрытием соединения
+        headers["connection"] = "close"
+    return length, chunked
+
+def _parse_request_line(line):
+    """(метод, цель, младшая цифра версии) из строки запроса."""
+    parts = line.split(' ')
+    if len(parts) == 3:
+        method, target, version = parts
+        minor = VERSIONS.get(version)
+        if minor is not None and method.isalpha() and method.isupper() and target:
+            return method, target, minor
+    match = REQUEST_LINE.match(line)
+    if not match:
+        raise BadRequest("Invalid HTTP request")
+    return match.groups()
+
+def _parse_request_head(text):
+    """Разбирает заголовки запроса (без CRLFCRLF). Возвращает Request без тела."""
+    lines = text.split('\r\n')
+    method, raw_path, minor = _parse_request_line(lines[0])
+    headers = _parse_headers(lines[1:])
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection != "close" if minor == "1" else connection == "keep-alive"
+    query = None
+    # Строка запроса отделяется до раскодирования: %3F в ключе — не её начало
+    if '?' in raw_path:
+        raw_path, _, raw_query = raw_path.partition('?')
+        query = dict(urllib.parse.parse_qsl(raw_query, keep_blank_values=True))
+    path = urllib.parse.unquote(raw_path) if '%' in raw_path else raw_path
+    return Request(method, path, headers, keep_alive, query)
+
+def _parse_response_head(text):
+    lines = text.split('\r\n')
+    try:
+        return int(lines[0][9:12]), _parse_headers(lines[1:])
+    except ValueError:
+        raise ConnectionError("Invalid response status line")
+
+def read_request(conn, buf):
+    """Читает заголовки очередного запроса; тело доступно через req.stream.
+
+    buf — bytearray соединения: в нём остаются байты следующих запросов
+    (pipelining). Перед следующим вызовом тело должно быть дочитано.
+    Возвращает Request или None, если клиент закрыл соединение.
+    """
+    head_end = _read_head(conn, buf)
+    if head_end == -1:
+        return None
+    start = time.perf_counter()
+    # Разбирается только секция заголовков; тело остаётся в buf
+    req = _parse_request_head(buf[:head_end].decode('latin1'))
+    metrics.PARSE.since(start)
+    req.head_size = head_end + 4
+    del buf[:head_end + 4]
+    expect = req.headers.get("expect", "").lower() == "100-continue"
+    req.stream = BodyReader(conn, buf, _content_length(req.headers) or 0,
+                            _is_chunked(req.headers), expect)
+    return req
+
+def read_response_head(sock, buf, head=False):
+    """Читает заголовки ответа upstream-ноды. Возвращает (код, заголовки, BodyReader).
+
+    head — ответ на HEAD: тела нет, хотя Content-Length указан.
+    """
+    head_end = _read_head(sock, buf)
+    if head_end == -1:
+        raise ConnectionError("Connection closed before response")
+    status_code, headers = _parse_response_head(buf[:head_end].decode('latin1'))
+    del buf[:head_end + 4]
+    length, chunked = _response_framing(status_code, headers, head)
+    return status_code, headers, BodyReader(sock, buf, length, chunked)
+
+def read_response(sock, buf=None):
+    """Читает ответ целиком. Возвращает (код, заголовки, тело)."""
+    buf = bytearray() if buf is None else buf
+    status_code, headers, stream = read_response_head(sock, buf)
+    return status_code, headers, stream.read_all()
+
+async def _read_head_async(reader):
+    try:
+        return await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial:
+            raise BadRequest("Unexpected end of headers")
+        return None
+    except asyncio.LimitOverrunError:
+        raise BadRequest("Headers too large")
+
+async def read_request_async(reader, writer):
+    """Асинхронный read_request для asyncio.StreamReader."""
+    head = await _read_head_async(reader)
+    if head is None:
+        return None
+    start = time.perf_counter()
+    req = _parse_request_head(head[:-4].decode('latin1'))
+    metrics.PARSE.since(start)
+    req.head_size = len(head)
+    expect = req.headers.get("expect", "").lower() == "100-continue"
+    req.stream = AsyncBodyReader(reader, _content_length(req.headers) or 0,
+                                 _is_chunked(req.headers), writer if expect else None)
+    return req
+
+async def read_response_head_async(reader, head=False):
+    """Асинхронный read_response_head. Возвращает (код, заголовки, AsyncBodyReader)."""
+    data = await _read_head_async(reader)
+    if data is None:
+        raise ConnectionError("Connection closed before response")
+    status_code, headers = _parse_response_head(data[:-4].decode('latin1'))
+    length, chunked = _response_framing(status_code, headers, head)
+    return status_code, headers, AsyncBodyReader(reader, length, chunked)
+
+async def read_response_async(reader):
+    status_code, headers, stream = await read_response_head_async(reader)
+    return status_code, headers, await stream.read_all()
+
+def request_head(method, path, host, length, content_type="application/octet-stream",
+                 keep_alive=True, headers=None):
+    """Заголовки запроса; length=None — тело пойдёт с Transfer-Encoding: chunked.
+
+    headers — дополнительные заголовки {имя: значение}.
+    """
+    lines = [
+        f"{method} {path} HTTP/1.1",
+        f"Host: {host}",
+        "Connection: keep-alive" if keep_alive else "Connection: close",
+    ]
+    if length is None:
+        lines.append("Transfer-Encoding: chunked")
+        lines.append(f"Content-Type: {content_type}")
+    elif length:
+        lines.append(f"Content-Length: {length}")
+        lines.append(f"Content-Type: {content_type}")
+    if headers:
+        lines.extend(f"{name}: {value}" for name, value in headers.items())
+    return ("\r\n".join(lines) + "\r\n\r\n").encode('latin1')
+
+def build_request(method, path, host, body=b"", content_type="application/octet-stream",
+                  keep_alive=True):
+    return request_head(method, path, host, len(body), content_type, keep_alive) + body
+
+def send_request(sock, method, path, host, body, keep_alive, headers=None):
+    """Отправляет запрос. body — bytes или потоковое тело (length, chunks())."""
+    if isinstance(body, bytes):
+        sendmsg_all(sock, [request_head(method, path, host, len(body), keep_alive=keep_alive,
+                                        headers=headers), body])
+        return
+    # Потоковое тело пробрасывается по частям, не собираясь в памяти
+    sock.sendall(request_head(method, path, host, body.length, keep_alive=keep_alive,
+                              headers=headers))
+    if body.length is None:
+        for chunk in body.chunks():
+            sock.sendall(encode_chunk(chunk))
+        sock.sendall(LAST_CHUNK)
+    else:
+        for chunk in body.chunks():
+            sock.sendall(chunk)
+
+def encode_chunk(chunk):
+    """Кусок тела в формате Transfer-Encoding: chunked."""
+    return b"%x\r\n%s\r\n" % (len(chunk), chunk)
+
+LAST_CHUNK = b"0\r\n\r\n"
+
+# Готовые строки ответа: статус, Content-Type и Connection не форматируются
+# заново для каждого ответа
+STATUS_LINES = {code: f"HTTP/1.1 {code} {reason}\r\n".encode('latin1')
+                for code, reason in REASONS.items()}
+CONTENT_TYPE_LINES = {}
+CHUNKED_LINE = b"Transfer-Encoding: chunked\r\n"
+KEEP_ALIVE_LINE = b"Connection: keep-alive\r\n"
+CLOSE_LINE = b"Connection: close\r\n"
+# (секунда, строка Date): пересчитывается раз в секунду
+_date = (0, b"")
+
+def http_date(timestamp):
+    """Время в формате заголовков HTTP (Date, Last-Modified)."""
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def date_line():
+    global _date
+    now = int(time.time())
+    second, line = _date
+    if second != now:
+        line = f"Date: {http_date(now)}\r\n".encode('latin1')
+        _date = (now, line)
+    return line
+
+def response_head(status_code, length, content_type="text/plain", keep_alive=False,
+                  headers=None, bodiless=False):
+    """Заголовки ответа. bodiless — тела не будет (HEAD, 304): length=None
+    означает, что Content-Length не отправляется, а не chunked.
+    """
+    status = STATUS_LINES.get(status_code)
+    if status is None:
+        status = f"HTTP/1.1 {status_code} Unknown\r\n".encode('latin1')
+    type_line = CONTENT_TYPE_LINES.get(content_type)
+    if type_line is None:
+        type_line = CONTENT_TYPE_LINES[content_type] = f"Content-Type: {content_type}\r\n".encode('latin1')
+    parts = [status, type_line,
+             b"Content-Length: %d\r\n" % length if length is not None
+             else b"" if bodiless else CHUNKED_LINE,
+             KEEP_ALIVE_LINE if keep_alive else CLOSE_LINE,
+             date_line()]
+    if headers:
+        parts.append("".join(f"{name}: {value}\r\n"
+                             for name, value in headers.items()).encode('latin1'))
+    parts.append(b"\r\n")
+    return b"".join(parts)
+
+def sendmsg_all(sock, buffers):
+    """sendall для нескольких буферов без их склейки."""
+    views = [memoryview(b) for b in buffers if len(b)]
+    while views:
+        sent = sock.sendmsg(views)
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if sent:
+            views[0] = views[0][sent:]
+
+def send_response(conn, status_code, body, content_type="text/plain", keep_alive=False,
+                  headers=None):
+    """Отправляет ответ. body — bytes, FileBody, StreamBody или HeadBody.
+
+    Возвращает число отправленных байт: заголовки и тело без разметки chunked.
+    """
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        head = response_head(status_code, len(body), content_type, keep_alive, headers)
+        sendmsg_all(conn, [head, body])
+        return len(head) + len(body)
+    if isinstance(body, HeadBody):
+        head = response_head(status_code, body.length, content_type, keep_alive, headers, True)
+        conn.sendall(head)
+        return len(head)
+    completed = False
+    try:
+        head = response_head(status_code, body.length, content_type, keep_alive, headers)
+        conn.sendall(head)
+        sent = len(head)
+        if isinstance(body, FileBody):
+            if body.length:
+                sent += conn.sendfile(body.file, body.offset, body.length)
+        elif body.length is None:
+            for chunk in body.chunks:
+                conn.sendall(encode_chunk(chunk))
+                sent += len(chunk)
+            conn.sendall(LAST_CHUNK)
+        else:
+            for chunk in body.chunks:
+                conn.sendall(chunk)
+                sent += len(chunk)
+        completed = True
+        return sent
+    finally:
+        body.close(completed)
+
+async def write_response_async(writer, status_code, body, content_type="text/plain",
+                               keep_alive=False, headers=None):
+    """Асинхронный send_response для asyncio.StreamWriter. Возвращает число отправленных байт."""
+    if isinstance(body, (bytes, bytearray, memoryview)):
+        head = response_head(status_code, len(body), content_type, keep_alive, headers)
+        writer.writelines([head, body])
+        await writer.drain()
+        return len(head) + len(body)
+    if isinstance(body, HeadBody):
+        head = response_head(status_code, body.length, content_type, keep_alive, headers, True)
+        writer.write(head)
+        await writer.drain()
+        return len(head)
+    completed = False
+    try:
+        head = response_head(status_code, body.length, content_type, keep_alive, headers)
+        writer.write(head)
+        await writer.drain()
+        sent = len(head)
+        if isinstance(body, FileBody):
+            if body.length:
+                loop = asyncio.get_running_loop()
+                sent += await loop.sendfile(writer.transport, body.file, body.offset, body.length)
+        else:
+            chunked = body.length is None
+            if hasattr(body.chunks, "__aiter__"):
+                async for chunk in body.chunks:
+                    writer.write(encode_chunk(chunk) if chunked else chunk)
+                    sent += len(chunk)
+                    await writer.drain()
+            else:
+                for chunk in body.chunks:
+                    writer.write(encode_chunk(chunk) if chunked else chunk)
+                    sent += len(chunk)
+                    await writer.drain()
+            if chunked:
+                writer.write(LAST_CHUNK)
+                await writer.drain()
+        completed = True
+        return sent
+    finally:
+        body.close(completed)
@@ -0,0 +1,178 @@
+# listing.py
+# Постраничный список ключей GET /storage: поток NDJSON и слияние
+# отсортированных потоков нод на мастере.
+#
+# Строки потока — {"key": ...} по возрастанию ключей. Если ключи ещё
+# есть, последняя строка — {"next_cursor": ...}: следующую страницу
+# запрашивают с cursor=<это значение>.
+import heapq
+import json
+import urllib.parse
+
+CONTENT_TYPE = "application/x-ndjson"
+# Ключей за одно обращение к индексу ноды
+PAGE = 1000
+# Размер куска при отправке
+CHUNK = 64 * 1024
+
+def parse_params(query):
+    """(prefix, cursor, limit) из параметров запроса. Неверный limit — ValueError."""
+    prefix = query.get("prefix", "")
+    cursor = query.get("cursor") or None
+    limit = query.get("limit")
+    if limit is not None:
+        if not limit.isdigit() or int(limit) == 0:
+            raise ValueError("limit must be a positive integer")
+        limit = int(limit)
+    return prefix, cursor, limit
+
+def query_string(prefix, cursor, limit):
+    params = {}
+    if prefix:
+        params["prefix"] = prefix
+    if cursor is not None:
+        params["cursor"] = cursor
+    if limit is not None:
+        params["limit"] = limit
+    return "?" + urllib.parse.urlencode(params) if params else ""
+
+def key_line(key):
+    return json.dumps({"key": key}, ensure_ascii=False).encode('utf-8') + b"\n"
+
+def cursor_line(cursor):
+    return json.dumps({"next_cursor": cursor}, ensure_ascii=False).encode('utf-8') + b"\n"
+
+def encode(lines):
+    """Склеивает строки в куски по ~64 КиБ."""
+    buf, size = [], 0
+    for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+async def encode_async(lines):
+    buf, size = [], 0
+    async for line in lines:
+        buf.append(line)
+        size += len(line)
+        if size >= CHUNK:
+            yield b"".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield b"".join(buf)
+
+def local_lines(fetch, prefix, cursor, limit):
+    """Строки NDJSON по страницам локального индекса.
+
+    fetch(prefix, after, count) — до count ключей больше after с префиксом prefix.
+    """
+    after, emitted = cursor, 0
+    while limit is None or emitted < limit:
+        want = PAGE if limit is None else min(PAGE, limit - emitted)
+        page = fetch(prefix, after, want)
+        for key in page:
+            yield key_line(key)
+        emitted += len(page)
+        if len(page) < want:
+            return
+        after = page[-1]
+    if fetch(prefix, after, 1):
+        yield cursor_line(after)
+
+def iter_records(chunks):
+    """Разбирает поток NDJSON из кусков произвольной длины."""
+    buf = b""
+    for chunk in chunks:
+        buf += chunk
+        lines = buf.split(b"\n")
+        buf = lines.pop()
+        for line in lines:
+            if line:
+                yield json.loads(line)
+    if buf.strip():
+        yield json.loads(buf)
+
+async def iter_records_async(chunks):
+    buf = b""
+    async for chunk in chunks:
+        buf += chunk
+        lines = buf.split(b"\n")
+        buf = lines.pop()
+        for line in lines:
+            if line:
+                yield json.loads(line)
+    if buf.strip():
+        yield json.loads(buf)
+
+def merge(streams, limit):
+    """k-way слияние отсортированных потоков записей нод в строки NDJSON.
+
+    Одинаковые ключи (реплики) выдаются один раз. Поток, закончившийся
+    next_cursor, не прислал ключи после своего курсора, поэтому слияние
+    останавливается на нём: дальше порядок уже не гарантирован.
+    """
+    heap = []
+    truncated = False
+
+    def push(i):
+        nonlocal truncated
+        record = next(streams[i], None)
+        if record is None:
+            return
+        if "next_cursor" in record:
+            truncated = True
+        else:
+            heapq.heappush(heap, (record["key"], i))
+
+    for i in range(len(streams)):
+        push(i)
+    last, emitted = None, 0
+    while heap:
+        key, i = heapq.heappop(heap)
+        if key != last:
+            if limit is not None and emitted == limit:
+                yield cursor_line(last)
+                return
+            yield key_line(key)
+            last = key
+            emitted += 1
+        push(i)
+        if truncated:
+            yield cursor_line(last)
+            return
+
+async def merge_async(streams, limit):
+    """merge для асинхронных потоков записей."""
+    heap = []
+    truncated = False
+
+    async def push(i):
+        nonlocal truncated
+        record = await anext(streams[i], None)
+        if record is None:
+            return
+        if "next_cursor" in record:
+            truncated = True
+        else:
+            heapq.heappush(heap, (record["key"], i))
+
+    for i in range(len(streams)):
+        await push(i)
+    last, emitted = None, 0
+    while heap:
+        key, i = heapq.heappop(heap)
+        if key != last:
+            if limit is not None and emitted == limit:
+                yield cursor_line(last)
+                return
+            yield key_line(key)
+            last = key
+            emitted += 1
+        await push(i)
+        if truncated:
+            yield cursor_line(last)
+            return
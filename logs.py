@@ -0,0 +1,44 @@
+# logs.py
+# Журнал запросов с уровнями и выборкой. Строка на каждый запрос в stdout
+# упирается в блокировку потока вывода и ограничивает пропускную
+# способность, поэтому по умолчанию запросы не пишутся совсем.
+import json
+import random
+import sys
+import threading
+import time
+
+LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40}
+
+# Выставляет configure() из аргументов командной строки
+level = LEVELS["info"]
+# Доля запросов, попадающих в журнал на уровне debug
+sample = 1.0
+# Имя процесса в записях журнала
+source = ""
+_lock = threading.Lock()
+
+def configure(name, level_name="info", sample_rate=1.0):
+    global level, sample, source
+    source = name
+    level = LEVELS[level_name]
+    sample = sample_rate
+
+def write(level_name, message, **fields):
+    """Запись журнала одной строкой JSON."""
+    if LEVELS[level_name] < level:
+        return
+    record = {"ts": round(time.time(), 3), "level": level_name, "source": source,
+              "msg": message}
+    record.update(fields)
+    line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+def request(req, code, sent, elapsed):
+    """Запись об обработанном запросе (debug, с выборкой sample)."""
+    if level > LEVELS["debug"] or (sample < 1.0 and random.random() >= sample):
+        return
+    write("debug", "request", method=req.method, path=req.path, status=code,
+          bytes=sent, ms=round(elapsed * 1000, 3))
@@ -1,261 +1,2729 @@
+import asyncio
+import concurrent.futures
+import os
+import signal
 import socket
+import sys
+import tempfile
 import threading
 import json
+import math
+import queue
 import time
-import random
 import urllib.parse
-import re
-from datetime import datetime
-import hashlib
+import argparse
+
+import admission
+import batch
+import cache
+import compress
+import hashring
+import health
+import httputil
+import listing
+import logs
+import metastore
+import metrics
+import pool
+import prefork
+import rebalance
 
 workers = {}
 workers_lock = threading.Lock()
+# Кольцо пересобирается только при смене состава активных нод
+ring = hashring.HashRing()
+vnodes = hashring.DEFAULT_VNODES
+
+# Пулы keep-alive соединений к нодам: (host, port) -> ConnectionPool
+pools = {}
+pools_lock = threading.Lock()
+pool_size = pool.DEFAULT_POOL_SIZE
+# Пулы asyncio-режима; доступны только из потока event loop
+async_pools = {}
+# Event loop asyncio-режима; None в режиме threads
+event_loop = None
+# Кэш значений (cache.ValueCache); None — кэш выключен
+value_cache = None
+# Части пакетного запроса к разным нодам отправляются параллельно
+batch_executor = concurrent.futures.ThreadPoolExecutor(max_workers=32,
+                                                       thread_name_prefix="batch")
+# Репликация: ключ хранится на replicas нодах, запись подтверждают
+# write_quorum из них, чтение ждёт read_quorum ответов
+replicas = 1
+write_quorum = 1
+read_quorum = 1
+# Через сколько секунд без ответа чтение дублируется на следующую реплику
+hedge_delay = 0.05
+replica_executor = concurrent.futures.ThreadPoolExecutor(max_workers=64,
+                                                         thread_name_prefix="replica")
+VERSION_HEADER = "X-Version"
+# Коды ответов реплик, засчитываемые как подтверждение записи; 409 — у
+# реплики уже есть более новая версия, которая эту запись перекрывает
+WRITE_ACKS = {'PUT': (201, 409), 'DELETE': (200, 404, 409)}
+version_lock = threading.Lock()
+last_version = 0
+version_stride = 1
+version_slot = 0
+replication_stats = {"hedged_reads": 0, "read_repairs": 0}
+# Перебалансировка: незавершённые переходы между кольцами, по порядку.
+# Пока список не пуст, мастер ставит версии всем записям, а чтения ключей,
+# ещё не доехавших до новых владельцев, уходят к прежним.
+migrations = []
+rebalance_cond = threading.Condition()
+last_migration = None
+fallback_reads = 0
+rebalance_throttle = rebalance.Throttle(rebalance.DEFAULT_RATE_MB * 1024 * 1024)
+rebalance_executor = None
+DROP_HEADER = "X-Drop-Version"
+# Доступность нод: (host, port) -> health.NodeHealth
+health_nodes = {}
+health_lock = threading.Lock()
+probe_interval = health.PROBE_INTERVAL
+phi_threshold = health.PHI_THRESHOLD
+probe_executor = concurrent.futures.ThreadPoolExecutor(max_workers=8, thread_name_prefix="probe")
+# Таймаут пакетных запросов и списков: их время не связано с задержкой одного ключа
+BULK_TIMEOUT = 10
+# Защита от перегрузки (admission.py); по умолчанию всё выключено.
+# flights — объединение одинаковых GET (Flights или AsyncFlights по
+# режиму); None — выключено.
+flights = None
+coalesce_limit = 0
+# Слоты нод: (host, port) -> NodeLimiter (AsyncNodeLimiter в asyncio-режиме);
+# node_limit=0 — без ограничения
+node_limiters = {}
+node_limiters_lock = threading.Lock()
+node_limiter_class = admission.NodeLimiter
+node_limit = 0
+node_queue = admission.DEFAULT_NODE_QUEUE
+queue_timeout = admission.DEFAULT_QUEUE_TIMEOUT
+# admission.ClientLimiter; None — частота запросов клиентов не ограничена
+client_limiter = None
+# Соединений клиентов одновременно; 0 — без ограничения
+max_connections = 0
+connection_slots = None
+open_connections = 0
 
 def get_active_workers():
     """Возвращает список активных нод (с портом != 0)"""
     with workers_lock:
         return [w for w in workers.values() if w["port"] != 0]
 
+def rebuild_ring(departed=None):
+    """Пересобирает кольцо по активным нодам. Вызывать под workers_lock.
+
+    departed — копия записи ушедшей ноды с прежним адресом: с неё тоже
+    забираются ключи.
+    """
+    global ring
+    old_ring = ring
+    ring = hashring.HashRing(
+        {w["id"]: w.get("weight", 1.0) for w in workers.values() if w["port"] != 0},
+        vnodes,
+    )
+    if old_ring.nodes == ring.nodes:
+        return
+    if value_cache is not None:
+        value_cache.invalidate_moved(old_ring.get_node, ring.get_node)
+    if old_ring.nodes and ring.nodes:
+        start_migration(old_ring, ring, departed)
+
+def route_key(key):
+    """Возвращает (нода-владелец, реплики); реплики — None без репликации."""
+    if replicas > 1:
+        nodes = get_replica_nodes(key)
+        return (nodes[0] if nodes else None), nodes
+    return get_target_node(key), None
+
 def get_target_node(key):
-    """Определяет целевую ноду для ключа по алгоритму шардирования."""
-    active_workers = get_active_workers()
-    if not active_workers:
+    """Определяет целевую ноду для ключа по консистентному хешированию.
+
+    Недоступная нода пропускается: без реплик ключ больше нигде не лежит,
+    поэтому возвращается None и запрос сразу получает 503.
+    """
+    node_id = ring.get_node(key)
+    if node_id is None:
+        return None
+    w = workers.get(node_id)
+    if w is None or node_down(w):
         return None
+    return w
 
-    # Простой хеш для равномерного распределения
-    # Используем SHA256 и конвертируем в число
-    key_hash = int(hashlib.sha256(key.encode('utf-8')).hexdigest(), 16)
-    target_index = key_hash % len(active_workers)
-    return active_workers[target_index]
-
-def send_http_request(host, port, method, path, body=b"", timeout=10):
-    try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.settimeout(timeout)
-            s.connect((host, port))
-            headers = [
-                f"{method} {path} HTTP/1.1",
-                f"Host: {host}",
-                "Connection: close"
-            ]
-            if body:
-                headers.append(f"Content-Length: {len(body)}")
-                headers.append("Content-Type: application/octet-stream")
-            request = "\r\n".join(headers) + "\r\n\r\n"
-            s.sendall(request.encode('latin1') + body)
-
-            response = b""
-            while True:
-                chunk = s.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-
-        header_end = response.find(b"\r\n\r\n")
-        if header_end == -1:
-            return 500, b"Invalid response"
-        status_line = response[:header_end].split(b'\r\n')[0]
-        status_code = int(status_line.split(b' ')[1])
-        body = response[header_end + 4:]
-        return status_code, body
+def get_pool(host, port):
+    with pools_lock:
+        p = pools.get((host, port))
+        if p is None:
+            p = pool.ConnectionPool(host, port, pool_size)
+            pools[(host, port)] = p
+        return p
+
+def close_pool(host, port):
+    with pools_lock:
+        p = pools.pop((host, port), None)
+    if p is not None:
+        p.close()
+
+def pool_reaper():
+    """Фоновая очистка простаивающих соединений к нодам."""
+    while True:
+        time.sleep(pool.DEFAULT_IDLE_TIMEOUT / 2)
+        with pools_lock:
+            current = list(pools.values())
+        for p in current:
+            p.evict_idle()
+
+# --- Доступность нод ---
+# Мастер опрашивает каждую активную ноду (GET /health) раз в probe_interval;
+# по интервалам между ответами детектор phi accrual решает, подозрительна
+# нода или недоступна. Недоступные ноды исключаются из маршрутизации, а
+# автомат размыкания цепи и адаптивный таймаут не дают запросам к
+# зависшей ноде ждать по 10 секунд.
+
+def node_health(host, port):
+    with health_lock:
+        h = health_nodes.get((host, port))
+        if h is None:
+            h = health.NodeHealth(probe_interval, phi_threshold)
+            health_nodes[(host, port)] = h
+        return h
+
+def node_state(w):
+    h = health_nodes.get((w['host'], w['port']))
+    return h.state if h is not None else health.ALIVE
+
+def node_down(w):
+    return node_state(w) == health.DOWN
+
+def small_body(body):
+    """Время ответа на запрос с небольшим телом отражает задержку ноды, а не передачу тела."""
+    return isinstance(body, bytes) or (body.length is not None and body.length <= httputil.RECV_SIZE)
+
+def upstream_health(host, port, timeout, body=b""):
+    """Проверяет цепь ноды. Возвращает (NodeHealth, таймаут, адаптивный ли он).
+
+    Ответ на запрос с большим телом ждёт и записи тела на ноде, поэтому
+    адаптивный таймаут к нему не применяется.
+    """
+    h = node_health(host, port)
+    if not h.breaker.allow():
+        raise health.NodeUnavailable(f"цепь к {host}:{port} разомкнута")
+    if timeout is None:
+        if not small_body(body):
+            return h, health.TIMEOUT_MAX, False
+        return h, h.latency.timeout(), True
+    return h, timeout, False
+
+def probe_node(w, h):
+    """GET /health на отдельном соединении; ответ 200 — очередной heartbeat детектора."""
+    try:
+        if h.probe_sock is None:
+            h.probe_sock = socket.create_connection((w['host'], w['port']),
+                                                    timeout=probe_interval * 2)
+            h.probe_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            h.probe_buf.clear()
+        httputil.send_request(h.probe_sock, "GET", "/health", w['host'], b"", True,
+                              {MAP_VERSION_HEADER: map_version})
+        code, _, _ = httputil.read_response(h.probe_sock, h.probe_buf)
+        if code == 200:
+            h.heartbeat(time.monotonic())
+    except Exception:
+        if h.probe_sock is not None:
+            h.probe_sock.close()
+            h.probe_sock = None
+    finally:
+        h.probing = False
+
+def health_monitor():
+    """Фоновый поток: пробы нод и пересчёт их состояния."""
+    while True:
+        time.sleep(probe_interval / 5)
+        now = time.monotonic()
+        active = {(w['host'], w['port']): w for w in get_active_workers()}
+        changed = False
+        for addr, w in active.items():
+            h = node_health(*addr)
+            old = h.state
+            if h.update(now) != old:
+                changed = True
+                print(f"[MASTER] Нода {w['id']} ({addr[0]}:{addr[1]}): {old} -> {h.state} "
+                      f"(phi={h.phi:.1f})")
+            if not h.probing and now - h.last_probe >= probe_interval:
+                h.probing = True
+                h.last_probe = now
+                probe_executor.submit(probe_node, w, h)
+        with health_lock:
+            gone = [addr for addr in health_nodes if addr not in active]
+            stale = [health_nodes.pop(addr) for addr in gone]
+        for h in stale:
+            if h.probe_sock is not None and not h.probing:
+                h.probe_sock.close()
+        if changed:
+            publish()
+
+def health_status():
+    result = {}
+    for w in get_active_workers():
+        h = health_nodes.get((w['host'], w['port']))
+        result[w['id']] = h.snapshot() if h is not None else {"state": health.ALIVE}
+    return result
+
+class Upstream:
+    """Запрос к ноде, у которого прочитаны заголовки ответа; тело — в stream."""
+
+    def __init__(self, pool_, sock, code, headers, stream):
+        self.pool = pool_
+        self.sock = sock
+        self.code = code
+        self.headers = headers
+        self.stream = stream
+
+    def read_all(self):
+        try:
+            body = self.stream.read_all()
+        except BaseException:
+            self.close(False)
+            raise
+        self.close()
+        return body
+
+    def close(self, completed=True):
+        """Возвращает соединение в пул, если тело ответа дочитано."""
+        reusable = (completed and self.stream.done
+                    and self.headers.get("connection", "").lower() != "close")
+        if self.pool is not None:
+            self.pool.release(self.sock, reusable)
+        else:
+            self.sock.close()
+
+def open_upstream(host, port, method, path, body=b"", timeout=None, headers=None):
+    """Отправляет запрос ноде и читает заголовки ответа.
+
+    body — bytes или потоковое тело запроса клиента. Повтор на новом
+    соединении возможен только для bytes: поток нельзя прочитать дважды,
+    поэтому небольшие тела заранее читаются целиком. headers —
+    дополнительные заголовки запроса. timeout=None — адаптивный таймаут
+    по задержкам ноды. При разомкнутой цепи запрос не отправляется
+    (health.NodeUnavailable).
+    """
+    node, timeout, adaptive = upstream_health(host, port, timeout, body)
+    start = time.monotonic()
+    try:
+        up = _open_upstream(host, port, method, path, body, timeout, headers)
+    except Exception as e:
+        node.failure(timeout if isinstance(e, TimeoutError) else None)
+        raise
+    node.success(time.monotonic() - start if adaptive else None)
+    return up
+
+def upstream_stage(start, stage):
+    """Записывает длительность этапа запроса к ноде; возвращает начало следующего."""
+    now = time.perf_counter()
+    stage.observe(now - start)
+    return now
+
+def _open_upstream(host, port, method, path, body, timeout, headers):
+    if not isinstance(body, bytes) and body.length is not None and body.length <= httputil.RECV_SIZE:
+        body = body.read_all()
+    start = time.perf_counter()
+    if pool_size == 0:
+        sock = socket.create_connection((host, port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        start = upstream_stage(start, metrics.UPSTREAM_CONNECT)
+        try:
+            httputil.send_request(sock, method, path, host, body, False, headers)
+            code, headers, stream = httputil.read_response_head(sock, bytearray(),
+                                                                method == 'HEAD')
+        except BaseException:
+            sock.close()
+            raise
+        upstream_stage(start, metrics.UPSTREAM_TRANSFER)
+        return Upstream(None, sock, code, headers, stream)
+
+    p = get_pool(host, port)
+    sock, reused = p.acquire(timeout)
+    start = upstream_stage(start, metrics.UPSTREAM_CONNECT)
+    try:
+        httputil.send_request(sock, method, path, host, body, True, headers)
+        code, headers, stream = httputil.read_response_head(sock, bytearray(), method == 'HEAD')
+    except OSError as e:
+        p.release(sock, False)
+        if not reused or not isinstance(body, bytes) or isinstance(e, TimeoutError):
+            raise
+        # Нода успела закрыть соединение из пула — повторяем на новом
+        sock, _ = p.acquire(timeout, fresh=True)
+        try:
+            httputil.send_request(sock, method, path, host, body, True, headers)
+            code, headers, stream = httputil.read_response_head(sock, bytearray(),
+                                                                method == 'HEAD')
+        except BaseException:
+            p.release(sock, False)
+            raise
+    except BaseException:
+        p.release(sock, False)
+        raise
+    upstream_stage(start, metrics.UPSTREAM_TRANSFER)
+    return Upstream(p, sock, code, headers, stream)
+
+def send_http_request(host, port, method, path, body=b"", timeout=None, stream=False,
+                      buffer_limit=0, headers=None):
+    """Запрос к ноде. Возвращает (код, тело).
+
+    stream=True — тело успешного ответа (200) длиннее buffer_limit
+    возвращается как StreamBody, который отправляется клиенту прямо из
+    сокета ноды. На HEAD вместо тела возвращаются заголовки ответа.
+    """
+    try:
+        up = open_upstream(host, port, method, path, body, timeout, headers)
+        if method == 'HEAD':
+            return head_reply(up)
+        if stream:
+            return upstream_reply(up, buffer_limit)
+        return up.code, up.read_all()
     except Exception as e:
-        print(f"[MASTER] Ошибка при обращении к ноде ({host}:{port}): {e}")
+        logs.write("warning", "upstream error", node=f"{host}:{port}", error=str(e))
         return 500, b""
 
-# Синхронизация больше не требуется в таком виде, так как данные не копируются между нодами.
-# def sync_new_node(node_info):
-#     ...
+def upstream_reply(up, buffer_limit):
+    """(код, тело) ответа ноды на GET: длинное тело — потоком из её сокета."""
+    if up.code in (200, 206) and not (up.stream.length is not None and up.stream.length <= buffer_limit):
+        return up.code, httputil.StreamBody(up.stream.chunks(), up.stream.length, up.close)
+    return up.code, up.read_all()
 
-def handle_client(conn, addr):
+def head_reply(up):
+    """(код, заголовки) ответа ноды на HEAD: тела нет, его место занимают заголовки."""
+    up.read_all()
+    return up.code, up.headers
+
+def head_body(headers):
+    """Тело ответа клиенту на HEAD с Content-Length из ответа ноды."""
+    length = headers.get("content-length")
+    return httputil.HeadBody(int(length) if length else None)
+
+# --- Репликация ---
+# Ключ хранится на replicas нодах: владельце и следующих за ним по кольцу.
+# Мастер ставит записи версию (X-Version), ноды отклоняют записи старше
+# своей, а из ответов реплик на чтение побеждает старшая версия.
+
+def get_replica_nodes(key):
+    """Доступные ноды, хранящие ключ, в порядке предпочтения; подозрительные — в конце."""
+    nodes, suspect = [], []
+    for node_id in ring.get_nodes(key, replicas):
+        w = workers.get(node_id)
+        if w is None:
+            continue
+        state = node_state(w)
+        if state == health.ALIVE:
+            nodes.append(w)
+        elif state == health.SUSPECT:
+            suspect.append(w)
+    return nodes + suspect
+
+def replica_quorum(method):
+    return read_quorum if method in ('GET', 'HEAD') else write_quorum
+
+def next_version():
+    """Версия записи: время в наносекундах, строго растущее в пределах мастера.
+
+    С --processes остаток от деления на version_stride — номер процесса,
+    поэтому версии разных процессов не совпадают.
+    """
+    global last_version
+    with version_lock:
+        version = max(last_version + 1, time.time_ns())
+        last_version = version + (version_slot - version) % version_stride
+        return last_version
+
+def response_version(headers):
     try:
-        data = conn.recv(1024 * 1024)
-        if not data:
-            return
+        return int(headers.get("x-version", 0))
+    except ValueError:
+        return 0
 
-        request_str = data.decode('latin1', errors='ignore')
-        lines = request_str.split('\r\n')
-        if not lines:
-            send_response(conn, 400, b"Bad Request")
-            return
+def count_replication(name):
+    with version_lock:
+        replication_stats[name] += 1
 
-        request_line = lines[0]
-        match = re.match(r'(GET|PUT|DELETE|POST)\s+(.+?)\s+HTTP/1\.1', request_line)
-        if not match:
-            send_response(conn, 400, b"Invalid HTTP request")
-            return
+def spool_body(stream):
+    """Тело записи для нескольких реплик: небольшое — в память, крупное — во временный файл."""
+    if isinstance(stream, bytes):
+        return stream
+    if stream.length is not None and stream.length <= httputil.RECV_SIZE:
+        return stream.read_all()
+    body = httputil.SpooledBody.from_stream(stream)
+    if body.length <= httputil.RECV_SIZE:
+        data = body.read_all()
+        body.close()
+        return data
+    return body
+
+def close_when_done(futures, body):
+    """Закрывает временный файл тела после ответа последней реплики."""
+    if not isinstance(body, httputil.SpooledBody):
+        return
+    remaining = [len(futures)]
+    lock = threading.Lock()
 
-        method, raw_path = match.groups()
-        path = urllib.parse.unquote(raw_path)
+    def done(_):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            body.close()
 
-        # --- Регистрация ноды ---
-        if path == "/register" and method == "POST":
-            body_start = data.find(b'\r\n\r\n') + 4
-            try:
-                body = data[body_start:]
-                payload = json.loads(body.decode('utf-8'))
-                node_id = payload.get("id")
-                port = payload.get("port")
-                if not isinstance(node_id, int) or not isinstance(port, int):
-                    send_response(conn, 400, b"Invalid id or port")
-                    return
-                with workers_lock:
-                    if node_id in workers:
-                        workers[node_id]["port"] = port
-                        print(f"[MASTER] Нода {node_id} зарегистрирована на порту {port}")
-                        # Синхронизация больше не нужна для шардинга
-                        # threading.Thread(target=sync_new_node, args=(workers[node_id],), daemon=True).start()
-                    else:
-                        print(f"[MASTER] Нода {node_id} не создана через PUT /node/{node_id}")
-                        send_response(conn, 404, b"Node not pre-registered")
-                        return
-                send_response(conn, 200, b"OK")
+    for future in futures:
+        future.add_done_callback(done)
+
+def write_result(method, codes):
+    if method == 'PUT':
+        return 201
+    return 200 if 200 in codes else 404
+
+def replicated_write(method, key, nodes, body, extra=None):
+    """PUT/DELETE на все реплики; ответ — после write_quorum подтверждений.
+
+    Остальные реплики дописываются в фоне. extra — заголовки для нод
+    помимо версии (Content-Encoding). Возвращает (код, тело).
+    """
+    headers = {VERSION_HEADER: next_version(), **(extra or {})}
+    path = worker_path(key)
+
+    def write(node):
+        up = open_upstream(node['host'], node['port'], method, path, body, headers=headers)
+        up.read_all()
+        return up.code
+
+    futures = [replica_executor.submit(write, node) for node in nodes]
+    close_when_done(futures, body)
+    acks, failures = [], 0
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            code = future.result()
+        except Exception as e:
+            print(f"[MASTER] Ошибка записи на реплику: {e}")
+            code = 500
+        if code in WRITE_ACKS[method]:
+            acks.append(code)
+            if len(acks) >= write_quorum:
+                return write_result(method, acks), b""
+        else:
+            failures += 1
+            if failures > len(futures) - write_quorum:
+                break
+    return 500, b""
+
+class ReadRound:
+    """Параллельное чтение реплик.
+
+    Заголовки ответов складываются в очередь; ответы, пришедшие после
+    выбора результата, закрываются.
+    """
+
+    def __init__(self, key, method='GET'):
+        self.path = worker_path(key)
+        self.method = method
+        self.replies = queue.Queue()
+        self.lock = threading.Lock()
+        self.finished = False
+        self.started = 0
+
+    def start(self, node):
+        self.started += 1
+        replica_executor.submit(self._read, node)
+
+    def _read(self, node):
+        try:
+            up = open_upstream(node['host'], node['port'], self.method, self.path)
+        except Exception as e:
+            up = e
+        with self.lock:
+            if not self.finished:
+                self.replies.put((node, up))
                 return
-            except Exception as e:
-                print(f"[MASTER] Ошибка регистрации: {e}")
-                send_response(conn, 400, b"Bad Request")
+        if isinstance(up, Upstream):
+            up.close(False)
+
+    def finish(self):
+        with self.lock:
+            self.finished = True
+        while True:
+            try:
+                _, up = self.replies.get_nowait()
+            except queue.Empty:
                 return
+            if isinstance(up, Upstream):
+                up.close(False)
 
-        # --- Управление нодами ---
-        if path == "/node" and method == "GET":
-            with workers_lock:
-                names = [w["name"] for w in workers.values()]
-            response_body = json.dumps(names, ensure_ascii=False).encode('utf-8')
-            send_response(conn, 200, response_body, "application/json")
+def discard_upstream(up):
+    """Освобождает лишний ответ: короткое тело дочитывается, чтобы соединение вернулось в пул."""
+    if up.stream.length is not None and up.stream.length <= httputil.RECV_SIZE:
+        try:
+            up.read_all()
+        except Exception:
+            pass
+    else:
+        up.close(False)
+
+def replicated_get(key, nodes, buffer_limit, timeout=10, fallback=None, method='GET'):
+    """Чтение с кворумом read_quorum и дублированием на запасные реплики.
+
+    Запросы сначала уходят первым read_quorum репликам; если за
+    hedge_delay не пришло ни одного ответа или реплика ответила ошибкой,
+    подключается следующая. fallback — прежние владельцы ключа во время
+    переноса: у них ищется ключ, которого нет у реплик (и нет надгробия).
+    Возвращает (код, тело) как send_http_request. HEAD (method) отставшие
+    реплики не восстанавливает: значения у него нет.
+    """
+    rnd = ReadRound(key, method)
+    for node in nodes[:read_quorum]:
+        rnd.start(node)
+    spare = list(nodes[read_quorum:])
+    replies = []
+    failures = 0
+    deadline = time.monotonic() + timeout
+    try:
+        while len(replies) < read_quorum:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                node, up = rnd.replies.get(timeout=min(hedge_delay, remaining) if spare
+                                           else remaining)
+            except queue.Empty:
+                if spare:
+                    count_replication("hedged_reads")
+                    rnd.start(spare.pop(0))
+                continue
+            if not isinstance(up, Upstream) or up.code not in (200, 404):
+                if isinstance(up, Upstream):
+                    discard_upstream(up)
+                else:
+                    print(f"[MASTER] Ошибка чтения с реплики ({node['host']}:{node['port']}): {up}")
+                failures += 1
+                if spare:
+                    rnd.start(spare.pop(0))
+                elif rnd.started - failures < read_quorum:
+                    break
+                continue
+            replies.append((response_version(up.headers), up.code == 200, node, up))
+    finally:
+        rnd.finish()
+    if len(replies) < read_quorum:
+        for _, _, _, up in replies:
+            up.close(False)
+        return 500, b""
+
+    replies.sort(key=lambda r: (r[0], r[1]), reverse=True)
+    version, found, _, winner = replies[0]
+    stale = [node for v, _, node, _ in replies[1:] if v < version]
+    for _, _, _, up in replies[1:]:
+        discard_upstream(up)
+    if not found:
+        winner.read_all()
+        if stale and version:
+            read_repair('DELETE', key, stale, version, b"")
+        if fallback and not version:
+            code, body = fallback_get(key, fallback, buffer_limit, method)
+            if code == 404:
+                # Ключ могли перенести между чтением реплик и прежних владельцев
+                return replicated_get(key, nodes, buffer_limit, timeout, method=method)
+            return code, body
+        return 404, b""
+    if method == 'HEAD':
+        return head_reply(winner)
+    length = winner.stream.length
+    if length is not None and (length <= buffer_limit or (stale and length <= httputil.RECV_SIZE)):
+        value = winner.read_all()
+        if stale:
+            read_repair('PUT', key, stale, version, value)
+        return 200, value
+    return 200, httputil.StreamBody(winner.stream.chunks(), length, winner.close)
+
+def read_repair(method, key, nodes, version, body):
+    """Досылает отставшим репликам значение (или удаление) с версией победителя."""
+    count_replication("read_repairs")
+    headers = {VERSION_HEADER: version}
+    path = worker_path(key)
+
+    def repair(node):
+        try:
+            open_upstream(node['host'], node['port'], method, path, body, headers=headers).read_all()
+        except Exception as e:
+            print(f"[MASTER] Ошибка восстановления реплики ({node['host']}:{node['port']}): {e}")
+
+    for node in nodes:
+        replica_executor.submit(repair, node)
+
+def replicated_request(method, key, nodes, body, buffer_limit, fallback=None, extra=None):
+    """body PUT-запроса уже подготовлен spool_body."""
+    if method in ('GET', 'HEAD'):
+        return replicated_get(key, nodes, buffer_limit, fallback=fallback, method=method)
+    return replicated_write(method, key, nodes, body, extra)
+
+# --- Перебалансировка ---
+# При смене состава нод ключи, сменившие владельца, переносятся фоновым
+# потоком: он обходит список ключей каждой ноды старого кольца, копирует
+# ключ новым владельцам с его версией и удаляет с источника. Пока перенос
+# идёт, записи получают версию (копия не затрёт более новую запись), а
+# чтение ключа, которого ещё нет у нового владельца, уходит к прежнему.
+
+def start_migration(old_ring, new_ring, departed):
+    """Ставит перенос в очередь. Вызывается из rebuild_ring под workers_lock."""
+    sources = {}
+    for node_id in old_ring.nodes:
+        w = workers.get(node_id)
+        if w is not None and w["port"] != 0:
+            sources[node_id] = dict(w)
+        elif departed is not None and departed["id"] == node_id:
+            sources[node_id] = departed
+    migration = rebalance.Migration(old_ring, new_ring, sources, replicas, next_version())
+    with rebalance_cond:
+        migrations.append(migration)
+        record_change({"op": "migration", "migration": migration_state(migration)})
+        rebalance_cond.notify()
+    print(f"[MASTER] Перебалансировка: {sorted(old_ring.nodes)} -> {sorted(new_ring.nodes)}")
+
+def write_headers(extra=None):
+    """Заголовки записи без репликации: версия нужна, только пока идёт перенос."""
+    if migrations:
+        return {VERSION_HEADER: next_version(), **(extra or {})}
+    return extra
+
+def fallback_nodes(key, current):
+    """Прежние владельцы ключа по незавершённым переносам, кроме нод из current."""
+    if not migrations:
+        return None
+    with rebalance_cond:
+        pending = list(migrations)
+    seen = {node['id'] for node in current}
+    nodes = []
+    for migration in pending:
+        for node_id in migration.old_owners(key):
+            if node_id not in seen and node_id in migration.sources:
+                seen.add(node_id)
+                nodes.append(migration.sources[node_id])
+    return nodes or None
+
+def count_fallback(count=1):
+    global fallback_reads
+    with rebalance_cond:
+        fallback_reads += count
+
+def fallback_get(key, nodes, buffer_limit, method='GET'):
+    """Читает ключ у прежних владельцев по порядку; первый найденный побеждает."""
+    count_fallback()
+    for node in nodes:
+        code, body = send_http_request(node['host'], node['port'], method, worker_path(key),
+                                       stream=True, buffer_limit=buffer_limit)
+        if code == 200:
+            return code, body
+    return 404, b""
+
+def migrating_get(key, node, fallback, buffer_limit, timeout=None, method='GET'):
+    """GET (или HEAD) без репликации во время переноса.
+
+    Нет ключа и нет надгробия у нового владельца — ключ ещё не перенесён,
+    и он читается у прежнего.
+    """
+    try:
+        up = open_upstream(node['host'], node['port'], method, worker_path(key), timeout=timeout)
+        if up.code == 404 and not response_version(up.headers):
+            discard_upstream(up)
+            code, body = fallback_get(key, fallback, buffer_limit, method)
+            if code == 404:
+                # Ключ могли перенести между двумя чтениями: он уже у нового владельца
+                return send_http_request(node['host'], node['port'], method, worker_path(key),
+                                         timeout=timeout, stream=True, buffer_limit=buffer_limit)
+            return code, body
+        if method == 'HEAD':
+            return head_reply(up)
+        return upstream_reply(up, buffer_limit)
+    except Exception as e:
+        print(f"[MASTER] Ошибка при обращении к ноде ({node['host']}:{node['port']}): {e}")
+        return 500, b""
+
+def rebalancer():
+    """Фоновый поток: выполняет переносы из очереди по одному."""
+    global last_migration
+    while True:
+        with rebalance_cond:
+            while not migrations:
+                rebalance_cond.wait()
+            migration = migrations[0]
+        announce_map(migration)
+        run_migration(migration)
+        with rebalance_cond:
+            migrations.pop(0)
+            record_change({"op": "migration_done"})
+            last_migration = migration
+        membership_changed()
+        active = {(w['host'], w['port']) for w in get_active_workers()}
+        for node in migration.sources.values():
+            if (node['host'], node['port']) not in active:
+                close_pool(node['host'], node['port'])
+
+def run_migration(migration):
+    for node in migration.sources.values():
+        try:
+            migrate_source(migration, node)
+        except Exception as e:
+            print(f"[MASTER] Перебалансировка: нода {node['id']} недоступна: {e}")
+            migration.add(errors=1)
+        migration.add(sources_done=1)
+    migration.finish()
+    progress = migration.progress()
+    print(f"[MASTER] Перебалансировка завершена: перенесено {progress['keys_copied']} ключей "
+          f"за {progress['elapsed_s']} с, ошибок: {progress['errors']}")
+
+def migrate_source(migration, node):
+    """Обходит ключи ноды страницами и переносит те, что сменили владельца."""
+    cursor = None
+    while True:
+        path = "/storage" + listing.query_string("", cursor, rebalance.PAGE)
+        up = open_upstream(node['host'], node['port'], 'GET', path, timeout=BULK_TIMEOUT)
+        body = up.read_all()
+        if up.code != 200:
+            raise RuntimeError(f"список ключей: код {up.code}")
+        records = list(listing.iter_records([body]))
+        keys = [r["key"] for r in records if "key" in r]
+        migration.add(keys_scanned=len(keys))
+        moves = []
+        for key in keys:
+            targets, move = migration.plan(key, node['id'])
+            if move:
+                moves.append((key, targets))
+        batches = [moves[i:i + rebalance.BATCH] for i in range(0, len(moves), rebalance.BATCH)]
+        for _ in rebalance_executor.map(lambda b: migrate_batch(migration, node, b), batches):
+            pass
+        if not records or "next_cursor" not in records[-1]:
             return
+        cursor = records[-1]["next_cursor"]
+
+def migrate_batch(migration, source, moves):
+    """Переносит пакет ключей [(ключ, ноды назначения)] пакетными запросами.
+
+    Значения длиннее rebalance.BATCH_VALUE нода в пакете не отдаёт, они
+    переносятся по одному потоком.
+    """
+    try:
+        copied, large = copy_batch(migration, source, moves)
+    except Exception as e:
+        print(f"[MASTER] Перебалансировка: ошибка пакета с ноды {source['id']}: {e}")
+        migration.add(errors=len(moves))
+        return
+    for key, targets in large:
+        migrate_key(migration, source, key, targets)
+    if not copied:
+        return
+    items = [(key, None) for key, _ in copied]
+    code, body = send_http_request(source['host'], source['port'], 'POST', batch.PATH,
+                                   batch.build_request("drop", items,
+                                                       versions=[v for _, v in copied]),
+                                   BULK_TIMEOUT)
+    if code != 200:
+        migration.add(errors=len(copied))
+        return
+    migration.add(keys_dropped=sum(1 for status, _, _ in batch.parse_response(body)
+                                   if status in (200, 404)))
+
+def copy_batch(migration, source, moves):
+    """Копирует небольшие значения пакета новым владельцам.
+
+    Возвращает ([(ключ, версия на источнике)] — можно забрать с источника,
+    [(ключ, ноды назначения)] — крупные значения).
+    """
+    items = [(key, None) for key, _ in moves]
+    code, body = send_http_request(source['host'], source['port'], 'POST', batch.PATH,
+                                   batch.build_request("get", items,
+                                                       max_value=rebalance.BATCH_VALUE),
+                                   BULK_TIMEOUT)
+    if code != 200:
+        raise RuntimeError(f"код {code}")
+    results = batch.parse_response(body)
+    if len(results) != len(moves):
+        raise RuntimeError("ответ не совпадает с запросом")
+    found, large, per_node = [], [], {}
+    size = 0
+    for (key, targets), (status, value, version) in zip(moves, results):
+        if status == 413:
+            large.append((key, targets))
+        elif status == 200:
+            found.append((key, version or 0, targets))
+            size += len(value) * len(targets)
+            for node_id in targets:
+                per_node.setdefault(node_id, []).append((key, value, version or migration.floor))
+    rebalance_throttle.wait(size)
+    failed = set()
+    for node_id, node_items in per_node.items():
+        w = workers.get(node_id)
+        replies = None
+        if w is not None and w['port'] != 0:
+            code, body = send_http_request(w['host'], w['port'], 'POST', batch.PATH,
+                                           batch.build_request("put", [(k, v) for k, v, _ in node_items],
+                                                               versions=[v for _, _, v in node_items]),
+                                           BULK_TIMEOUT)
+            if code == 200:
+                replies = batch.parse_response(body)
+        if replies is None or len(replies) != len(node_items):
+            replies = [(500, None, None)] * len(node_items)
+        for (key, _, _), (status, _, _) in zip(node_items, replies):
+            if status not in WRITE_ACKS['PUT']:
+                failed.add(key)
+    copied = [(key, version) for key, version, _ in found if key not in failed]
+    migration.add(keys_copied=sum(1 for key, _, targets in found if targets and key not in failed),
+                  bytes_copied=size, errors=len(failed))
+    return copied, large
+
+def migrate_key(migration, source, key, targets):
+    try:
+        move_key(migration, source, key, targets)
+    except Exception as e:
+        print(f"[MASTER] Перебалансировка: ошибка переноса {key!r}: {e}")
+        migration.add(errors=1)
+
+def move_key(migration, source, key, targets):
+    """Копирует ключ на ноды targets и удаляет его с источника.
+
+    Копия получает версию источника (floor для ключа без версии): если у
+    нового владельца уже есть запись новее, он ответит 409. Источник
+    удаляет ключ, только если тот не перезаписан после чтения.
+    """
+    nodes = [workers.get(node_id) for node_id in targets]
+    if any(w is None or w['port'] == 0 for w in nodes):
+        raise RuntimeError("новый владелец уже неактивен")
+    path = worker_path(key)
+    up = open_upstream(source['host'], source['port'], 'GET', path)
+    if up.code != 200:
+        discard_upstream(up)
+        return
+    version = response_version(up.headers)
+    if not nodes:
+        discard_upstream(up)
+    else:
+        length = up.stream.length or 0
+        rebalance_throttle.wait(length * len(nodes))
+        try:
+            body = spool_body(up.stream)
+        except BaseException:
+            up.close(False)
+            raise
+        up.close()
+        try:
+            for node in nodes:
+                reply = open_upstream(node['host'], node['port'], 'PUT', path, body,
+                                      headers={VERSION_HEADER: version or migration.floor})
+                reply.read_all()
+                if reply.code not in WRITE_ACKS['PUT']:
+                    raise RuntimeError(f"нода {node['id']} ответила {reply.code}")
+        finally:
+            if isinstance(body, httputil.SpooledBody):
+                body.close()
+        migration.add(keys_copied=1, bytes_copied=length * len(nodes))
+    reply = open_upstream(source['host'], source['port'], 'DELETE', path,
+                          headers={DROP_HEADER: version})
+    reply.read_all()
+    if reply.code in (200, 404):
+        migration.add(keys_dropped=1)
+
+def rebalance_status():
+    with rebalance_cond:
+        pending = list(migrations)
+        last = last_migration
+        fallbacks = fallback_reads
+    return {
+        "active": bool(pending),
+        "pending": len(pending),
+        "rate_mb_s": rebalance_throttle.rate / 1024 / 1024,
+        "fallback_reads": fallbacks,
+        "current": pending[0].progress() if pending else None,
+        "last": last.progress() if last is not None else None,
+    }
 
-        if path.startswith('/node/') and len(path.split('/')) == 3:
-            node_id_str = path.split('/')[2]
-            if method == 'PUT' and node_id_str.isdigit():
-                handle_create_node(conn, int(node_id_str), data)
+# --- Защита от перегрузки ---
+# Одинаковые GET ключа, пришедшие, пока первый ещё ждёт ноду, получают его
+# ответ (single flight). К каждой ноде идёт не больше node_limit запросов
+# клиентов сразу, остальные ждут в ограниченной очереди, а при полной
+# очереди сразу получают 503 с Retry-After. Соединения сверх
+# max_connections и запросы клиента сверх --client-rate тоже отклоняются
+# сразу, не занимая потоков и памяти.
+
+def node_limiter(node):
+    """Слоты ноды или None, если запросы к нодам не ограничены."""
+    if not node_limit:
+        return None
+    addr = (node['host'], node['port'])
+    limiter = node_limiters.get(addr)
+    if limiter is None:
+        with node_limiters_lock:
+            limiter = node_limiters.get(addr)
+            if limiter is None:
+                limiter = node_limiter_class(node_limit, node_queue, queue_timeout)
+                node_limiters[addr] = limiter
+    return limiter
+
+def reject(code, reason, message, retry):
+    """Ответ на запрос, отклонённый без обращения к нодам."""
+    metrics.REJECTED.inc(reason)
+    return code, message, "text/plain", {"Retry-After": admission.retry_after(retry)}
+
+def rate_limited(client, req):
+    """429, если клиент исчерпал --client-rate, иначе None. Ограничиваются только /storage."""
+    if client_limiter is None or not req.path.startswith("/storage"):
+        return None
+    wait = client_limiter.take(client)
+    if not wait:
+        return None
+    return reject(429, "rate_limit", b"Too Many Requests", wait)
+
+def busy_response():
+    """503 для соединения сверх max_connections."""
+    metrics.REJECTED.inc("connections")
+    body = b"Too many connections"
+    return httputil.response_head(503, len(body), "text/plain", False,
+                                  {"Retry-After": admission.retry_after(1)}) + body
+
+def reject_connection(conn):
+    """Отвечает 503 и закрывает соединение в потоке приёма, не заводя своего."""
+    try:
+        conn.setblocking(False)
+        # Непрочитанный запрос превратил бы close в RST, и клиент не увидел бы ответа
+        conn.recv(httputil.RECV_SIZE)
+    except OSError:
+        pass
+    try:
+        conn.send(busy_response())
+    except OSError:
+        pass
+    conn.close()
+
+def serve_client(conn, addr):
+    """handle_client в слоте соединения."""
+    try:
+        handle_client(conn, addr)
+    finally:
+        connection_slots.release()
+
+def release_after(limiter, reply):
+    """Освобождает слот ноды; для потокового тела — когда оно отправлено клиенту."""
+    body = reply[1] if reply is not None else None
+    if not isinstance(body, httputil.StreamBody):
+        limiter.release()
+        return
+    close = body.on_close
+
+    def on_close(completed):
+        try:
+            if close is not None:
+                close(completed)
+        finally:
+            limiter.release()
+    body.on_close = on_close
+
+def shared_reply(reply):
+    """Ответ ведущего GET, который можно отдать ждущим: с телом, прочитанным целиком."""
+    if reply is None or isinstance(reply[1], httputil.StreamBody):
+        return None
+    return reply
+
+def admitted(node, handler, *args):
+    """handler(*args) в слоте ноды; без свободного слота и места в очереди — 503."""
+    limiter = node_limiter(node)
+    if limiter is None:
+        return handler(*args)
+    try:
+        limiter.acquire()
+    except admission.Overloaded as e:
+        return reject(503, "node_queue", b"Worker overloaded", e.retry_after)
+    reply = None
+    try:
+        reply = handler(*args)
+    finally:
+        release_after(limiter, reply)
+    return reply
+
+def coalesced_get(key, node, nodes):
+    """GET через single flight: пока идёт запрос ключа к нодам, такие же GET ждут его ответа.
+
+    Ведущий читает целиком тело до coalesce_limit; более длинное идёт ему
+    потоком, а ждущие обращаются к нодам сами.
+    """
+    flight, leader = flights.join(key)
+    if not leader:
+        reply = flight.wait()
+        if reply is not None:
+            metrics.COALESCED.inc()
+            return reply
+        return admitted(node, key_request, 'GET', key, node, nodes)
+    reply = None
+    try:
+        reply = admitted(node, key_request, 'GET', key, node, nodes, b"", None,
+                         max(cache_entry_limit(), coalesce_limit))
+        return reply
+    finally:
+        flights.finish(key, flight, shared_reply(reply))
+
+def handle_client(conn, addr):
+    """Обслуживает соединение клиента: несколько запросов подряд (keep-alive)."""
+    buf = bytearray()
+    conn.settimeout(httputil.KEEPALIVE_TIMEOUT)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        while True:
+            try:
+                req = httputil.read_request(conn, buf)
+            except httputil.BadRequest as e:
+                httputil.send_response(conn, 400, str(e).encode('latin1'))
                 return
-            elif method == 'DELETE' and node_id_str.isdigit():
-                handle_delete_node(conn, int(node_id_str))
+            if req is None:
+                return
+            start = metrics.request_started()
+            code, sent = 500, 0
+            try:
+                try:
+                    reply = rate_limited(addr[0], req) or handle_request(req)
+                    if req.method == 'HEAD':
+                        reply = httputil.without_body(*reply)
+                    code, body, content_type, *headers = reply
+                except Exception as e:
+                    logs.write("error", str(e), method=req.method, path=req.path)
+                    code = 500
+                    sent = httputil.send_response(conn, 500, b"Internal Error")
+                    return
+                # Недочитанное тело запроса не даёт разобрать следующий
+                keep_alive = req.keep_alive and req.stream.done
+                sent = httputil.send_response(conn, code, body, content_type, keep_alive,
+                                              *headers)
+            finally:
+                logs.request(req, code, sent, metrics.request_finished(req, code, sent, start))
+            if not keep_alive:
                 return
+    except (socket.timeout, ConnectionError):
+        pass
+    except Exception as e:
+        logs.write("error", str(e))
+    finally:
+        conn.close()
 
-        # --- Хранилище (ШАРДИРОВАНИЕ) ---
-        if not (path == "/storage" or path.startswith("/storage/")):
-            send_response(conn, 400, b"Use /storage or /storage/<key>")
-            return
+def handle_request(req):
+    """Обрабатывает один запрос.
 
-        # Для /storage (получение всех ключей) пока оставим выбор первой ноды
-        # или можно реализовать объединение ключей со всех нод, но это дорого.
-        # Пусть будет с первой активной.
-        key = path[len('/storage/'):] if path.startswith('/storage/') else ""
+    Возвращает (код, тело, Content-Type) или (код, тело, Content-Type, заголовки).
+    """
+    method, path = req.method, req.path
 
-        if key == "":
-            # GET /storage - получить все ключи (с одной ноды)
-            active_workers = get_active_workers()
-            if not active_workers:
-                send_response(conn, 503, b"No workers available")
-                return
-            w = active_workers[0]
-            code, body = send_http_request(w['host'], w['port'], 'GET', "/storage")
-            if code == 200:
-                send_response(conn, 200, body, "application/json")
-            else:
-                send_response(conn, 500, b"Failed to fetch keys")
-            return
+    if control_request(req):
+        return forward_control(req)
 
-        # Для конкретного ключа используем шардирование
-        target_node_info = get_target_node(key)
-        if not target_node_info:
-            send_response(conn, 503, b"No workers available")
-            return
+    # --- Регистрация ноды ---
+    if path == "/register" and method == "POST":
+        try:
+            payload = json.loads(req.body.decode('utf-8'))
+            node_id = payload.get("id")
+            port = payload.get("port")
+            if not isinstance(node_id, int) or not isinstance(port, int):
+                return 400, b"Invalid id or port", "text/plain"
+            with workers_lock:
+                if node_id in workers:
+                    w = workers[node_id]
+                    if w.get("removed"):
+                        # Нода удалена через DELETE /node: сама она в кольцо не вернётся
+                        return 410, b"Node was removed", "text/plain"
+                    if w["port"] != port:
+                        w["port"] = port
+                        record_change({"op": "node", "node": dict(w)})
+                        rebuild_ring()
+                    print(f"[MASTER] Нода {node_id} зарегистрирована на порту {port}")
+                else:
+                    print(f"[MASTER] Нода {node_id} не создана через PUT /node/{node_id}")
+                    return 404, b"Node not pre-registered", "text/plain"
+            membership_changed()
+            return 200, b"OK", "text/plain"
+        except Exception as e:
+            print(f"[MASTER] Ошибка регистрации: {e}")
+            return 400, b"Bad Request", "text/plain"
 
-        host, port = target_node_info['host'], target_node_info['port']
-        encoded_key = urllib.parse.quote(key, safe='')
+    # --- Статистика ---
+    if path == "/stats" and method == "GET":
+        stats = {"cache": value_cache.stats() if value_cache is not None else None}
+        if replicas > 1:
+            stats["replication"] = dict(replication_stats, replicas=replicas,
+                                        write_quorum=write_quorum, read_quorum=read_quorum)
+        return 200, json.dumps(stats).encode('utf-8'), "application/json"
 
+    # --- Карта кластера для прямых запросов к нодам ---
+    if path == "/cluster" and method == "GET":
+        return 200, json.dumps(cluster_map()).encode('utf-8'), "application/json"
+
+    # --- Доступность нод ---
+    if path == "/health" and method == "GET":
+        return 200, json.dumps(health_status()).encode('utf-8'), "application/json"
+
+    # --- Метрики ---
+    if path == metrics.PATH and method == "GET":
+        return 200, metrics.render(), metrics.CONTENT_TYPE
+
+    # --- Ход перебалансировки ---
+    if path == "/rebalance" and method == "GET":
+        return 200, json.dumps(rebalance_status()).encode('utf-8'), "application/json"
+
+    # --- Управление нодами ---
+    if path == "/node" and method == "GET":
+        with workers_lock:
+            names = [w["name"] for w in workers.values()]
+        response_body = json.dumps(names, ensure_ascii=False).encode('utf-8')
+        return 200, response_body, "application/json"
+
+    if path.startswith('/node/') and len(path.split('/')) == 3:
+        node_id_str = path.split('/')[2]
+        if method == 'PUT' and node_id_str.isdigit():
+            return handle_create_node(int(node_id_str), req.body)
+        elif method == 'DELETE' and node_id_str.isdigit():
+            return handle_delete_node(int(node_id_str))
+
+    # --- Хранилище (ШАРДИРОВАНИЕ) ---
+    if not (path == "/storage" or path.startswith("/storage/")):
+        return 400, b"Use /storage or /storage/<key>", "text/plain"
+
+    if path == batch.PATH and method == 'POST':
+        return handle_batch(req.body)
+
+    key = path[len('/storage/'):] if path.startswith('/storage/') else ""
+    if key == "":
+        if method != 'GET':
+            return 405, b"Method Not Allowed", "text/plain"
+        # GET /storage - ключи всех нод, слитые в один отсортированный поток
+        return handle_list(req.query)
+
+    if method not in ('PUT', 'GET', 'HEAD', 'DELETE'):
+        return 405, b"Method Not Allowed", "text/plain"
+    # Для конкретного ключа используем шардирование
+    start = time.perf_counter()
+    target_node_info, nodes = route_key(key)
+    metrics.ROUTE.since(start)
+    if not target_node_info:
+        return 503, b"No workers available", "text/plain"
+    if nodes is not None and len(nodes) < replica_quorum(method):
+        return 503, b"Not enough replicas for quorum", "text/plain"
+    if direct(req, key, nodes, target_node_info):
+        return admitted(target_node_info, direct_get, req, key, target_node_info)
+
+    try:
+        encoding = put_encoding(req) if method == 'PUT' else None
+    except ValueError:
+        return 415, b"Unsupported Content-Encoding", "text/plain"
+    if method == 'GET':
+        if value_cache is not None:
+            value = value_cache.get(key)
+            if value is not None:
+                return 200, value, "application/octet-stream"
+        if flights is not None:
+            return coalesced_get(key, target_node_info, nodes)
+    return admitted(target_node_info, key_request, method, key, target_node_info, nodes,
+                    req.stream, encoding)
+
+def key_request(method, key, node, nodes, body=b"", encoding=None, buffer_limit=None):
+    """Запрос с ключом к нодам: через кэш, реплики и прежних владельцев при переносе.
+
+    buffer_limit — тело ответа на GET не длиннее читается целиком, а не
+    потоком; по умолчанию — предел записи кэша.
+    """
+    if buffer_limit is None:
+        buffer_limit = cache_entry_limit()
+    reading = method in ('GET', 'HEAD')
+    # Ответ на HEAD не содержит значения: кэш он не заполняет и не сбрасывает
+    cached = value_cache is not None and method != 'HEAD'
+    token = None
+    if cached:
+        if method == 'GET':
+            token = value_cache.begin_read(key)
+        else:
+            token = value_cache.begin_write(key)
+            if method == 'PUT' and body.length is not None and body.length <= value_cache.max_entry:
+                body = body.read_all()
+    fallback = fallback_nodes(key, nodes or [node]) if reading else None
+    if nodes is not None:
         if method == 'PUT':
-            body_start = data.find(b'\r\n\r\n') + 4
-            body = data[body_start:] if body_start > 3 else b""
-            code, _ = send_http_request(host, port, 'PUT', f"/storage/{encoded_key}", body)
-            if code == 201:
-                send_response(conn, 201, b"OK")
-            else:
-                send_response(conn, 500, b"Failed to store key")
+            body = spool_body(body)
+        code, response_body = replicated_request(method, key, nodes, body, buffer_limit,
+                                                 fallback, encoding)
+    elif fallback:
+        code, response_body = migrating_get(key, node, fallback, buffer_limit, method=method)
+    else:
+        code, response_body = send_http_request(node['host'], node['port'], method,
+                                                worker_path(key), body, stream=method == 'GET',
+                                                buffer_limit=buffer_limit,
+                                                headers=write_headers(encoding)
+                                                if not reading else None)
+    if cached:
+        # Сжатое тело в кэш не попадает: там значения несжатые
+        cache_finish(method, key, token, None if encoding else body, code, response_body)
+    if not reading and flights is not None:
+        flights.forget(key)
+    return proxy_response(method, code, response_body)
 
-        elif method == 'GET':
-            code, body = send_http_request(host, port, 'GET', f"/storage/{encoded_key}")
-            if code == 200:
-                send_response(conn, 200, body, "application/octet-stream")
-            elif code == 404:
-                send_response(conn, 404, b"Key not found")
+def handle_batch(body):
+    """POST /storage/_batch: MGET / MPUT / MDELETE.
+
+    Ключи группируются по нодам-владельцам (с репликацией — по всем
+    репликам), каждой ноде уходит один подзапрос, и все подзапросы
+    выполняются параллельно.
+    """
+    try:
+        op, items, encoding, _, max_value = batch.parse_request(body)
+    except ValueError as e:
+        return 400, str(e).encode('utf-8'), "text/plain"
+    if op not in batch.CLIENT_OPS:
+        return 400, b"Unknown op", "text/plain"
+    results, tokens, replies, calls, fallbacks = batch_plan(op, items, max_value)
+    batch_send(calls, replies)
+    if fallbacks:
+        batch_fallback(items, results, replies, fallbacks, max_value)
+    return batch_finish(op, items, results, tokens, replies, encoding)
+
+def batch_send(calls, replies):
+    """Выполняет подзапросы параллельно и раскладывает ответы нод по позициям."""
+    futures = [(idxs, batch_executor.submit(send_http_request, node['host'], node['port'],
+                                            'POST', batch.PATH, sub_body, BULK_TIMEOUT))
+               for idxs, node, sub_body in calls[1:]]
+    # Первый подзапрос выполняем сами, не занимая лишний поток
+    if calls:
+        idxs, node, sub_body = calls[0]
+        code, response_body = send_http_request(node['host'], node['port'], 'POST', batch.PATH,
+                                                sub_body, BULK_TIMEOUT)
+        batch_merge(replies, idxs, code, response_body)
+    for idxs, future in futures:
+        code, response_body = future.result()
+        batch_merge(replies, idxs, code, response_body)
+
+def batch_fallback(items, results, replies, fallbacks, max_value):
+    """Пакетный get во время переноса — как migrating_get для каждого ключа.
+
+    Ключи, которых нет у новых владельцев (и нет надгробия), читаются у
+    прежних по порядку; не найденные нигде перечитываются у новых.
+    """
+    missing = batch_missing(results, replies, fallbacks)
+    if not missing:
+        return
+    count_fallback(len(missing))
+    level = 0
+    while True:
+        calls = batch_fallback_calls(items, missing, fallbacks, level, max_value)
+        if not calls:
+            break
+        found = [[] for _ in items]
+        batch_send(calls, found)
+        missing = batch_found(results, found, missing)
+        level += 1
+    if missing:
+        # Ключ могли перенести между двумя чтениями: он уже у нового владельца
+        batch_send(batch_reread(items, replies, missing, fallbacks, max_value), replies)
+
+def batch_plan(op, items, max_value=None):
+    """Раскладывает пакет по нодам. max_value — из запроса get, передаётся нодам.
+
+    Возвращает (results, tokens, replies, calls, fallbacks): в results уже
+    заполнены ответы, известные без нод (попадание в кэш, нет нод для
+    кворума); tokens — токены кэша по позициям; replies — пустые списки
+    для ответов нод по позициям; calls — [(позиции, нода, тело подзапроса)];
+    fallbacks — {позиция: (ноды, прежние владельцы)} для get во время переноса.
+    """
+    results = [None] * len(items)
+    tokens = [None] * len(items)
+    replies = [[] for _ in items]
+    versions = [None] * len(items) if (replicas > 1 or migrations) and op != "get" else None
+    fallbacks = {}
+    groups = {}
+    for i, (key, _) in enumerate(items):
+        if value_cache is not None:
+            if op == "get":
+                value = value_cache.get(key)
+                if value is not None:
+                    too_large = max_value is not None and len(value) > max_value
+                    results[i] = (413, None, None) if too_large else (200, value, None)
+                    continue
+                tokens[i] = value_cache.begin_read(key)
             else:
-                send_response(conn, 500, b"Failed to retrieve key")
+                tokens[i] = value_cache.begin_write(key)
+        node, nodes = route_key(key)
+        if nodes is None:
+            nodes = [node] if node is not None else []
+        elif len(nodes) < replica_quorum('GET' if op == "get" else 'PUT'):
+            nodes = []
+        if not nodes:
+            results[i] = (503, None, None)
+            continue
+        if versions is not None:
+            versions[i] = next_version()
+        if op == "get":
+            fallback = fallback_nodes(key, nodes)
+            if fallback:
+                fallbacks[i] = (nodes, fallback)
+        for node in nodes:
+            groups.setdefault(node['id'], (node, []))[1].append(i)
+    return results, tokens, replies, batch_calls(op, items, groups, versions, max_value), fallbacks
 
-        elif method == 'DELETE':
-            code, _ = send_http_request(host, port, 'DELETE', f"/storage/{encoded_key}")
-            if code == 200:
-                send_response(conn, 200, b"Deleted")
-            elif code == 404:
-                send_response(conn, 404, b"Key not found")
+def batch_calls(op, items, groups, versions=None, max_value=None):
+    """Подзапросы [(позиции, нода, тело)] по группам {id ноды: (нода, позиции)}."""
+    calls = []
+    for node, idxs in groups.values():
+        sub_versions = [versions[i] for i in idxs] if versions is not None else None
+        calls.append((idxs, node, batch.build_request(op, [items[i] for i in idxs],
+                                                      versions=sub_versions,
+                                                      max_value=max_value)))
+    return calls
+
+def batch_missing(results, replies, fallbacks):
+    """Позиции get, которых нет у новых владельцев: ни значения, ни надгробия."""
+    missing = []
+    for i in fallbacks:
+        if results[i] is None:
+            status, _, version = batch_reduce("get", replies[i])
+            if status == 404 and not version:
+                missing.append(i)
+    return missing
+
+def batch_fallback_calls(items, missing, fallbacks, level, max_value):
+    """Подзапросы к прежнему владельцу номер level для каждого ненайденного ключа."""
+    groups = {}
+    for i in missing:
+        old = fallbacks[i][1]
+        if level < len(old):
+            groups.setdefault(old[level]['id'], (old[level], []))[1].append(i)
+    return batch_calls("get", items, groups, max_value=max_value)
+
+def batch_found(results, found, missing):
+    """Записывает в results ключи, найденные у прежних владельцев; возвращает остальные."""
+    rest = []
+    for i in missing:
+        if found[i] and found[i][0][0] in (200, 413):
+            results[i] = found[i][0]
+        else:
+            rest.append(i)
+    return rest
+
+def batch_reread(items, replies, missing, fallbacks, max_value):
+    """Подзапросы, перечитывающие ненайденные ключи у новых владельцев."""
+    groups = {}
+    for i in missing:
+        replies[i] = []
+        for node in fallbacks[i][0]:
+            groups.setdefault(node['id'], (node, []))[1].append(i)
+    return batch_calls("get", items, groups, max_value=max_value)
+
+def batch_merge(replies, idxs, code, body):
+    """Раскладывает ответ ноды по позициям пакета; при сбое ноды — 500 на каждый её ключ."""
+    sub = None
+    if code == 200:
+        try:
+            sub = batch.parse_response(body)
+        except (ValueError, KeyError, TypeError):
+            sub = None
+    if sub is None or len(sub) != len(idxs):
+        sub = [(500, None, None)] * len(idxs)
+    for i, result in zip(idxs, sub):
+        replies[i].append(result)
+
+def batch_reduce(op, replies):
+    """Сводит ответы реплик на один ключ пакета в один результат.
+
+    Пакет ждёт все реплики: без раннего ответа по кворуму и без дублирования чтений.
+    """
+    if replicas == 1:
+        return replies[0]
+    if op == "get":
+        answers = [r for r in replies if r[0] in (200, 404, 413)]
+        if len(answers) < read_quorum:
+            return 500, None, None
+        return max(answers, key=lambda r: (r[2] or 0, r[0] == 200))
+    acks = [r for r in replies if r[0] in WRITE_ACKS['PUT' if op == "put" else 'DELETE']]
+    if len(acks) < write_quorum:
+        if all(r[0] == 400 for r in replies):
+            return 400, None, None
+        return 500, None, None
+    version = max(r[2] or 0 for r in acks)
+    return write_result('PUT' if op == "put" else 'DELETE', [r[0] for r in acks]), None, version
+
+def batch_finish(op, items, results, tokens, replies, encoding):
+    for i, result in enumerate(results):
+        if result is None:
+            results[i] = batch_reduce(op, replies[i])
+    if value_cache is not None:
+        for (key, value), (status, received, _), token in zip(items, results, tokens):
+            if token is None:
+                continue
+            if op == "get":
+                if status == 200:
+                    value_cache.finish_read(key, received, token)
             else:
-                send_response(conn, 500, b"Failed to delete key")
+                value_cache.finish_write(key, value if op == "put" and status == 201 else None,
+                                         token)
+    if op != "get" and flights is not None:
+        for key, _ in items:
+            flights.forget(key)
+    return 200, batch.build_response(items, results, encoding), "application/json"
+
+def cache_entry_limit():
+    return value_cache.max_entry if value_cache is not None else 0
+
+def cache_finish(method, key, token, sent, code, received):
+    """Сквозная запись в кэш после ответа ноды."""
+    if method == 'GET':
+        if code == 200 and isinstance(received, bytes):
+            value_cache.finish_read(key, received, token)
+    elif method == 'PUT' and code == 201 and isinstance(sent, bytes):
+        value_cache.finish_write(key, sent, token)
+    else:
+        value_cache.finish_write(key, None, token)
+
+def list_request(query):
+    """Разбирает параметры списка. Возвращает (ноды, путь, limit) или готовый ответ с ошибкой."""
+    try:
+        prefix, cursor, limit = listing.parse_params(query)
+    except ValueError as e:
+        return None, (400, str(e).encode('utf-8'), "text/plain")
+    active = get_active_workers()
+    if replicas > 1:
+        # Ключи недоступной ноды есть на других репликах
+        active = [w for w in active if not node_down(w)]
+    if not active:
+        return None, (503, b"No workers available", "text/plain")
+    # Ключи, ещё не перенесённые с ушедшей ноды, тоже попадают в список
+    with rebalance_cond:
+        pending = list(migrations)
+    for migration in pending:
+        for node in migration.sources.values():
+            if all(w['id'] != node['id'] for w in active):
+                active.append(node)
+    return (active, "/storage" + listing.query_string(prefix, cursor, limit), limit), None
+
+def handle_list(query):
+    """GET /storage: scatter-gather по всем нодам.
+
+    Каждой ноде уходит тот же запрос, её отсортированный поток читается
+    по мере слияния, поэтому память мастера не зависит от числа ключей.
+    """
+    params, error = list_request(query)
+    if error:
+        return error
+    active, path, limit = params
+    futures = [batch_executor.submit(open_upstream, w['host'], w['port'], 'GET', path, b"",
+                                     BULK_TIMEOUT)
+               for w in active]
+    ups, failed = [], False
+    for future in futures:
+        try:
+            up = future.result()
+        except Exception as e:
+            print(f"[MASTER] Ошибка получения списка ключей: {e}")
+            failed = True
+            continue
+        ups.append(up)
+        failed = failed or up.code != 200
+    if failed:
+        for up in ups:
+            up.close(False)
+        return 500, b"Failed to fetch keys", "text/plain"
+
+    def close(completed):
+        for up in ups:
+            up.close(completed)
+
+    streams = [listing.iter_records(up.stream.chunks()) for up in ups]
+    lines = listing.encode(listing.merge(streams, limit))
+    return 200, httputil.StreamBody(lines, None, close), listing.CONTENT_TYPE
+
+# --- Диапазоны (Range) и сжатие (Accept-Encoding) ---
+# GET с Range или Accept-Encoding читается с единственного владельца ключа:
+# заголовки уходят ноде, а её Content-Range и Content-Encoding — клиенту.
+# Через мастер проходит только запрошенная часть, а сжатое значение — без
+# распаковки. Так же идёт GET с If-None-Match: нода отвечает 304 по ETag
+# из своего индекса, не открывая значение. С репликацией и во время
+# переноса эти заголовки не учитываются и отдаётся всё значение без
+# сжатия — RFC 9110 это разрешает. В кэше мастера значения несжатые.
+
+DIRECT_REQUEST_HEADERS = (("range", "Range"), ("accept-encoding", "Accept-Encoding"),
+                          ("if-none-match", "If-None-Match"))
+DIRECT_REPLY_HEADERS = (("content-range", "Content-Range"),
+                        ("content-encoding", "Content-Encoding"), ("vary", "Vary"),
+                        ("etag", "ETag"), ("last-modified", "Last-Modified"))
+
+def direct(req, key, nodes, node):
+    """Запрос идёт единственному владельцу как есть: HEAD или GET с заголовками для ноды."""
+    return (nodes is None
+            and (req.method == 'HEAD' or req.method == 'GET'
+                 and any(lower in req.headers for lower, _ in DIRECT_REQUEST_HEADERS))
+            and not fallback_nodes(key, [node]))
+
+def pick_headers(headers, names):
+    return {name: headers[lower] for lower, name in names if lower in headers}
+
+def range_response(value, byte_range):
+    """Ответ на GET с Range по значению из кэша."""
+    try:
+        part = httputil.parse_range(byte_range, len(value))
+    except httputil.RangeNotSatisfiable:
+        return (416, b"Range Not Satisfiable", "text/plain",
+                {"Content-Range": httputil.content_range(None, 0, len(value))})
+    if part is None:
+        return 200, value, "application/octet-stream"
+    start, length = part
+    return (206, value[start:start + length], "application/octet-stream",
+            {"Content-Range": httputil.content_range(start, length, len(value))})
+
+def direct_cached(key, byte_range, conditional=False):
+    """(ответ из кэша или None, токен заполнения кэша или None).
+
+    ETag в кэше нет, поэтому условный GET (conditional) идёт к ноде.
+    """
+    value = None if conditional else value_cache.get(key)
+    if value is not None:
+        if byte_range is None:
+            return (200, value, "application/octet-stream"), None
+        return range_response(value, byte_range), None
+    # Заполняется только значением целиком и без сжатия
+    return None, value_cache.begin_read(key) if byte_range is None else None
+
+def direct_reply(key, token, code, body, headers):
+    reply = pick_headers(headers, DIRECT_REPLY_HEADERS) or None
+    if code in (200, 206):
+        if token is not None and code == 200 and "content-encoding" not in headers:
+            cache_finish('GET', key, token, None, code, body)
+        return code, body, "application/octet-stream", reply
+    if code == 416:
+        return code, body, "text/plain", reply
+    if code == 304:
+        return code, httputil.HeadBody(), "application/octet-stream", reply
+    return proxy_response('GET', code, body)
+
+def direct_get(req, key, node):
+    """GET или HEAD владельцу; ETag, Last-Modified, Content-Range и 304 передаются клиенту."""
+    token = None
+    # В кэше нет ETag, поэтому HEAD, как и условный GET, идёт к ноде
+    if value_cache is not None and req.method == 'GET':
+        cached, token = direct_cached(key, req.headers.get("range"),
+                                      "if-none-match" in req.headers)
+        if cached is not None:
+            return cached
+    try:
+        up = open_upstream(node['host'], node['port'], req.method, worker_path(key),
+                           headers=pick_headers(req.headers, DIRECT_REQUEST_HEADERS))
+        code, body = upstream_reply(up, cache_entry_limit() if token is not None else 0)
+    except Exception as e:
+        logs.write("warning", "upstream error", node=f"{node['host']}:{node['port']}", error=str(e))
+        return proxy_response('GET', 500, b"")
+    if req.method == 'HEAD':
+        body = head_body(up.headers)
+    return direct_reply(key, token, code, body, up.headers)
+
+def put_encoding(req):
+    """Заголовок Content-Encoding PUT-запроса для нод; None — тело не сжато.
+
+    ValueError — кодек неизвестен нодам.
+    """
+    encoding = req.headers.get("content-encoding")
+    if encoding is None or encoding.strip().lower() == "identity":
+        return None
+    if compress.by_token(encoding) is None:
+        raise ValueError(f"unsupported Content-Encoding {encoding}")
+    return {"Content-Encoding": encoding}
+
+def worker_path(key):
+    return f"/storage/{urllib.parse.quote(key, safe='')}"
+
+def proxy_response(method, code, body):
+    """Переводит ответ ноды на операцию с ключом в ответ клиенту."""
+    if method == 'PUT':
+        if code == 201:
+            return 201, b"OK", "text/plain"
+        return 500, b"Failed to store key", "text/plain"
+    elif method in ('GET', 'HEAD'):
+        if code == 200 and method == 'HEAD':
+            # Вместо тела — заголовки ответа ноды (head_reply)
+            return (200, head_body(body), "application/octet-stream",
+                    pick_headers(body, DIRECT_REPLY_HEADERS) or None)
+        if code == 200:
+            return 200, body, "application/octet-stream"
+        elif code == 404:
+            return 404, b"Key not found", "text/plain"
+        return 500, b"Failed to retrieve key", "text/plain"
+    else:
+        if code == 200:
+            return 200, b"Deleted", "text/plain"
+        elif code == 404:
+            return 404, b"Key not found", "text/plain"
+        return 500, b"Failed to delete key", "text/plain"
+
+# --- asyncio-режим ---
+# Соединения и ответы обслуживает event loop; запросы к нодам идут через
+# неблокирующий пул. Остальные маршруты (/register, /node, /stats...)
+# обрабатывает синхронный handle_request в отдельном потоке: запись
+# метаданных с fsync и рассылка снимка процессам не держат event loop.
+
+def get_async_pool(host, port):
+    p = async_pools.get((host, port))
+    if p is None:
+        p = pool.AsyncConnectionPool(host, port, max(pool_size, 1))
+        async_pools[(host, port)] = p
+    return p
+
+def close_async_pool(host, port):
+    """Закрывает пул удалённой ноды. Вызывается в потоке event loop."""
+    p = async_pools.pop((host, port), None)
+    if p is not None:
+        p.close()
+
+class AsyncUpstream:
+    """Upstream для asyncio-режима."""
+
+    def __init__(self, pool_, reader, writer, code, headers, stream):
+        self.pool = pool_
+        self.reader = reader
+        self.writer = writer
+        self.code = code
+        self.headers = headers
+        self.stream = stream
+        self.timeout = None
+
+    async def read_all(self):
+        try:
+            body = await self.stream.read_all()
+        except BaseException:
+            self.close(False)
+            raise
+        self.close()
+        return body
+
+    def close(self, completed=True):
+        reusable = (completed and self.stream.done
+                    and self.headers.get("connection", "").lower() != "close")
+        if self.pool is not None:
+            self.pool.release(self.reader, self.writer, reusable)
+        else:
+            self.writer.close()
 
+async def _send_upstream_async(writer, method, path, host, body, keep_alive, headers=None):
+    if isinstance(body, bytes):
+        writer.writelines([httputil.request_head(method, path, host, len(body),
+                                                 keep_alive=keep_alive, headers=headers), body])
+        await writer.drain()
+        return
+    writer.write(httputil.request_head(method, path, host, body.length, keep_alive=keep_alive,
+                                       headers=headers))
+    chunked = body.length is None
+    chunks = body.chunks()
+    if hasattr(chunks, "__aiter__"):
+        async for chunk in chunks:
+            writer.write(httputil.encode_chunk(chunk) if chunked else chunk)
+            await writer.drain()
+    else:
+        # SpooledBody: читается из временного файла
+        for chunk in chunks:
+            writer.write(httputil.encode_chunk(chunk) if chunked else chunk)
+            await writer.drain()
+    if chunked:
+        writer.write(httputil.LAST_CHUNK)
+    await writer.drain()
+
+async def _exchange_async(reader, writer, method, path, host, body, keep_alive, timeout,
+                          headers=None):
+    # Таймаут не ограничивает передачу тела: многогигабайтный PUT идёт дольше
+    await _send_upstream_async(writer, method, path, host, body, keep_alive, headers)
+    async with asyncio.timeout(timeout):
+        return await httputil.read_response_head_async(reader, method == 'HEAD')
+
+async def open_upstream_async(host, port, method, path, body=b"", timeout=None, headers=None):
+    """Асинхронный open_upstream. Таймаут запроса сохраняется в AsyncUpstream.timeout."""
+    node, timeout, adaptive = upstream_health(host, port, timeout, body)
+    start = time.monotonic()
+    try:
+        up = await _open_upstream_async(host, port, method, path, body, timeout, headers)
+    except Exception as e:
+        node.failure(timeout if isinstance(e, TimeoutError) else None)
+        raise
+    node.success(time.monotonic() - start if adaptive else None)
+    up.timeout = timeout
+    return up
+
+async def _open_upstream_async(host, port, method, path, body, timeout, headers):
+    if not isinstance(body, bytes) and body.length is not None and body.length <= httputil.RECV_SIZE:
+        body = await body.read_all()
+    start = time.perf_counter()
+    if pool_size == 0:
+        async with asyncio.timeout(timeout):
+            reader, writer = await asyncio.open_connection(host, port)
+        start = upstream_stage(start, metrics.UPSTREAM_CONNECT)
+        try:
+            code, headers, stream = await _exchange_async(reader, writer, method, path, host,
+                                                          body, False, timeout, headers)
+        except BaseException:
+            writer.close()
+            raise
+        upstream_stage(start, metrics.UPSTREAM_TRANSFER)
+        return AsyncUpstream(None, reader, writer, code, headers, stream)
+
+    p = get_async_pool(host, port)
+    async with asyncio.timeout(timeout):
+        reader, writer, reused = await p.acquire()
+    start = upstream_stage(start, metrics.UPSTREAM_CONNECT)
+    try:
+        code, headers, stream = await _exchange_async(reader, writer, method, path, host,
+                                                      body, True, timeout, headers)
+    except OSError as e:
+        p.release(reader, writer, False)
+        if not reused or not isinstance(body, bytes) or isinstance(e, TimeoutError):
+            raise
+        # Нода успела закрыть соединение из пула — повторяем на новом
+        async with asyncio.timeout(timeout):
+            reader, writer, _ = await p.acquire(fresh=True)
+        try:
+            code, headers, stream = await _exchange_async(reader, writer, method, path, host,
+                                                          body, True, timeout, headers)
+        except BaseException:
+            p.release(reader, writer, False)
+            raise
+    except BaseException:
+        p.release(reader, writer, False)
+        raise
+    upstream_stage(start, metrics.UPSTREAM_TRANSFER)
+    return AsyncUpstream(p, reader, writer, code, headers, stream)
+
+async def direct_get_async(req, key, node):
+    """Асинхронный direct_get."""
+    token = None
+    if value_cache is not None and req.method == 'GET':
+        cached, token = direct_cached(key, req.headers.get("range"),
+                                      "if-none-match" in req.headers)
+        if cached is not None:
+            return cached
+    try:
+        up = await open_upstream_async(node['host'], node['port'], req.method, worker_path(key),
+                                       headers=pick_headers(req.headers, DIRECT_REQUEST_HEADERS))
+        code, body = await upstream_reply_async(up, cache_entry_limit() if token is not None else 0)
     except Exception as e:
-        print(f"[MASTER ERROR] {e}")
-        send_response(conn, 500, b"Internal Error")
+        logs.write("warning", "upstream error", node=f"{node['host']}:{node['port']}",
+                   error=repr(e))
+        return proxy_response('GET', 500, b"")
+    if req.method == 'HEAD':
+        body = head_body(up.headers)
+    return direct_reply(key, token, code, body, up.headers)
+
+async def send_http_request_async(host, port, method, path, body=b"", timeout=None,
+                                  stream=False, buffer_limit=0, headers=None):
+    """Асинхронный send_http_request."""
+    try:
+        up = await open_upstream_async(host, port, method, path, body, timeout, headers)
+        if method == 'HEAD':
+            return await head_reply_async(up)
+        if stream:
+            return await upstream_reply_async(up, buffer_limit)
+        async with asyncio.timeout(up.timeout):
+            return up.code, await up.read_all()
+    except Exception as e:
+        logs.write("warning", "upstream error", node=f"{host}:{port}", error=repr(e))
+        return 500, b""
+
+async def upstream_reply_async(up, buffer_limit):
+    if up.code in (200, 206) and not (up.stream.length is not None and up.stream.length <= buffer_limit):
+        return up.code, httputil.StreamBody(up.stream.chunks(), up.stream.length, up.close)
+    async with asyncio.timeout(up.timeout):
+        return up.code, await up.read_all()
+
+async def head_reply_async(up):
+    async with asyncio.timeout(up.timeout):
+        await up.read_all()
+    return up.code, up.headers
+
+# --- Репликация в asyncio-режиме ---
+
+# Сильные ссылки на фоновые задачи (дописывание реплик, восстановление):
+# event loop хранит только слабые
+background_tasks = set()
+
+def spawn(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def spool_body_async(stream):
+    """Асинхронный spool_body."""
+    if isinstance(stream, bytes):
+        return stream
+    if stream.length is not None and stream.length <= httputil.RECV_SIZE:
+        return await stream.read_all()
+    f = tempfile.TemporaryFile()
+    try:
+        async for chunk in stream.chunks():
+            f.write(chunk)
+        f.flush()
+    except BaseException:
+        f.close()
+        raise
+    body = httputil.SpooledBody(f, f.tell())
+    if body.length <= httputil.RECV_SIZE:
+        data = body.read_all()
+        body.close()
+        return data
+    return body
+
+async def close_after(tasks, body):
+    await asyncio.wait(tasks)
+    body.close()
+
+async def replicated_write_async(method, key, nodes, body, timeout=None, extra=None):
+    """Асинхронный replicated_write."""
+    headers = {VERSION_HEADER: next_version(), **(extra or {})}
+    path = worker_path(key)
+
+    async def write(node):
+        try:
+            up = await open_upstream_async(node['host'], node['port'], method, path, body,
+                                           timeout, headers)
+            async with asyncio.timeout(up.timeout):
+                await up.read_all()
+            return up.code
+        except Exception as e:
+            print(f"[MASTER] Ошибка записи на реплику ({node['host']}:{node['port']}): {e!r}")
+            return 500
+
+    tasks = [spawn(write(node)) for node in nodes]
+    if isinstance(body, httputil.SpooledBody):
+        spawn(close_after(tasks, body))
+    acks, failures = [], 0
+    for next_done in asyncio.as_completed(tasks):
+        code = await next_done
+        if code in WRITE_ACKS[method]:
+            acks.append(code)
+            if len(acks) >= write_quorum:
+                return write_result(method, acks), b""
+        else:
+            failures += 1
+            if failures > len(tasks) - write_quorum:
+                break
+    return 500, b""
+
+def close_late_upstream(task):
+    if not task.cancelled() and task.exception() is None:
+        task.result().close(False)
+
+async def discard_upstream_async(up):
+    if up.stream.length is not None and up.stream.length <= httputil.RECV_SIZE:
+        try:
+            await up.read_all()
+        except Exception:
+            pass
+    else:
+        up.close(False)
+
+async def replicated_get_async(key, nodes, buffer_limit, timeout=10, fallback=None,
+                               method='GET'):
+    """Асинхронный replicated_get."""
+    loop = asyncio.get_running_loop()
+    path = worker_path(key)
+    pending = {}
+
+    def start(node):
+        task = asyncio.ensure_future(open_upstream_async(node['host'], node['port'], method,
+                                                         path))
+        pending[task] = node
+
+    for node in nodes[:read_quorum]:
+        start(node)
+    spare = list(nodes[read_quorum:])
+    replies = []
+    deadline = loop.time() + timeout
+    try:
+        while len(replies) < read_quorum and pending:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            done, _ = await asyncio.wait(pending, timeout=min(hedge_delay, remaining) if spare
+                                         else remaining, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if spare:
+                    count_replication("hedged_reads")
+                    start(spare.pop(0))
+                continue
+            for task in done:
+                node = pending.pop(task)
+                error = task.exception()
+                if error is None and task.result().code in (200, 404):
+                    up = task.result()
+                    replies.append((response_version(up.headers), up.code == 200, node, up))
+                    continue
+                if error is None:
+                    await discard_upstream_async(task.result())
+                else:
+                    print(f"[MASTER] Ошибка чтения с реплики ({node['host']}:{node['port']}): "
+                          f"{error!r}")
+                if spare:
+                    start(spare.pop(0))
     finally:
-        conn.close()
+        for task in pending:
+            task.add_done_callback(close_late_upstream)
+    if len(replies) < read_quorum:
+        for _, _, _, up in replies:
+            up.close(False)
+        return 500, b""
 
-def handle_create_node(conn, node_id, raw_request):
-    body_start = raw_request.find(b'\r\n\r\n') + 4
+    replies.sort(key=lambda r: (r[0], r[1]), reverse=True)
+    version, found, _, winner = replies[0]
+    stale = [node for v, _, node, _ in replies[1:] if v < version]
+    for _, _, _, up in replies[1:]:
+        await discard_upstream_async(up)
+    if not found:
+        async with asyncio.timeout(timeout):
+            await winner.read_all()
+        if stale and version:
+            read_repair_async('DELETE', key, stale, version, b"")
+        if fallback and not version:
+            code, body = await fallback_get_async(key, fallback, buffer_limit, method)
+            if code == 404:
+                return await replicated_get_async(key, nodes, buffer_limit, timeout, method=method)
+            return code, body
+        return 404, b""
+    if method == 'HEAD':
+        return await head_reply_async(winner)
+    length = winner.stream.length
+    if length is not None and (length <= buffer_limit or (stale and length <= httputil.RECV_SIZE)):
+        async with asyncio.timeout(timeout):
+            value = await winner.read_all()
+        if stale:
+            read_repair_async('PUT', key, stale, version, value)
+        return 200, value
+    return 200, httputil.StreamBody(winner.stream.chunks(), length, winner.close)
+
+def read_repair_async(method, key, nodes, version, body):
+    count_replication("read_repairs")
+    headers = {VERSION_HEADER: version}
+    path = worker_path(key)
+
+    async def repair(node):
+        try:
+            up = await open_upstream_async(node['host'], node['port'], method, path, body,
+                                           headers=headers)
+            await up.read_all()
+        except Exception as e:
+            print(f"[MASTER] Ошибка восстановления реплики ({node['host']}:{node['port']}): {e!r}")
+
+    for node in nodes:
+        spawn(repair(node))
+
+async def replicated_request_async(method, key, nodes, body, buffer_limit, fallback=None,
+                                   extra=None):
+    """body PUT-запроса уже подготовлен spool_body_async."""
+    if method in ('GET', 'HEAD'):
+        return await replicated_get_async(key, nodes, buffer_limit, fallback=fallback,
+                                          method=method)
+    return await replicated_write_async(method, key, nodes, body, extra=extra)
+
+# Перенос ключей выполняет поток rebalancer и в asyncio-режиме; здесь —
+# только чтение у прежних владельцев.
+
+async def fallback_get_async(key, nodes, buffer_limit, method='GET'):
+    count_fallback()
+    for node in nodes:
+        code, body = await send_http_request_async(node['host'], node['port'], method,
+                                                   worker_path(key), stream=True,
+                                                   buffer_limit=buffer_limit)
+        if code == 200:
+            return code, body
+    return 404, b""
+
+async def migrating_get_async(key, node, fallback, buffer_limit, timeout=None, method='GET'):
+    """Асинхронный migrating_get."""
+    try:
+        up = await open_upstream_async(node['host'], node['port'], method, worker_path(key),
+                                       timeout=timeout)
+        if up.code == 404 and not response_version(up.headers):
+            await discard_upstream_async(up)
+            code, body = await fallback_get_async(key, fallback, buffer_limit, method)
+            if code == 404:
+                return await send_http_request_async(node['host'], node['port'], method,
+                                                     worker_path(key), timeout=timeout,
+                                                     stream=True, buffer_limit=buffer_limit)
+            return code, body
+        if method == 'HEAD':
+            return await head_reply_async(up)
+        return await upstream_reply_async(up, buffer_limit)
+    except Exception as e:
+        print(f"[MASTER] Ошибка при обращении к ноде ({node['host']}:{node['port']}): {e!r}")
+        return 500, b""
+
+async def handle_request_async(req):
+    method, path = req.method, req.path
+    if not (path == "/storage" or path.startswith("/storage/")):
+        await req.load_body()
+        if control_request(req):
+            return await asyncio.to_thread(forward_control, req)
+        return await asyncio.to_thread(handle_request, req)
+
+    if path == batch.PATH and method == 'POST':
+        await req.load_body()
+        return await handle_batch_async(req.body)
+
+    key = path[len('/storage/'):] if path.startswith('/storage/') else ""
+    if key == "":
+        if method != 'GET':
+            return 405, b"Method Not Allowed", "text/plain"
+        return await handle_list_async(req.query)
+
+    if method not in ('PUT', 'GET', 'HEAD', 'DELETE'):
+        return 405, b"Method Not Allowed", "text/plain"
+    start = time.perf_counter()
+    target_node_info, nodes = route_key(key)
+    metrics.ROUTE.since(start)
+    if not target_node_info:
+        return 503, b"No workers available", "text/plain"
+    if nodes is not None and len(nodes) < replica_quorum(method):
+        return 503, b"Not enough replicas for quorum", "text/plain"
+    if direct(req, key, nodes, target_node_info):
+        return await admitted_async(target_node_info, direct_get_async, req, key,
+                                    target_node_info)
+
+    try:
+        encoding = put_encoding(req) if method == 'PUT' else None
+    except ValueError:
+        return 415, b"Unsupported Content-Encoding", "text/plain"
+    if method == 'GET':
+        if value_cache is not None:
+            value = value_cache.get(key)
+            if value is not None:
+                return 200, value, "application/octet-stream"
+        if flights is not None:
+            return await coalesced_get_async(key, target_node_info, nodes)
+    return await admitted_async(target_node_info, key_request_async, method, key,
+                                target_node_info, nodes, req.stream, encoding)
+
+async def key_request_async(method, key, node, nodes, body=b"", encoding=None,
+                            buffer_limit=None):
+    """Асинхронный key_request."""
+    if buffer_limit is None:
+        buffer_limit = cache_entry_limit()
+    reading = method in ('GET', 'HEAD')
+    cached = value_cache is not None and method != 'HEAD'
+    token = None
+    if cached:
+        if method == 'GET':
+            token = value_cache.begin_read(key)
+        else:
+            token = value_cache.begin_write(key)
+            if method == 'PUT' and body.length is not None and body.length <= value_cache.max_entry:
+                body = await body.read_all()
+    fallback = fallback_nodes(key, nodes or [node]) if reading else None
+    if nodes is not None:
+        if method == 'PUT':
+            body = await spool_body_async(body)
+        code, response_body = await replicated_request_async(method, key, nodes, body,
+                                                             buffer_limit, fallback, encoding)
+    elif fallback:
+        code, response_body = await migrating_get_async(key, node, fallback, buffer_limit,
+                                                        method=method)
+    else:
+        code, response_body = await send_http_request_async(
+            node['host'], node['port'], method, worker_path(key), body,
+            stream=method == 'GET', buffer_limit=buffer_limit,
+            headers=write_headers(encoding) if not reading else None)
+    if cached:
+        cache_finish(method, key, token, None if encoding else body, code, response_body)
+    if not reading and flights is not None:
+        flights.forget(key)
+    return proxy_response(method, code, response_body)
+
+async def admitted_async(node, handler, *args):
+    """Асинхронный admitted."""
+    limiter = node_limiter(node)
+    if limiter is None:
+        return await handler(*args)
+    try:
+        await limiter.acquire()
+    except admission.Overloaded as e:
+        return reject(503, "node_queue", b"Worker overloaded", e.retry_after)
+    reply = None
+    try:
+        reply = await handler(*args)
+    finally:
+        release_after(limiter, reply)
+    return reply
+
+async def coalesced_get_async(key, node, nodes):
+    """Асинхронный coalesced_get."""
+    future, leader = flights.join(key)
+    if not leader:
+        # shield: отмена одного ждущего не отменяет ответ для остальных
+        reply = await asyncio.shield(future)
+        if reply is not None:
+            metrics.COALESCED.inc()
+            return reply
+        return await admitted_async(node, key_request_async, 'GET', key, node, nodes)
+    reply = None
+    try:
+        reply = await admitted_async(node, key_request_async, 'GET', key, node, nodes, b"",
+                                     None, max(cache_entry_limit(), coalesce_limit))
+        return reply
+    finally:
+        flights.finish(key, future, shared_reply(reply))
+
+async def handle_list_async(query):
+    """Асинхронный handle_list."""
+    params, error = list_request(query)
+    if error:
+        return error
+    active, path, limit = params
+    results = await asyncio.gather(*(open_upstream_async(w['host'], w['port'], 'GET', path,
+                                                         timeout=BULK_TIMEOUT)
+                                     for w in active), return_exceptions=True)
+    ups = [r for r in results if not isinstance(r, BaseException)]
+    if len(ups) < len(results) or any(up.code != 200 for up in ups):
+        for r in results:
+            if isinstance(r, BaseException):
+                print(f"[MASTER] Ошибка получения списка ключей: {r!r}")
+        for up in ups:
+            up.close(False)
+        return 500, b"Failed to fetch keys", "text/plain"
+
+    def close(completed):
+        for up in ups:
+            up.close(completed)
+
+    streams = [listing.iter_records_async(up.stream.chunks()) for up in ups]
+    lines = listing.encode_async(listing.merge_async(streams, limit))
+    return 200, httputil.StreamBody(lines, None, close), listing.CONTENT_TYPE
+
+async def handle_batch_async(body):
+    """Асинхронный handle_batch: подзапросы к нодам идут через gather."""
+    try:
+        op, items, encoding, _, max_value = batch.parse_request(body)
+    except ValueError as e:
+        return 400, str(e).encode('utf-8'), "text/plain"
+    if op not in batch.CLIENT_OPS:
+        return 400, b"Unknown op", "text/plain"
+    results, tokens, replies, calls, fallbacks = batch_plan(op, items, max_value)
+    await batch_send_async(calls, replies)
+    if fallbacks:
+        await batch_fallback_async(items, results, replies, fallbacks, max_value)
+    return batch_finish(op, items, results, tokens, replies, encoding)
+
+async def batch_send_async(calls, replies):
+    responses = await asyncio.gather(*(
+        send_http_request_async(node['host'], node['port'], 'POST', batch.PATH, sub_body,
+                                BULK_TIMEOUT)
+        for _, node, sub_body in calls))
+    for (idxs, _, _), (code, response_body) in zip(calls, responses):
+        batch_merge(replies, idxs, code, response_body)
+
+async def batch_fallback_async(items, results, replies, fallbacks, max_value):
+    missing = batch_missing(results, replies, fallbacks)
+    if not missing:
+        return
+    count_fallback(len(missing))
+    level = 0
+    while True:
+        calls = batch_fallback_calls(items, missing, fallbacks, level, max_value)
+        if not calls:
+            break
+        found = [[] for _ in items]
+        await batch_send_async(calls, found)
+        missing = batch_found(results, found, missing)
+        level += 1
+    if missing:
+        await batch_send_async(batch_reread(items, replies, missing, fallbacks, max_value),
+                               replies)
+
+async def handle_client_async(reader, writer):
+    global open_connections
+    if max_connections and open_connections >= max_connections:
+        writer.write(busy_response())
+        writer.close()
+        return
+    open_connections += 1
+    peer = writer.get_extra_info("peername")
+    client = peer[0] if peer else ""
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(httputil.KEEPALIVE_TIMEOUT):
+                    req = await httputil.read_request_async(reader, writer)
+            except httputil.BadRequest as e:
+                await httputil.write_response_async(writer, 400, str(e).encode('latin1'))
+                return
+            if req is None:
+                return
+            start = metrics.request_started()
+            code, sent = 500, 0
+            try:
+                try:
+                    reply = rate_limited(client, req) or await handle_request_async(req)
+                    if req.method == 'HEAD':
+                        reply = httputil.without_body(*reply)
+                    code, body, content_type, *headers = reply
+                except Exception as e:
+                    logs.write("error", str(e), method=req.method, path=req.path)
+                    code = 500
+                    sent = await httputil.write_response_async(writer, 500, b"Internal Error")
+                    return
+                keep_alive = req.keep_alive and req.stream.done
+                sent = await httputil.write_response_async(writer, code, body, content_type,
+                                                           keep_alive, *headers)
+            finally:
+                logs.request(req, code, sent, metrics.request_finished(req, code, sent, start))
+            if not keep_alive:
+                return
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logs.write("error", str(e))
+    finally:
+        open_connections -= 1
+        writer.close()
+
+async def async_pool_reaper():
+    while True:
+        await asyncio.sleep(pool.DEFAULT_IDLE_TIMEOUT / 2)
+        for p in list(async_pools.values()):
+            p.evict_idle()
+
+async def serve_async(host, port, reuse_port=False):
+    global event_loop
+    event_loop = asyncio.get_running_loop()
+    server = await asyncio.start_server(handle_client_async, host, port,
+                                        backlog=socket.SOMAXCONN,
+                                        limit=httputil.MAX_HEADER_SIZE, reuse_address=True,
+                                        reuse_port=reuse_port)
+    print(f"Мастер-нода (Шардирование, asyncio) запущена на http://{host}:{port}")
+    asyncio.create_task(async_pool_reaper())
+    async with server:
+        await server.serve_forever()
+
+# --- Метаданные кластера ---
+# Состав нод, кольцо и незавершённые переносы записываются в metastore
+# (снимок и журнал изменений в --meta-dir). После перезапуска мастер сразу
+# направляет запросы прежним нодам, не дожидаясь PUT /node и регистрации.
+# Доступность нод не сохраняется: восстановленная нода считается живой,
+# пока пробы не покажут обратное.
+
+# metastore.MetaStore; None — метаданные не сохраняются
+meta = None
+# Версия карты кластера (GET /cluster): новая при каждом изменении состава
+# нод или переносов. Клиенты, которые ходят к нодам напрямую, передают её
+# нодам в X-Map-Version, а ноды узнают текущую из проб мастера.
+map_version = 0
+MAP_VERSION_HEADER = "X-Map-Version"
+
+def record_change(record):
+    """Изменение состава: новая версия карты и запись в журнал.
+
+    Вызывать под блокировкой изменяемого состояния.
+    """
+    global map_version
+    map_version = next_version()
+    if meta is not None:
+        meta.append(record)
+
+def cluster_map():
+    """Карта кластера для клиентов, которые ходят к нодам напрямую (client.SmartClient).
+
+    direct — можно ли: ключ лежит ровно на одной ноде, и мастеру не нужно
+    видеть записи (нет кэша и переносов). Иначе клиент идёт через мастер.
+    """
+    with workers_lock:
+        nodes = [{"id": w["id"], "host": w["host"], "port": w["port"],
+                  "weight": w.get("weight", 1.0)}
+                 for w in workers.values() if w["port"] != 0]
+        version, ring_vnodes = map_version, ring.vnodes
+    return {"version": version, "vnodes": ring_vnodes, "replicas": replicas,
+            "direct": replicas == 1 and value_cache is None and not migrations,
+            "workers": nodes}
+
+def announce_map(migration):
+    """Сообщает нодам-источникам текущую версию карты до начала переноса.
+
+    Узнав её, нода отклоняет (421) прямые запросы клиентов с прежней
+    картой: иначе клиент мог бы записать ключ прежнему владельцу уже после
+    того, как перенос обошёл его ключи.
+    """
+    headers = {MAP_VERSION_HEADER: map_version}
+    for node in migration.sources.values():
+        send_http_request(node['host'], node['port'], 'GET', "/health",
+                          timeout=probe_interval * 2, headers=headers)
+
+def migration_state(m):
+    return {"old": list(m.old_ring.nodes.items()), "new": list(m.new_ring.nodes.items()),
+            "vnodes": [m.old_ring.vnodes, m.new_ring.vnodes],
+            "sources": list(m.sources.values()), "floor": m.floor}
+
+def migration_from_state(state):
+    old_vnodes, new_vnodes = state["vnodes"]
+    return rebalance.Migration(hashring.HashRing(dict(state["old"]), old_vnodes),
+                               hashring.HashRing(dict(state["new"]), new_vnodes),
+                               {node["id"]: node for node in state["sources"]}, replicas,
+                               state["floor"])
+
+def checkpoint():
+    """Сворачивает журнал изменений в снимок текущего состояния."""
+    with workers_lock, rebalance_cond:
+        meta.compact({"vnodes": ring.vnodes,
+                      "workers": {w["id"]: dict(w) for w in workers.values()},
+                      "migrations": [migration_state(m) for m in migrations]})
+
+def membership_changed():
+    """После изменения состава нод: свернуть выросший журнал и разослать снимок процессам."""
+    if meta is not None and meta.needs_compaction():
+        checkpoint()
+    publish()
+
+def restore_metadata(state):
+    """Восстанавливает состав нод, кольцо и переносы. Вызывать до запуска потоков."""
+    global ring, last_version
+    workers.update(state["workers"])
+    active = {w["id"]: w.get("weight", 1.0) for w in workers.values() if w["port"] != 0}
+    ring = hashring.HashRing(active, state["vnodes"] or vnodes)
+    migrations.extend(migration_from_state(m) for m in state["migrations"])
+    # Записи после перезапуска получают версии новее нижних границ переносов
+    last_version = max([last_version] + [m.floor for m in migrations])
+    now = time.monotonic()
+    for w in workers.values():
+        if w["port"] != 0:
+            # Нода считается ответившей при запуске мастера: если на пробы
+            # она не ответит, детектор объявит её недоступной как обычно
+            node_health(w["host"], w["port"]).heartbeat(now)
+    if ring.vnodes != vnodes:
+        # Кольцо с другим --vnodes: ключи переносятся как при смене состава
+        with workers_lock:
+            old_ring, ring = ring, hashring.HashRing(active, vnodes)
+            if active:
+                start_migration(old_ring, ring, None)
+
+# --- Несколько процессов (--processes) ---
+# Запросы клиентов принимают N процессов на общем порту (SO_REUSEPORT).
+# Состав нод, переносы и доступность ведёт управляющий процесс (родитель):
+# процессы передают ему /register, изменения /node, /rebalance и /health
+# через его внутренний порт. После каждого изменения он рассылает всем
+# процессам снимок состояния и отвечает на запрос, только когда все его
+# применили, поэтому следующий запрос клиента любой процесс обслужит уже
+# по новому кольцу. Кэш значений у каждого процесса был бы свой и
+# устаревал бы после записи через другой процесс, поэтому с --processes
+# он не поддерживается.
+
+# Управляющий процесс: [(сокет связи с процессом, чтение из него)]
+control_links = []
+# Процесс приёма запросов: внутренний порт управляющего процесса
+control_port = None
+publish_lock = threading.Lock()
+CONTROL_TIMEOUT = 10
+
+def control_request(req):
+    """Выполняет ли запрос управляющий процесс."""
+    if control_port is None:
+        return False
+    return (req.path in ("/register", "/rebalance", "/health")
+            or req.path.startswith("/node/") and req.method != 'GET')
+
+def forward_control(req):
+    with socket.create_connection(("127.0.0.1", control_port), timeout=BULK_TIMEOUT) as s:
+        s.sendall(httputil.build_request(req.method, req.path, "127.0.0.1", req.body,
+                                         req.headers.get("content-type", "application/json"),
+                                         keep_alive=False))
+        code, headers, body = httputil.read_response(s)
+    return code, body, headers.get("content-type", "text/plain")
+
+def membership_snapshot():
+    with workers_lock:
+        snapshot = {"workers": [dict(w) for w in workers.values()], "map_version": map_version}
+    with rebalance_cond:
+        snapshot["migrations"] = [migration_state(m) for m in migrations]
+    with health_lock:
+        snapshot["health"] = [[host, port, h.state] for (host, port), h in health_nodes.items()]
+    return snapshot
+
+def publish():
+    """Рассылает снимок состояния процессам и ждёт, пока все его применят."""
+    if not control_links:
+        return
+    with publish_lock:
+        data = json.dumps(membership_snapshot()).encode('utf-8') + b"\n"
+        for link, _ in control_links:
+            try:
+                link.sendall(data)
+            except OSError as e:
+                print(f"[MASTER] Процесс недоступен: {e}")
+        for _, reader in control_links:
+            try:
+                reader.readline()
+            except OSError as e:
+                print(f"[MASTER] Процесс не подтвердил снимок: {e}")
+
+def apply_snapshot(snapshot):
+    """Снимок управляющего процесса заменяет состав нод, кольцо, переносы и доступность."""
+    global workers, ring, map_version
+    new_workers = {w["id"]: w for w in snapshot["workers"]}
+    active = {w["id"]: w.get("weight", 1.0) for w in new_workers.values() if w["port"] != 0}
+    pending = [migration_from_state(m) for m in snapshot["migrations"]]
+    with workers_lock:
+        workers = new_workers
+        if active != ring.nodes:
+            ring = hashring.HashRing(active, vnodes)
+    with rebalance_cond:
+        migrations[:] = pending
+    # Версия меняется последней: карта с ней уже отражает переносы
+    map_version = snapshot["map_version"]
+    for host, port, state in snapshot["health"]:
+        node_health(host, port).state = state
+
+def snapshot_listener(link):
+    """Поток процесса приёма запросов: применяет снимки управляющего процесса."""
+    reader = link.makefile('rb')
+    for line in reader:
+        apply_snapshot(json.loads(line))
+        link.sendall(b"ok\n")
+
+def start_processes(count):
+    """Создаёт count процессов приёма запросов.
+
+    Возвращает (номер процесса, None) в процессе и (None, [pid]) в
+    управляющем. Вызывать до запуска потоков.
+    """
+    global control_port, version_stride, version_slot
+    control_sock = prefork.listen_socket("127.0.0.1", 0)
+    links = [socket.socketpair() for _ in range(count)]
+    index, pids = prefork.fork(count)
+    version_stride = count + 1
+    if index is None:
+        for parent_end, child_end in links:
+            child_end.close()
+            parent_end.settimeout(CONTROL_TIMEOUT)
+            control_links.append((parent_end, parent_end.makefile('rb')))
+        return None, pids, control_sock
+    control_port = control_sock.getsockname()[1]
+    control_sock.close()
+    version_slot = index + 1
+    for i, (parent_end, child_end) in enumerate(links):
+        parent_end.close()
+        if i != index:
+            child_end.close()
+    threading.Thread(target=snapshot_listener, args=(links[index][1],), daemon=True).start()
+    return index, None, None
+
+def serve_control(sock, pids):
+    """Управляющий процесс: внутренний порт и надзор за процессами приёма запросов.
+
+    Если один из них завершился, мастер останавливается целиком.
+    """
+    stopping = threading.Event()
+
+    def watch():
+        pid, status = os.wait()
+        if not stopping.is_set():
+            print(f"[MASTER] Процесс {pid} завершился (код {os.waitstatus_to_exitcode(status)}), "
+                  f"мастер останавливается")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    def on_signal(sig, frame):
+        stopping.set()
+        sys.exit(0)
+
+    threading.Thread(target=watch, daemon=True).start()
+    signal.signal(signal.SIGTERM, on_signal)
+    try:
+        while True:
+            conn, addr = sock.accept()
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+    except KeyboardInterrupt:
+        print("\nМастер остановлен.")
+    finally:
+        stopping.set()
+        sock.close()
+        # Процессы не должны пережить мастер: их сокеты остались бы на порту
+        prefork.stop(pids)
+        prefork.wait(pids)
+
+def handle_create_node(node_id, body):
     try:
-        body = raw_request[body_start:]
         payload = json.loads(body.decode('utf-8'))
         name = payload.get("name")
         if not name or not isinstance(name, str):
-            send_response(conn, 400, b"Missing or invalid 'name'")
-            return
+            return 400, b"Missing or invalid 'name'", "text/plain"
+        weight = payload.get("weight", 1.0)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+            return 400, b"Invalid 'weight'", "text/plain"
     except:
-        send_response(conn, 400, b"Invalid JSON")
-        return
+        return 400, b"Invalid JSON", "text/plain"
 
     with workers_lock:
         workers[node_id] = {
             "name": name,
             "host": "127.0.0.1",
             "port": 0, # Пока не зарегистрирована
-            "id": node_id
+            "id": node_id,
+            "weight": float(weight)
         }
-    send_response(conn, 201, b"", "text/plain")
+        record_change({"op": "node", "node": dict(workers[node_id])})
+        rebuild_ring()
+    membership_changed()
     print(f"[MASTER] Создана запись для ноды {node_id} ('{name}')")
+    return 201, b"", "text/plain"
 
-def handle_delete_node(conn, node_id):
+def handle_delete_node(node_id):
     with workers_lock:
-        if node_id in workers:
-            # При удалении ноды она становится "неактивной" (port = 0)
-            # Это приведёт к ребалансировке при следующем запросе
-            workers[node_id]["port"] = 0
-            # Данные на ней теряются (или остаются, но становятся недоступны через мастер)
-            send_response(conn, 200, b"Node marked as inactive (data potentially lost)")
-        else:
-            send_response(conn, 404, b"Node not found")
-
-def send_response(conn, status_code, body, content_type="text/plain"):
-    reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 500: "Internal Error", 503: "Service Unavailable"}.get(status_code, "Unknown")
-    response = (
-        f"HTTP/1.1 {status_code} {reason}\r\n"
-        f"Content-Type: {content_type}\r\n"
-        f"Content-Length: {len(body)}\r\n"
-        "Connection: close\r\n"
-        f"Date: {datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')}\r\n"
-        "\r\n"
-    ).encode('latin1') + body
-    conn.sendall(response)
+        if node_id not in workers:
+            return 404, b"Node not found", "text/plain"
+        # При удалении ноды она становится "неактивной" (port = 0)
+        # Кольцо пересобирается: к соседям уходит ~1/N ключей
+        w = workers[node_id]
+        host, port = w["host"], w["port"]
+        departed = dict(w) if port != 0 else None
+        w["port"] = 0
+        w["removed"] = True
+        record_change({"op": "node", "node": dict(w)})
+        # Ключи ноды переносятся к новым владельцам в фоне
+        rebuild_ring(departed)
+    membership_changed()
+    if event_loop is not None:
+        # handle_request выполняется вне потока event loop, а пулы доступны только из него
+        event_loop.call_soon_threadsafe(close_async_pool, host, port)
+    return 200, b"Node marked as inactive, keys are being moved", "text/plain"
 
 def main():
+    global vnodes, pool_size, value_cache, replicas, write_quorum, read_quorum, hedge_delay
+    global rebalance_throttle, rebalance_executor, probe_interval, phi_threshold, meta
+    global map_version, flights, coalesce_limit, node_limiter_class, node_limit, node_queue
+    global queue_timeout, client_limiter, max_connections, connection_slots
+    parser = argparse.ArgumentParser(description="Мастер-нода")
+    parser.add_argument("--vnodes", type=int, default=hashring.DEFAULT_VNODES,
+                        help="виртуальных нод на ноду с весом 1.0")
+    parser.add_argument("--pool-size", type=int, default=pool.DEFAULT_POOL_SIZE,
+                        help="keep-alive соединений к каждой ноде (0 — без пула)")
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                        help="поток на соединение или event loop")
+    parser.add_argument("--cache-mb", type=float, default=0,
+                        help="объём кэша значений в МиБ (0 — без кэша)")
+    parser.add_argument("--cache-entry-kb", type=float, default=cache.DEFAULT_MAX_ENTRY / 1024,
+                        help="значения крупнее не кэшируются")
+    parser.add_argument("--replicas", type=int, default=1, help="копий каждого ключа (N)")
+    parser.add_argument("--write-quorum", type=int,
+                        help="подтверждений записи (W), по умолчанию большинство из N")
+    parser.add_argument("--read-quorum", type=int,
+                        help="ответов на чтение (R), по умолчанию большинство из N")
+    parser.add_argument("--hedge-ms", type=float, default=hedge_delay * 1000,
+                        help="через сколько мс без ответа дублировать чтение на другую реплику")
+    parser.add_argument("--rebalance-mb", type=float, default=rebalance.DEFAULT_RATE_MB,
+                        help="скорость переноса ключей при смене нод, МиБ/с (0 — без ограничения)")
+    parser.add_argument("--rebalance-threads", type=int, default=rebalance.DEFAULT_THREADS,
+                        help="пакетов, переносимых параллельно")
+    parser.add_argument("--probe-ms", type=float, default=health.PROBE_INTERVAL * 1000,
+                        help="интервал опроса нод (GET /health), мс")
+    parser.add_argument("--phi-threshold", type=float, default=health.PHI_THRESHOLD,
+                        help="phi, начиная с которого нода считается недоступной")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="процессов приёма запросов на общем порту (SO_REUSEPORT)")
+    parser.add_argument("--meta-dir", default="basic_node/master_meta",
+                        help="каталог метаданных кластера (пустая строка — не сохранять)")
+    parser.add_argument("--coalesce-kb", type=float, default=0,
+                        help="объединять одинаковые GET; ответ ноды не длиннее делится между "
+                             "ними (0 — не объединять)")
+    parser.add_argument("--node-limit", type=int, default=0,
+                        help="одновременных запросов клиентов к одной ноде (0 — без ограничения)")
+    parser.add_argument("--node-queue", type=int, default=admission.DEFAULT_NODE_QUEUE,
+                        help="запросов, ждущих слота ноды; сверх — сразу 503")
+    parser.add_argument("--queue-ms", type=float, default=admission.DEFAULT_QUEUE_TIMEOUT * 1000,
+                        help="сколько запрос ждёт слота ноды, мс")
+    parser.add_argument("--client-rate", type=float, default=0,
+                        help="запросов в секунду с одного адреса клиента (0 — без ограничения)")
+    parser.add_argument("--client-burst", type=int,
+                        help="запас запросов сверх частоты, по умолчанию — частота за секунду")
+    parser.add_argument("--max-connections", type=int, default=0,
+                        help="соединений клиентов одновременно, сверх — 503 (0 — без ограничения)")
+    parser.add_argument("--log-level", choices=sorted(logs.LEVELS), default="info",
+                        help="debug — запись о каждом запросе")
+    parser.add_argument("--log-sample", type=float, default=1.0,
+                        help="доля запросов в журнале на уровне debug")
+    args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes должно быть не меньше 1")
+    if args.processes > 1 and args.cache_mb > 0:
+        parser.error("кэш значений (--cache-mb) несовместим с --processes")
+    majority = args.replicas // 2 + 1
+    replicas = args.replicas
+    write_quorum = args.write_quorum or majority
+    read_quorum = args.read_quorum or majority
+    if replicas < 1 or not (1 <= write_quorum <= replicas and 1 <= read_quorum <= replicas):
+        parser.error("нужно 1 <= W <= N и 1 <= R <= N")
+    hedge_delay = args.hedge_ms / 1000
+    vnodes = args.vnodes
+    pool_size = args.pool_size
+    if args.cache_mb > 0:
+        value_cache = cache.ValueCache(int(args.cache_mb * 1024 * 1024),
+                                       int(args.cache_entry_kb * 1024))
+    if args.rebalance_threads < 1:
+        parser.error("--rebalance-threads должно быть не меньше 1")
+    if min(args.coalesce_kb, args.node_limit, args.node_queue, args.client_rate,
+           args.max_connections) < 0:
+        parser.error("ограничения нагрузки не могут быть отрицательными")
+    if args.coalesce_kb > 0:
+        coalesce_limit = int(args.coalesce_kb * 1024)
+        flights = admission.AsyncFlights() if args.mode == "asyncio" else admission.Flights()
+    if args.mode == "asyncio":
+        node_limiter_class = admission.AsyncNodeLimiter
+    node_limit = args.node_limit
+    node_queue = args.node_queue
+    queue_timeout = args.queue_ms / 1000
+    if args.client_rate > 0:
+        client_limiter = admission.ClientLimiter(
+            args.client_rate, args.client_burst or math.ceil(args.client_rate))
+    max_connections = args.max_connections
+    if max_connections and args.mode == "threads":
+        connection_slots = threading.Semaphore(max_connections)
+    rebalance_throttle = rebalance.Throttle(args.rebalance_mb * 1024 * 1024)
+    probe_interval = args.probe_ms / 1000
+    phi_threshold = args.phi_threshold
+    if args.meta_dir:
+        start = time.perf_counter()
+        meta = metastore.MetaStore(args.meta_dir)
+        if meta.state is not None:
+            restore_metadata(meta.state)
+            print(f"[MASTER] Восстановлено нод: {len(workers)}, переносов: {len(migrations)} "
+                  f"за {(time.perf_counter() - start) * 1000:.1f} мс")
+        checkpoint()
+    # Карта после запуска новее любой, которую клиенты получили до него
+    map_version = next_version()
+    index, pids, control_sock = None, None, None
+    if args.processes > 1:
+        index, pids, control_sock = start_processes(args.processes)
+    logs.configure("master" if index is None else f"master.{index}", args.log_level,
+                   args.log_sample)
+    if index is None:
+        # Переносы и пробы нод ведёт только управляющий процесс
+        rebalance_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.rebalance_threads, thread_name_prefix="rebalance")
+        threading.Thread(target=rebalancer, daemon=True).start()
+        threading.Thread(target=health_monitor, daemon=True).start()
+    if pool_size:
+        # Перебалансировка ходит к нодам через синхронные пулы и в asyncio-режиме
+        threading.Thread(target=pool_reaper, daemon=True).start()
+    if pids is not None:
+        print(f"Мастер-нода: {args.processes} процессов, управляющий процесс на порту "
+              f"{control_sock.getsockname()[1]}")
+        serve_control(control_sock, pids)
+        return
+
     HOST, PORT = "127.0.0.1", 8080
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind((HOST, PORT))
-    sock.listen(10)
+    if args.mode == "asyncio":
+        try:
+            asyncio.run(serve_async(HOST, PORT, reuse_port=index is not None))
+        except KeyboardInterrupt:
+            print("\nМастер остановлен.")
+        return
+
+    sock = prefork.listen_socket(HOST, PORT, reuse_port=index is not None)
     print(f"Мастер-нода (Шардирование) запущена на http://{HOST}:{PORT}")
 
     try:
         while True:
             conn, addr = sock.accept()
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+            if connection_slots is None:
+                threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+            elif connection_slots.acquire(blocking=False):
+                threading.Thread(target=serve_client, args=(conn, addr), daemon=True).start()
+            else:
+                reject_connection(conn)
     except KeyboardInterrupt:
         print("\nМастер остановлен.")
     finally:
@@ -0,0 +1,137 @@
+# metastore.py
+# Метаданные кластера на мастере: состав нод, кольцо и незавершённые
+# переносы переживают перезапуск. Хранятся как снимок (snapshot.json) и
+# журнал изменений (changes.log), в который только дописывают. При
+# открытии журнал применяется к снимку; мастер затем сворачивает оба в
+# новый снимок, и журнал начинается заново.
+import json
+import os
+import threading
+import zlib
+
+SNAPSHOT = "snapshot.json"
+CHANGES = "changes.log"
+# Записей в журнале, после которых его стоит свернуть в снимок
+COMPACT_RECORDS = 1000
+
+def empty_state():
+    """Состояние без нод. vnodes — с каким числом виртуальных нод построено кольцо."""
+    return {"vnodes": None, "workers": {}, "migrations": []}
+
+def apply(state, record):
+    """Применяет к состоянию запись журнала.
+
+    node — запись ноды целиком (создание, регистрация, удаление);
+    migration — начат перенос; migration_done — завершён самый старый
+    из начатых: переносы выполняются по порядку.
+    """
+    op = record["op"]
+    if op == "node":
+        state["workers"][record["node"]["id"]] = record["node"]
+    elif op == "migration":
+        state["migrations"].append(record["migration"])
+    elif op == "migration_done":
+        if state["migrations"]:
+            state["migrations"].pop(0)
+    else:
+        raise ValueError(f"unknown record {op!r}")
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class MetaStore:
+    """Снимок и журнал изменений в каталоге directory.
+
+    Строка журнала — crc32 JSON-записи в hex и сама запись. Каждая запись
+    сбрасывается на диск (fsync) до ответа клиенту: изменения состава
+    редки, а потерянная запись означала бы ноду, которой мастер не знает.
+    Оборванная последняя строка при открытии отбрасывается.
+    """
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, SNAPSHOT)
+        self.changes_path = os.path.join(directory, CHANGES)
+        self._lock = threading.Lock()
+        self.records = 0
+        # Загруженное состояние; None — метаданных ещё не было
+        self.state = self._load()
+        self._file = open(self.changes_path, 'ab')
+
+    def _load(self):
+        state = None
+        try:
+            with open(self.snapshot_path, 'rb') as f:
+                snapshot = json.loads(f.read())
+            state = empty_state()
+            state["vnodes"] = snapshot["vnodes"]
+            state["workers"] = {w["id"]: w for w in snapshot["workers"]}
+            state["migrations"] = snapshot["migrations"]
+        except FileNotFoundError:
+            pass
+        try:
+            with open(self.changes_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return state
+        pos = 0
+        while True:
+            end = data.find(b"\n", pos)
+            if end < 0:
+                break
+            crc, _, payload = data[pos:end].partition(b" ")
+            try:
+                valid = int(crc, 16) == zlib.crc32(payload)
+            except ValueError:
+                valid = False
+            if not valid:
+                break
+            if state is None:
+                state = empty_state()
+            apply(state, json.loads(payload))
+            self.records += 1
+            pos = end + 1
+        if pos < len(data):
+            # Оборванная или испорченная запись в конце
+            os.truncate(self.changes_path, pos)
+        return state
+
+    def append(self, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self._file.write(b"%08x %s\n" % (zlib.crc32(payload), payload))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.records += 1
+
+    def needs_compaction(self):
+        return self.records >= COMPACT_RECORDS
+
+    def compact(self, state):
+        """Записывает state снимком и очищает журнал.
+
+        Вызывающий не даёт состоянию меняться, пока снимок пишется: иначе
+        изменение попало бы в очищенный журнал, но не в снимок.
+        """
+        snapshot = {"vnodes": state["vnodes"], "workers": list(state["workers"].values()),
+                    "migrations": state["migrations"]}
+        tmp = self.snapshot_path + ".tmp"
+        with self._lock:
+            with open(tmp, 'wb') as f:
+                f.write(json.dumps(snapshot, ensure_ascii=False).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.snapshot_path)
+            _fsync_dir(self.directory)
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+            self.records = 0
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,239 @@
+# metrics.py
+# Счётчики, датчики и гистограммы задержек процесса в текстовом формате
+# Prometheus (GET /metrics). Общие для мастера и рабочих нод.
+import threading
+import time
+
+PATH = "/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Гистограмма в духе HDR: интервалы по степеням двойки, каждый поделён на
+# 2**SUB_BITS равных частей, — относительная погрешность не больше 12.5%
+# на всём диапазоне от микросекунды до MAX_US
+SUB_BITS = 3
+SUB = 1 << SUB_BITS
+MAX_US = 1 << 27
+
+def bucket_index(us):
+    """Номер корзины для целого числа микросекунд."""
+    shift = max(us.bit_length() - SUB_BITS - 1, 0)
+    return (shift << SUB_BITS) + (us >> shift)
+
+def _bucket_upper(index):
+    """Граница корзины сверху (исключая), мкс."""
+    if index < 2 * SUB:
+        return index + 1
+    shift = (index >> SUB_BITS) - 1
+    return (index - (shift << SUB_BITS) + 1) << shift
+
+BUCKETS = bucket_index(MAX_US - 1) + 1
+# Границы корзин для le="..." в секундах
+BUCKET_LE = [f"{_bucket_upper(i) / 1e6:g}" for i in range(BUCKETS)]
+
+registry = []
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Counter:
+    """Монотонный счётчик с метками; значения меток передаются по порядку labels.
+
+    lock — общая блокировка нескольких метрик, которые обновляются вместе
+    (см. request_finished): одна блокировка на запрос вместо нескольких.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=(), lock=None):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}
+        self.lock = lock or threading.Lock()
+        registry.append(self)
+
+    def inc(self, *labels, value=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + value
+
+    def add(self, labels, value):
+        """inc для вызова под self.lock."""
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        with self.lock:
+            items = sorted(self.values.items(), key=lambda item: [str(v) for v in item[0]])
+        for labels, value in items:
+            yield f"{self.name}{_labels(self.label_names, labels)} {value}"
+
+class Gauge(Counter):
+    """Значение, которое может уменьшаться (запросы в обработке, размеры)."""
+
+    kind = "gauge"
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+class HistogramSeries:
+    """Одна гистограмма с фиксированными значениями меток (Histogram.labels)."""
+
+    __slots__ = ("buckets", "sum", "count", "lock")
+
+    def __init__(self):
+        self.buckets = [0] * BUCKETS
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        us = int(seconds * 1e6)
+        if us >= MAX_US:
+            us = MAX_US - 1
+        elif us < 0:
+            us = 0
+        shift = us.bit_length() - SUB_BITS - 1
+        index = ((shift << SUB_BITS) + (us >> shift)) if shift > 0 else us
+        with self.lock:
+            self.buckets[index] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def since(self, start):
+        """Записывает время от start (time.perf_counter()) до текущего момента."""
+        self.observe(time.perf_counter() - start)
+
+class Histogram:
+    """Распределение длительностей в логарифмических корзинах (см. bucket_index).
+
+    Выводятся корзины до последней непустой: границы у всех процессов
+    одинаковые, поэтому гистограммы разных нод можно складывать.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        # {значения меток: HistogramSeries}
+        self.series = {}
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def labels(self, *values):
+        """Ряд для значений меток; на горячем пути его стоит получить один раз заранее."""
+        series = self.series.get(values)
+        if series is None:
+            with self._lock:
+                series = self.series.get(values)
+                if series is None:
+                    series = self.series[values] = HistogramSeries()
+        return series
+
+    def observe(self, seconds, *labels):
+        self.labels(*labels).observe(seconds)
+
+    def since(self, start, *labels):
+        self.labels(*labels).observe(time.perf_counter() - start)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self.series.items(), key=lambda item: [str(v) for v in item[0]])
+        names = self.label_names
+        for labels, series in items:
+            with series.lock:
+                buckets, total, count = list(series.buckets), series.sum, series.count
+            last = max((i for i, n in enumerate(buckets) if n), default=-1)
+            cumulative = 0
+            for i in range(last + 1):
+                cumulative += buckets[i]
+                yield f"{self.name}_bucket{_labels(names + ('le',), labels + (BUCKET_LE[i],))} {cumulative}"
+            yield f"{self.name}_bucket{_labels(names + ('le',), labels + ('+Inf',))} {count}"
+            yield f"{self.name}_sum{_labels(names, labels)} {total:.6f}"
+            yield f"{self.name}_count{_labels(names, labels)} {count}"
+
+def render():
+    """Все метрики процесса в текстовом формате Prometheus."""
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return ("\n".join(lines) + "\n").encode('utf-8')
+
+# --- Метрики HTTP-сервера ---
+# Заводятся здесь, потому что их пишут и мастер, и ноды, и общий httputil.
+
+_requests_lock = threading.Lock()
+REQUESTS = Counter("dstorage_requests_total", "Обработанные HTTP-запросы",
+                   ("method", "route", "status"), _requests_lock)
+BYTES_IN = Counter("dstorage_received_bytes_total", "Принято байт: заголовки и тела запросов",
+                   lock=_requests_lock)
+BYTES_OUT = Counter("dstorage_sent_bytes_total", "Отправлено байт: заголовки и тела ответов",
+                    lock=_requests_lock)
+IN_FLIGHT = Gauge("dstorage_requests_in_flight", "Запросы, которые обрабатываются сейчас",
+                  lock=_requests_lock)
+DURATION = Histogram("dstorage_request_duration_seconds",
+                     "Время от разбора заголовков до отправки ответа", ("route",))
+STAGES = Histogram("dstorage_stage_duration_seconds", "Длительность этапов обработки запроса",
+                   ("stage",))
+PARSE = STAGES.labels("parse")
+ROUTE = STAGES.labels("route")
+UPSTREAM_CONNECT = STAGES.labels("upstream_connect")
+UPSTREAM_TRANSFER = STAGES.labels("upstream_transfer")
+DISK_READ = STAGES.labels("disk_read")
+DISK_WRITE = STAGES.labels("disk_write")
+FSYNC = STAGES.labels("fsync")
+# Средний размер группы fsync у нод: DURABLE_WRITES / GROUP_COMMITS
+DURABLE_WRITES = Counter("dstorage_durable_writes_total", "Записи, дождавшиеся fsync")
+GROUP_COMMITS = Counter("dstorage_group_commits_total",
+                        "fsync, подтвердившие записи (один на группу в режиме batch)")
+
+# Защита мастера от перегрузки (admission.py)
+COALESCED = Counter("dstorage_coalesced_requests_total",
+                    "GET, получившие ответ одинакового запроса к ноде, который уже шёл")
+REJECTED = Counter("dstorage_rejected_requests_total",
+                   "Запросы, отклонённые без обращения к нодам", ("reason",))
+
+# Имена маршрутов для метки route: ключ в метку не попадает
+ROUTES = {"/storage": "/storage", "/storage/_batch": "/storage/_batch", "/node": "/node",
+          "/register": "/register", "/stats": "/stats", "/health": "/health",
+          "/rebalance": "/rebalance", PATH: PATH}
+
+def route_label(path):
+    route = ROUTES.get(path)
+    if route is not None:
+        return route
+    if path.startswith("/storage/"):
+        return "/storage/{key}"
+    if path.startswith("/node/"):
+        return "/node/{id}"
+    return "other"
+
+def request_started():
+    IN_FLIGHT.inc()
+    return time.perf_counter()
+
+def request_finished(req, code, sent, start):
+    """Учитывает ответ на req, отправленный за sent байт. Возвращает длительность, с."""
+    elapsed = time.perf_counter() - start
+    route = route_label(req.path)
+    duration = DURATION.labels(route)
+    received = req.head_size + req.stream.received
+    with _requests_lock:
+        IN_FLIGHT.add((), -1)
+        REQUESTS.add((req.method, route, code), 1)
+        BYTES_IN.add((), received)
+        BYTES_OUT.add((), sent)
+    duration.observe(elapsed)
+    return elapsed
@@ -0,0 +1,120 @@
+# pool.py
+# Пул keep-alive соединений от мастера к одной рабочей ноде.
+import asyncio
+import select
+import socket
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 8
+# Меньше KEEPALIVE_TIMEOUT ноды, чтобы не получать соединения, закрытые той стороной
+DEFAULT_IDLE_TIMEOUT = 30
+
+def _is_alive(sock):
+    """Проверка простаивающего сокета: живое соединение не читается без запроса.
+
+    Если сокет готов к чтению, нода либо закрыла его (EOF), либо прислала
+    лишние байты — в обоих случаях переиспользовать его нельзя.
+    """
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    return not readable
+
+class ConnectionPool:
+    def __init__(self, host, port, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # [(sock, время возврата)], последний — самый свежий
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self, timeout, fresh=False):
+        """Возвращает (сокет, reused). reused=True — соединение взято из пула.
+
+        fresh=True — всегда открыть новое соединение.
+        """
+        now = time.monotonic()
+        while not fresh:
+            with self._lock:
+                if not self._idle:
+                    break
+                sock, released_at = self._idle.pop()
+            if now - released_at < self.idle_timeout and _is_alive(sock):
+                sock.settimeout(timeout)
+                return sock, True
+            sock.close()
+        sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, False
+
+    def release(self, sock, reusable=True):
+        """Возвращает соединение в пул; лишние и сломанные закрываются."""
+        if reusable:
+            with self._lock:
+                if not self._closed and len(self._idle) < self.max_size:
+                    self._idle.append((sock, time.monotonic()))
+                    return
+        sock.close()
+
+    def evict_idle(self):
+        """Закрывает соединения, простоявшие дольше idle_timeout."""
+        deadline = time.monotonic() - self.idle_timeout
+        with self._lock:
+            stale = [s for s, t in self._idle if t < deadline]
+            self._idle = [(s, t) for s, t in self._idle if t >= deadline]
+        for sock in stale:
+            sock.close()
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for sock, _ in idle:
+            sock.close()
+
+class AsyncConnectionPool:
+    """Тот же пул для asyncio-режима мастера: хранит пары (reader, writer)."""
+
+    def __init__(self, host, port, max_size=DEFAULT_POOL_SIZE, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self._idle = []  # [(reader, writer, время возврата)]
+        self._closed = False
+
+    async def acquire(self, fresh=False):
+        now = time.monotonic()
+        while self._idle and not fresh:
+            reader, writer, released_at = self._idle.pop()
+            # Закрытое нодой соединение видно по EOF в буфере reader
+            if (now - released_at < self.idle_timeout and not reader.at_eof()
+                    and not writer.is_closing()):
+                return reader, writer, True
+            writer.close()
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return reader, writer, False
+
+    def release(self, reader, writer, reusable=True):
+        if reusable and not self._closed and len(self._idle) < self.max_size:
+            self._idle.append((reader, writer, time.monotonic()))
+        else:
+            writer.close()
+
+    def evict_idle(self):
+        deadline = time.monotonic() - self.idle_timeout
+        for _, writer, t in self._idle:
+            if t < deadline:
+                writer.close()
+        self._idle = [item for item in self._idle if item[2] >= deadline]
+
+    def close(self):
+        self._closed = True
+        for _, writer, _ in self._idle:
+            writer.close()
+        self._idle = []
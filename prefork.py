@@ -0,0 +1,89 @@
+# prefork.py
+# Несколько процессов на одном порту (--processes у мастера и нод).
+# Процессы создаются fork до запуска потоков; каждый слушает порт своим
+# сокетом с SO_REUSEPORT, и ядро раздаёт им входящие соединения. Родитель
+# следит за ними: если один завершился, останавливаются все. Если родитель
+# убит (SIGKILL), процессы замечают это и завершаются сами: иначе они
+# остались бы на порту и принимали бы соединения вместо нового запуска.
+import os
+import signal
+import socket
+import threading
+
+def listen_socket(host, port, reuse_port=False):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(socket.SOMAXCONN)
+    return sock
+
+def fork(count):
+    """Создаёт count процессов.
+
+    Возвращает (номер процесса, None) в потомке и (None, [pid]) в родителе.
+    Вызывать до запуска потоков: fork копирует только вызвавший поток.
+    """
+    # Конец канала для записи есть только у родителя: когда он завершится,
+    # чтение в потомке вернёт конец файла
+    read_end, write_end = os.pipe()
+    pids = []
+    for index in range(count):
+        pid = os.fork()
+        if pid == 0:
+            os.close(write_end)
+            threading.Thread(target=_watch_parent, args=(read_end,), daemon=True).start()
+            return index, None
+        pids.append(pid)
+    os.close(read_end)
+    return None, pids
+
+def _watch_parent(fd):
+    os.read(fd, 1)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+def stop(pids):
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+def wait(pids):
+    """Дожидается завершения процессов pids."""
+    for pid in pids:
+        try:
+            os.waitpid(pid, 0)
+        except ChildProcessError:
+            pass
+
+def supervise(pids):
+    """Ждёт процессы pids; первый завершившийся останавливает остальные.
+
+    SIGTERM и SIGINT родителя тоже останавливают их; вызывать из главного
+    потока. Возвращает код выхода: 0, если процессы остановлены сигналом
+    родителю, иначе 1.
+    """
+    remaining = set(pids)
+    stopping = failed = False
+
+    def on_signal(sig, frame):
+        nonlocal stopping
+        stopping = True
+        stop(remaining)
+
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGINT, on_signal)
+    while remaining:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        remaining.discard(pid)
+        if not stopping:
+            print(f"Процесс {pid} завершился (код {os.waitstatus_to_exitcode(status)}), "
+                  f"остальные останавливаются")
+            stopping = failed = True
+            stop(remaining)
+    return 1 if failed else 0
@@ -0,0 +1,99 @@
+# rebalance.py
+# Перенос ключей при смене состава нод: какие ключи куда копировать,
+# ограничение скорости и учёт прогресса. Запросы к нодам выполняет мастер.
+import threading
+import time
+
+# Ключей в одной странице списка, запрашиваемой у ноды-источника
+PAGE = 1000
+# Ограничение скорости переноса по умолчанию, МиБ/с
+DEFAULT_RATE_MB = 20
+# Ключей в пакете переноса
+BATCH = 100
+# Значения длиннее переносятся по одному потоком, а не в пакете
+BATCH_VALUE = 64 * 1024
+# Пакетов, переносимых параллельно
+DEFAULT_THREADS = 4
+
+class Migration:
+    """Переход от старого кольца к новому.
+
+    sources — {id ноды: запись ноды с адресом}: все ноды старого кольца,
+    включая ушедшую, — с них забираются ключи. floor — версия для ключей,
+    записанных без версии: новее надгробий прошлых переносов, но старше
+    любой записи, сделанной мастером после смены кольца.
+    """
+
+    def __init__(self, old_ring, new_ring, sources, replicas, floor):
+        self.old_ring = old_ring
+        self.new_ring = new_ring
+        self.sources = sources
+        self.replicas = replicas
+        self.floor = floor
+        self.started = time.time()
+        self.finished = None
+        self._lock = threading.Lock()
+        self.stats = {"sources_total": len(sources), "sources_done": 0, "keys_scanned": 0,
+                      "keys_copied": 0, "keys_dropped": 0, "bytes_copied": 0, "errors": 0}
+
+    def plan(self, key, source_id):
+        """Для ключа на ноде source_id: (ноды, куда копировать, забрать ли ключ с источника).
+
+        Ключ копирует только источник, выпадающий из набора владельцев, и
+        только на новых владельцев: остальные реплики у них уже есть. Ключ,
+        оказавшийся на ноде не по кольцу, копируется всем владельцам.
+        """
+        new = self.new_ring.get_nodes(key, self.replicas)
+        if source_id in new:
+            return [], False
+        old = self.old_ring.get_nodes(key, self.replicas)
+        if source_id not in old:
+            return new, True
+        return [n for n in new if n not in old], True
+
+    def old_owners(self, key):
+        return self.old_ring.get_nodes(key, self.replicas)
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def finish(self):
+        self.finished = time.time()
+
+    def progress(self):
+        with self._lock:
+            result = dict(self.stats)
+        elapsed = (self.finished or time.time()) - self.started
+        result.update(
+            old_nodes=sorted(self.old_ring.nodes),
+            new_nodes=sorted(self.new_ring.nodes),
+            done=self.finished is not None,
+            elapsed_s=round(elapsed, 3),
+            keys_per_s=round(result["keys_copied"] / elapsed, 1) if elapsed > 0 else 0.0,
+            mb_per_s=round(result["bytes_copied"] / elapsed / 1024 / 1024, 3) if elapsed > 0 else 0.0,
+        )
+        return result
+
+class Throttle:
+    """Ограничение средней скорости переноса до rate байт в секунду (0 — без ограничения).
+
+    Каждая передача занимает интервал времени по своему размеру; если
+    интервалы идут вплотную, следующая передача ждёт начала своего.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._lock = threading.Lock()
+        self._next_free = time.monotonic()
+
+    def wait(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_free)
+            self._next_free = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
@@ -0,0 +1,1557 @@
+# storage.py
+# Движки хранения рабочей ноды: файл на ключ (исходная раскладка) и
+# журнал с дописыванием в стиле Bitcask. Сброс записей на диск — общий
+# для обоих движков (Durability).
+import array
+import bisect
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+import compress
+import metrics
+
+CHUNK_SIZE = 64 * 1024
+# Значения FileEngine крупнее этого не копируются в журнал упреждающей
+# записи: их файл сбрасывается на диск сам
+WAL_VALUE_LIMIT = 1024 * 1024
+# Открытых дескрипторов файлов значений в LRU FileEngine
+HANDLE_CACHE_SIZE = 256
+# С этой длины чтение значения подсказывается ядру как последовательное
+SEQUENTIAL_READ = 1024 * 1024
+# Сколько байт такого чтения ядро начинает подкачивать заранее
+READAHEAD = 8 * 1024 * 1024
+# Префикс временных файлов FileEngine: имена файлов значений — hex-хэши
+TMP_PREFIX = "#"
+# Каталогов раскладки FileEngine (value_path)
+FANOUT = 16 ** 3
+# Файл значения FileEngine: метка | crc32 значения | длина значения |
+# длина ключа | ключ | значение. Исходный ключ хранится в файле: по нему
+# индекс восстанавливается без манифеста.
+FILE_MAGIC = b"DSF1"
+FILE_HEADER = struct.Struct(">4sIQI")
+# Столько байт ключа читается вместе с заголовком одним pread
+KEY_PEEK = 1024
+# Потоков чтения заголовков при старте без манифеста
+SCAN_THREADS = 8
+# Манифест индекса FileEngine: метка | crc32 остального | записи
+# (длина значения | время изменения | crc32 значения | сводка заголовка
+# сжатия | длина ключа | ключ)
+MANIFEST_MAGIC = b"DSM2"
+MANIFEST_RECORD = struct.Struct(">QdIQI")
+
+def advise_read(fd, offset, length):
+    """Подсказка ядру перед отправкой length байт файла с offset.
+
+    Крупное значение читается подряд: окно упреждающего чтения
+    увеличивается, а начало диапазона подкачивается сразу.
+    """
+    if length < SEQUENTIAL_READ or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_SEQUENTIAL)
+        os.posix_fadvise(fd, offset, min(length, READAHEAD), os.POSIX_FADV_WILLNEED)
+    except OSError:
+        pass
+
+def value_path(key):
+    """Путь файла значения FileEngine относительно каталога данных: abc/<хэш ключа>.
+
+    Хэш — 128 бит BLAKE2b: у разных ключей разные файлы (совпадение
+    практически невозможно), а FANOUT каталогов по первым трём цифрам
+    хэша оставляют в каждом пару тысяч файлов и при 10 млн ключей.
+    """
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(digest[:3], digest)
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+class SortedKeys:
+    """Отсортированное множество строк для постраничного списка ключей.
+
+    Хранится блоками по BLOCK..2*BLOCK ключей: вставка и удаление сдвигают
+    только один блок, а не весь список. Не потокобезопасно — защищается
+    блокировкой движка.
+    """
+
+    BLOCK = 1000
+
+    def __init__(self, keys=()):
+        keys = sorted(set(keys))
+        self._blocks = [keys[i:i + self.BLOCK] for i in range(0, len(keys), self.BLOCK)]
+        self._maxes = [block[-1] for block in self._blocks]
+
+    def __len__(self):
+        return sum(len(block) for block in self._blocks)
+
+    def add(self, key):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            return
+        i = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+        block = self._blocks[i]
+        j = bisect.bisect_left(block, key)
+        if j < len(block) and block[j] == key:
+            return
+        block.insert(j, key)
+        self._maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK:
+            half = self.BLOCK
+            self._blocks[i:i + 1] = [block[:half], block[half:]]
+            self._maxes[i:i + 1] = [block[half - 1], block[-1]]
+
+    def discard(self, key):
+        i = bisect.bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return
+        block = self._blocks[i]
+        j = bisect.bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return
+        del block[j]
+        if block:
+            self._maxes[i] = block[-1]
+        else:
+            del self._blocks[i]
+            del self._maxes[i]
+
+    def page(self, prefix="", after=None, count=1000):
+        """До count ключей с префиксом prefix, строго больших after."""
+        if after is not None and after >= prefix:
+            find, low = bisect.bisect_right, after
+        else:
+            find, low = bisect.bisect_left, prefix
+        i = find(self._maxes, low)
+        if i == len(self._maxes):
+            return []
+        j = find(self._blocks[i], low)
+        result = []
+        while i < len(self._blocks):
+            for key in self._blocks[i][j:]:
+                if not key.startswith(prefix):
+                    return result
+                result.append(key)
+                if len(result) == count:
+                    return result
+            i += 1
+            j = 0
+        return result
+
+class KeyIndex:
+    """Метаданные ключей FileEngine в памяти: ключ -> номер слота.
+
+    Длина значения, время изменения, crc32 и сводка заголовка сжатия
+    (compress.frame_of) лежат в массивах по номеру слота, а не кортежем
+    на ключ: 28 байт на ключ вместо четырёх объектов.
+    Слоты удалённых ключей занимаются снова. Не потокобезопасно —
+    защищается блокировкой движка.
+    """
+
+    def __init__(self):
+        self._slots = {}
+        self._sizes = array.array('Q')
+        self._mtimes = array.array('d')
+        self._crcs = array.array('I')
+        self._frames = array.array('Q')
+        self._free = []
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __iter__(self):
+        return iter(self._slots)
+
+    def get(self, key):
+        """(длина, время изменения, crc32, сводка заголовка) или None."""
+        slot = self._slots.get(key)
+        if slot is None:
+            return None
+        return self._sizes[slot], self._mtimes[slot], self._crcs[slot], self._frames[slot]
+
+    def items(self):
+        for key, slot in self._slots.items():
+            yield key, self._sizes[slot], self._mtimes[slot], self._crcs[slot], self._frames[slot]
+
+    def set(self, key, size, mtime, crc, frame):
+        """Записывает метаданные ключа. Возвращает True, если ключ новый."""
+        slot = self._slots.get(key)
+        new = slot is None
+        if new:
+            if self._free:
+                slot = self._free.pop()
+            else:
+                slot = len(self._sizes)
+                self._sizes.append(0)
+                self._mtimes.append(0.0)
+                self._crcs.append(0)
+                self._frames.append(0)
+            self._slots[key] = slot
+        self._sizes[slot] = size
+        self._mtimes[slot] = mtime
+        self._crcs[slot] = crc
+        self._frames[slot] = frame
+        return new
+
+    def remove(self, key):
+        slot = self._slots.pop(key, None)
+        if slot is not None:
+            self._free.append(slot)
+
+# --- Долговечность записи ---
+# none — без fsync: запись переживает падение процесса, но не ОС;
+# batch — групповая запись: одновременные записи ждут один общий fsync;
+# always — fsync после каждой записи.
+DURABILITY_MODES = ("none", "batch", "always")
+# Сколько ведущий группы ждёт записи, которые уже начались, с
+COMMIT_WINDOW = 0.002
+
+class _CommitGroup:
+    __slots__ = ("fds", "writes", "done", "error")
+
+    def __init__(self):
+        self.fds = set()
+        self.writes = 0
+        self.done = False
+        self.error = None
+
+class Durability:
+    """Сброс записей движка на диск в режиме mode.
+
+    Писатель вызывает begin() перед записью и end(fd) после неё; end
+    возвращается, когда записанное в fd уже на диске. В режиме batch
+    первый закончивший запись становится ведущим группы: пока другие
+    начатые записи не закончились, он ждёт их, но не дольше window, и
+    затем делает один fsync на каждый дескриптор группы. Записи,
+    закончившиеся во время этого fsync, собираются в следующую группу.
+    """
+
+    def __init__(self, mode="none", window=COMMIT_WINDOW):
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        self.mode = mode
+        self.window = window
+        self._cond = threading.Condition()
+        # Начатые и ещё не законченные записи
+        self._writing = 0
+        self._group = _CommitGroup()
+        self._leader = False
+
+    def begin(self):
+        if self.mode == "batch":
+            with self._cond:
+                self._writing += 1
+
+    def end(self, fd=None):
+        """Конец записи в fd; fd=None — запись не удалась, ждать нечего."""
+        if self.mode == "none":
+            return
+        if self.mode == "always":
+            if fd is not None:
+                _fsync(fd)
+                metrics.GROUP_COMMITS.inc()
+                metrics.DURABLE_WRITES.inc()
+            return
+        with self._cond:
+            self._writing -= 1
+            # Ведущий ждёт окончания начатых записей
+            self._cond.notify_all()
+            if fd is None:
+                return
+            group = self._group
+            group.fds.add(fd)
+            group.writes += 1
+            while self._leader and not group.done:
+                self._cond.wait()
+            if group.done:
+                if group.error is not None:
+                    raise group.error
+                return
+            self._leader = True
+            deadline = time.monotonic() + self.window
+            while self._writing > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._group = _CommitGroup()
+        try:
+            for group_fd in group.fds:
+                _fsync(group_fd)
+        except OSError as e:
+            group.error = e
+        with self._cond:
+            group.done = True
+            self._leader = False
+            self._cond.notify_all()
+        metrics.GROUP_COMMITS.inc()
+        metrics.DURABLE_WRITES.inc(value=group.writes)
+        if group.error is not None:
+            raise group.error
+
+    def sync_dir(self, path):
+        """Сбрасывает на диск записи каталога (создание, переименование файлов)."""
+        if self.mode == "none":
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            _fsync(fd)
+        finally:
+            os.close(fd)
+
+class FileEngine:
+    """Каждый ключ — отдельный файл в каталоге данных.
+
+    Имя файла — хэш ключа (value_path), а сам ключ, длина и crc32 значения
+    записаны в заголовке файла (FILE_HEADER). Индекс ключей с их
+    метаданными держится в памяти (KeyIndex): промах не обращается к
+    диску, а длина, время изменения, crc32 и заголовок сжатия для HEAD и
+    ETag берутся из него. При открытии индекс читается из манифеста, который записал
+    close(), а после аварийного завершения строится чтением заголовков
+    всех файлов в SCAN_THREADS потоках. Файлы прежней раскладки (имя из
+    ключа прямо в каталоге данных) переводятся в новую при открытии.
+
+    Значение пишется во временный файл и переименовывается поверх старого,
+    поэтому перезапись атомарна. В режимах batch и always запись сначала
+    попадает в журнал упреждающей записи (WriteAheadLog) рядом с каталогом
+    и ждёт fsync журнала, а не своего файла: одновременные PUT разных
+    ключей делят один fsync. Значения крупнее WAL_VALUE_LIMIT в журнал не
+    копируются — запись на диск вдвое дороже одного fsync их файла.
+
+    Файл значения после переименования не меняется, поэтому дескрипторы
+    недавно прочитанных файлов и их размеры держатся в LRU (_handles):
+    GET получает копию дескриптора (dup) без открытия файла по пути.
+    """
+
+    name = "files"
+
+    def __init__(self, data_dir, durability=None, handle_cache=HANDLE_CACHE_SIZE):
+        self.data_dir = data_dir
+        self.durability = durability or Durability()
+        os.makedirs(data_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # ключ -> (дескриптор, размер)
+        self._handles = OrderedDict()
+        self._handle_cache = handle_cache
+        # Растёт при каждой замене файла: дескриптор, открытый до неё,
+        # в LRU не кладётся
+        self._generation = 0
+        # Каталоги раскладки, которые уже точно есть на диске
+        self._dirs = set()
+        self._index = KeyIndex()
+        self._manifest = data_dir + ".manifest"
+        self._migrate()
+        self._wal = None
+        replayed = False
+        if self.durability.mode != "none":
+            self._wal = WriteAheadLog(data_dir + ".wal", self.durability)
+            replayed = self._replay()
+        # После применения журнала манифест устарел
+        if not self._load_manifest(valid=not replayed):
+            self._scan()
+        self._sorted = SortedKeys(self._index)
+
+    def _path(self, key):
+        return os.path.join(self.data_dir, value_path(key))
+
+    def _ensure_dir(self, path):
+        """Создаёт каталог файла path при первой записи в него."""
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            try:
+                os.mkdir(directory)
+                # Без этого после сбоя ОС новый каталог мог бы пропасть вместе с файлами
+                self.durability.sync_dir(self.data_dir)
+            except FileExistsError:
+                pass
+            self._dirs.add(directory)
+
+    def _write_temp(self, path, key_bytes, chunks):
+        """Пишет заголовок и значение во временный файл для path.
+
+        Возвращает (открытый файл, путь временного файла, длина, crc32,
+        сводка заголовка сжатия).
+        Длина и crc32 попадают в заголовок после значения. Временные файлы
+        создаются в корне каталога данных, который всегда в кэше, — это
+        дешевле, чем в одном из FANOUT каталогов, а переименование в
+        каталог раскладки так же атомарно.
+        """
+        self._ensure_dir(path)
+        fd, tmp = tempfile.mkstemp(dir=self.data_dir, prefix=TMP_PREFIX)
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(FILE_HEADER.pack(FILE_MAGIC, 0, 0, len(key_bytes)) + key_bytes)
+            size = crc = 0
+            head = b""
+            for chunk in chunks:
+                f.write(chunk)
+                if len(head) < compress.HEADER.size:
+                    head += chunk[:compress.HEADER.size - len(head)]
+                size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+            f.flush()
+            _pwrite_all(f.fileno(), FILE_HEADER.pack(FILE_MAGIC, crc, size, len(key_bytes)), 0)
+        except BaseException:
+            f.close()
+            _remove(tmp)
+            raise
+        return f, tmp, size, crc, compress.frame_of(head)
+
+    def _migrate(self):
+        """Переводит файлы прежней раскладки в новую.
+
+        Прежде имя файла было ключом с заменой всех символов, кроме букв,
+        цифр и '._-', на '_', поэтому исходный ключ не восстановить:
+        ключом становится само имя, как его и показывал список ключей.
+        """
+        names = []
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                if entry.name.startswith(TMP_PREFIX):
+                    # Недописанное значение прерванного PUT
+                    os.remove(entry.path)
+                else:
+                    names.append(entry.name)
+        for name in names:
+            old = os.path.join(self.data_dir, name)
+            path = self._path(name)
+            with open(old, 'rb') as src:
+                f, tmp, _, _, _ = self._write_temp(path, name.encode('utf-8'),
+                                                   iter(lambda: src.read(CHUNK_SIZE), b""))
+            with f:
+                if self.durability.mode != "none":
+                    _fsync(f.fileno())
+            os.rename(tmp, path)
+            self.durability.sync_dir(os.path.dirname(path))
+            # Прерванный перевод повторится со следующим стартом
+            os.remove(old)
+        if names:
+            self.durability.sync_dir(self.data_dir)
+            print(f"[storage] {self.data_dir}: файлов переведено в новую раскладку: {len(names)}")
+
+    def _replay(self):
+        """Применяет записи журнала к файлам и очищает журнал.
+
+        Каждая запись заменяет файл целиком, поэтому применяется только
+        последняя запись каждого ключа. Возвращает True, если журнал не был пуст.
+        """
+        records = self._wal.records()
+        last = {}
+        for flags, key, value_offset, value_len in records:
+            if not flags & FLAG_PADDING:
+                last[key] = (flags, value_offset, value_len)
+        for key, (flags, value_offset, value_len) in last.items():
+            if flags & FLAG_EXTERNAL:
+                continue
+            path = self._path(key)
+            if flags & FLAG_TOMBSTONE:
+                _remove(path)
+                continue
+            f, tmp, _, _, _ = self._write_temp(path, key.encode('utf-8'),
+                                               self._wal.read(value_offset, value_len))
+            f.close()
+            os.rename(tmp, path)
+            self._wal.touched.add(path)
+        if records:
+            print(f"[storage] журнал {self._wal.path}: применено записей: {len(records)}")
+        self._wal.checkpoint(self.data_dir, force=True)
+        return bool(records)
+
+    def _load_manifest(self, valid=True):
+        """Заполняет индекс из манифеста и удаляет манифест.
+
+        Возвращает False, если манифеста нет, он повреждён или не valid:
+        тогда индекс строит _scan. Манифест удаляется до первой записи,
+        иначе после сбоя следующий старт принял бы устаревший.
+        """
+        _remove(self._manifest + ".tmp")
+        try:
+            with open(self._manifest, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return False
+        os.remove(self._manifest)
+        self.durability.sync_dir(os.path.dirname(self._manifest) or ".")
+        if not valid:
+            return False
+        if (data[:4] != MANIFEST_MAGIC or len(data) < 8
+                or struct.unpack(">I", data[4:8])[0] != zlib.crc32(memoryview(data)[8:])):
+            print(f"[storage] манифест {self._manifest} повреждён, индекс строится заново")
+            return False
+        pos = 8
+        while pos < len(data):
+            size, mtime, crc, frame, key_len = MANIFEST_RECORD.unpack_from(data, pos)
+            pos += MANIFEST_RECORD.size
+            self._index.set(data[pos:pos + key_len].decode('utf-8'), size, mtime, crc, frame)
+            pos += key_len
+        return True
+
+    def _save_manifest(self):
+        """Записывает индекс в манифест: следующий старт не читает заголовки файлов."""
+        parts = []
+        with self._lock:
+            for key, size, mtime, crc, frame in self._index.items():
+                key_bytes = key.encode('utf-8')
+                parts.append(MANIFEST_RECORD.pack(size, mtime, crc, frame, len(key_bytes))
+                             + key_bytes)
+        data = b"".join(parts)
+        tmp = self._manifest + ".tmp"
+        with open(tmp, 'wb') as f:
+            f.write(MANIFEST_MAGIC + struct.pack(">I", zlib.crc32(data)))
+            f.write(data)
+            f.flush()
+            if self.durability.mode != "none":
+                _fsync(f.fileno())
+        os.rename(tmp, self._manifest)
+        self.durability.sync_dir(os.path.dirname(self._manifest) or ".")
+
+    def _scan(self):
+        """Строит индекс по заголовкам файлов значений.
+
+        Каталоги раскладки читаются в SCAN_THREADS потоках: open и pread
+        отпускают GIL, и на холодном диске запросы идут параллельно.
+        """
+        with os.scandir(self.data_dir) as entries:
+            dirs = [entry.path for entry in entries if entry.is_dir() and len(entry.name) == 3]
+        if not dirs:
+            return
+        start = time.perf_counter()
+        with ThreadPoolExecutor(SCAN_THREADS) as executor:
+            for found in executor.map(_scan_dir, dirs):
+                for key, size, mtime, crc, frame in found:
+                    self._index.set(key, size, mtime, crc, frame)
+        print(f"[storage] {self.data_dir}: индекс из {len(self._index)} ключей построен "
+              f"за {time.perf_counter() - start:.2f} с")
+
+    def put(self, key, chunks, length=None):
+        """Записывает значение по кускам. Возвращает его размер; 0 — ничего не записано."""
+        staged = self.stage(key, chunks, length)
+        if staged is None:
+            return 0
+        return self.publish(staged)
+
+    def stage(self, key, chunks, length=None):
+        """Пишет значение во временный файл, не трогая ключ.
+
+        Возвращает запись для publish() или discard(); None — значение
+        пустое. Тело читается здесь, поэтому вызывающему не нужно держать
+        блокировку ключа, пока оно приходит.
+        """
+        path = self._path(key)
+        f, tmp, size, crc, frame = self._write_temp(path, key.encode('utf-8'), chunks)
+        try:
+            if size == 0:
+                f.close()
+                os.remove(tmp)
+                return None
+            if self._wal is not None and size > WAL_VALUE_LIMIT:
+                _fsync(f.fileno())
+        except BaseException:
+            f.close()
+            _remove(tmp)
+            raise
+        return key, path, f, tmp, size, crc, frame
+
+    def publish(self, staged):
+        """Делает записанное stage() значением ключа. Возвращает его размер."""
+        key, path, f, tmp, size, crc, frame = staged
+        try:
+            with f:
+                external = size > WAL_VALUE_LIMIT
+                if self._wal is not None and not external:
+                    # В журнал идёт только значение, без заголовка файла
+                    self._wal.append(key, size, f.fileno(),
+                                     offset=FILE_HEADER.size + len(key.encode('utf-8')))
+            if self._wal is None:
+                os.rename(tmp, path)
+                self._forget(key)
+            elif external:
+                os.rename(tmp, path)
+                self.durability.sync_dir(os.path.dirname(path))
+                # Отметка в журнале, чтобы восстановление не вернуло
+                # прежнее значение из более ранней записи
+                self._forget(key)
+                self._wal.append(key, 0, flags=FLAG_EXTERNAL)
+                self._wal.applied(path)
+            else:
+                try:
+                    os.rename(tmp, path)
+                    self._forget(key)
+                finally:
+                    self._wal.applied(path)
+        except BaseException:
+            _remove(tmp)
+            raise
+        with self._lock:
+            if self._index.set(key, size, time.time(), crc, frame):
+                self._sorted.add(key)
+        if self._wal is not None:
+            self._wal.checkpoint(self.data_dir)
+        return size
+
+    def discard(self, staged):
+        """Отменяет запись stage()."""
+        f, tmp = staged[2], staged[3]
+        f.close()
+        _remove(tmp)
+
+    def get(self, key):
+        """Возвращает (файл, смещение, длина) для отправки или None.
+
+        Ключа нет в индексе — None без обращения к диску.
+        """
+        offset = FILE_HEADER.size + len(key.encode('utf-8'))
+        with self._lock:
+            if key not in self._index:
+                return None
+            handle = self._handles.get(key)
+            if handle is not None:
+                self._handles.move_to_end(key)
+                return os.fdopen(os.dup(handle[0]), 'rb'), offset, handle[1]
+            generation = self._generation
+        try:
+            fd = os.open(self._path(key), os.O_RDONLY)
+        except FileNotFoundError:
+            return None
+        size = os.fstat(fd).st_size - offset
+        if self._handle_cache:
+            with self._lock:
+                if generation == self._generation and key not in self._handles:
+                    self._handles[key] = (fd, size)
+                    while len(self._handles) > self._handle_cache:
+                        os.close(self._handles.popitem(last=False)[1][0])
+                    fd = os.dup(fd)
+        return os.fdopen(fd, 'rb'), offset, size
+
+    def stat(self, key):
+        """(длина, время изменения, crc32, сводка заголовка сжатия) из индекса или None."""
+        with self._lock:
+            return self._index.get(key)
+
+    def _forget(self, key):
+        """Убирает из LRU дескриптор заменённого или удалённого файла ключа."""
+        with self._lock:
+            self._generation += 1
+            handle = self._handles.pop(key, None)
+        if handle is not None:
+            os.close(handle[0])
+
+    def delete(self, key):
+        with self._lock:
+            if key not in self._index:
+                return False
+        path = self._path(key)
+        if self._wal is not None:
+            self._wal.append(key, 0, flags=FLAG_TOMBSTONE)
+        existed = True
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            existed = False
+        finally:
+            self._forget(key)
+            if self._wal is not None:
+                self._wal.applied(path)
+        with self._lock:
+            self._index.remove(key)
+            self._sorted.discard(key)
+        return existed
+
+    def list_keys(self, prefix="", after=None, count=1000):
+        with self._lock:
+            return self._sorted.page(prefix, after, count)
+
+    def close(self):
+        with self._lock:
+            for fd, _ in self._handles.values():
+                os.close(fd)
+            self._handles.clear()
+        if self._wal is not None:
+            self._wal.checkpoint(self.data_dir, force=True)
+            self._wal.close()
+        self._save_manifest()
+
+def _read_file_header(path):
+    """(ключ, длина значения, время изменения, crc32, сводка заголовка сжатия) файла значения.
+
+    None — файл не целый: чужой, оборванный или с неверной длиной.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        st = os.fstat(fd)
+        data = os.pread(fd, FILE_HEADER.size + KEY_PEEK, 0)
+        if len(data) < FILE_HEADER.size:
+            return None
+        magic, crc, size, key_len = FILE_HEADER.unpack_from(data)
+        end = FILE_HEADER.size + key_len
+        if magic != FILE_MAGIC or end + size != st.st_size:
+            return None
+        # Заголовок сжатия в начале значения — для HEAD без чтения файла
+        head_end = end + min(size, compress.HEADER.size)
+        if len(data) < head_end:
+            data += os.pread(fd, head_end - len(data), len(data))
+        return (data[FILE_HEADER.size:end].decode('utf-8'), size, st.st_mtime, crc,
+                compress.frame_of(data[end:head_end]))
+    except UnicodeDecodeError:
+        return None
+    finally:
+        os.close(fd)
+
+def _scan_dir(directory):
+    """Заголовки файлов значений в каталоге раскладки."""
+    found = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            item = _read_file_header(entry.path)
+            if item is None:
+                print(f"[storage] {entry.path}: повреждённый файл значения пропущен")
+                continue
+            found.append(item)
+    return found
+
+# --- Журнал (Bitcask) ---
+# Запись: crc32 | флаги | длина ключа | длина значения | ключ | значение.
+# CRC покрывает всё после себя. Значение большого PUT пишется прямо в
+# зарезервированное место сегмента, поэтому писатели не ждут друг друга.
+HEADER = struct.Struct(">IBIQ")
+# Запись hint-файла: флаги | длина ключа | длина значения | смещение значения | ключ
+HINT = struct.Struct(">BIQQ")
+FLAG_TOMBSTONE = 1
+# Место неудавшейся записи: пропускается без проверки CRC
+FLAG_PADDING = 2
+# Журнал FileEngine: значение уже на диске в своём файле
+FLAG_EXTERNAL = 4
+
+SEGMENT_SIZE = 64 * 1024 * 1024
+MAINTENANCE_INTERVAL = 1.0
+COMPACT_INTERVAL = 60.0
+# Сжатие запускается, когда мусор составляет эту долю закрытых сегментов
+COMPACT_RATIO = 0.5
+COMPACT_MIN_DEAD = 16 * 1024 * 1024
+KEY_LOCKS = 256
+
+def _pwrite_all(fd, data, offset):
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+def _fsync(fd):
+    start = time.perf_counter()
+    os.fsync(fd)
+    metrics.FSYNC.since(start)
+
+def _header_crc(flags, key_len, value_len):
+    return zlib.crc32(HEADER.pack(0, flags, key_len, value_len)[4:])
+
+def _write_padding(fd, offset, size):
+    """Помечает область записи, которая не удалась, как пропуск."""
+    value_len = size - HEADER.size
+    try:
+        _pwrite_all(fd, HEADER.pack(_header_crc(FLAG_PADDING, 0, value_len),
+                                    FLAG_PADDING, 0, value_len), offset)
+    except OSError:
+        pass
+
+class _BlockReader:
+    """Последовательное чтение сегмента крупными блоками через pread."""
+
+    BLOCK = 1024 * 1024
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.start = 0
+        self.data = b""
+
+    def read(self, pos, size):
+        if not (self.start <= pos and pos + size <= self.start + len(self.data)):
+            self.start = pos
+            self.data = os.pread(self.fd, max(size, self.BLOCK), pos)
+        rel = pos - self.start
+        return self.data[rel:rel + size]
+
+def _scan_records(fd, size):
+    """Читает файл журнала с проверкой CRC. Возвращает (записи, конец последней целой записи).
+
+    Только pread: позицию дескриптора сдвигают отправки через sendfile.
+    """
+    entries = []
+    offset = 0
+    reader = _BlockReader(fd)
+    while offset + HEADER.size <= size:
+        crc, flags, key_len, value_len = HEADER.unpack(reader.read(offset, HEADER.size))
+        end = offset + HEADER.size + key_len + value_len
+        if end > size or key_len > size:
+            break
+        if flags & FLAG_PADDING:
+            if crc != _header_crc(flags, key_len, value_len):
+                break
+            entries.append((flags, "", end - value_len, value_len))
+            offset = end
+            continue
+        key_bytes = reader.read(offset + HEADER.size, key_len)
+        check = zlib.crc32(key_bytes, _header_crc(flags, key_len, value_len))
+        pos = end - value_len
+        while pos < end:
+            chunk = reader.read(pos, min(end - pos, CHUNK_SIZE))
+            check = zlib.crc32(chunk, check)
+            pos += len(chunk)
+        if check == crc:
+            entries.append((flags, key_bytes.decode('utf-8'), end - value_len, value_len))
+        # Запись с неверным CRC пропускается: её длины известны
+        offset = end
+    return entries, offset
+
+class WriteAheadLog:
+    """Журнал упреждающей записи FileEngine в формате сегментов LogEngine.
+
+    append() дописывает значение и ждёт fsync журнала, после чего движок
+    переименовывает файл значения и вызывает applied(). Файлы, изменённые
+    после записи в журнал, сбрасываются на диск контрольной точкой
+    (checkpoint), когда журнал перерастает CHECKPOINT_SIZE, — после неё
+    журнал очищается. При открытии движка записи журнала применяются
+    заново: это безопасно, потому что каждая из них заменяет файл целиком.
+    """
+
+    CHECKPOINT_SIZE = 64 * 1024 * 1024
+
+    def __init__(self, path, durability):
+        self.path = path
+        self.durability = durability
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        self._cond = threading.Condition()
+        # Записи журнала, ещё не применённые к файлам
+        self.pending = 0
+        self.checkpointing = False
+        # Файлы, изменённые после последней контрольной точки
+        self.touched = set()
+
+    def records(self):
+        """Целые записи журнала по порядку: (флаги, ключ, смещение значения, длина)."""
+        entries, _ = _scan_records(self.fd, self.size)
+        return entries
+
+    def read(self, offset, length):
+        """Значение записи журнала по кускам."""
+        end = offset + length
+        while offset < end:
+            chunk = os.pread(self.fd, min(end - offset, CHUNK_SIZE), offset)
+            if not chunk:
+                raise OSError(f"журнал {self.path} короче записи")
+            yield chunk
+            offset += len(chunk)
+
+    def append(self, key, length, src_fd=None, flags=0, offset=0):
+        """Дописывает значение (length байт файла src_fd с offset) или отметку flags и ждёт fsync.
+
+        После append запись надо применить и вызвать applied(), даже если
+        применение не удалось: до этого контрольная точка ждёт.
+        """
+        key_bytes = key.encode('utf-8')
+        size = HEADER.size + len(key_bytes) + length
+        src_offset = offset
+        with self._cond:
+            while self.checkpointing:
+                self._cond.wait()
+            offset = self.size
+            self.size += size
+            self.pending += 1
+        self.durability.begin()
+        try:
+            crc = zlib.crc32(key_bytes, _header_crc(flags, len(key_bytes), length))
+            pos = offset + HEADER.size + len(key_bytes)
+            copied = 0
+            while copied < length:
+                chunk = os.pread(src_fd, min(length - copied, CHUNK_SIZE), src_offset + copied)
+                if not chunk:
+                    raise ValueError("Body length mismatch")
+                _pwrite_all(self.fd, chunk, pos + copied)
+                crc = zlib.crc32(chunk, crc)
+                copied += len(chunk)
+            _pwrite_all(self.fd, HEADER.pack(crc, flags, len(key_bytes), length) + key_bytes,
+                        offset)
+        except BaseException:
+            self.durability.end(None)
+            _write_padding(self.fd, offset, size)
+            self.applied(None)
+            raise
+        try:
+            self.durability.end(self.fd)
+        except BaseException:
+            self.applied(None)
+            raise
+
+    def applied(self, path):
+        """Запись журнала применена к файлу path (None — применять нечего)."""
+        with self._cond:
+            self.pending -= 1
+            if path is not None:
+                self.touched.add(path)
+            self._cond.notify_all()
+
+    def checkpoint(self, data_dir, force=False):
+        """Сбрасывает изменённые файлы на диск и очищает журнал.
+
+        Без force — только если журнал перерос CHECKPOINT_SIZE. Новые
+        записи ждут конца контрольной точки.
+        """
+        with self._cond:
+            if self.checkpointing or (not force and self.size < self.CHECKPOINT_SIZE):
+                return
+            self.checkpointing = True
+            while self.pending:
+                self._cond.wait()
+            touched, self.touched = self.touched, set()
+        try:
+            for path in touched:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                except FileNotFoundError:
+                    continue
+                try:
+                    _fsync(fd)
+                finally:
+                    os.close(fd)
+            for directory in {os.path.dirname(path) for path in touched}:
+                self.durability.sync_dir(directory)
+            self.durability.sync_dir(data_dir)
+            os.ftruncate(self.fd, 0)
+            # Иначе после сбоя за новыми записями могли бы найтись старые
+            _fsync(self.fd)
+            with self._cond:
+                self.size = 0
+        finally:
+            with self._cond:
+                self.checkpointing = False
+                self._cond.notify_all()
+
+    def close(self):
+        os.close(self.fd)
+
+class Segment:
+    def __init__(self, seg_id, path, fd, size=0):
+        self.id = seg_id
+        self.path = path
+        self.fd = fd
+        self.size = size
+        self.dead = 0
+        # Незавершённые записи в зарезервированные области
+        self.pending = 0
+        self.has_hint = False
+
+class _Staged:
+    """Запись LogEngine.stage(): значение в журнале, ещё не видное по ключу.
+
+    overtaken — дальше в журнале опубликована другая запись того же ключа.
+    """
+
+    __slots__ = ("key", "seg", "offset", "size", "value_offset", "crc", "overtaken")
+
+    def __init__(self, key, seg, offset, size, value_offset):
+        self.key = key
+        self.seg = seg
+        self.offset = offset
+        self.size = size
+        self.value_offset = value_offset
+        self.crc = 0
+        self.overtaken = False
+
+class LogEngine:
+    """Сегменты, в которые только дописывают, и индекс ключей в памяти.
+
+    Индекс: ключ -> (id сегмента, смещение значения, длина). Удаление —
+    запись-надгробие. Закрытые сегменты получают hint-файлы, чтобы старт
+    не читал значения, и периодически сливаются фоновым сжатием.
+    """
+
+    name = "log"
+
+    def __init__(self, data_dir, segment_size=SEGMENT_SIZE, background=True, durability=None):
+        self.data_dir = data_dir
+        self.segment_size = segment_size
+        # Сегменты сами служат журналом упреждающей записи: значение
+        # попадает в индекс только после сброса своей записи на диск
+        self.durability = durability or Durability()
+        os.makedirs(data_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCKS)]
+        # Сжатие и запись hint-файлов не должны идти одновременно
+        self._maintenance_lock = threading.Lock()
+        self.index = {}
+        # Ключ -> записи stage(), ещё не опубликованные
+        self._staged = {}
+        self.segments = {}
+        self.active = None
+        self._load()
+        self._stop = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._maintenance, daemon=True)
+            self._thread.start()
+
+    # --- Пути и открытие ---
+
+    def _data_path(self, seg_id):
+        return os.path.join(self.data_dir, f"{seg_id:09d}.data")
+
+    def _hint_path(self, seg_id):
+        return os.path.join(self.data_dir, f"{seg_id:09d}.hint")
+
+    def _open_segment(self, seg_id):
+        path = self._data_path(seg_id)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        return Segment(seg_id, path, fd, os.fstat(fd).st_size)
+
+    # --- Восстановление ---
+
+    def _load(self):
+        ids = []
+        for name in os.listdir(self.data_dir):
+            if name.endswith((".compact", ".tmp")):
+                # Недописанный результат прерванного сжатия
+                os.remove(os.path.join(self.data_dir, name))
+            elif name.endswith(".data"):
+                ids.append(int(name[:-5]))
+        ids.sort()
+        for seg_id in ids:
+            seg = self._open_segment(seg_id)
+            self.segments[seg_id] = seg
+            if os.path.exists(self._hint_path(seg_id)):
+                seg.has_hint = True
+                entries = self._read_hint(seg_id)
+            else:
+                entries, valid_end = self._scan(seg)
+                if valid_end < seg.size:
+                    # Хвост, оборванный аварийным завершением
+                    print(f"[storage] сегмент {seg_id}: отброшено {seg.size - valid_end} байт хвоста")
+                    os.ftruncate(seg.fd, valid_end)
+                    seg.size = valid_end
+            for flags, key, value_offset, value_len in entries:
+                self._apply(seg, flags, key, value_offset, value_len)
+        self._sorted = SortedKeys(self.index)
+        if ids and self.segments[ids[-1]].size == 0:
+            self.active = self.segments[ids[-1]]
+        else:
+            self.active = self._new_segment((ids[-1] + 1) if ids else 1)
+
+    def _apply(self, seg, flags, key, value_offset, value_len):
+        record_size = HEADER.size + len(key.encode('utf-8')) + value_len
+        if flags & FLAG_PADDING:
+            seg.dead += HEADER.size + value_len
+            return
+        old = self.index.pop(key, None)
+        if old is not None:
+            self._mark_dead(key, old)
+        if flags & FLAG_TOMBSTONE:
+            seg.dead += record_size
+        else:
+            self.index[key] = (seg.id, value_offset, value_len)
+
+    def _mark_dead(self, key, loc):
+        seg = self.segments.get(loc[0])
+        if seg is not None:
+            seg.dead += HEADER.size + len(key.encode('utf-8')) + loc[2]
+
+    def _scan(self, seg):
+        return _scan_records(seg.fd, seg.size)
+
+    def _read_hint(self, seg_id):
+        entries = []
+        with open(self._hint_path(seg_id), 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos < len(data):
+            flags, key_len, value_len, value_offset = HINT.unpack_from(data, pos)
+            pos += HINT.size
+            key = data[pos:pos + key_len].decode('utf-8')
+            pos += key_len
+            entries.append((flags, key, value_offset, value_len))
+        return entries
+
+    def _write_hint(self, seg_id, entries, tmp=None):
+        """Пишет hint-файл через временный; tmp задан — оставляет его без переименования."""
+        keep_tmp = tmp is not None
+        tmp = tmp or self._hint_path(seg_id) + ".tmp"
+        with open(tmp, 'wb') as f:
+            for flags, key, value_offset, value_len in entries:
+                key_bytes = key.encode('utf-8')
+                f.write(HINT.pack(flags, len(key_bytes), value_len, value_offset))
+                f.write(key_bytes)
+            f.flush()
+            _fsync(f.fileno())
+        if not keep_tmp:
+            os.rename(tmp, self._hint_path(seg_id))
+
+    # --- Запись ---
+
+    def _new_segment(self, seg_id):
+        seg = self._open_segment(seg_id)
+        self.segments[seg_id] = seg
+        return seg
+
+    def _rotate(self):
+        """Закрывает активный сегмент. Вызывать под self._lock."""
+        if self.active.size == 0:
+            return
+        self.active = self._new_segment(self.active.id + 1)
+
+    def _reserve(self, size):
+        """Резервирует size байт в активном сегменте. Вызывать под self._lock."""
+        if self.active.size >= self.segment_size:
+            self._rotate()
+        seg = self.active
+        offset = seg.size
+        seg.size += size
+        seg.pending += 1
+        return seg, offset
+
+    def _commit(self, seg, key, value_offset, value_len, tombstone=False):
+        """Публикует запись ключа; у надгробия value_offset — начало записи."""
+        with self._lock:
+            seg.pending -= 1
+            for staged in self._staged.get(key, ()):
+                if (staged.seg.id, staged.value_offset) < (seg.id, value_offset):
+                    staged.overtaken = True
+            old = self.index.pop(key, None)
+            if old is not None:
+                self._mark_dead(key, old)
+            if tombstone:
+                seg.dead += HEADER.size + len(key.encode('utf-8'))
+                self._sorted.discard(key)
+            else:
+                self.index[key] = (seg.id, value_offset, value_len)
+                if old is None:
+                    self._sorted.add(key)
+
+    def _abort(self, seg, offset, size):
+        """Помечает зарезервированную область неудавшейся записи как пропуск."""
+        _write_padding(seg.fd, offset, size)
+        with self._lock:
+            seg.pending -= 1
+            seg.dead += size
+
+    def _key_lock(self, key):
+        return self._key_locks[hash(key) % KEY_LOCKS]
+
+    def put(self, key, chunks, length=None):
+        """Дописывает значение в журнал. Возвращает его размер; 0 — ничего не записано."""
+        staged = self.stage(key, chunks, length)
+        if staged is None:
+            return 0
+        return self.publish(staged)
+
+    def stage(self, key, chunks, length=None):
+        """Пишет запись значения в зарезервированную область, не трогая ключ.
+
+        CRC записи остаётся нулевым до publish(): после сбоя такая запись
+        не пройдёт проверку. Возвращает запись для publish() или discard();
+        None — значение пустое.
+        """
+        spool = None
+        try:
+            if length is None:
+                # Длина неизвестна (chunked): сначала во временный файл
+                spool = tempfile.TemporaryFile(dir=self.data_dir)
+                for chunk in chunks:
+                    spool.write(chunk)
+                length = spool.tell()
+                spool.seek(0)
+                chunks = iter(lambda: spool.read(CHUNK_SIZE), b"")
+            if length == 0:
+                return None
+            return self._write_staged(key, chunks, length)
+        finally:
+            if spool is not None:
+                spool.close()
+
+    def _write_staged(self, key, chunks, length):
+        key_bytes = key.encode('utf-8')
+        size = HEADER.size + len(key_bytes) + length
+        with self._lock:
+            seg, offset = self._reserve(size)
+            staged = _Staged(key, seg, offset, size, offset + HEADER.size + len(key_bytes))
+            self._staged.setdefault(key, []).append(staged)
+        try:
+            crc = zlib.crc32(key_bytes, _header_crc(0, len(key_bytes), length))
+            if length <= CHUNK_SIZE:
+                # Небольшое значение — одна запись
+                value = b"".join(chunks)
+                if len(value) != length:
+                    raise ValueError("Body length mismatch")
+                crc = zlib.crc32(value, crc)
+                _pwrite_all(seg.fd, HEADER.pack(0, 0, len(key_bytes), length) + key_bytes + value,
+                            offset)
+            else:
+                _pwrite_all(seg.fd, HEADER.pack(0, 0, len(key_bytes), length) + key_bytes, offset)
+                pos = staged.value_offset
+                written = 0
+                for chunk in chunks:
+                    if written + len(chunk) > length:
+                        raise ValueError("Body length mismatch")
+                    _pwrite_all(seg.fd, chunk, pos + written)
+                    crc = zlib.crc32(chunk, crc)
+                    written += len(chunk)
+                if written != length:
+                    raise ValueError("Body length mismatch")
+        except BaseException:
+            self.discard(staged)
+            raise
+        staged.crc = crc
+        return staged
+
+    def publish(self, staged):
+        """Делает записанное stage() значением ключа. Возвращает его длину.
+
+        Восстановление берёт последнюю запись ключа в журнале. Если после
+        резервирования дальше в журнале успела появиться другая запись
+        ключа, значение дописывается заново, иначе после сбоя вернулась
+        бы та запись.
+        """
+        with self._key_lock(staged.key):
+            with self._lock:
+                self._unstage(staged)
+            return self._publish(staged)
+
+    def _publish(self, staged):
+        key, seg, offset, size = staged.key, staged.seg, staged.offset, staged.size
+        length = size - (staged.value_offset - offset)
+        if staged.overtaken:
+            # Под блокировкой ключа новую копию никто не обгонит
+            try:
+                fresh = self._write_staged(key, self._read(seg, staged.value_offset, length),
+                                           length)
+            finally:
+                self._abort(seg, offset, size)
+            with self._lock:
+                self._unstage(fresh)
+            return self._publish(fresh)
+        self.durability.begin()
+        try:
+            _pwrite_all(seg.fd, struct.pack(">I", staged.crc), offset)
+        except BaseException:
+            self.durability.end(None)
+            self._abort(seg, offset, size)
+            raise
+        self._sync(seg, offset, size)
+        self._commit(seg, key, staged.value_offset, length)
+        return length
+
+    def discard(self, staged):
+        """Отменяет запись stage()."""
+        with self._lock:
+            self._unstage(staged)
+        self._abort(staged.seg, staged.offset, staged.size)
+
+    def _unstage(self, staged):
+        """Вызывать под self._lock."""
+        pending = self._staged[staged.key]
+        pending.remove(staged)
+        if not pending:
+            del self._staged[staged.key]
+
+    def _read(self, seg, offset, length):
+        end = offset + length
+        while offset < end:
+            chunk = os.pread(seg.fd, min(end - offset, CHUNK_SIZE), offset)
+            if not chunk:
+                raise OSError(f"сегмент {seg.id} короче записи")
+            yield chunk
+            offset += len(chunk)
+
+    def _sync(self, seg, offset, size):
+        """Ждёт сброса записи на диск; если fsync не удался, запись отменяется."""
+        try:
+            self.durability.end(seg.fd)
+        except BaseException:
+            self._abort(seg, offset, size)
+            raise
+
+    def get(self, key):
+        """Возвращает (файл, смещение, длина) для отправки или None."""
+        with self._lock:
+            loc = self.index.get(key)
+            if loc is None:
+                return None
+            # Свой дескриптор: сжатие может закрыть сегмент во время отправки
+            fd = os.dup(self.segments[loc[0]].fd)
+        return os.fdopen(fd, 'rb'), loc[1], loc[2]
+
+    def stat(self, key):
+        """(длина, время изменения, контрольная сумма, сводка заголовка сжатия) или None.
+
+        Время изменения журнал не хранит — None. Контрольная сумма — CRC
+        записи из её заголовка: он покрывает ключ и значение и меняется
+        вместе со значением. Заголовок записи и начало значения с
+        заголовком сжатия читаются одним pread.
+        """
+        with self._lock:
+            loc = self.index.get(key)
+            if loc is None:
+                return None
+            fd = os.dup(self.segments[loc[0]].fd)
+        start = loc[1] - len(key.encode('utf-8')) - HEADER.size
+        try:
+            data = os.pread(fd, loc[1] - start + min(loc[2], compress.HEADER.size), start)
+        finally:
+            os.close(fd)
+        return (loc[2], None, struct.unpack_from(">I", data)[0],
+                compress.frame_of(data[loc[1] - start:]))
+
+    def delete(self, key):
+        key_bytes = key.encode('utf-8')
+        with self._key_lock(key):
+            size = HEADER.size + len(key_bytes)
+            with self._lock:
+                if key not in self.index:
+                    return False
+                seg, offset = self._reserve(size)
+            self.durability.begin()
+            try:
+                crc = zlib.crc32(key_bytes, _header_crc(FLAG_TOMBSTONE, len(key_bytes), 0))
+                _pwrite_all(seg.fd, HEADER.pack(crc, FLAG_TOMBSTONE, len(key_bytes), 0) + key_bytes,
+                            offset)
+            except BaseException:
+                self.durability.end(None)
+                self._abort(seg, offset, size)
+                raise
+            self._sync(seg, offset, size)
+            self._commit(seg, key, offset, 0, tombstone=True)
+        return True
+
+    def list_keys(self, prefix="", after=None, count=1000):
+        """До count ключей с префиксом prefix, больших after, по возрастанию."""
+        with self._lock:
+            return self._sorted.page(prefix, after, count)
+
+    # --- Фоновое обслуживание ---
+
+    def _maintenance(self):
+        last_compact = time.monotonic()
+        while not self._stop.wait(MAINTENANCE_INTERVAL):
+            try:
+                self.write_hints()
+                if time.monotonic() - last_compact >= COMPACT_INTERVAL:
+                    last_compact = time.monotonic()
+                    with self._lock:
+                        sealed = [s for s in self.segments.values() if s is not self.active]
+                    dead = sum(s.dead for s in sealed)
+                    total = sum(s.size for s in sealed)
+                    if dead >= COMPACT_MIN_DEAD and dead >= total * COMPACT_RATIO:
+                        self.compact()
+            except Exception as e:
+                print(f"[storage] ошибка обслуживания журнала: {e}")
+
+    def write_hints(self):
+        """Пишет hint-файлы закрытых сегментов без незавершённых записей."""
+        with self._maintenance_lock:
+            with self._lock:
+                todo = [s for s in self.segments.values()
+                        if s is not self.active and not s.has_hint and s.pending == 0]
+            for seg in todo:
+                entries, _ = self._scan(seg)
+                self._write_hint(seg.id, entries)
+                seg.has_hint = True
+
+    def compact(self):
+        """Сливает закрытые сегменты в один, оставляя только живые значения.
+
+        Результат получает id старшего из слитых сегментов, поэтому при
+        восстановлении он читается раньше более новых сегментов. Надгробия
+        отбрасываются: все более старые данные уходят вместе с ними.
+        """
+        with self._maintenance_lock:
+            with self._lock:
+                self._rotate()
+                targets = []
+                for seg_id in sorted(self.segments):
+                    seg = self.segments[seg_id]
+                    if seg is self.active or seg.pending:
+                        break
+                    targets.append(seg)
+                if not targets:
+                    return
+                ids = {s.id for s in targets}
+                live = [(key, loc) for key, loc in self.index.items() if loc[0] in ids]
+            out_id = targets[-1].id
+            out_path = self._data_path(out_id) + ".compact"
+            moved = []
+            hint = []
+            with open(out_path, 'wb') as out:
+                for key, (seg_id, value_offset, value_len) in live:
+                    key_bytes = key.encode('utf-8')
+                    src = self.segments[seg_id].fd
+                    record_start = out.tell()
+                    out.write(HEADER.pack(0, 0, len(key_bytes), value_len))
+                    out.write(key_bytes)
+                    crc = zlib.crc32(key_bytes, _header_crc(0, len(key_bytes), value_len))
+                    pos, remaining = value_offset, value_len
+                    while remaining:
+                        chunk = os.pread(src, min(remaining, CHUNK_SIZE), pos)
+                        if not chunk:
+                            raise OSError(f"сегмент {seg_id} короче индекса")
+                        out.write(chunk)
+                        crc = zlib.crc32(chunk, crc)
+                        pos += len(chunk)
+                        remaining -= len(chunk)
+                    end = out.tell()
+                    out.seek(record_start)
+                    out.write(struct.pack(">I", crc))
+                    out.seek(end)
+                    new_offset = record_start + HEADER.size + len(key_bytes)
+                    moved.append((key, (seg_id, value_offset, value_len), (out_id, new_offset, value_len)))
+                    hint.append((0, key, new_offset, value_len))
+                out.flush()
+                _fsync(out.fileno())
+            hint_tmp = self._hint_path(out_id) + ".compact"
+            self._write_hint(out_id, hint, hint_tmp)
+
+            with self._lock:
+                # Порядок важен для восстановления после сбоя: сегмент без
+                # hint-файла просто читается целиком
+                try:
+                    os.remove(self._hint_path(out_id))
+                except FileNotFoundError:
+                    pass
+                os.rename(out_path, self._data_path(out_id))
+                os.rename(hint_tmp, self._hint_path(out_id))
+                merged = self._open_segment(out_id)
+                merged.has_hint = True
+                for seg in targets:
+                    del self.segments[seg.id]
+                self.segments[out_id] = merged
+                for key, old, new in moved:
+                    if self.index.get(key) == old:
+                        self.index[key] = new
+                    else:
+                        # Ключ перезаписан или удалён во время сжатия
+                        merged.dead += HEADER.size + len(key.encode('utf-8')) + new[2]
+            for seg in targets:
+                os.close(seg.fd)
+                if seg.id != out_id:
+                    os.remove(seg.path)
+                    try:
+                        os.remove(self._hint_path(seg.id))
+                    except FileNotFoundError:
+                        pass
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._rotate()
+        self.write_hints()
+        with self._lock:
+            for seg in self.segments.values():
+                os.close(seg.fd)
+            self.segments = {}
+
+# --- Версии ключей ---
+# Запись: версия | флаги | длина ключа | ключ.
+VERSION_RECORD = struct.Struct(">QBI")
+# Ключ перенесён на другую ноду: версия забыта, надгробия не остаётся
+FLAG_DROPPED = 2
+
+class VersionTable:
+    """Версии ключей, выставленные мастером при репликации.
+
+    Хранится рядом с данными движка и не зависит от него: словарь в памяти
+    и журнал, в который только дописывают. Удаление оставляет надгробие с
+    версией, чтобы запоздавшая запись на отставшую реплику не вернула ключ.
+    Журнал переписывается при открытии, если устаревших записей в нём
+    больше, чем живых.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # ключ -> (версия, удалён ли)
+        self.versions = {}
+        records = self._load()
+        if records > 2 * len(self.versions) + 1024:
+            self._rewrite()
+        self._file = open(path, 'ab')
+
+    @staticmethod
+    def _record(key, version, deleted):
+        key_bytes = key.encode('utf-8')
+        return VERSION_RECORD.pack(version, FLAG_TOMBSTONE if deleted else 0,
+                                   len(key_bytes)) + key_bytes
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0
+        pos = records = 0
+        while pos + VERSION_RECORD.size <= len(data):
+            version, flags, key_len = VERSION_RECORD.unpack_from(data, pos)
+            end = pos + VERSION_RECORD.size + key_len
+            if end > len(data):
+                break
+            key = data[pos + VERSION_RECORD.size:end].decode('utf-8')
+            if flags & FLAG_DROPPED:
+                self.versions.pop(key, None)
+            else:
+                self.versions[key] = (version, bool(flags & FLAG_TOMBSTONE))
+            pos = end
+            records += 1
+        if pos < len(data):
+            # Оборванная последняя запись
+            os.truncate(self.path, pos)
+        return records
+
+    def _rewrite(self):
+        tmp = self.path + ".tmp"
+        with open(tmp, 'wb') as f:
+            for key, (version, deleted) in self.versions.items():
+                f.write(self._record(key, version, deleted))
+            f.flush()
+            _fsync(f.fileno())
+        os.rename(tmp, self.path)
+
+    def get(self, key):
+        """(версия, удалён ли) или None, если версии у ключа нет."""
+        return self.versions.get(key)
+
+    def set(self, key, version, deleted=False):
+        with self._lock:
+            self.versions[key] = (version, deleted)
+            self._file.write(self._record(key, version, deleted))
+            self._file.flush()
+
+    def drop(self, key):
+        """Забывает версию ключа (ключ перенесён на другую ноду)."""
+        with self._lock:
+            if self.versions.pop(key, None) is None:
+                return
+            key_bytes = key.encode('utf-8')
+            self._file.write(VERSION_RECORD.pack(0, FLAG_DROPPED, len(key_bytes)) + key_bytes)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+ENGINES = {"files": FileEngine, "log": LogEngine}
+
+def open_engine(name, data_dir, durability=None):
+    return ENGINES[name](data_dir, durability=durability)
@@ -1,172 +1,916 @@
 # worker.py
+import argparse
+import asyncio
+import concurrent.futures
 import socket
 import threading
 import os
 import json
 import sys
 import signal
-import urllib.parse
-import re
-from datetime import datetime
 import time
+import glob
+import mmap
+import random
+import struct
+import urllib.parse
+import zlib
 
-if len(sys.argv) != 4:
-    print("Запуск: python worker.py <порт> <имя_ноды> <id_ноды>")
-    sys.exit(1)
+import batch
+import compress
+import hashring
+import httputil
+import listing
+import logs
+import metrics
+import pool
+import prefork
+import storage
 
-PORT = int(sys.argv[1])
-NODE_NAME = sys.argv[2]
-NODE_ID = int(sys.argv[3])
+# Заполняются в main() из аргументов командной строки
+PORT = None
+NODE_NAME = None
+NODE_ID = None
 HOST = "127.0.0.1"
 MASTER_HOST, MASTER_PORT = "127.0.0.1", 8080
-DATA_DIR = f"basic_node/worker_data_{PORT}"
-os.makedirs(DATA_DIR, exist_ok=True)
+DATA_DIR = None
+# Движок хранения (storage.FileEngine или storage.LogEngine)
+engine = None
+# Версии ключей для репликации (storage.VersionTable)
+versions = None
+# Проверка версии и публикация записи ключа выполняются атомарно под
+# блокировкой полосы; тело значения пишется движком до неё
+KEY_LOCKS = 256
+key_locks = [threading.Lock() for _ in range(KEY_LOCKS)]
+# read_value: значение длиннее запрошенного предела
+TOO_LARGE = object()
+# lookup_value: ETag совпал с If-None-Match, значение не открывалось
+NOT_MODIFIED = object()
+# asyncio-режим: пул потоков для обработчиков с работой с диском (--disk-threads)
+DISK_THREADS = 16
+disk_executor = None
+# Кодек сжатия новых значений (compress.Codec) или None; задаётся --compress
+codec = None
+compress_min = compress.MIN_SIZE
+# --processes: номер процесса (он же номер шарда ключей), их число,
+# внутренние порты процессов и пулы соединений к ним
+shard = 0
+shards = 1
+shard_ports = []
+shard_pools = []
+SHARD_HEADER = "X-Shard"
+SHARD_TIMEOUT = 30
+# Заголовки запроса и ответа, которые передаются между процессами
+RELAY_HEADERS = (("content-encoding", "Content-Encoding"), ("x-version", "X-Version"),
+                 ("x-drop-version", "X-Drop-Version"), ("range", "Range"),
+                 ("accept-encoding", "Accept-Encoding"), ("if-none-match", "If-None-Match"))
+RELAY_REPLY_HEADERS = (("x-version", "X-Version"), ("content-range", "Content-Range"),
+                       ("content-encoding", "Content-Encoding"), ("vary", "Vary"),
+                       ("etag", "ETag"), ("last-modified", "Last-Modified"))
+
+# Повторная регистрация. Мастер опрашивает ноду (GET /health) каждые
+# полсекунды; если проб нет дольше MASTER_SILENCE, мастер перезапущен или
+# недоступен, и нода регистрируется снова, удваивая паузу между попытками.
+# Попытки не прекращаются и при отказе мастера (404 — ноду ещё не создали,
+# 410 — её удалили): после PUT /node нода вернётся сама.
+MASTER_SILENCE = 5.0
+REGISTER_DELAY_MIN = 0.2
+REGISTER_DELAY_MAX = 5.0
+# Время последней пробы мастера (time.monotonic) в памяти, общей для
+# процессов --processes: пробы приходят в любой, а регистрирует процесс 0
+probe_clock = mmap.mmap(-1, 8)
 
 def register_with_master():
+    """Возвращает None, если мастер принял регистрацию, иначе описание ошибки."""
     try:
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((MASTER_HOST, MASTER_PORT))
+        with socket.create_connection((MASTER_HOST, MASTER_PORT), timeout=10) as s:
             body = json.dumps({"id": NODE_ID, "port": PORT}).encode('utf-8')
-            request = (
-                f"POST /register HTTP/1.1\r\n"
-                f"Host: {MASTER_HOST}\r\n"
-                f"Content-Length: {len(body)}\r\n"
-                "Content-Type: application/json\r\n"
-                "Connection: close\r\n\r\n"
-            ).encode('latin1') + body
-            s.sendall(request)
-            response = b""
-            while True:
-                chunk = s.recv(4096)
-                if not chunk:
-                    break
-                response += chunk
-            print(f"Зарегистрирован на мастере как нода {NODE_ID}")
+            s.sendall(httputil.build_request("POST", "/register", MASTER_HOST, body,
+                                             "application/json", keep_alive=False))
+            code, _, reply = httputil.read_response(s)
     except Exception as e:
-        print(f"Ошибка регистрации: {e}")
+        return f"Ошибка регистрации: {e}"
+    if code != 200:
+        return f"Мастер отклонил регистрацию: {code} {reply.decode('utf-8', 'replace')}"
+    print(f"Зарегистрирован на мастере как нода {NODE_ID}")
+    return None
 
-def safe_filename(key):
-    safe = ""
-    for c in key:
-        if c.isalnum() or c in "._-":
-            safe += c
-        else:
-            safe += "_"
-    return safe or "_"
+def note_probe():
+    struct.pack_into("d", probe_clock, 0, time.monotonic())
+
+def registration_loop():
+    """Фоновый поток: регистрация на мастере и повторная, когда его пробы пропали."""
+    delay = REGISTER_DELAY_MIN
+    last_error = None
+    while True:
+        error = register_with_master()
+        if error is None:
+            delay = REGISTER_DELAY_MIN
+            last_error = None
+            note_probe()
+            while time.monotonic() - struct.unpack_from("d", probe_clock)[0] < MASTER_SILENCE:
+                time.sleep(MASTER_SILENCE / 10)
+            print("Мастер не присылает пробы, повторная регистрация")
+            continue
+        if error != last_error:
+            # Одна и та же ошибка раз в несколько секунд не засоряет вывод
+            print(error)
+            last_error = error
+        time.sleep(delay * random.uniform(0.5, 1.5))
+        delay = min(delay * 2, REGISTER_DELAY_MAX)
+
+# --- Прямые запросы клиентов по карте кластера ---
+# Клиент с картой кластера (client.SmartClient) ходит к ноде напрямую и
+# передаёт версию своей карты в X-Map-Version. Нода проверяет по своей
+# копии карты, что ключ принадлежит ей, и иначе отвечает 421: клиент
+# обновит карту. Текущую версию нода узнаёт из проб мастера (и от
+# клиентов с более новой картой), саму карту — из GET /cluster мастера.
+MAP_VERSION_HEADER = "X-Map-Version"
+# {"version", "direct", "ring"} или None, пока карта не нужна
+cluster_map = None
+# map_refreshing — идёт фоновая загрузка карты (refresh_map)
+map_lock = threading.Lock()
+map_refreshing = False
+# Новейшая известная версия карты, общая для процессов --processes
+latest_map = mmap.mmap(-1, 8)
+
+def note_map_version(version):
+    if version > struct.unpack_from("Q", latest_map)[0]:
+        struct.pack_into("Q", latest_map, 0, version)
+
+def fetch_map():
+    """Карта кластера с мастера или None, если он недоступен."""
+    try:
+        with socket.create_connection((MASTER_HOST, MASTER_PORT), timeout=5) as s:
+            s.sendall(httputil.build_request("GET", "/cluster", MASTER_HOST, keep_alive=False))
+            code, _, body = httputil.read_response(s)
+        if code != 200:
+            return None
+        data = json.loads(body.decode('utf-8'))
+    except Exception as e:
+        logs.write("warning", "cluster map unavailable", error=str(e))
+        return None
+    ring = hashring.HashRing({w["id"]: w["weight"] for w in data["workers"]}, data["vnodes"])
+    return {"version": data["version"], "direct": data["direct"], "ring": ring}
+
+def refresh_map():
+    """Загружает карту с мастера в фоновом потоке."""
+    global cluster_map, map_refreshing
+    try:
+        fetched = fetch_map()
+        with map_lock:
+            m = cluster_map
+            if fetched is not None and (m is None or fetched["version"] > m["version"]):
+                cluster_map = fetched
+    finally:
+        with map_lock:
+            map_refreshing = False
 
-def list_keys():
-    return [f for f in os.listdir(DATA_DIR) if os.path.isfile(os.path.join(DATA_DIR, f))]
+def current_map():
+    """Карта не старее новейшей известной версии или None.
+
+    Устаревшая карта обновляется в фоне, не больше одной загрузки сразу:
+    запрос не ждёт мастера и получает 421, пока карта не обновится.
+    """
+    global map_refreshing
+    latest = struct.unpack_from("Q", latest_map)[0]
+    m = cluster_map
+    if m is not None and m["version"] >= latest:
+        return m
+    with map_lock:
+        if map_refreshing:
+            return None
+        map_refreshing = True
+    threading.Thread(target=refresh_map, daemon=True).start()
+    return None
+
+def misdirected(req, key):
+    """Ответ 421, если прямой запрос клиента пришёл не по текущей карте, иначе None."""
+    try:
+        client_version = int(req.headers["x-map-version"])
+    except ValueError:
+        return 400, b"Invalid X-Map-Version", "text/plain"
+    note_map_version(client_version)
+    m = current_map()
+    if (m is not None and m["version"] == client_version and m["direct"]
+            and m["ring"].get_node(key) == NODE_ID):
+        return None
+    headers = {MAP_VERSION_HEADER: m["version"]} if m is not None else None
+    return 421, b"Not the owner of this key, refresh the cluster map", "text/plain", headers
 
 def handle_client(conn, addr):
+    """Обслуживает соединение: мастер держит его открытым между запросами."""
+    buf = bytearray()
+    conn.settimeout(httputil.KEEPALIVE_TIMEOUT)
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
     try:
-        data = conn.recv(1024 * 1024)
-        if not data:
-            return
-
-        request_str = data.decode('latin1', errors='ignore')
-        lines = request_str.split('\r\n')
-        if not lines:
-            send_response(conn, 400, b"Bad Request")
-            return
-
-        request_line = lines[0]
-        match = re.match(r'(GET|PUT|DELETE)\s+(.+?)\s+HTTP/1\.1', request_line)
-        if not match:
-            send_response(conn, 400, b"Invalid HTTP request")
-            return
-
-        method, raw_path = match.groups()
-        path = urllib.parse.unquote(raw_path)
-
-        if not (path == "/storage" or path.startswith("/storage/")):
-            send_response(conn, 400, b"Use /storage or /storage/<key>")
-            return
-
-        key = path[len('/storage/'):] if path.startswith('/storage/') else ""
-        print(f"[{NODE_NAME}] Получен запрос: {method} /storage/{repr(key)}")
-
-        if method == 'PUT':
-            body_start = data.find(b'\r\n\r\n') + 4
-            body = data[body_start:] if body_start > 3 else b""
-            if not body:
-                send_response(conn, 400, b"Body required")
+        while True:
+            try:
+                req = httputil.read_request(conn, buf)
+            except httputil.BadRequest as e:
+                httputil.send_response(conn, 400, str(e).encode('latin1'))
                 return
-            file_path = os.path.join(DATA_DIR, safe_filename(key))
-            with open(file_path, 'wb') as f:
-                f.write(body)
-            print(f"[{NODE_NAME}] Ответ: 201 Created")
-            send_response(conn, 201, b"OK")
-
-        elif method == 'GET':
-            if key == "":
-                keys = list_keys()
-                response_body = json.dumps(keys, ensure_ascii=False).encode('utf-8')
-                print(f"[{NODE_NAME}] Ответ: 200 (все ключи)")
-                send_response(conn, 200, response_body, "application/json")
-            else:
-                file_path = os.path.join(DATA_DIR, safe_filename(key))
-                if not os.path.exists(file_path):
-                    print(f"[{NODE_NAME}] Ответ: 404 Not Found")
-                    send_response(conn, 404, b"Key not found")
+            if req is None:
+                return
+            start = metrics.request_started()
+            code, sent = 500, 0
+            try:
+                try:
+                    code, body, content_type, *headers = handle_request(req)
+                except Exception as e:
+                    logs.write("error", str(e), method=req.method, path=req.path)
+                    code = 500
+                    sent = httputil.send_response(conn, 500, b"Internal Error")
                     return
-                with open(file_path, 'rb') as f:
-                    content = f.read()
-                print(f"[{NODE_NAME}] Ответ: 200 OK (длина: {len(content)} байт)")
-                send_response(conn, 200, content, "application/octet-stream")
-
-        elif method == 'DELETE':
-            file_path = os.path.join(DATA_DIR, safe_filename(key))
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"[{NODE_NAME}] Ответ: 200 Deleted")
-                send_response(conn, 200, b"Deleted")
+                # Недочитанное тело запроса не даёт разобрать следующий
+                keep_alive = req.keep_alive and req.stream.done
+                sent = httputil.send_response(conn, code, body, content_type, keep_alive, *headers)
+            finally:
+                logs.request(req, code, sent, metrics.request_finished(req, code, sent, start))
+            if not keep_alive:
+                return
+    except (socket.timeout, ConnectionError):
+        pass
+    except Exception as e:
+        logs.write("error", str(e))
+    finally:
+        conn.close()
+
+def handle_request(req):
+    """Обрабатывает один запрос.
+
+    Возвращает (код, тело, Content-Type) или (код, тело, Content-Type, заголовки).
+    HEAD получает заголовки того же GET без тела.
+    """
+    if req.method == 'HEAD':
+        return httputil.without_body(*route_request(req))
+    return route_request(req)
+
+def route_request(req):
+    # HEAD проходит тот же путь, что GET; владельцу в другом процессе он
+    # передаётся как HEAD
+    method = 'GET' if req.method == 'HEAD' else req.method
+    path = req.path
+
+    # Проба доступности от мастера
+    if path == "/health" and method == 'GET':
+        note_probe()
+        if "x-map-version" in req.headers:
+            try:
+                note_map_version(int(req.headers["x-map-version"]))
+            except ValueError:
+                return 400, b"Invalid X-Map-Version", "text/plain"
+        return 200, b"OK", "text/plain"
+
+    if path == metrics.PATH and method == 'GET':
+        return 200, metrics.render(), metrics.CONTENT_TYPE
+
+    if not (path == "/storage" or path.startswith("/storage/")):
+        return 400, b"Use /storage or /storage/<key>", "text/plain"
+
+    local = shards == 1 or "x-shard" in req.headers
+    if path == batch.PATH and method == 'POST':
+        if not local:
+            return sharded_batch(req.body)
+        return handle_batch(req.body)
+
+    key = path[len('/storage/'):] if path.startswith('/storage/') else ""
+    if key and "x-map-version" in req.headers:
+        rejected = misdirected(req, key)
+        if rejected is not None:
+            return rejected
+    if not local and key and shard_of(key) != shard:
+        return relay(req, key)
+
+    try:
+        version = request_version(req)
+    except ValueError:
+        return 400, b"Invalid X-Version", "text/plain"
+
+    if method == 'PUT':
+        stream = req.stream
+        if stream.length == 0:
+            return 400, b"Body required", "text/plain"
+        encoding = req.headers.get("content-encoding", "identity")
+        value_codec = None
+        if encoding.strip().lower() != "identity":
+            value_codec = compress.by_token(encoding)
+            if value_codec is None:
+                return 415, b"Unsupported Content-Encoding", "text/plain"
+        # Значение пишется на диск по мере приёма, не собираясь в памяти
+        code, version = put_value(key, stream.chunks(), stream.length, version, value_codec)
+        if code == 400:
+            return 400, b"Body required", "text/plain"
+        if code == 409:
+            return 409, b"Newer version exists", "text/plain", version_header(version)
+        return 201, b"OK", "text/plain", version_header(version)
+
+    elif method == 'GET':
+        if key == "":
+            try:
+                prefix, cursor, limit = listing.parse_params(req.query)
+            except ValueError as e:
+                return 400, str(e).encode('utf-8'), "text/plain"
+            if not local:
+                return sharded_list(prefix, cursor, limit)
+            # Ключи идут из отсортированного индекса страницами, не целиком
+            lines = listing.local_lines(engine.list_keys, prefix, cursor, limit)
+            return 200, httputil.StreamBody(listing.encode(lines), None), listing.CONTENT_TYPE
+        value, version, validators = lookup_value(key, req.headers.get("if-none-match"),
+                                                  head=req.method == 'HEAD')
+        if value is None:
+            # Версия надгробия нужна мастеру, чтобы выбрать ответ кворума
+            return 404, b"Key not found", "text/plain", version_header(version)
+        if value is NOT_MODIFIED:
+            headers = dict(version_header(version) or {}, **validators)
+            return 304, httputil.HeadBody(), "application/octet-stream", headers
+        return value_response(value, version, req.headers.get("range"),
+                              req.headers.get("accept-encoding"), validators)
+
+    elif method == 'DELETE':
+        if "x-drop-version" in req.headers:
+            # Перебалансировка перенесла ключ на другую ноду
+            try:
+                dropped = int(req.headers["x-drop-version"])
+            except ValueError:
+                return 400, b"Invalid X-Drop-Version", "text/plain"
+            code = drop_value(key, dropped)
+            return code, b"", "text/plain"
+        code, version = delete_value(key, version)
+        if code == 409:
+            return 409, b"Newer version exists", "text/plain", version_header(version)
+        if code == 200:
+            return 200, b"Deleted", "text/plain", version_header(version)
+        return 404, b"Key not found", "text/plain", version_header(version)
+
+    return 405, b"Method Not Allowed", "text/plain"
+
+def value_response(value, version, byte_range=None, accept_encoding=None, validators=None):
+    """Ответ на GET ключа: всё значение (200) или его диапазон из Range (206, 416).
+
+    Файл уходит в сокет через sendfile, минуя память процесса. Сжатое
+    значение отдаётся как есть, если клиент принимает его кодек
+    (Accept-Encoding), иначе распаковывается по ходу отправки.
+    value и validators (ETag и Last-Modified) — из lookup_value; без
+    файла (HEAD) тело заменяет HeadBody с длиной того же GET.
+    """
+    f, offset, size, frame = value
+    headers = dict(version_header(version) or {}, **(validators or {}))
+    try:
+        framed, value_codec, original = compress.read_frame(frame, size)
+    except ValueError:
+        close_value(f)
+        raise
+    if framed:
+        offset, size = offset + compress.HEADER.size, size - compress.HEADER.size
+    if value_codec is not None:
+        headers["Vary"] = "Accept-Encoding"
+        if not compress.accepts(accept_encoding, value_codec):
+            return decoded_response(f, offset, size, value_codec, original, byte_range, headers)
+        # Range относится к сжатым байтам, как у любого Content-Encoding
+        headers["Content-Encoding"] = value_codec.token
+    code = 200
+    if byte_range is not None:
+        try:
+            part = httputil.parse_range(byte_range, size)
+        except httputil.RangeNotSatisfiable:
+            close_value(f)
+            headers["Content-Range"] = httputil.content_range(None, 0, size)
+            return 416, b"Range Not Satisfiable", "text/plain", headers
+        if part is not None:
+            start, length = part
+            headers["Content-Range"] = httputil.content_range(start, length, size)
+            code, offset, size = 206, offset + start, length
+    if f is None:
+        return code, httputil.HeadBody(size), "application/octet-stream", headers
+    storage.advise_read(f.fileno(), offset, size)
+    return code, httputil.FileBody(f, offset, size), "application/octet-stream", headers or None
+
+def close_value(f):
+    if f is not None:
+        f.close()
+
+def decoded_response(f, offset, size, value_codec, original, byte_range, headers):
+    """Сжатое значение для клиента без его кодека: распаковка кусками.
+
+    Range выбирает распакованные байты; у значения неизвестной длины
+    (пришло уже сжатым) Range не учитывается.
+    """
+    code, start, length = 200, 0, original
+    if byte_range is not None and original is not None:
+        try:
+            part = httputil.parse_range(byte_range, original)
+        except httputil.RangeNotSatisfiable:
+            close_value(f)
+            headers["Content-Range"] = httputil.content_range(None, 0, original)
+            return 416, b"Range Not Satisfiable", "text/plain", headers
+        if part is not None:
+            start, length = part
+            headers["Content-Range"] = httputil.content_range(start, length, original)
+            code = 206
+    if f is None:
+        return code, httputil.HeadBody(length), "application/octet-stream", headers
+    storage.advise_read(f.fileno(), offset, size)
+    chunks = compress.decode(f.fileno(), offset, size, value_codec, start, length)
+    body = httputil.StreamBody(chunks, length, lambda completed: f.close())
+    return code, body, "application/octet-stream", headers
+
+# --- Версии ---
+# Мастер с репликацией передаёт версию записи в X-Version. Запись со
+# старой версией отклоняется (409), поэтому реплики сходятся к последней
+# записи независимо от порядка, в котором до них дошли запросы.
+
+def key_lock(key):
+    return key_locks[hash(key) % KEY_LOCKS]
+
+def request_version(req):
+    """Версия из заголовка X-Version; None — запрос без версии."""
+    value = req.headers.get("x-version")
+    if value is None:
+        return None
+    version = int(value)
+    if version < 0:
+        raise ValueError("negative version")
+    return version
+
+def version_header(version):
+    return {"X-Version": version} if version is not None else None
+
+def next_local_version(current):
+    # Запись мимо мастера всё равно должна обогнать прежнюю версию ключа
+    return max(current[0] + 1, time.time_ns())
+
+def put_value(key, chunks, length, version, value_codec=None):
+    """Записывает значение с проверкой версии. Возвращает (код, версия ключа).
+
+    value_codec — кодек, которым тело уже сжато клиентом (Content-Encoding);
+    иначе значение сжимается кодеком ноды, если это выгодно. Тело пишется
+    движком без блокировки ключа (engine.stage), а под ней версия
+    проверяется ещё раз и значение публикуется.
+    """
+    if version is not None:
+        with key_lock(key):
+            current = versions.get(key)
+        if current is not None and current[0] >= version:
+            # Тело дочитывается, чтобы соединение осталось пригодным
+            for _ in chunks:
+                pass
+            return 409, current[0]
+    if value_codec is not None:
+        chunks, length = compress.encoded(chunks, value_codec), None
+    else:
+        chunks, length = compress.encode(chunks, length, codec, compress_min)
+    start = time.perf_counter()
+    staged = engine.stage(key, chunks, length)
+    if staged is None:
+        metrics.DISK_WRITE.since(start)
+        return 400, None
+    with key_lock(key):
+        current = versions.get(key)
+        if version is not None and current is not None and current[0] >= version:
+            engine.discard(staged)
+            return 409, current[0]
+        engine.publish(staged)
+        metrics.DISK_WRITE.since(start)
+        if version is None and current is not None:
+            version = next_local_version(current)
+        if version is not None:
+            versions.set(key, version)
+        return 201, version
+
+def delete_value(key, version):
+    """Удаляет ключ, оставляя надгробие с версией. Возвращает (код, версия ключа)."""
+    with key_lock(key):
+        current = versions.get(key)
+        if version is not None and current is not None and current[0] >= version:
+            return 409, current[0]
+        start = time.perf_counter()
+        existed = engine.delete(key)
+        metrics.DISK_WRITE.since(start)
+        if version is None and current is not None:
+            version = next_local_version(current)
+        if version is not None:
+            versions.set(key, version, deleted=True)
+        return (200 if existed else 404), version
+
+def drop_value(key, version):
+    """Удаляет перенесённый ключ без надгробия.
+
+    Ключ, записанный после переноса (версия новее version), остаётся: 409.
+    Версия 0 соответствует ключу без версии.
+    """
+    with key_lock(key):
+        current = versions.get(key)
+        if current is not None and current[0] > version:
+            return 409
+        existed = engine.delete(key)
+        versions.drop(key)
+        return 200 if existed else 404
+
+def entity_tag(size, checksum):
+    """ETag значения по его длине и контрольной сумме из индекса движка.
+
+    Слабый: сжатое значение отдаётся и как есть, и распакованным, а тег
+    у обоих представлений один.
+    """
+    return f'W/"{checksum:08x}-{size:x}"'
+
+def lookup_value(key, if_none_match=None, validate=True, head=False):
+    """Возвращает (место значения для отправки или None, версия или None, заголовки).
+
+    Место значения — (файл, смещение, длина, сводка заголовка сжатия).
+    Заголовки ETag и Last-Modified и сводка берутся из индекса движка
+    (validate=False — без них, сводка None). Если ETag совпал с
+    if_none_match, вместо места значения возвращается NOT_MODIFIED. Ни
+    тогда, ни для HEAD (head) файл не открывается: вместо него None.
+    """
+    start = time.perf_counter()
+    validators = {}
+    with key_lock(key):
+        current = versions.get(key)
+        meta = engine.stat(key) if validate else None
+        if meta is not None:
+            size, mtime, checksum, frame = meta
+            validators["ETag"] = entity_tag(size, checksum)
+            if mtime is not None:
+                validators["Last-Modified"] = httputil.http_date(mtime)
+        if validate and meta is None:
+            value = None
+        elif (if_none_match and meta is not None
+              and httputil.etag_matches(if_none_match, validators["ETag"])):
+            value = NOT_MODIFIED
+        elif head:
+            value = None, 0, size, frame
+        else:
+            value = engine.get(key)
+            if value is not None:
+                value += (frame if meta is not None else None,)
+    metrics.DISK_READ.since(start)
+    return value, current[0] if current is not None else None, validators
+
+def read_value(key, max_size=None):
+    """Читает значение целиком в память. Возвращает (значение или None, версия).
+
+    Значение длиннее max_size не читается: вместо него возвращается TOO_LARGE.
+    """
+    value, version, _ = lookup_value(key, validate=False)
+    if value is None:
+        return None, version
+    f, offset, size, _ = value
+    try:
+        framed, value_codec, original = compress.read_header(f.fileno(), offset, size)
+    except (OSError, ValueError):
+        f.close()
+        raise
+    if framed:
+        offset, size = offset + compress.HEADER.size, size - compress.HEADER.size
+    # Длина распакованного значения бывает неизвестна: тогда проверка после чтения
+    full = original if value_codec is not None else size
+    if max_size is not None and full is not None and full > max_size:
+        f.close()
+        return TOO_LARGE, version
+    start = time.perf_counter()
+    try:
+        parts = []
+        while size > 0:
+            chunk = os.pread(f.fileno(), min(size, storage.CHUNK_SIZE), offset)
+            if not chunk:
+                break
+            parts.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        metrics.DISK_READ.since(start)
+        data = b"".join(parts)
+        if value_codec is not None:
+            data = compress.decode_all(data, value_codec)
+            if max_size is not None and len(data) > max_size:
+                return TOO_LARGE, version
+        return data, version
+    finally:
+        f.close()
+
+def handle_batch(body):
+    """POST /storage/_batch: операции над ключами этой ноды по порядку."""
+    try:
+        op, items, encoding, item_versions, max_value = batch.parse_request(body)
+    except ValueError as e:
+        return 400, str(e).encode('utf-8'), "text/plain"
+    results = []
+    for (key, value), version in zip(items, item_versions):
+        if op == "put":
+            if value:
+                code, version = put_value(key, [value], len(value), version)
+                results.append((code, None, version))
+            else:
+                results.append((400, None, None))
+        elif op == "get":
+            value, version = read_value(key, max_value)
+            if value is TOO_LARGE:
+                results.append((413, None, version))
             else:
-                print(f"[{NODE_NAME}] Ответ: 404 Not Found")
-                send_response(conn, 404, b"Key not found")
+                results.append((404 if value is None else 200, value, version))
+        elif op == "drop":
+            results.append((drop_value(key, version or 0), None, None))
+        else:
+            code, version = delete_value(key, version)
+            results.append((code, None, version))
+    return 200, batch.build_response(items, results, encoding), "application/json"
+
+# --- Несколько процессов (--processes) ---
+# Процессы слушают общий порт (SO_REUSEPORT), и ядро раздаёт им соединения.
+# Ключи поделены между процессами по crc32: у каждого свой каталог движка и
+# своя таблица версий, поэтому ключ пишет только один процесс и блокировки
+# полос (key_lock) достаточно. Запрос к чужому ключу передаётся владельцу
+# через его внутренний порт; пакетные запросы и список ключей собираются
+# из частей всех процессов. Части помечаются X-Shard: их процесс выполняет
+# только у себя.
+
+def shard_of(key):
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+def shard_data_dir(data_dir, index, count):
+    return f"{data_dir}-shard{index}of{count}" if count > 1 else data_dir
+
+def check_data_dirs(data_dir, count):
+    """Данные, записанные с другим --processes, лежат не в тех шардах: ключи не найдутся."""
+    own = {shard_data_dir(data_dir, i, count) for i in range(count)}
+    for other in [data_dir] + glob.glob(f"{glob.escape(data_dir)}-shard*of*"):
+        if other not in own and os.path.isdir(other) and os.listdir(other):
+            raise SystemExit(f"{other}: данные записаны с другим --processes")
+
+def shard_request(owner, method, path, body=b"", headers=None):
+    """Запрос процессу owner. Возвращает (код, заголовки, поток тела, close(completed))."""
+    p = shard_pools[owner]
+    headers = dict(headers or {}, **{SHARD_HEADER: owner})
+    sock, _ = p.acquire(SHARD_TIMEOUT)
+    try:
+        httputil.send_request(sock, method, path, HOST, body, True, headers)
+        code, reply, stream = httputil.read_response_head(sock, bytearray(), method == 'HEAD')
+    except BaseException:
+        p.release(sock, False)
+        raise
+
+    def close(completed=True):
+        p.release(sock, completed and stream.done
+                  and reply.get("connection", "").lower() != "close")
+    return code, reply, stream, close
+
+def relay(req, key):
+    """Передаёт запрос к ключу процессу-владельцу; его ответ уходит клиенту потоком."""
+    path = f"/storage/{urllib.parse.quote(key, safe='')}"
+    headers = {name: req.headers[lower] for lower, name in RELAY_HEADERS if lower in req.headers}
+    body = req.stream if req.method == 'PUT' else b""
+    code, reply, stream, close = shard_request(shard_of(key), req.method, path, body, headers)
+    content_type = reply.get("content-type", "text/plain")
+    extra = {name: reply[lower] for lower, name in RELAY_REPLY_HEADERS if lower in reply} or None
+    if req.method == 'HEAD' or code == 304:
+        close()
+        length = reply.get("content-length")
+        return code, httputil.HeadBody(int(length) if length else None), content_type, extra
+    if stream.length is not None and stream.length <= httputil.RECV_SIZE:
+        try:
+            data = stream.read_all()
+        except BaseException:
+            close(False)
+            raise
+        close()
+        return code, data, content_type, extra
+    return code, httputil.StreamBody(stream.chunks(), stream.length, close), content_type, extra
+
+def sharded_batch(body):
+    """Пакет, разложенный по процессам-владельцам ключей; результаты — в порядке запроса."""
+    try:
+        op, items, encoding, item_versions, max_value = batch.parse_request(body)
+    except ValueError as e:
+        return 400, str(e).encode('utf-8'), "text/plain"
+    groups = {}
+    for i, (key, _) in enumerate(items):
+        groups.setdefault(shard_of(key), []).append(i)
+    results = [None] * len(items)
+    for owner, idxs in groups.items():
+        part = [items[i] for i in idxs]
+        # Версии приходят для всех ключей пакета или ни для одного
+        part_versions = None if item_versions[0] is None else [item_versions[i] for i in idxs]
+        part_body = batch.build_request(op, part, "base64", part_versions, max_value)
+        if owner == shard:
+            _, reply_body, _ = handle_batch(part_body)
+        else:
+            code, _, stream, close = shard_request(owner, 'POST', batch.PATH, part_body)
+            try:
+                reply_body = stream.read_all()
+            finally:
+                close()
+            if code != 200:
+                return 500, b"Shard batch failed", "text/plain"
+        for i, result in zip(idxs, batch.parse_response(reply_body, "base64")):
+            results[i] = result
+    return 200, batch.build_response(items, results, encoding), "application/json"
 
+def sharded_list(prefix, cursor, limit):
+    """GET /storage: слияние отсортированных списков всех процессов."""
+    path = "/storage" + listing.query_string(prefix, cursor, limit)
+    parts = []
+    try:
+        for owner in range(shards):
+            if owner != shard:
+                parts.append(shard_request(owner, 'GET', path))
+    except BaseException:
+        for _, _, _, close in parts:
+            close(False)
+        raise
+
+    def close_all(completed):
+        for _, _, _, close in parts:
+            close(completed)
+
+    if any(code != 200 for code, _, _, _ in parts):
+        close_all(False)
+        return 500, b"Failed to list shards", "text/plain"
+    streams = [listing.iter_records(stream.chunks()) for _, _, stream, _ in parts]
+    streams.append(listing.iter_records(listing.local_lines(engine.list_keys, prefix, cursor,
+                                                            limit)))
+    lines = listing.encode(listing.merge(streams, limit))
+    return 200, httputil.StreamBody(lines, None, close_all), listing.CONTENT_TYPE
+
+# --- asyncio-режим ---
+# Соединения обслуживает event loop, а работа с диском уходит в пул потоков
+# disk_executor, чтобы медленный диск не останавливал приём запросов. Тело
+# запроса принимается на event loop до передачи в пул: медленный клиент
+# не занимает поток. Пробу мастера event loop обслуживает сам.
+
+async def handle_client_async(reader, writer):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(httputil.KEEPALIVE_TIMEOUT):
+                    req = await httputil.read_request_async(reader, writer)
+            except httputil.BadRequest as e:
+                await httputil.write_response_async(writer, 400, str(e).encode('latin1'))
+                return
+            if req is None:
+                return
+            stream = req.stream
+            start = metrics.request_started()
+            code, sent = 500, 0
+            try:
+                try:
+                    if req.path == "/health":
+                        code, body, content_type, *headers = handle_request(req)
+                    else:
+                        req.stream = await httputil.receive_body_async(stream)
+                        try:
+                            code, body, content_type, *headers = await loop.run_in_executor(
+                                disk_executor, handle_request, req)
+                        finally:
+                            req.stream.close()
+                            req.stream = stream
+                except Exception as e:
+                    logs.write("error", str(e), method=req.method, path=req.path)
+                    code = 500
+                    sent = await httputil.write_response_async(writer, 500, b"Internal Error")
+                    return
+                keep_alive = req.keep_alive and stream.done
+                sent = await httputil.write_response_async(writer, code, body, content_type,
+                                                           keep_alive, *headers)
+            finally:
+                logs.request(req, code, sent, metrics.request_finished(req, code, sent, start))
+            if not keep_alive:
+                return
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
     except Exception as e:
-        print(f"[{NODE_NAME} ERROR] {e}")
-        send_response(conn, 500, b"Internal Error")
+        logs.write("error", str(e))
     finally:
-        conn.close()
+        writer.close()
 
-def send_response(conn, status_code, body, content_type="text/plain"):
-    reason = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 500: "Internal Error"}.get(status_code, "Unknown")
-    response = (
-        f"HTTP/1.1 {status_code} {reason}\r\n"
-        f"Content-Type: {content_type}\r\n"
-        f"Content-Length: {len(body)}\r\n"
-        "Connection: close\r\n"
-        f"Date: {datetime.utcnow().strftime('%a, %d %b %Y %H:%M:%S GMT')}\r\n"
-        "\r\n"
-    ).encode('latin1') + body
-    conn.sendall(response)
+async def serve_async(shard_sock=None):
+    server = await asyncio.start_server(handle_client_async, HOST, PORT,
+                                        backlog=socket.SOMAXCONN,
+                                        limit=httputil.MAX_HEADER_SIZE, reuse_address=True,
+                                        reuse_port=shards > 1)
+    if shard_sock is not None:
+        await asyncio.start_server(handle_client_async, sock=shard_sock,
+                                   limit=httputil.MAX_HEADER_SIZE)
+    print(f"Рабочая нода '{NODE_NAME}' (ID={NODE_ID}, asyncio) запущена на порту {PORT}")
+    await asyncio.sleep(0.2)
+    if shard == 0:
+        threading.Thread(target=registration_loop, daemon=True).start()
+    async with server:
+        await server.serve_forever()
 
 def signal_handler(sig, frame):
     print("Завершение работы...")
     sys.exit(0)
 
+def accept_loop(sock):
+    while True:
+        conn, addr = sock.accept()
+        threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+
+def start_shards(count):
+    """Создаёт count процессов-шардов. Возвращается только в процессе-шарде
+    с его внутренним сокетом; родитель следит за шардами и завершается вместе с ними.
+    """
+    global shard, shards, shard_ports, shard_pools
+    socks = [prefork.listen_socket(HOST, 0) for _ in range(count)]
+    ports = [sock.getsockname()[1] for sock in socks]
+    index, pids = prefork.fork(count)
+    if index is None:
+        for sock in socks:
+            sock.close()
+        print(f"Рабочая нода '{NODE_NAME}': {count} процессов на порту {PORT}")
+        sys.exit(prefork.supervise(pids))
+    shard, shards, shard_ports = index, count, ports
+    shard_pools = [pool.ConnectionPool(HOST, port) for port in ports]
+    for i, sock in enumerate(socks):
+        if i != index:
+            sock.close()
+    return socks[index]
+
 def main():
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    sock.bind((HOST, PORT))
-    sock.listen(5)
+    global PORT, NODE_NAME, NODE_ID, DATA_DIR, engine, versions, codec, compress_min
+    global disk_executor
+    parser = argparse.ArgumentParser(description="Рабочая нода",
+                                     usage="python worker.py <порт> <имя_ноды> <id_ноды> [опции]")
+    parser.add_argument("port", type=int)
+    parser.add_argument("name")
+    parser.add_argument("id", type=int)
+    parser.add_argument("--mode", choices=("threads", "asyncio"), default="threads",
+                        help="поток на соединение или event loop")
+    parser.add_argument("--disk-threads", type=int, default=DISK_THREADS,
+                        help="потоков для работы с диском в режиме asyncio")
+    parser.add_argument("--engine", choices=sorted(storage.ENGINES), default="files",
+                        help="файл на ключ или журнал с дописыванием")
+    parser.add_argument("--durability", choices=storage.DURABILITY_MODES, default="batch",
+                        help="none — без fsync, batch — общий fsync одновременных записей, "
+                             "always — fsync каждой записи")
+    parser.add_argument("--commit-window", type=float, default=storage.COMMIT_WINDOW * 1000,
+                        help="сколько общий fsync ждёт начатые записи, мс (batch)")
+    parser.add_argument("--compress", choices=["none"] + sorted(compress.CODECS), default="none",
+                        help="кодек сжатия новых значений")
+    parser.add_argument("--compress-min", type=int, default=compress.MIN_SIZE,
+                        help="значения короче, байт, не сжимаются")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="процессов на общем порту (SO_REUSEPORT), ключи делятся между ними")
+    parser.add_argument("--log-level", choices=sorted(logs.LEVELS), default="info",
+                        help="debug — запись о каждом запросе")
+    parser.add_argument("--log-sample", type=float, default=1.0,
+                        help="доля запросов в журнале на уровне debug")
+    args = parser.parse_args()
+    if args.processes < 1:
+        parser.error("--processes должно быть не меньше 1")
+    if args.disk_threads < 1:
+        parser.error("--disk-threads должно быть не меньше 1")
+    PORT, NODE_NAME, NODE_ID = args.port, args.name, args.id
+    codec = compress.CODECS.get(args.compress)
+    compress_min = args.compress_min
+    # У журнала свой каталог: раскладки не смешиваются
+    base_dir = (f"basic_node/worker_data_{PORT}" if args.engine == "files"
+                else f"basic_node/worker_{args.engine}_{PORT}")
+    check_data_dirs(base_dir, args.processes)
+    # Процессы создаются до открытия движка: у каждого свой движок и свои потоки
+    shard_sock = start_shards(args.processes) if args.processes > 1 else None
+    logs.configure(NODE_NAME if shards == 1 else f"{NODE_NAME}.{shard}", args.log_level,
+                   args.log_sample)
+    DATA_DIR = shard_data_dir(base_dir, shard, shards)
+    durability = storage.Durability(args.durability, args.commit_window / 1000)
+    engine = storage.open_engine(args.engine, DATA_DIR, durability)
+    versions = storage.VersionTable(DATA_DIR + ".versions")
+
+    if args.mode == "asyncio":
+        disk_executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.disk_threads,
+                                                              thread_name_prefix="disk")
+        signal.signal(signal.SIGTERM, signal_handler)
+        try:
+            asyncio.run(serve_async(shard_sock))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            engine.close()
+            versions.close()
+        return
+
+    sock = prefork.listen_socket(HOST, PORT, reuse_port=shards > 1)
+    if shard_sock is not None:
+        threading.Thread(target=accept_loop, args=(shard_sock,), daemon=True).start()
     print(f"Рабочая нода '{NODE_NAME}' (ID={NODE_ID}) запущена на порту {PORT}")
 
     time.sleep(0.2)
-    register_with_master()
+    if shard == 0:
+        threading.Thread(target=registration_loop, daemon=True).start()
 
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
 
     try:
-        while True:
-            conn, addr = sock.accept()
-            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+        accept_loop(sock)
     except KeyboardInterrupt:
         pass
     finally:
         sock.close()
+        engine.close()
+        versions.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file